@@ -1,7 +1,14 @@
 # config/middleware.py (ou core/middleware.py)
+import random
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
 from django.utils import timezone
-from django.core.cache import cache
-from logistics.models import MotoboyProfile
+from logistics.presence import presenca
+from orders.groups import abrir_cache, fechar_cache
+from orders.profiling import PerfilSQL, perfis_sql
 
 class ActiveUserMiddleware:
     def __init__(self, get_response):
@@ -9,17 +16,71 @@ class ActiveUserMiddleware:
 
     def __call__(self, request):
         if request.user.is_authenticated and request.user.type == 'MOTOBOY':
-            # Atualiza o cache "last_seen_ID" com o horário atual
-            # Usamos cache (Redis/Memcached/LocMem) para não bater no banco a cada clique
-            current_user = request.user
-            now = timezone.now()
-            
-            # Opção A: Salvar no Cache (Mais rápido, menos banco)
-            cache.set(f'seen_{current_user.id}', now, 300) # Expira em 300s (5 min)
-
-            # Opção B: Salvar no Banco (Se quiser histórico real)
-            # Isso exige um campo 'last_activity' no MotoboyProfile
-            # MotoboyProfile.objects.filter(user=current_user).update(last_activity=now)
+            # Qualquer request do motoboy conta como heartbeat. As escritas são agrupadas
+            # em memória e gravadas em lote (ver logistics/presence.py), então não custa
+            # uma query por clique.
+            presenca.registrar(request.user.id)
 
         response = self.get_response(request)
-        return response
\ No newline at end of file
+        return response
+
+
+class GroupCacheMiddleware:
+    """ Mapa de mães de grupo (orders/groups.py) vivo só durante o request """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = abrir_cache()
+        try:
+            return self.get_response(request)
+        finally:
+            fechar_cache(token)
+
+
+# ==========================================================
+# PERFIL DE SQL POR REQUEST (opt-in)
+# ==========================================================
+# Liga com SQL_PROFILING_ENABLED = True. Só uma amostra dos requests é medida
+# (SQL_PROFILING_SAMPLE_RATE, ex: 0.02 = 2%); nos demais o custo é um random().
+# As medidas vão para o header Server-Timing e para um buffer circular em memória
+# (por processo, orders/profiling.py), visível em /painel-admin/perfil-sql/.
+
+class SQLProfilingMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'SQL_PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.taxa = getattr(settings, 'SQL_PROFILING_SAMPLE_RATE', 0.02)
+
+    def __call__(self, request):
+        if random.random() >= self.taxa:
+            return self.get_response(request)
+
+        perfil = PerfilSQL()
+        inicio = time.perf_counter()
+        with connection.execute_wrapper(perfil):
+            response = self.get_response(request)
+        total_ms = (time.perf_counter() - inicio) * 1000
+        sql_ms = perfil.tempo * 1000
+
+        response['Server-Timing'] = (
+            f'db;dur={sql_ms:.1f};desc="{perfil.queries} queries", app;dur={total_ms - sql_ms:.1f}, total;dur={total_ms:.1f}'
+        )
+
+        usuario = getattr(request, 'user', None)
+        match = getattr(request, 'resolver_match', None)
+        perfis_sql.registrar({
+            'quando': timezone.now(),
+            'metodo': request.method,
+            'caminho': request.path,
+            'view': match.view_name if match else '',
+            'usuario': usuario.type if usuario is not None and usuario.is_authenticated else 'ANONIMO',
+            'status': response.status_code,
+            'queries': perfil.queries,
+            'sql_ms': round(sql_ms, 1),
+            'total_ms': round(total_ms, 1),
+            'duplicadas': [(sql[:300], n) for sql, n in perfil.duplicadas()],
+        })
+        return response
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = 'accounts.CustomUser'
 
 MIDDLEWARE = [
+    'config.middleware.SQLProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,8 +54,29 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'config.middleware.ActiveUserMiddleware',
+    'config.middleware.GroupCacheMiddleware',
 ]
 
+# Perfil de SQL por request (config/middleware.py; buffer em orders/profiling.py). Desligado
+# por padrão; em produção usar amostragem baixa (1-5%).
+SQL_PROFILING_ENABLED = os.environ.get('SQL_PROFILING_ENABLED', '') == '1'
+SQL_PROFILING_SAMPLE_RATE = float(os.environ.get('SQL_PROFILING_SAMPLE_RATE', '0.02'))
+SQL_PROFILING_BUFFER = 200
+
+# Fila de tarefas em segundo plano (orders/jobs.py). Em produção as tarefas (transferência de
+# rota no resgate, reagendamento, otimização de rota, exportações) só andam com o worker rodando
+# ao lado do servidor web, como processo próprio (systemd, supervisor...):
+#     python manage.py processar_tarefas
+# Em dev (DEBUG) a tarefa roda no próprio processo logo depois do commit, sem worker.
+TAREFAS_EM_LINHA = DEBUG
+
+# Tempo real do painel de despacho (orders/events.py): cada stream SSE segura uma thread do
+# servidor por até 5 minutos. Exige servidor com threads ou ASGI (runserver, gunicorn com
+# `--worker-class gthread --threads N`, uvicorn...); com worker síncrono de uma thread o
+# painel travaria o processo. Acima deste número de streams por processo, o painel volta ao
+# polling de 10s. Deixar bem abaixo de --threads para sobrar thread para os outros requests.
+SSE_MAX_CONEXOES = int(os.environ.get('SSE_MAX_CONEXOES', '4'))
+
 ROOT_URLCONF = 'config.urls'
 
 TEMPLATES = [
@@ -90,6 +112,21 @@ DATABASES = {
 }
 
 
+# Cache
+# Telas "Minhas Entregas", carga do baú e perfis de ETA ficam no cache e são descartados
+# depois de cada escrita. Com mais de um processo servindo (gunicorn com N workers, worker
+# da fila) o cache PRECISA ser compartilhado: o LocMemCache padrão é por processo, então a
+# invalidação de um worker não chega nos outros (`manage.py check --deploy` avisa).
+# Ex: CACHE_URL=redis://localhost:6379/1
+if os.environ.get('CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['CACHE_URL'],
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -135,4 +172,8 @@ LOGIN_REDIRECT_URL = 'root'
 LOGOUT_REDIRECT_URL = 'login'
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / 'media'
\ No newline at end of file
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Exportações de OS/entregas (nome, endereço e CEP dos destinatários): fora do MEDIA_ROOT, para
+# não serem servidas como mídia pública. Só saem pelo export_download_view, que confere o dono.
+EXPORTS_ROOT = BASE_DIR / 'private' / 'exports'
\ No newline at end of file
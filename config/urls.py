@@ -23,12 +23,18 @@ urlpatterns = [
     
     # Painéis
     path('painel-admin/', admin_dashboard_view, name='admin_dashboard'),
+    path('painel-admin/perfil-sql/', views.sql_profile_view, name='sql_profile'),
     path('painel-empresa/', company_dashboard_view, name='company_dashboard'),
+    path('painel-empresa/os/', views.company_orders_api_view, name='company_orders_api'),
     path('painel-despacho/', dispatch_dashboard_view, name='dispatch_dashboard'),
+    path('painel-despacho/eventos/', views.dispatch_events_view, name='dispatch_events'),
+    path('painel-despacho/cards/', views.dispatch_cards_view, name='dispatch_cards'),
     
     # OS
     path('nova-os/', os_create_view, name='os_create'),
+    path('nova-os/lote/', views.os_bulk_create_view, name='os_bulk_create'),
     path('os/<int:os_id>/stops/', views.get_route_stops, name='get_route_stops'),
+    path('os/buscar/', views.search_os_view, name='search_os'),
     path('os/mesclar/', views.merge_os_view, name='merge_os'),
     path('os/desfazer-mescla/', views.unmerge_os_view, name='unmerge_os'),
     
@@ -43,6 +49,8 @@ urlpatterns = [
     # Despacho (Ações)
     path('painel-despacho/atribuir/<int:os_id>/', assign_motoboy_view, name='assign_motoboy'),
     path('painel-despacho/reordenar-paradas/', views.reorder_stops_view, name='reorder_stops'),
+    path('painel-despacho/rota/<int:motoboy_id>/sugerir/', views.suggest_route_view, name='suggest_route'),
+    path('painel-despacho/rota/<int:motoboy_id>/aplicar/', views.apply_route_view, name='apply_route'),
     path('os/<int:os_id>/detalhes/', os_details_view, name='os_details'),
     
     # Ações Legadas de Problemas
@@ -52,7 +60,13 @@ urlpatterns = [
     
     # NOVO: Caminho exato que o JS espera para resolver as ocorrências e transferências seguras
     path('orders/occurrence/<int:occurrence_id>/resolve/', views.resolve_occurrence_view, name='resolve_occurrence'),
+    path('painel-despacho/tarefas/<int:tarefa_id>/', views.job_status_view, name='job_status'),
     
+    # Exportações (CSV / XLSX)
+    path('exportar/status/<int:exportacao_id>/', views.export_status_view, name='export_status'),
+    path('exportar/baixar/<int:exportacao_id>/', views.export_download_view, name='export_download'),
+    path('exportar/<str:tipo>/', views.export_view, name='export'),
+
     # Outros
     path('painel-geral/cadastrar-usuario/', register_user_view, name='register_user'),
 ]
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import MotoboyProfile, Vehicle
+from .models import MotoboyProfile, Vehicle, MotoboyPresence, PresenceSession
 
 @admin.register(MotoboyProfile)
 class MotoboyProfileAdmin(admin.ModelAdmin):
@@ -9,4 +9,16 @@ class MotoboyProfileAdmin(admin.ModelAdmin):
 
 @admin.register(Vehicle)
 class VehicleAdmin(admin.ModelAdmin):
-    list_display = ('plate', 'model', 'brand', 'type')
\ No newline at end of file
+    list_display = ('plate', 'model', 'brand', 'type')
+
+@admin.register(MotoboyPresence)
+class MotoboyPresenceAdmin(admin.ModelAdmin):
+    list_display = ('user', 'last_seen', 'online_since', 'heartbeats')
+    search_fields = ('user__username', 'user__first_name')
+
+@admin.register(PresenceSession)
+class PresenceSessionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'started_at', 'ended_at', 'heartbeats')
+    list_filter = ('started_at',)
+    search_fields = ('user__username', 'user__first_name')
+    date_hierarchy = 'started_at'
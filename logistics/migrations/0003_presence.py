@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0002_alter_motoboyprofile_category'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MotoboyPresence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_seen', models.DateTimeField(db_index=True, verbose_name='Visto por último')),
+                ('online_since', models.DateTimeField(blank=True, null=True, verbose_name='Online desde')),
+                ('heartbeats', models.PositiveIntegerField(default=0, help_text='Heartbeats recebidos na sessão atual')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='presence', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PresenceSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(verbose_name='Início')),
+                ('ended_at', models.DateTimeField(verbose_name='Fim')),
+                ('heartbeats', models.PositiveIntegerField(default=0)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='presence_sessions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'started_at'], name='presence_user_start_idx')],
+            },
+        ),
+    ]
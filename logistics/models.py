@@ -37,3 +37,32 @@ class Vehicle(models.Model):
 
     def __str__(self):
         return f"{self.plate} - {self.brand}"
+
+
+class MotoboyPresence(models.Model):
+    """ Último heartbeat de cada motoboy (uma linha por usuário). Gravado em lote por logistics/presence.py """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='presence')
+    last_seen = models.DateTimeField(db_index=True, verbose_name="Visto por último")
+    online_since = models.DateTimeField(null=True, blank=True, verbose_name="Online desde")
+    heartbeats = models.PositiveIntegerField(default=0, help_text="Heartbeats recebidos na sessão atual")
+
+    def __str__(self):
+        return f"{self.user} - {self.last_seen:%d/%m %H:%M}"
+
+
+class PresenceSession(models.Model):
+    """ Histórico: cada intervalo contínuo em que o motoboy ficou online """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='presence_sessions')
+    started_at = models.DateTimeField(verbose_name="Início")
+    ended_at = models.DateTimeField(verbose_name="Fim")
+    heartbeats = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'started_at'], name='presence_user_start_idx')]
+
+    @property
+    def duration(self):
+        return self.ended_at - self.started_at
+
+    def __str__(self):
+        return f"{self.user}: {self.started_at:%d/%m %H:%M} - {self.ended_at:%H:%M}"
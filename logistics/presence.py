@@ -0,0 +1,156 @@
+# logistics/presence.py
+"""
+Presença dos motoboys (quem está online).
+
+Cada heartbeat (tela do motoboy a cada ~15s, ou qualquer request dele) cai primeiro num
+dicionário em memória. Uma thread do processo (iniciada no primeiro heartbeat) grava tudo a
+cada FLUSH_INTERVALO segundos, chegue ou não outro request: um upsert/bulk_update em
+MotoboyPresence (última vez visto) e, para quem teve a sessão encerrada, um bulk_create em
+PresenceSession (histórico). Nenhum heartbeat fica em memória mais que um intervalo.
+
+Assim um motoboy mandando heartbeat a cada 15s custa ~1 escrita por intervalo, e
+"quem está online" é uma única consulta por faixa em last_seen (indexado). O que ainda
+estiver em memória quando o processo termina (reciclagem do worker, deploy) é gravado
+no atexit.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from orders.events import broker, PRESENCA_TTL
+from .models import MotoboyPresence, PresenceSession
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVALO = 30  # segundos entre gravações no banco (por processo)
+
+
+class PresenceService:
+    def __init__(self, intervalo=FLUSH_INTERVALO, ttl=PRESENCA_TTL):
+        self.intervalo = intervalo
+        self.ttl = timedelta(seconds=ttl)
+        self._lock = threading.Lock()
+        # user_id -> [primeiro heartbeat, último heartbeat, quantidade] desde o último flush
+        self._pendentes = {}
+        # pid do processo dono da thread de gravação (worker forkado depois do import não a herda)
+        self._pid_gravador = None
+
+    def registrar(self, user_id, quando=None):
+        """ Registra um heartbeat em memória; a thread de gravação leva ao banco no próximo intervalo. """
+        quando = quando or timezone.now()
+        with self._lock:
+            pendente = self._pendentes.get(user_id)
+            if pendente is None:
+                self._pendentes[user_id] = [quando, quando, 1]
+            else:
+                pendente[1] = max(pendente[1], quando)
+                pendente[2] += 1
+            if self._pid_gravador != os.getpid():
+                self._pid_gravador = os.getpid()
+                threading.Thread(target=self._gravador, name='presenca-flush', daemon=True).start()
+
+        # Painel de Despacho (SSE): avisa quando o motoboy acabou de ficar online
+        broker.heartbeat(user_id)
+
+    def flush(self):
+        """ Grava o que estiver pendente agora (ex: no fim de um teste ou de um comando) """
+        with self._lock:
+            lote, self._pendentes = self._pendentes, {}
+        if lote:
+            self._gravar(lote)
+
+    def _gravador(self):
+        """ Thread do processo: grava a cada intervalo, independente de chegarem requests """
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.flush()
+            except Exception:
+                # O lote que falhou se perde (como no atexit); o próximo heartbeat do motoboy repõe
+                logger.exception("Falha ao gravar a presença pendente")
+            finally:
+                # Não segura uma conexão ociosa entre um intervalo e outro
+                connection.close()
+
+    def online_ids(self):
+        """ user_ids vistos dentro da janela de presença: uma consulta + o que ainda está em memória """
+        limite = timezone.now() - self.ttl
+        ids = set(MotoboyPresence.objects.filter(last_seen__gte=limite).values_list('user_id', flat=True))
+        with self._lock:
+            ids.update(uid for uid, (_, ultimo, _n) in self._pendentes.items() if ultimo >= limite)
+        return ids
+
+    def _gravar(self, lote):
+        with transaction.atomic():
+            atuais = {
+                p.user_id: p for p in MotoboyPresence.objects.select_for_update().filter(user_id__in=list(lote))
+            }
+            novos, alterados, sessoes = [], [], []
+            for user_id, (primeiro, ultimo, quantidade) in lote.items():
+                presenca = atuais.get(user_id)
+                if presenca is None:
+                    novos.append(MotoboyPresence(
+                        user_id=user_id, last_seen=ultimo, online_since=primeiro, heartbeats=quantidade
+                    ))
+                    continue
+
+                # Sumiu por mais que a janela: fecha a sessão anterior e abre outra
+                if presenca.online_since is None or presenca.last_seen < primeiro - self.ttl:
+                    if presenca.online_since is not None:
+                        sessoes.append(self._sessao(presenca))
+                    presenca.online_since = primeiro
+                    presenca.heartbeats = 0
+                # Outro processo pode ter gravado um heartbeat mais novo
+                presenca.last_seen = max(presenca.last_seen, ultimo)
+                presenca.heartbeats += quantidade
+                alterados.append(presenca)
+
+            if novos:
+                # Outro processo pode criar a mesma linha ao mesmo tempo
+                MotoboyPresence.objects.bulk_create(
+                    novos, update_conflicts=True, unique_fields=['user'],
+                    update_fields=['last_seen', 'online_since', 'heartbeats']
+                )
+            if alterados:
+                MotoboyPresence.objects.bulk_update(alterados, ['last_seen', 'online_since', 'heartbeats'])
+
+            sessoes += self._fechar_expiradas()
+            if sessoes:
+                PresenceSession.objects.bulk_create(sessoes)
+
+    def _fechar_expiradas(self):
+        """ Quem parou de mandar heartbeat há mais que a janela tem a sessão encerrada """
+        limite = timezone.now() - self.ttl
+        expiradas = list(
+            MotoboyPresence.objects.select_for_update(skip_locked=True)
+            .filter(online_since__isnull=False, last_seen__lt=limite)
+        )
+        if not expiradas:
+            return []
+        MotoboyPresence.objects.filter(id__in=[p.id for p in expiradas]).update(online_since=None, heartbeats=0)
+        return [self._sessao(p) for p in expiradas]
+
+    @staticmethod
+    def _sessao(presenca):
+        return PresenceSession(
+            user_id=presenca.user_id, started_at=presenca.online_since,
+            ended_at=presenca.last_seen, heartbeats=presenca.heartbeats
+        )
+
+
+presenca = PresenceService()
+
+
+@atexit.register
+def _gravar_na_saida():
+    try:
+        presenca.flush()
+    except Exception:
+        # Banco já fora do ar no desligamento: perde só os heartbeats do último intervalo
+        logger.exception("Falha ao gravar a presença pendente no encerramento")
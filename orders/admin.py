@@ -1,5 +1,9 @@
 from django.contrib import admin
-from .models import ServiceOrder, OSItem, OSDestination, ItemDistribution
+from .models import ServiceOrder, OSItem, OSDestination, ItemDistribution, OrderStatusLog
+from .search import buscar_ids
+
+# Quantas OS a busca do admin traz (as mais recentes que casam)
+LIMITE_BUSCA_ADMIN = 500
 
 # Isso faz os Itens aparecerem dentro da tela da OS no Admin
 class OSItemInline(admin.TabularInline):
@@ -11,13 +15,30 @@ class OSDestinationInline(admin.TabularInline):
     model = OSDestination
     extra = 1
 
+# Histórico de status gravado pelo motor de transições (orders/transitions.py); só leitura
+class OrderStatusLogInline(admin.TabularInline):
+    model = OrderStatusLog
+    extra = 0
+    can_delete = False
+    readonly_fields = ('status_anterior', 'status_novo', 'changed_by', 'timestamp')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
 @admin.register(ServiceOrder)
 class ServiceOrderAdmin(admin.ModelAdmin):
     list_display = ('os_number', 'client', 'status', 'priority', 'created_at')
     list_filter = ('status', 'priority', 'vehicle_type')
+    # A caixa de busca usa o índice de busca (orders/search.py): número, solicitante, coleta,
+    # destinatários, endereços e itens. search_fields só liga a caixa na tela.
     search_fields = ('os_number', 'requester_name')
     readonly_fields = ('os_number',) # Retiramos os campos antigos daqui
-    inlines = [OSItemInline, OSDestinationInline]
+    inlines = [OSItemInline, OSDestinationInline, OrderStatusLogInline]
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return queryset.filter(id__in=buscar_ids(search_term, LIMITE_BUSCA_ADMIN)), False
 
 @admin.register(ItemDistribution)
 class ItemDistributionAdmin(admin.ModelAdmin):
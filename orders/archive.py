@@ -0,0 +1,194 @@
+# orders/archive.py
+"""
+Arquivo das OS encerradas (quente / frio).
+
+Grupos (mãe + filhas) com todas as OS em ENTREGUE/CANCELADO e sem movimento há mais de
+DIAS_PADRAO dias saem das tabelas do dia a dia. `manage.py arquivar_os` faz isso em lotes,
+cada lote numa transação:
+  1. Cada OS do grupo vira uma linha em ArchivedOrder com o retrato dela e dos registros
+     que pendem dela (REGISTROS), no formato de `serializers.serialize('python', ...)`.
+  2. A OS é apagada (o CASCADE leva o resto) sem descontar dos KPIs: ela continua na
+     contagem e o `recalcular_kpis` soma as arquivadas.
+
+Leitura: `restaurar` devolve instâncias não salvas de ServiceOrder com itens, destinos,
+paradas, ocorrências etc. já ligados, sem query, como se viessem de um prefetch_related.
+Assim a tela de detalhes da OS e as exportações usam o mesmo código para OS quentes e
+arquivadas. As fotos ficam onde estavam no storage (o retrato guarda o caminho).
+
+Fora do escopo do arquivo: a lista da empresa (cursor), a busca e o histórico do motoboy
+mostram só as OS quentes.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from itertools import islice
+
+from django.core import serializers
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+
+from .models import (
+    ArchivedOrder, DispatcherDecision, ItemDistribution, Occurrence, OrderStatusLog, OSDestination, OSItem,
+    RouteStop, ServiceOrder,
+)
+
+DIAS_PADRAO = 90  # Maior que a janela de treino do ETA (orders/eta.py -> DIAS_TREINO)
+LOTE_PADRAO = 200  # Grupos por transação
+ENCERRADAS = [ServiceOrder.Status.DELIVERED, ServiceOrder.Status.CANCELED]
+
+# Registros que vão no retrato da OS: (model, caminho até a OS). Apagados junto pelo CASCADE.
+REGISTROS = (
+    (OSItem, 'order'),
+    (OSDestination, 'order'),
+    (ItemDistribution, 'item__order'),
+    (RouteStop, 'service_order'),
+    (Occurrence, 'service_order'),
+    (DispatcherDecision, 'occurrence__service_order'),
+    (OrderStatusLog, 'order'),
+)
+MODELOS = {ServiceOrder, *(model for model, _ in REGISTROS)}
+
+
+# ==========================================================
+# 1. QUEM PODE SAIR
+# ==========================================================
+
+def _arquivaveis(dias):
+    """ Mães de grupos inteiramente encerrados e parados desde o corte """
+    corte = timezone.now() - timedelta(days=dias)
+    do_grupo = {'service_order__group_root_id': OuterRef('group_root_id')}
+    return ServiceOrder.objects.filter(
+        id=F('group_root_id'), status__in=ENCERRADAS, created_at__lt=corte,
+    ).exclude(
+        # Alguma OS do grupo ainda viva ou recente
+        Exists(ServiceOrder.objects.filter(group_root_id=OuterRef('group_root_id')).filter(
+            ~Q(status__in=ENCERRADAS) | Q(created_at__gte=corte)
+        ))
+    ).exclude(
+        # Parada aberta ou concluída depois do corte
+        Exists(RouteStop.objects.filter(**do_grupo).filter(Q(is_completed=False) | Q(completed_at__gte=corte)))
+    ).exclude(
+        Exists(Occurrence.objects.filter(**do_grupo, resolvida=False))
+    ).exclude(
+        # Item ainda no baú de alguém (a carga do motoboy conta com ele)
+        Exists(OSItem.objects.filter(
+            order__group_root_id=OuterRef('group_root_id'),
+            status__in=[OSItem.ItemStatus.COLETADO, OSItem.ItemStatus.TRANSFERIDO],
+        ))
+    )
+
+
+def grupos_arquivaveis(dias=DIAS_PADRAO, limite=LOTE_PADRAO):
+    """ Ids das mães dos próximos `limite` grupos elegíveis, mais antigos primeiro """
+    return list(_arquivaveis(dias).order_by('id').values_list('id', flat=True)[:limite])
+
+
+def contar_arquivaveis(dias=DIAS_PADRAO):
+    return _arquivaveis(dias).count()
+
+
+# ==========================================================
+# 2. ARQUIVAMENTO
+# ==========================================================
+
+def arquivar(raiz_ids, dias=DIAS_PADRAO):
+    """ Move os grupos para ArchivedOrder numa transação. Retorna (grupos, OS) que saíram das tabelas quentes. """
+    with transaction.atomic():
+        # Confere de novo com as mães travadas: o grupo pode ter voltado a andar desde a seleção
+        raizes = list(_arquivaveis(dias).filter(id__in=raiz_ids).select_for_update().values_list('id', flat=True))
+        if not raizes:
+            return 0, 0
+        ordens = list(ServiceOrder.objects.filter(group_root_id__in=raizes).order_by('id'))
+        ids = [os_obj.id for os_obj in ordens]
+
+        registros = defaultdict(list)
+        for model, caminho in REGISTROS:
+            for obj in model.objects.filter(**{f'{caminho}__in': ids}).annotate(os_do_retrato=F(caminho)).order_by('id'):
+                registros[obj.os_do_retrato].append(obj)
+
+        ArchivedOrder.objects.bulk_create([
+            ArchivedOrder(
+                id=os_obj.id, os_number=os_obj.os_number, group_root_id=os_obj.group_root_id,
+                client_id=os_obj.client_id, motoboy_id=os_obj.motoboy_id, status=os_obj.status,
+                created_at=os_obj.created_at, dados=serializers.serialize('python', [os_obj, *registros[os_obj.id]]),
+            ) for os_obj in ordens
+        ])
+        ServiceOrder.objects.filter(id__in=ids).apagar_arquivadas()
+    return len(raizes), len(ids)
+
+
+# ==========================================================
+# 3. LEITURA (detalhes da OS, exportações)
+# ==========================================================
+
+def _queryset_pronto(model, objetos):
+    """ QuerySet já "avaliado" com `objetos`, como o prefetch_related deixa no cache da instância """
+    qs = model._default_manager.none()
+    qs._result_cache = objetos
+    qs._prefetch_done = True
+    return qs
+
+
+def _ligar(objetos):
+    """ Liga as FKs entre os objetos restaurados e preenche os reversos (os.items.all(), ...) """
+    por_chave = {(type(obj), obj.pk): obj for obj in objetos}
+    reversos = defaultdict(list)
+    for obj in objetos:
+        for campo in obj._meta.concrete_fields:
+            if campo.is_relation and campo.related_model in MODELOS:
+                alvo = por_chave.get((campo.related_model, getattr(obj, campo.attname)))
+                if alvo is not None:
+                    campo.set_cached_value(obj, alvo)
+                    reversos[(type(alvo), alvo.pk, campo.remote_field.cache_name)].append(obj)
+
+    for obj in objetos:
+        cache_prefetch = obj.__dict__.setdefault('_prefetched_objects_cache', {})
+        for relacao in obj._meta.related_objects:
+            if relacao.related_model not in MODELOS:
+                continue
+            ligados = reversos.get((type(obj), obj.pk, relacao.cache_name), [])
+            if relacao.one_to_one:
+                relacao.set_cached_value(obj, ligados[0] if ligados else None)
+            else:
+                cache_prefetch[relacao.cache_name] = _queryset_pronto(relacao.related_model, ligados)
+
+
+def restaurar(*retratos):
+    """ OS (não salvas) dos retratos, na ordem recebida, com as relações entre os registros ligadas """
+    objetos = [
+        desserializado.object
+        for dados in retratos
+        # Campos removidos do model depois do arquivamento são ignorados; os novos ficam no default
+        for desserializado in serializers.deserialize('python', dados, ignorenonexistent=True)
+    ]
+    _ligar(objetos)
+    return [obj for obj in objetos if isinstance(obj, ServiceOrder)]
+
+
+def grupo_da_os(os_id):
+    """ Grupo arquivado da OS para a tela de detalhes: {'os', 'raiz', 'paradas', 'ocorrencias'} ou None """
+    raiz_id = ArchivedOrder.objects.filter(id=os_id).values_list('group_root_id', flat=True).first()
+    if raiz_id is None:
+        return None
+    ordens = {
+        os_obj.id: os_obj
+        for os_obj in restaurar(*ArchivedOrder.objects.filter(group_root_id=raiz_id).order_by('id').values_list('dados', flat=True))
+    }
+    return {
+        'os': ordens[os_id],
+        'raiz': ordens.get(raiz_id, ordens[os_id]),
+        'paradas': sorted((p for os_obj in ordens.values() for p in os_obj.stops.all()), key=lambda p: p.sequence),
+        'ocorrencias': sorted(
+            (oc for os_obj in ordens.values() for oc in os_obj.ocorrencias.all()), key=lambda oc: oc.criado_em, reverse=True
+        ),
+    }
+
+
+def lotes(filtro, tamanho):
+    """ OS arquivadas do filtro (colunas de ArchivedOrder), restauradas `tamanho` por vez, em ordem de id """
+    retratos = ArchivedOrder.objects.filter(**filtro).order_by('id').values_list('dados', flat=True).iterator(chunk_size=tamanho)
+    while True:
+        lote = list(islice(retratos, tamanho))
+        if not lote:
+            return
+        yield restaurar(*lote)
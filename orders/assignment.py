@@ -0,0 +1,396 @@
+# orders/assignment.py
+"""
+Atribuição automática da fila PENDENTE aos motoboys.
+
+Em vez de escolher OS por OS (guloso, o primeiro da fila leva o melhor motoboy), a janela
+da fila inteira vira um problema de emparelhamento resolvido de uma vez por fluxo de custo
+mínimo (cancelamento de ciclos negativos com Dijkstra e potenciais, puro Python):
+
+  T -> OS (1 vaga, "recompensa" pela prioridade/idade)
+    -> motoboy (só os CANDIDATOS_POR_OS mais baratos de cada OS)
+    -> T (uma aresta por vaga do motoboy, cada vez mais cara com a carga)
+
+Custo de uma OS para um motoboy, em "km equivalentes":
+  - distância do fim da rota dele (ou da última parada feita) até a coleta;
+  - fila: cada parada aberta pesa PESO_CARGA (aresta da vaga, cresce a cada OS nova);
+  - veículo maior que o pedido pela OS (ServiceOrder.vehicle_type x Vehicle.type) pesa
+    PESO_VEICULO por nível, para não gastar a van com entrega de moto.
+Só entram motoboys online (logistics/presence.py) e is_available; veículo menor que o
+pedido, coleta além de RAIO_MAXIMO_KM ou grupo que não cabe no baú (peso/volume de
+orders/capacity.py) não é candidato. Sobrando menos vagas que OS,
+urgentes e as mais antigas ganham (recompensa maior).
+
+`planejar()` não grava nada (simulação / dry-run); `aplicar()` grava o plano travando as
+OS e as filas dos motoboys, pulando o que o despachante atribuiu à mão nesse meio tempo.
+"""
+import heapq
+import time
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.utils import timezone
+
+from logistics.models import MotoboyProfile, Vehicle
+from logistics.presence import presenca
+from .capacity import LIMITES, calcular, carga_dos_grupos
+from .events import publicar_evento
+from .models import ServiceOrder, RouteStop
+from .routing import SEQUENCIA_ESTACIONADA, distancia_km, local_da_coleta, local_da_parada
+from .transitions import TERMINAIS, transicionar_varias
+
+JANELA = 500  # OS da fila consideradas por rodada (as primeiras na ordem do painel)
+CANDIDATOS_POR_OS = 8
+MAX_OS_POR_RODADA = 3  # Por motoboy: o resto fica para a próxima rodada, já com a carga nova
+RAIO_MAXIMO_KM = 25.0
+KM_SEM_POSICAO = 10.0  # Motoboy sem nenhuma parada conhecida (acabou de entrar)
+
+PESO_CARGA = 1.5
+PESO_VEICULO = 5.0
+RECOMPENSA_BASE = 100.0
+RECOMPENSA_URGENTE = 50.0
+RECOMPENSA_POR_MINUTO = 0.5  # Espera na fila, até RECOMPENSA_ESPERA_MAXIMA
+RECOMPENSA_ESPERA_MAXIMA = 30.0
+
+# Porte: a OS pede um veículo mínimo; veículo maior atende, menor não
+PORTE_OS = {
+    ServiceOrder.VehicleType.MOTO: 1,
+    ServiceOrder.VehicleType.CAR: 2,
+    ServiceOrder.VehicleType.UTILITY: 3,
+}
+PORTE_VEICULO = {
+    Vehicle.Type.MOTO: 1,
+    Vehicle.Type.CAR: 2,
+    Vehicle.Type.VAN: 3,
+}
+
+
+# ==========================================================
+# 1. DADOS (número fixo de queries)
+# ==========================================================
+
+def _motoboys_elegiveis():
+    """ Motoboys online e disponíveis: porte do veículo, paradas abertas e posição estimada """
+    online = presenca.online_ids()
+    posicionaveis = RouteStop.objects.filter(
+        motoboy=OuterRef('pk'),
+        stop_type__in=[RouteStop.StopType.COLLECTION, RouteStop.StopType.DELIVERY],
+    )
+    # A OS nova entra no fim da fila: a distância que importa é a partir da última parada dela
+    ultima_aberta = (
+        posicionaveis.filter(is_completed=False, sequence__lt=SEQUENCIA_ESTACIONADA)
+        .order_by('-sequence').values('id')[:1]
+    )
+    ultima_feita = (
+        posicionaveis.filter(is_completed=True, completed_at__isnull=False)
+        .order_by('-completed_at').values('id')[:1]
+    )
+    motoboys = {
+        mb.id: mb for mb in MotoboyProfile.objects.select_related('user')
+        .filter(is_available=True, user_id__in=online)
+        .annotate(ultima_aberta_id=Subquery(ultima_aberta), ultima_feita_id=Subquery(ultima_feita))
+    }
+    if not motoboys:
+        return {}
+
+    # Só a contagem e as duas paradas de referência: a fila inteira de cada um não é carregada
+    abertas = dict(
+        RouteStop.objects.filter(motoboy_id__in=motoboys, is_completed=False)
+        .values('motoboy_id').annotate(n=Count('id')).values_list('motoboy_id', 'n')
+    )
+    referencias = RouteStop.objects.select_related('service_order', 'destination').in_bulk([
+        parada_id for mb in motoboys.values()
+        for parada_id in (mb.ultima_aberta_id, mb.ultima_feita_id) if parada_id
+    ])
+
+    carga_por_motoboy = calcular(list(motoboys))
+
+    elegiveis = {}
+    for mb_id, mb in motoboys.items():
+        ancora = None
+        for parada_id in (mb.ultima_aberta_id, mb.ultima_feita_id):
+            if parada_id in referencias:
+                ancora = local_da_parada(referencias[parada_id])
+                if ancora is not None:
+                    break
+        carga = carga_por_motoboy[mb_id]
+        limite = LIMITES[carga['veiculo']]
+        elegiveis[mb_id] = {
+            'profile': mb,
+            'porte': PORTE_VEICULO[carga['veiculo']],  # Maior veículo cadastrado (sem veículo = moto)
+            'abertas': abertas.get(mb_id, 0),
+            'livre_kg': limite['kg'] - carga['kg'],
+            'livre_litros': limite['litros'] - carga['litros'],
+            'ancora': ancora,
+        }
+    return elegiveis
+
+
+def _fila(janela):
+    """ OS raiz PENDENTE sem motoboy, na ordem do painel, com o número de paradas e as medidas do grupo """
+    ordens = list(
+        ServiceOrder.objects.filter(status=ServiceOrder.Status.PENDING, motoboy__isnull=True, parent_os__isnull=True)
+        .exclude(priority=ServiceOrder.Priority.SCHEDULED)  # Agendadas continuam com o despachante
+        .only('id', 'os_number', 'priority', 'created_at', 'vehicle_type',
+              'origin_lat', 'origin_lng', 'origin_zip_code', 'origin_district', 'origin_city')
+        .order_by('-priority', 'created_at')[:janela]
+    )
+    paradas = dict(
+        RouteStop.objects.filter(service_order__group_root_id__in=[o.id for o in ordens], is_completed=False)
+        .values('service_order__group_root_id').annotate(n=Count('id'))
+        .values_list('service_order__group_root_id', 'n')
+    )
+    medidas = carga_dos_grupos([o.id for o in ordens])
+    return [(o, paradas.get(o.id, 0), medidas[o.id]) for o in ordens]
+
+
+# ==========================================================
+# 2. CUSTOS
+# ==========================================================
+
+def recompensa(os_obj, agora):
+    """ Quanto vale atribuir a OS agora (decide quem fica de fora quando faltam vagas) """
+    espera = (agora - os_obj.created_at).total_seconds() / 60
+    valor = RECOMPENSA_BASE + min(espera * RECOMPENSA_POR_MINUTO, RECOMPENSA_ESPERA_MAXIMA)
+    if os_obj.priority == ServiceOrder.Priority.URGENT:
+        valor += RECOMPENSA_URGENTE
+    return valor
+
+
+def custo(os_obj, local_coleta, motoboy):
+    """ (custo, km) da OS para o motoboy, sem a carga (que vai na vaga). None = não é candidato. """
+    porte = PORTE_OS.get(os_obj.vehicle_type, 1)
+    if motoboy['porte'] < porte:
+        return None
+    if motoboy['ancora'] is None or local_coleta is None:
+        km = KM_SEM_POSICAO
+    else:
+        km = distancia_km(motoboy['ancora'], local_coleta)
+    if km > RAIO_MAXIMO_KM:
+        return None
+    return km + PESO_VEICULO * (motoboy['porte'] - porte), km
+
+
+# ==========================================================
+# 3. SOLVER: FLUXO DE CUSTO MÍNIMO (puro Python, sem banco)
+# ==========================================================
+
+class _Fluxo:
+    """
+    Grafo residual: OS (0..n-1), motoboys (n..n+m-1) e um nó T que é fonte e sumidouro ao
+    mesmo tempo. Arestas como listas [destino, capacidade, custo, índice da reversa].
+    Atribuir uma OS = ciclo T -> OS -> motoboy -> T de custo negativo.
+    """
+
+    def __init__(self, n, m):
+        self.t = n + m
+        self.g = [[] for _ in range(n + m + 1)]
+
+    def aresta(self, u, v, custo):
+        self.g[u].append([v, 1, custo, len(self.g[v])])
+        self.g[v].append([u, 0, -custo, len(self.g[u]) - 1])
+        return self.g[u][-1]
+
+    def caminho(self, origem, pot):
+        """ Dijkstra com custos reduzidos da OS até T, parando ao chegar (só explora a vizinhança) """
+        inf = float('inf')
+        dist, anterior = {origem: 0.0}, {}
+        heap = [(0.0, origem)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            if u == self.t:
+                break
+            pu = pot[u]
+            for i, (v, cap, c, _) in enumerate(self.g[u]):
+                if cap > 0:
+                    nd = d + c + pu - pot[v]
+                    if nd < dist.get(v, inf) - 1e-12:
+                        dist[v] = nd
+                        anterior[v] = (u, i)
+                        heapq.heappush(heap, (nd, v))
+        return dist, anterior
+
+    def aumentar(self, destino, origem, anterior):
+        v = destino
+        while v != origem:
+            u, i = anterior[v]
+            aresta = self.g[u][i]
+            aresta[1] -= 1
+            self.g[v][aresta[3]][1] += 1
+            v = u
+
+
+def emparelhar(recompensas, candidatos, vagas):
+    """
+    recompensas: [valor por OS]  /  candidatos: {os_idx: [(motoboy_idx, custo)]}
+    vagas: [[custo da 1ª vaga, da 2ª, ...] por motoboy] (crescentes).
+    Retorna {os_idx: motoboy_idx} que maximiza a soma de (recompensa - custo).
+
+    As OS entram uma a uma (mais valiosas primeiro). Para cada uma, o caminho mais barato
+    até T pode usar uma vaga livre, empurrar outra OS para outro motoboy ou tirar uma OS
+    menos valiosa (aresta OS -> T, custo = recompensa dela). Se o ciclo fechado com
+    T -> OS (custo -recompensa) for negativo, ele é aplicado. Os potenciais mantêm os
+    custos reduzidos >= 0 (Dijkstra vale) e a solução ótima a cada passo. T nunca é
+    expandido, então cada OS só explora a vizinhança dos seus candidatos.
+    """
+    n, m = len(recompensas), len(vagas)
+    fluxo = _Fluxo(n, m)
+    arestas = {}
+    chegada = [None] * m
+    for o, lista in candidatos.items():
+        for mb, c in lista:
+            arestas[(o, mb)] = fluxo.aresta(o, n + mb, c)
+            chegada[mb] = c if chegada[mb] is None else min(chegada[mb], c)
+    for mb, custos in enumerate(vagas):
+        for c in custos:
+            fluxo.aresta(n + mb, fluxo.t, c)
+
+    # Potenciais iniciais (tudo livre): OS = 0, motoboy = aresta mais barata que chega, T = vaga mais barata
+    pot = [0.0] * (n + m + 1)
+    for mb in range(m):
+        pot[n + mb] = chegada[mb] or 0.0
+    primeiras = [pot[n + mb] + custos[0] for mb, custos in enumerate(vagas) if custos]
+    pot[fluxo.t] = min(primeiras, default=0.0)
+
+    for o in sorted(candidatos, key=lambda o: -recompensas[o]):
+        dist, anterior = fluxo.caminho(o, pot)
+        if fluxo.t not in dist:
+            continue
+        limite = dist[fluxo.t]
+        if limite - pot[o] + pot[fluxo.t] - recompensas[o] >= -1e-9:
+            continue  # Atribuir esta OS não compensa (não há vaga que valha a recompensa)
+        # Nós não alcançados sobem `limite` (constante comum a todos, não mexe nos custos reduzidos)
+        for v, d in dist.items():
+            pot[v] += min(d, limite) - limite
+        fluxo.aumentar(fluxo.t, o, anterior)
+        fluxo.aresta(o, fluxo.t, recompensas[o])  # Volta possível: tirar esta OS custa a recompensa dela
+
+    # Aresta OS -> motoboy sem capacidade sobrando = usada
+    return {o: mb for (o, mb), aresta in arestas.items() if aresta[1] == 0}
+
+
+# ==========================================================
+# 4. PLANO E APLICAÇÃO
+# ==========================================================
+
+def planejar(janela=JANELA):
+    """ Calcula a atribuição da fila sem gravar nada (é o que a simulação mostra) """
+    inicio = time.monotonic()
+    motoboys = _motoboys_elegiveis()
+    fila = _fila(janela)
+    agora = timezone.now()
+
+    ids_mb = list(motoboys)
+    vagas = []
+    for mb_id in ids_mb:
+        mb = motoboys[mb_id]
+        cabe = mb['livre_kg'] > 0 and mb['livre_litros'] > 0
+        vagas.append([PESO_CARGA * (mb['abertas'] + k) for k in range(MAX_OS_POR_RODADA if cabe else 0)])
+
+    recompensas, candidatos, detalhes = [], {}, {}
+    for o, (os_obj, _paradas, medidas) in enumerate(fila):
+        recompensas.append(recompensa(os_obj, agora))
+        coleta = local_da_coleta(os_obj)
+        opcoes = []
+        for k, mb_id in enumerate(ids_mb):
+            mb = motoboys[mb_id]
+            if medidas['kg'] > mb['livre_kg'] or medidas['litros'] > mb['livre_litros']:
+                continue
+            resultado = custo(os_obj, coleta, mb)
+            if resultado is not None:
+                opcoes.append((resultado[0], k, resultado[1]))
+        melhores = heapq.nsmallest(CANDIDATOS_POR_OS, opcoes)
+        if melhores:
+            candidatos[o] = [(k, c) for c, k, _km in melhores]
+            detalhes.update({(o, k): (c, km) for c, k, km in melhores})
+
+    escolha = emparelhar(recompensas, candidatos, vagas)
+
+    # O fluxo conta OS, não peso: confere o baú de cada motoboy com tudo que ele recebeu (as mais baratas primeiro)
+    usado_kg, usado_litros = Counter(), Counter()
+    pares = []
+    for o, k in sorted(escolha.items(), key=lambda item: detalhes[item]):
+        os_obj, paradas, medidas = fila[o]
+        mb = motoboys[ids_mb[k]]
+        if (usado_kg[k] + medidas['kg'] > mb['livre_kg']
+                or usado_litros[k] + medidas['litros'] > mb['livre_litros']):
+            continue
+        usado_kg[k] += medidas['kg']
+        usado_litros[k] += medidas['litros']
+        c, km = detalhes[(o, k)]
+        pares.append({
+            'os': os_obj,
+            'motoboy': mb['profile'],
+            'custo': round(c, 2),
+            'km': round(km, 2),
+            'paradas': paradas,
+            'kg': round(medidas['kg'], 2),
+            'litros': round(medidas['litros'], 1),
+        })
+    atribuidas = {p['os'].id for p in pares}
+    sem_motoboy = [os_obj for os_obj, _p, _m in fila if os_obj.id not in atribuidas]
+
+    return {
+        'pares': pares,
+        'sem_motoboy': sem_motoboy,
+        'fila': len(fila),
+        'motoboys': len(motoboys),
+        'tempo_ms': round((time.monotonic() - inicio) * 1000, 1),
+    }
+
+
+@transaction.atomic
+def aplicar(plano, usuario=None):
+    """ Grava o plano. OS que deixaram de estar livres (atribuição manual no meio tempo) são puladas. """
+    ids = [p['os'].id for p in plano['pares']]
+    livres = set(
+        ServiceOrder.objects.select_for_update()
+        .filter(id__in=ids, status=ServiceOrder.Status.PENDING, motoboy__isnull=True)
+        .values_list('id', flat=True)
+    )
+    por_motoboy = defaultdict(list)
+    for par in plano['pares']:
+        if par['os'].id in livres:
+            por_motoboy[par['motoboy'].id].append(par['os'].id)
+    if not por_motoboy:
+        return 0
+
+    # Mesma regra do atribuir_paradas: as paradas do grupo entram no fim da fila (fila travada)
+    proxima = Counter(
+        RouteStop.objects.select_for_update()
+        .filter(motoboy_id__in=list(por_motoboy), is_completed=False)
+        .values_list('motoboy_id', flat=True)
+    )
+    paradas_por_raiz = defaultdict(list)
+    for parada in (RouteStop.objects.filter(service_order__group_root_id__in=livres)
+                   .select_related('service_order').order_by('sequence', 'id')):
+        paradas_por_raiz[parada.service_order.group_root_id].append(parada)
+
+    alteradas = []
+    for mb_id, raizes in por_motoboy.items():
+        # Um UPDATE (+ logs) por motoboy: o grupo todo (mãe + filhas) vai para ACEITO com ele
+        transicionar_varias(
+            ServiceOrder.objects.filter(group_root_id__in=raizes).exclude(status__in=TERMINAIS),
+            ServiceOrder.Status.ACCEPTED, usuario, motoboy_id=mb_id,
+        )
+        for raiz_id in raizes:
+            for parada in paradas_por_raiz[raiz_id]:
+                proxima[mb_id] += 1
+                parada.motoboy_id = mb_id
+                parada.sequence = proxima[mb_id]
+                alteradas.append(parada)
+    RouteStop.objects.bulk_update(alteradas, ['motoboy', 'sequence'])
+
+    for par in plano['pares']:
+        if par['os'].id in livres:
+            publicar_evento('os_atribuida', os_id=par['os'].id, os_number=par['os'].os_number, motoboy_id=par['motoboy'].id)
+    return sum(len(raizes) for raizes in por_motoboy.values())
+
+
+def atribuir_fila(usuario=None, simular=False, janela=JANELA):
+    """ Planeja e (sem simular) grava. Retorna o plano com 'atribuidas' preenchido. """
+    plano = planejar(janela)
+    plano['atribuidas'] = 0 if simular else aplicar(plano, usuario)
+    return plano
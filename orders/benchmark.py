@@ -0,0 +1,221 @@
+# orders/benchmark.py
+"""
+Benchmark de queries e latência das telas principais (`manage.py medir_views`).
+
+Para cada cenário (N OS / M motoboys) a massa é gerada com o modo rápido do gerar_os
+(orders/seeding.py) num banco de teste descartável, e cada view é chamada pelo test
+Client. Medimos número de queries, tempo de banco e tempo total (mediana das
+repetições), a frio (cache limpo antes, ex: tela do motoboy de orders/driver_view.py) e a
+quente (logo em seguida, com o cache preenchido). O resultado pode ser comparado com um
+baseline salvo: query a mais ou tempo muito acima do baseline é regressão.
+"""
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Q
+from django.test import Client
+from django.urls import reverse
+from faker import Faker
+
+from logistics.models import MotoboyProfile
+from .models import ServiceOrder
+from .seeding import gerar_massa
+
+CustomUser = get_user_model()
+
+CENARIOS_PADRAO = '1000:50,10000:500'
+
+# Tolerâncias padrão da comparação com o baseline
+TOLERANCIA_QUERIES = 0        # queries a mais permitidas
+TOLERANCIA_TEMPO = 0.5        # +50% no tempo total
+FOLGA_TEMPO_MS = 20.0         # diferenças abaixo disso são ruído
+
+
+def ler_cenarios(texto):
+    """ '1000:50,10000:500' -> [(1000, 50), (10000, 500)], em ordem crescente """
+    cenarios = []
+    for parte in texto.split(','):
+        os_str, _, motoboys_str = parte.strip().partition(':')
+        cenarios.append((int(os_str), int(motoboys_str or 50)))
+    return sorted(cenarios)
+
+
+def nome_cenario(quantidade_os, motoboys):
+    return f"{quantidade_os}os_{motoboys}mb"
+
+
+# ==========================================================
+# 1. MASSA E ALVOS
+# ==========================================================
+
+def _usuario(username, tipo, **extra):
+    usuario, _ = CustomUser.objects.get_or_create(username=username, defaults={'type': tipo, **extra})
+    return usuario
+
+
+def escolher_alvos():
+    """ Usuários e OS "piores casos" da massa atual: quem tem mais dados em cada tela """
+    empresa = CustomUser.objects.filter(type='COMPANY').annotate(
+        total=Count('orders')
+    ).order_by('-total').first()
+    motoboy = MotoboyProfile.objects.select_related('user').annotate(
+        abertas=Count('route_stops', filter=Q(route_stops__is_completed=False))
+    ).order_by('-abertas').first()
+    os_alvo = ServiceOrder.objects.filter(status='OCORRENCIA').annotate(
+        n_dest=Count('destinations')
+    ).order_by('-n_dest').first() or ServiceOrder.objects.first()
+
+    return {
+        'despachante': _usuario('bench_despacho', 'DISPATCHER'),
+        'admin': _usuario('bench_admin', 'ADMIN'),
+        'empresa': empresa,
+        'motoboy': motoboy.user if motoboy else None,
+        'os_id': os_alvo.id if os_alvo else None,
+    }
+
+
+def views_medidas(alvos):
+    """ (nome, usuário, url) de cada tela medida """
+    os_id = alvos['os_id']
+    return [
+        ('dispatch_dashboard', alvos['despachante'], reverse('dispatch_dashboard')),
+        ('admin_dashboard', alvos['admin'], reverse('admin_dashboard')),
+        ('company_dashboard', alvos['empresa'], reverse('company_dashboard')),
+        ('motoboy_tasks', alvos['motoboy'], reverse('motoboy_tasks')),
+        ('os_details', alvos['despachante'], reverse('os_details', args=[os_id])),
+        ('get_route_stops', alvos['despachante'], reverse('get_route_stops', args=[os_id])),
+    ]
+
+
+# ==========================================================
+# 2. MEDIÇÃO
+# ==========================================================
+
+class _Cronometro:
+    """ execute_wrapper que conta as queries e soma o tempo de cada uma com perf_counter """
+
+    def __init__(self):
+        self.queries = 0
+        self.segundos = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.segundos += time.perf_counter() - inicio
+            self.queries += 1
+
+
+def _amostra(client, url):
+    cronometro = _Cronometro()
+    with connection.execute_wrapper(cronometro):
+        inicio = time.perf_counter()
+        resposta = client.get(url)
+        if hasattr(resposta, 'streaming_content'):
+            b''.join(resposta.streaming_content)
+        total_ms = (time.perf_counter() - inicio) * 1000
+    return {
+        'status_code': resposta.status_code,
+        'queries': cronometro.queries,
+        'db_ms': cronometro.segundos * 1000,
+        'wall_ms': total_ms,
+    }
+
+
+def medir_view(usuario, url, repeticoes=3):
+    """
+    Uma chamada de aquecimento + `repeticoes` pares de medidas: a frio (cache limpo) e a
+    quente (a mesma chamada de novo). Retorna as medianas; as da medida quente com '_quente'.
+    """
+    client = Client()
+    client.force_login(usuario)
+    client.get(url)
+
+    frias, quentes = [], []
+    for _ in range(repeticoes):
+        cache.clear()
+        frias.append(_amostra(client, url))
+        quentes.append(_amostra(client, url))
+
+    return {
+        'status_code': frias[-1]['status_code'],
+        'queries': max(a['queries'] for a in frias),
+        'db_ms': round(statistics.median(a['db_ms'] for a in frias), 2),
+        'wall_ms': round(statistics.median(a['wall_ms'] for a in frias), 2),
+        'queries_quente': max(a['queries'] for a in quentes),
+        'db_ms_quente': round(statistics.median(a['db_ms'] for a in quentes), 2),
+        'wall_ms_quente': round(statistics.median(a['wall_ms'] for a in quentes), 2),
+    }
+
+
+def executar(cenarios, repeticoes=3, seed=42, progresso=None):
+    """
+    Gera a massa de forma incremental (cada cenário acrescenta a diferença para o anterior)
+    e mede todas as views. Deve rodar num banco descartável.
+    """
+    fake = Faker('pt_BR')
+    Faker.seed(seed)
+    resultados = []
+    geradas = 0
+    for k, (quantidade_os, motoboys) in enumerate(cenarios):
+        if quantidade_os > geradas:
+            gerar_massa(quantidade_os - geradas, fake, seed=seed + k, motoboys=motoboys)
+            geradas = quantidade_os
+
+        cenario = nome_cenario(quantidade_os, motoboys)
+        for nome, usuario, url in views_medidas(escolher_alvos()):
+            if usuario is None:
+                continue
+            medida = {'cenario': cenario, 'view': nome, **medir_view(usuario, url, repeticoes)}
+            resultados.append(medida)
+            if progresso:
+                progresso(medida)
+    return resultados
+
+
+# ==========================================================
+# 3. RELATÓRIO E BASELINE
+# ==========================================================
+
+def comparar(resultados, baseline, tolerancia_queries=TOLERANCIA_QUERIES, tolerancia_tempo=TOLERANCIA_TEMPO):
+    """ Retorna a lista de regressões (strings) em relação ao baseline """
+    anteriores = {(b['cenario'], b['view']): b for b in baseline.get('resultados', [])}
+    regressoes = []
+    for atual in resultados:
+        antes = anteriores.get((atual['cenario'], atual['view']))
+        if not antes:
+            continue
+        rotulo = f"{atual['cenario']} / {atual['view']}"
+        if atual['status_code'] != antes['status_code']:
+            regressoes.append(f"{rotulo}: status {antes['status_code']} -> {atual['status_code']}")
+        # Baselines antigos não têm a medida quente: só compara o que existe nos dois
+        for sufixo, nome in (('', ''), ('_quente', ' (quente)')):
+            if f'queries{sufixo}' not in antes or f'queries{sufixo}' not in atual:
+                continue
+            q_antes, q_atual = antes[f'queries{sufixo}'], atual[f'queries{sufixo}']
+            if q_atual > q_antes + tolerancia_queries:
+                regressoes.append(f"{rotulo}: queries{nome} {q_antes} -> {q_atual}")
+            t_antes, t_atual = antes[f'wall_ms{sufixo}'], atual[f'wall_ms{sufixo}']
+            limite = max(t_antes * (1 + tolerancia_tempo), t_antes + FOLGA_TEMPO_MS)
+            if t_atual > limite:
+                regressoes.append(f"{rotulo}: tempo{nome} {t_antes:.1f}ms -> {t_atual:.1f}ms")
+    return regressoes
+
+
+def relatorio_markdown(resultados, regressoes=None):
+    linhas = [
+        '| Cenário | View | Status | Queries | DB (ms) | Total (ms) | Queries quente | DB quente (ms) | Total quente (ms) |',
+        '|---|---|---:|---:|---:|---:|---:|---:|---:|',
+    ]
+    for r in resultados:
+        linhas.append(
+            f"| {r['cenario']} | {r['view']} | {r['status_code']} | {r['queries']} | {r['db_ms']:.1f} | {r['wall_ms']:.1f} "
+            f"| {r['queries_quente']} | {r['db_ms_quente']:.1f} | {r['wall_ms_quente']:.1f} |"
+        )
+    if regressoes:
+        linhas += ['', '**Regressões:**', ''] + [f'- {r}' for r in regressoes]
+    return '\n'.join(linhas) + '\n'
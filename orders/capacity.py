@@ -0,0 +1,211 @@
+# orders/capacity.py
+"""
+Capacidade do baú: peso e volume que cada motoboy carrega agora e vai carregar.
+
+Carga de um motoboy = itens em posse dele (COLETADO com posse_atual) + coletas planejadas:
+itens NAO_COLETADO dos grupos com parada de COLETA aberta na fila dele e itens TRANSFERIDO
+dos grupos com parada de TRANSFERENCIA aberta para ele (resgate). Peso e dimensões do OSItem
+são por unidade (x total_quantity); item sem peso ou sem dimensões conta zero e aparece
+em 'sem_medidas'.
+
+O limite vem do maior veículo cadastrado (LIMITES por Vehicle.type; sem veículo = moto).
+Para o painel da frota (`cargas`) a carga fica no cache por motoboy e é descartada junto com a
+tela "Minhas Entregas" sempre que uma parada, OS ou posse de item dele muda (orders/models.py
+-> `invalidar_carga`). Decisões (atribuir, transferir, resgatar, atribuição automática) não
+confiam no cache, que pode estar velho em outro worker: usam `calcular`, lido na hora.
+"""
+import re
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+
+from logistics.models import Vehicle
+from .models import OSItem, RouteStop, ServiceOrder
+
+CACHE_TTL = 120  # Rede de segurança para escritas que não passam pelos hooks (ex: peso editado no admin)
+MARCADOR_SOCORRO = '[AGUARDANDO SOCORRO]'
+
+# Limite por veículo (baú / porta-malas / caçamba)
+LIMITES = {
+    Vehicle.Type.MOTO: {'kg': 30.0, 'litros': 90.0},
+    Vehicle.Type.CAR: {'kg': 250.0, 'litros': 600.0},
+    Vehicle.Type.VAN: {'kg': 1200.0, 'litros': 6000.0},
+}
+AVISO = 0.85  # Acima disso (de peso ou volume) avisa; acima de 1.0 excede
+
+# Veículo que a OS pede (ServiceOrder.vehicle_type) -> limite usado antes de ter motoboy
+VEICULO_DA_OS = {
+    ServiceOrder.VehicleType.MOTO: Vehicle.Type.MOTO,
+    ServiceOrder.VehicleType.CAR: Vehicle.Type.CAR,
+    ServiceOrder.VehicleType.UTILITY: Vehicle.Type.VAN,
+}
+
+# Itens ainda no circuito (nem entregues, nem devolvidos, nem perdidos)
+STATUS_EM_CIRCULACAO = [OSItem.ItemStatus.NAO_COLETADO, OSItem.ItemStatus.COLETADO, OSItem.ItemStatus.TRANSFERIDO]
+
+_NUMEROS = re.compile(r'\d+(?:[.,]\d+)?')
+
+
+def _chave(motoboy_id):
+    return f'carga_motoboy_{motoboy_id}'
+
+
+def invalidar_carga(*motoboy_ids):
+    """ Descarta a carga cacheada (depois do commit, como a tela do motoboy) """
+    chaves = [_chave(mid) for mid in set(motoboy_ids) if mid]
+    if chaves:
+        transaction.on_commit(lambda: cache.delete_many(chaves))
+
+
+# ==========================================================
+# 1. MEDIDAS
+# ==========================================================
+
+def volume_litros(dimensoes):
+    """ 'CxLxA' em cm ('30x20x15', '30 X 20 X 15', '30,5x20x15') -> litros. None se não der para ler. """
+    numeros = _NUMEROS.findall(dimensoes or '')
+    if len(numeros) != 3:
+        return None
+    c, l, a = (float(n.replace(',', '.')) for n in numeros)
+    return c * l * a / 1000
+
+
+def _somar(total, peso, quantidade, dimensoes):
+    litros = volume_litros(dimensoes)
+    if peso is None or litros is None:
+        total['sem_medidas'] += 1
+    total['kg'] += float(peso or Decimal(0)) * quantidade
+    total['litros'] += (litros or 0.0) * quantidade
+    total['itens'] += quantidade
+
+
+def _vazia():
+    return {'kg': 0.0, 'litros': 0.0, 'itens': 0, 'sem_medidas': 0}
+
+
+def carga_dos_grupos(raiz_ids):
+    """ {raiz_id: medidas} dos itens ainda em circulação de cada grupo (mãe + filhas), numa query """
+    cargas = defaultdict(_vazia)
+    for raiz_id, peso, quantidade, dimensoes in (
+        OSItem.objects.filter(order__group_root_id__in=list(raiz_ids), status__in=STATUS_EM_CIRCULACAO)
+        .values_list('order__group_root_id', 'weight', 'total_quantity', 'dimensions')
+    ):
+        _somar(cargas[raiz_id], peso, quantidade, dimensoes)
+    return cargas
+
+
+# ==========================================================
+# 2. CARGA POR MOTOBOY
+# ==========================================================
+
+def calcular(motoboy_ids):
+    """ Carga de vários motoboys, lida do banco agora, com um número fixo de queries """
+    cargas = {}
+    for mb_id in motoboy_ids:
+        cargas[mb_id] = {'veiculo': Vehicle.Type.MOTO, 'em_posse': _vazia(), 'planejada': _vazia()}
+
+    for owner_id, tipo in Vehicle.objects.filter(owner_id__in=motoboy_ids).values_list('owner_id', 'type'):
+        atual = cargas[owner_id]['veiculo']
+        if LIMITES.get(tipo, LIMITES[atual])['kg'] > LIMITES[atual]['kg']:
+            cargas[owner_id]['veiculo'] = tipo
+
+    # 1. No baú agora
+    for mb_id, peso, quantidade, dimensoes in (
+        OSItem.objects.filter(posse_atual_id__in=motoboy_ids, status=OSItem.ItemStatus.COLETADO)
+        .values_list('posse_atual_id', 'weight', 'total_quantity', 'dimensions')
+    ):
+        _somar(cargas[mb_id]['em_posse'], peso, quantidade, dimensoes)
+
+    # 2. Vai pegar: coleta na loja (itens NAO_COLETADO) ou resgate de colega (itens TRANSFERIDO)
+    quem_pega = {}
+    for mb_id, raiz_id, tipo in (
+        RouteStop.objects.filter(
+            motoboy_id__in=motoboy_ids, is_completed=False,
+            stop_type__in=[RouteStop.StopType.COLLECTION, RouteStop.StopType.TRANSFER],
+        ).exclude(failure_reason__icontains=MARCADOR_SOCORRO)
+        .values_list('motoboy_id', 'service_order__group_root_id', 'stop_type')
+    ):
+        status = OSItem.ItemStatus.NAO_COLETADO if tipo == RouteStop.StopType.COLLECTION else OSItem.ItemStatus.TRANSFERIDO
+        quem_pega[(raiz_id, status)] = mb_id
+    if quem_pega:
+        for raiz_id, status, peso, quantidade, dimensoes in (
+            OSItem.objects.filter(
+                order__group_root_id__in={raiz_id for raiz_id, _ in quem_pega},
+                status__in=[OSItem.ItemStatus.NAO_COLETADO, OSItem.ItemStatus.TRANSFERIDO],
+            ).values_list('order__group_root_id', 'status', 'weight', 'total_quantity', 'dimensions')
+        ):
+            mb_id = quem_pega.get((raiz_id, status))
+            if mb_id is not None:
+                _somar(cargas[mb_id]['planejada'], peso, quantidade, dimensoes)
+
+    for carga in cargas.values():
+        limite = LIMITES[carga['veiculo']]
+        carga['kg'] = round(carga['em_posse']['kg'] + carga['planejada']['kg'], 3)
+        carga['litros'] = round(carga['em_posse']['litros'] + carga['planejada']['litros'], 3)
+        carga['limite_kg'], carga['limite_litros'] = limite['kg'], limite['litros']
+        carga['ocupacao'] = round(ocupacao(carga['kg'], carga['litros'], limite), 3)
+    return cargas
+
+
+def cargas(motoboy_ids):
+    """ {motoboy_id: carga} do cache, só para exibição; os que faltam são calculados (em lote) """
+    ids = list(dict.fromkeys(mid for mid in motoboy_ids if mid))
+    cacheadas = cache.get_many([_chave(mid) for mid in ids])
+    resultado = {mid: cacheadas[_chave(mid)] for mid in ids if _chave(mid) in cacheadas}
+    faltando = [mid for mid in ids if mid not in resultado]
+    if faltando:
+        novas = calcular(faltando)
+        cache.set_many({_chave(mid): carga for mid, carga in novas.items()}, CACHE_TTL)
+        resultado.update(novas)
+    return resultado
+
+
+# ==========================================================
+# 3. VERIFICAÇÃO (atribuição, mescla, resgate)
+# ==========================================================
+
+def ocupacao(kg, litros, limite):
+    """ Fração do limite usada (a pior entre peso e volume) """
+    return max(kg / limite['kg'], litros / limite['litros'])
+
+
+def avaliar(carga_motoboy, extra=None):
+    """
+    Carga do motoboy somada a `extra` (medidas de um grupo) contra o limite do veículo.
+    Retorna {'nivel': 'ok' | 'aviso' | 'excede', 'ocupacao', 'kg', 'litros', 'mensagem'}.
+    """
+    extra = extra or _vazia()
+    kg = carga_motoboy['kg'] + extra['kg']
+    litros = carga_motoboy['litros'] + extra['litros']
+    limite = LIMITES[carga_motoboy['veiculo']]
+    fracao = ocupacao(kg, litros, limite)
+    nivel = 'excede' if fracao > 1 else 'aviso' if fracao > AVISO else 'ok'
+    mensagem = ''
+    if nivel != 'ok':
+        mensagem = (
+            f"{'Capacidade excedida' if nivel == 'excede' else 'Baú quase cheio'}: "
+            f"{kg:.1f}/{limite['kg']:.0f} kg e {litros:.0f}/{limite['litros']:.0f} L "
+            f"({fracao:.0%} do limite do veículo {Vehicle.Type(carga_motoboy['veiculo']).label})."
+        )
+    return {'nivel': nivel, 'ocupacao': round(fracao, 3), 'kg': round(kg, 3), 'litros': round(litros, 3), 'mensagem': mensagem}
+
+
+def _somar_grupos(raiz_ids):
+    extra = _vazia()
+    for medidas in carga_dos_grupos(raiz_ids).values():
+        for campo in extra:
+            extra[campo] += medidas[campo]
+    return extra
+
+
+def verificar(motoboy_id, raiz_ids):
+    """ Como ficaria o baú do motoboy levando também os grupos `raiz_ids` (carga lida na hora, sem cache) """
+    return avaliar(calcular([motoboy_id])[motoboy_id], _somar_grupos(raiz_ids))
+
+
+def verificar_veiculo(raiz_ids, vehicle_type):
+    """ Os grupos cabem, vazios de outra carga, no veículo que a OS pede? (mescla, ainda sem motoboy) """
+    vazio = {'kg': 0.0, 'litros': 0.0, 'veiculo': VEICULO_DA_OS.get(vehicle_type, Vehicle.Type.MOTO)}
+    return avaliar(vazio, _somar_grupos(raiz_ids))
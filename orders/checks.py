@@ -0,0 +1,17 @@
+# orders/checks.py
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def cache_compartilhado(app_configs, **kwargs):
+    """ Tela do motoboy / carga do baú são invalidadas no cache: com cache por processo, os outros workers ficam velhos """
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend.endswith('LocMemCache'):
+        return [Warning(
+            "O cache padrão é LocMemCache (um por processo).",
+            hint="Com mais de um worker, configure um cache compartilhado (ex: CACHE_URL=redis://...). "
+                 "Sem isso a tela do motoboy e a carga do baú ficam desatualizadas nos outros processos até o TTL.",
+            id='orders.W001',
+        )]
+    return []
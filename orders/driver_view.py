@@ -0,0 +1,125 @@
+# orders/driver_view.py
+"""
+Tela "Minhas Entregas" do motoboy montada numa passada só.
+
+A versão antiga fazia, para cada OS ativa, uma query de paradas, outra de filhas, um
+exists() das filhas e outro para saber se a OS estava pausada. Aqui carregamos:
+  1. As paradas abertas do motoboy (só ids/sequência) -> descobre as OS raiz.
+  2. As OS raiz + filhas (+ itens em prefetch).
+  3. As paradas do motoboy nessas OS (com destino; distribuição em prefetch).
+e calculamos pausa / OS atual em memória.
+
+O resultado fica no cache por motoboy e é invalidado sempre que uma parada ou OS dele
+muda (save/delete/update/bulk_* em orders/models.py chamam `invalidar_rota_motoboy`).
+"""
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+
+from .models import ServiceOrder, RouteStop, ItemDistribution
+
+SEQUENCIA_PAUSADA = 999  # Paradas "estacionadas" aguardando o despachante
+STATUS_ATIVOS = ['ACEITO', 'COLETADO', 'OCORRENCIA']
+CACHE_TTL = 120  # Rede de segurança: nenhuma tela fica mais que isso desatualizada
+
+
+def _chave(motoboy_id):
+    return f'rota_motoboy_{motoboy_id}'
+
+
+def invalidar_rota_motoboy(*motoboy_ids):
+    """ Descarta a tela cacheada dos motoboys (depois do commit, para ninguém recachear o estado antigo) """
+    chaves = [_chave(mid) for mid in set(motoboy_ids) if mid]
+    if chaves:
+        transaction.on_commit(lambda: cache.delete_many(chaves))
+
+
+def _montar(perfil):
+    # 1. OS com parada aberta para este motoboy -> OS raiz (a mãe, se for filha)
+    abertas = list(
+        RouteStop.objects.filter(motoboy=perfil, is_completed=False)
+        .values_list('service_order_id', 'service_order__group_root_id', 'sequence', 'id')
+    )
+    raizes_candidatas = {raiz_id or os_id for os_id, raiz_id, _seq, _id in abertas}
+
+    # Mesmo critério do `.exclude(sequence=999).order_by('sequence').first()` antigo
+    proxima = min(
+        ((seq, stop_id, os_id) for os_id, _p, seq, stop_id in abertas if seq != SEQUENCIA_PAUSADA),
+        default=None
+    )
+    os_em_execucao_id = proxima[2] if proxima else None
+
+    # 2. Raízes ativas e suas filhas
+    # Itens em prefetch: usados nas paradas de COLETA
+    ordens = list(
+        ServiceOrder.objects.filter(group_root_id__in=raizes_candidatas)
+        .prefetch_related('items')
+    ) if raizes_candidatas else []
+    ordens_por_id = {o.id: o for o in ordens}
+    raizes = sorted(
+        (o for o in ordens if o.parent_os_id is None and o.status in STATUS_ATIVOS),
+        key=lambda o: o.created_at
+    )
+    filhas_por_raiz = {}
+    for o in sorted(ordens, key=lambda o: o.id):
+        if o.parent_os_id is not None:
+            filhas_por_raiz.setdefault(o.parent_os_id, []).append(o)
+
+    # 3. Paradas do motoboy nessas OS (o novo motoboy não vê o que o antigo já fez)
+    paradas_por_raiz = {}
+    if raizes:
+        ids_raizes = {r.id for r in raizes}
+        ids_grupo = [o.id for o in ordens if (o.parent_os_id or o.id) in ids_raizes]
+        paradas = RouteStop.objects.filter(motoboy=perfil, service_order_id__in=ids_grupo).select_related(
+            'destination'
+        ).prefetch_related(
+            Prefetch('destination__distributed_items', queryset=ItemDistribution.objects.select_related('item'))
+        ).order_by('sequence')
+        for parada in paradas:
+            os_parada = ordens_por_id[parada.service_order_id]
+            parada.service_order = os_parada  # reaproveita a OS já carregada (sem query extra)
+            paradas_por_raiz.setdefault(os_parada.parent_os_id or os_parada.id, []).append(parada)
+
+    ativas_data = []
+    for os_obj in raizes:
+        stops = paradas_por_raiz.get(os_obj.id, [])
+        filhas = filhas_por_raiz.get(os_obj.id, [])
+        ativas_data.append({
+            'os': os_obj,
+            'stops': stops,
+            'has_children': bool(filhas),
+            'child_numbers': [f.os_number for f in filhas],
+            # Só sobraram paradas 999: a OS está aguardando o despachante
+            'ta_pausada': not any(not s.is_completed and s.sequence != SEQUENCIA_PAUSADA for s in stops),
+            'eh_a_atual': os_obj.id == os_em_execucao_id,
+        })
+
+    ativas_data.sort(key=lambda x: (x['ta_pausada'], not x['eh_a_atual'], x['os'].created_at))
+
+    hoje = timezone.localdate()  # Dia de São Paulo (TIME_ZONE), não o de UTC
+    # Faixa [00:00, 00:00 do dia seguinte) em vez de completed_at__date: assim usa o parada_concluida_idx
+    inicio_dia = timezone.make_aware(datetime.combine(hoje, time.min))
+    fim_dia = timezone.make_aware(datetime.combine(hoje + timedelta(days=1), time.min))
+    return {
+        'dia': hoje,
+        'ativas_data': ativas_data,
+        'entregas_concluidas': RouteStop.objects.filter(
+            motoboy=perfil, stop_type='ENTREGA', is_completed=True, is_failed=False,
+            completed_at__gte=inicio_dia, completed_at__lt=fim_dia
+        ).count(),
+        'historico': list(
+            ServiceOrder.objects.filter(motoboy=perfil, status__in=['ENTREGUE', 'CANCELADO']).order_by('-created_at')[:10]
+        ),
+    }
+
+
+def build_driver_view(perfil):
+    """ Retorna o contexto da tela do motoboy (do cache quando possível) """
+    dados = cache.get(_chave(perfil.id))
+    if dados is None or dados['dia'] != timezone.localdate():
+        dados = _montar(perfil)
+        cache.set(_chave(perfil.id), dados, CACHE_TTL)
+    return dados
@@ -0,0 +1,313 @@
+# orders/eta.py
+"""
+Previsão de chegada (ETA) das paradas e das OS.
+
+Para a fila de cada motoboy (paradas abertas na ordem de sequence), partindo de agora e
+do local da última parada feita:
+  chegada(parada) = saída da anterior + distância / velocidade do bairro de destino
+  saída(parada)   = chegada + permanência típica do tipo de parada
+Velocidade por bairro (senão cidade, senão geral) e permanência por tipo de parada vêm de
+EtaProfile, aprendidos offline por `manage.py treinar_eta` com os intervalos entre os
+completed_at de paradas consecutivas do mesmo motoboy. Sem perfil valem os padrões abaixo.
+
+O resultado fica gravado em RouteStop.eta e em ServiceOrder.expected_pickup /
+expected_delivery: os painéis só leem colunas. Qualquer escrita nas paradas de um motoboy
+(conclusão, reordenação, atribuição, resgate) agenda o recálculo só da fila dele, depois do
+commit (orders/models.py -> `agendar`). Parada que trava a rota (falha, resgate) e tudo que
+vem depois ficam sem previsão até o despachante resolver.
+"""
+import logging
+import threading
+from collections import defaultdict
+from datetime import timedelta
+from statistics import median
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from logistics.models import MotoboyProfile
+from .geocoding import normalizar
+from .models import EtaProfile, RouteStop, ServiceOrder
+from .routing import SEQUENCIA_ESTACIONADA, distancia_km, local_da_parada, trava_rota
+
+logger = logging.getLogger(__name__)
+
+VELOCIDADE_PADRAO_KMH = 20.0
+PERMANENCIA_PADRAO_MIN = {
+    RouteStop.StopType.COLLECTION: 8.0,
+    RouteStop.StopType.DELIVERY: 5.0,
+    RouteStop.StopType.TRANSFER: 10.0,
+    RouteStop.StopType.RETURN: 8.0,
+}
+TOLERANCIA_ATRASO = timedelta(minutes=10)  # Previsão vencida há mais que isso = atrasado
+DIFERENCA_MINIMA = timedelta(seconds=60)  # Previsões que mudaram menos que isso não são regravadas
+
+# Treino
+DIAS_TREINO = 60
+MIN_AMOSTRAS = 20
+INTERVALO_MAXIMO_MIN = 120  # Intervalo maior entre duas paradas = pausa/fim de turno, não trajeto
+RAIO_MESMO_LOCAL_KM = 0.2  # Paradas coladas: o intervalo é praticamente só permanência
+DISTANCIA_MINIMA_KM = 1.0  # Trechos menores não dizem nada sobre velocidade
+VELOCIDADE_FAIXA_KMH = (3.0, 80.0)
+
+CHAVE_CACHE_PERFIS = 'eta_perfis'
+CACHE_TTL = 600
+
+
+# ==========================================================
+# 1. PERFIS (velocidade por bairro, permanência por tipo)
+# ==========================================================
+
+def _chave_regiao(bairro, cidade):
+    return f"{normalizar(cidade)}|{normalizar(bairro)}"
+
+
+def _regiao_da_parada(stop):
+    """ (bairro, cidade) de onde a parada acontece; None para endereço livre (transferência/devolução) """
+    if stop.stop_type == RouteStop.StopType.COLLECTION:
+        return stop.service_order.origin_district, stop.service_order.origin_city
+    if stop.stop_type == RouteStop.StopType.DELIVERY and stop.destination_id:
+        return stop.destination.destination_district, stop.destination.destination_city
+    return None
+
+
+def _perfis():
+    perfis = cache.get(CHAVE_CACHE_PERFIS)
+    if perfis is None:
+        perfis = {(p.tipo, p.chave): p.valor for p in EtaProfile.objects.all()}
+        cache.set(CHAVE_CACHE_PERFIS, perfis, CACHE_TTL)
+    return perfis
+
+
+def velocidade_kmh(perfis, regiao):
+    if regiao:
+        bairro, cidade = regiao
+        for chave in (_chave_regiao(bairro, cidade), _chave_regiao('', cidade)):
+            valor = perfis.get((EtaProfile.Tipo.VELOCIDADE, chave))
+            if valor:
+                return valor
+    return perfis.get((EtaProfile.Tipo.VELOCIDADE, ''), VELOCIDADE_PADRAO_KMH)
+
+
+def permanencia_min(perfis, stop_type):
+    return perfis.get((EtaProfile.Tipo.PERMANENCIA, stop_type), PERMANENCIA_PADRAO_MIN.get(stop_type, 5.0))
+
+
+# ==========================================================
+# 2. PREVISÃO DA FILA DE UM MOTOBOY (sem banco)
+# ==========================================================
+
+def prever(paradas, origem, partida, perfis):
+    """
+    paradas: abertas do motoboy na ordem da fila (com service_order/destination carregados).
+    Retorna {stop_id: eta ou None}.
+    """
+    previsoes = {}
+    local, relogio, travada = origem, partida, False
+    for stop in paradas:
+        if travada or stop.sequence >= SEQUENCIA_ESTACIONADA or trava_rota(stop):
+            # Daqui para frente depende de decisão do despachante
+            travada = travada or stop.sequence < SEQUENCIA_ESTACIONADA
+            previsoes[stop.id] = None
+            continue
+        destino = local_da_parada(stop)
+        km = distancia_km(local, destino) if local is not None and destino is not None else 0.0
+        relogio += timedelta(hours=km / velocidade_kmh(perfis, _regiao_da_parada(stop)))
+        previsoes[stop.id] = relogio
+        relogio += timedelta(minutes=permanencia_min(perfis, stop.stop_type))
+        if destino is not None:
+            local = destino
+    return previsoes
+
+
+def _mudou(antigo, novo):
+    if antigo is None or novo is None:
+        return antigo is not novo
+    return abs(antigo - novo) >= DIFERENCA_MINIMA
+
+
+def recalcular(motoboy_ids, agora=None):
+    """ Refaz e grava as previsões da fila dos motoboys. Retorna quantas paradas mudaram. """
+    motoboy_ids = [mid for mid in set(motoboy_ids) if mid]
+    if not motoboy_ids:
+        return 0
+    agora = agora or timezone.now()
+    perfis = _perfis()
+
+    ultima_feita = (
+        RouteStop.objects.filter(motoboy=OuterRef('pk'), is_completed=True, completed_at__isnull=False)
+        .order_by('-completed_at').values('id')[:1]
+    )
+    ultimas = dict(
+        MotoboyProfile.objects.filter(id__in=motoboy_ids)
+        .annotate(ultima_feita_id=Subquery(ultima_feita)).values_list('id', 'ultima_feita_id')
+    )
+    feitas = RouteStop.objects.select_related('service_order', 'destination').in_bulk(
+        [stop_id for stop_id in ultimas.values() if stop_id]
+    )
+    filas = defaultdict(list)
+    for parada in (RouteStop.objects.filter(motoboy_id__in=motoboy_ids, is_completed=False)
+                   .select_related('service_order', 'destination').order_by('motoboy_id', 'sequence', 'id')):
+        filas[parada.motoboy_id].append(parada)
+
+    alteradas, paradas = [], []
+    for mb_id, fila in filas.items():
+        feita = feitas.get(ultimas.get(mb_id))
+        origem = local_da_parada(feita) if feita else None
+        previsoes = prever(fila, origem, agora, perfis)
+        for stop in fila:
+            paradas.append(stop)
+            if _mudou(stop.eta, previsoes[stop.id]):
+                stop.eta = previsoes[stop.id]
+                alteradas.append(stop)
+
+    with transaction.atomic():
+        if alteradas:
+            RouteStop.objects.bulk_update(alteradas, ['eta'])
+        _atualizar_ordens(paradas, motoboy_ids)
+    return len(alteradas)
+
+
+def _atualizar_ordens(paradas, motoboy_ids):
+    """ expected_pickup = chegada na coleta; expected_delivery = última entrega aberta (de qualquer motoboy) """
+    ordens = {stop.service_order_id: stop.service_order for stop in paradas}
+    if not ordens:
+        return
+    coleta, entregas = {}, defaultdict(list)
+    for stop in paradas:
+        if stop.stop_type == RouteStop.StopType.COLLECTION:
+            coleta[stop.service_order_id] = stop.eta
+        elif stop.stop_type == RouteStop.StopType.DELIVERY:
+            entregas[stop.service_order_id].append(stop.eta)
+    # Entregas da mesma OS com outro motoboy (resgate parcial) ou ainda sem motoboy também contam
+    for os_id, motoboy_id, eta in (
+        RouteStop.objects.filter(service_order_id__in=ordens, is_completed=False, stop_type=RouteStop.StopType.DELIVERY)
+        .exclude(motoboy_id__in=motoboy_ids).values_list('service_order_id', 'motoboy_id', 'eta')
+    ):
+        entregas[os_id].append(eta if motoboy_id else None)  # Sem motoboy, a eta gravada é de quem a tinha antes
+
+    alteradas = []
+    for os_id, os_obj in ordens.items():
+        coleta_prevista = coleta.get(os_id, os_obj.expected_pickup)  # Já coletada: mantém a última previsão
+        etas = entregas.get(os_id)
+        entrega_prevista = (None if None in etas else max(etas)) if etas else os_obj.expected_delivery
+        if _mudou(os_obj.expected_pickup, coleta_prevista) or _mudou(os_obj.expected_delivery, entrega_prevista):
+            os_obj.expected_pickup, os_obj.expected_delivery = coleta_prevista, entrega_prevista
+            alteradas.append(os_obj)
+    if alteradas:
+        ServiceOrder.objects.bulk_update(alteradas, ['expected_pickup', 'expected_delivery'])
+
+
+_pendentes = threading.local()
+
+
+def agendar(*motoboy_ids):
+    """ Recalcula depois do commit. Várias escritas no mesmo request viram um recálculo só por motoboy. """
+    ids = {mid for mid in motoboy_ids if mid}
+    if not ids:
+        return
+    if not hasattr(_pendentes, 'ids'):
+        _pendentes.ids = set()
+    _pendentes.ids.update(ids)
+    transaction.on_commit(_recalcular_pendentes)
+
+
+def _recalcular_pendentes():
+    ids, _pendentes.ids = getattr(_pendentes, 'ids', set()), set()
+    if not ids:
+        return  # Outro callback do mesmo commit já levou todos
+    try:
+        recalcular(ids)
+    except Exception:
+        # Já estamos depois do commit: previsão desatualizada não derruba o request
+        logger.exception("Falha ao recalcular as previsões dos motoboys %s", sorted(ids)[:20])
+
+
+def atraso(stop, agora=None):
+    """ Minutos de atraso da parada (previsão vencida além da tolerância); 0 se no prazo ou sem previsão """
+    if stop.eta is None or stop.is_completed:
+        return 0
+    vencida = (agora or timezone.now()) - stop.eta
+    return int(vencida.total_seconds() // 60) if vencida > TOLERANCIA_ATRASO else 0
+
+
+# ==========================================================
+# 3. TREINO OFFLINE (manage.py treinar_eta)
+# ==========================================================
+
+def _amostras(dias):
+    """ Pares de paradas consecutivas concluídas do mesmo motoboy: (tipo, região, km, minutos) """
+    desde = timezone.now() - timedelta(days=dias)
+    anterior = None
+    for stop in (RouteStop.objects.filter(is_completed=True, completed_at__gte=desde, motoboy__isnull=False)
+                 .select_related('service_order', 'destination')
+                 .order_by('motoboy_id', 'completed_at').iterator(chunk_size=2000)):
+        if anterior is not None and anterior.motoboy_id == stop.motoboy_id:
+            minutos = (stop.completed_at - anterior.completed_at).total_seconds() / 60
+            a, b = local_da_parada(anterior), local_da_parada(stop)
+            # Só coordenadas: a distância estimada por CEP/bairro é grosseira demais para medir velocidade
+            if 0 < minutos <= INTERVALO_MAXIMO_MIN and a and b and a[0] == 'geo' and b[0] == 'geo':
+                yield stop.stop_type, _regiao_da_parada(stop), distancia_km(a, b), minutos
+        anterior = stop
+
+
+def treinar(dias=DIAS_TREINO):
+    """ Aprende permanência por tipo de parada e velocidade por bairro/cidade. Substitui os perfis. """
+    amostras = list(_amostras(dias))
+
+    # 1. Permanência: intervalos entre paradas no mesmo lugar (quase sem deslocamento)
+    por_tipo = defaultdict(list)
+    for tipo, _regiao, km, minutos in amostras:
+        if km < RAIO_MESMO_LOCAL_KM:
+            por_tipo[tipo].append(minutos)
+    permanencia = {tipo: median(valores) for tipo, valores in por_tipo.items() if len(valores) >= MIN_AMOSTRAS}
+
+    # 2. Velocidade: intervalo menos a permanência no destino
+    por_regiao = defaultdict(list)
+    faixa_min, faixa_max = VELOCIDADE_FAIXA_KMH
+    for tipo, regiao, km, minutos in amostras:
+        if km < DISTANCIA_MINIMA_KM:
+            continue
+        trajeto = minutos - permanencia.get(tipo, PERMANENCIA_PADRAO_MIN.get(tipo, 5.0))
+        if trajeto <= 1:
+            continue
+        kmh = min(max(km / (trajeto / 60), faixa_min), faixa_max)
+        por_regiao[''].append(kmh)
+        if regiao:
+            bairro, cidade = regiao
+            por_regiao[_chave_regiao('', cidade)].append(kmh)
+            por_regiao[_chave_regiao(bairro, cidade)].append(kmh)
+
+    perfis = [
+        EtaProfile(tipo=EtaProfile.Tipo.PERMANENCIA, chave=tipo, valor=round(valor, 2), amostras=len(por_tipo[tipo]))
+        for tipo, valor in permanencia.items()
+    ]
+    perfis += [
+        EtaProfile(tipo=EtaProfile.Tipo.VELOCIDADE, chave=chave, valor=round(median(valores), 2), amostras=len(valores))
+        for chave, valores in por_regiao.items() if len(valores) >= MIN_AMOSTRAS
+    ]
+    with transaction.atomic():
+        EtaProfile.objects.all().delete()
+        EtaProfile.objects.bulk_create(perfis)
+    cache.delete(CHAVE_CACHE_PERFIS)
+    return {
+        'pares': len(amostras),
+        'permanencias': len(permanencia),
+        'regioes': sum(1 for p in perfis if p.tipo == EtaProfile.Tipo.VELOCIDADE),
+    }
+
+
+def recalcular_todos(progresso=None, lote=50):
+    """ Refaz as previsões de todos os motoboys com fila aberta (depois de treinar) """
+    ids = list(
+        RouteStop.objects.filter(is_completed=False, motoboy__isnull=False)
+        .values_list('motoboy_id', flat=True).order_by('motoboy_id').distinct()
+    )
+    total = 0
+    for inicio in range(0, len(ids), lote):
+        total += recalcular(ids[inicio:inicio + lote])
+        if progresso:
+            progresso(min(inicio + lote, len(ids)), len(ids))
+    return total
@@ -0,0 +1,280 @@
+# orders/events.py
+"""
+Deltas do Painel de Despacho distribuídos via Server-Sent Events.
+
+Em vez de cada despachante reconstruir o painel a cada 10s, as ações que mexem no
+quadro publicam um "delta". O evento é gravado num BoardEvent na mesma transação da
+escrita (rollback = evento nunca existiu), então é visto por todos os processos: os outros
+workers web, o `processar_tarefas` (transferência, reagendamento) e comandos como
+`atribuir_automaticamente`. O id do BoardEvent é o cursor do EventSource (Last-Event-ID),
+válido em qualquer worker.
+
+Por processo, uma única thread lê a tabela a cada INTERVALO_LEITURA segundos enquanto houver
+stream aberto (uma query por faixa de id, não uma por despachante) e acorda as conexões,
+que dormem numa Condition. Quem publica no próprio processo acorda a leitura na hora.
+
+Cada stream ocupa uma thread do servidor enquanto está aberto, por isso o número de streams
+por processo é limitado (settings.SSE_MAX_CONEXOES): sem vaga, a view responde 503 e o
+painel fica no polling (orders/static/orders/js/dispatch_panel.js).
+"""
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .models import BoardEvent
+
+logger = logging.getLogger(__name__)
+
+# Janela de presença (5 minutos), a mesma usada por logistics/presence.py
+PRESENCA_TTL = 300
+MAX_CONEXOES = 4  # Padrão de settings.SSE_MAX_CONEXOES
+
+INTERVALO_LEITURA = 1.0  # segundos entre leituras da tabela (por processo)
+# Transações commitam fora da ordem dos ids: cada leitura revê os últimos RELEITURA ids
+# gravados há menos de JANELA_ATRASO e entrega os que ainda não tinham aparecido
+RELEITURA = 200
+JANELA_ATRASO = timedelta(seconds=60)
+MAX_REPLAY = 500  # Reconexão que perdeu mais que isso recarrega o painel inteiro
+RETENCAO = timedelta(hours=1)
+INTERVALO_LIMPEZA = 300  # segundos
+
+
+class BoardBroker:
+    """ Buffer local dos eventos lidos do banco; acorda quem está esperando """
+
+    def __init__(self, capacidade=1000):
+        self._cond = threading.Condition()
+        # (seq local, id do BoardEvent, tipo, dados): seq cresce na ordem em que o processo viu o evento
+        self._eventos = deque(maxlen=capacidade)
+        self._seq = itertools.count(1)
+        self._ultimo_seq = 0
+        self._ultimo_id = None  # Maior id lido (None = ainda não leu)
+        self._vistos = set()
+        self._lendo = False
+        self._proxima_leitura = 0.0
+        self._proxima_limpeza = 0.0
+        # Estado incremental do quadro: user_id -> último heartbeat (monotonic)
+        self._online = {}
+
+    @property
+    def cursor(self):
+        """ Posição atual do buffer; `aguardar` devolve o que chegar depois dela """
+        return self._ultimo_seq
+
+    @property
+    def ultimo_id(self):
+        if self._ultimo_id is None:
+            self._ler()
+        return self._ultimo_id
+
+    def acordar(self):
+        """ Evento novo publicado neste processo: lê a tabela agora, sem esperar o intervalo """
+        with self._cond:
+            self._proxima_leitura = 0.0
+            self._cond.notify_all()
+
+    def _ler(self):
+        agora = timezone.now()
+        if time.monotonic() >= self._proxima_limpeza:
+            self._proxima_limpeza = time.monotonic() + INTERVALO_LIMPEZA
+            BoardEvent.objects.filter(criado_em__lt=agora - RETENCAO).delete()
+
+        inicial = self._ultimo_id is None
+        if inicial:
+            base = BoardEvent.objects.aggregate(ultimo=Max('id'))['ultimo'] or 0
+        else:
+            base = self._ultimo_id
+        linhas = list(
+            BoardEvent.objects.filter(id__gt=base - RELEITURA, criado_em__gte=agora - JANELA_ATRASO)
+            .order_by('id').values_list('id', 'tipo', 'dados')
+        )
+        with self._cond:
+            for evento_id, tipo, dados in linhas:
+                if evento_id in self._vistos:
+                    continue
+                self._vistos.add(evento_id)
+                if inicial and evento_id <= base:
+                    continue  # Histórico de antes do processo subir: só reconexão (desde) entrega
+                if len(self._eventos) == self._eventos.maxlen:
+                    self._vistos.discard(self._eventos[0][1])
+                self._ultimo_seq = next(self._seq)
+                self._eventos.append((self._ultimo_seq, evento_id, tipo, dados))
+            self._ultimo_id = max([base, self._ultimo_id or 0, *(linha[0] for linha in linhas)])
+            limite = self._ultimo_id - RELEITURA
+            self._vistos = {evento_id for evento_id in self._vistos if evento_id > limite}
+
+    def perdeu_eventos(self, cursor):
+        """ True se o buffer já descartou eventos que este stream ainda não entregou """
+        with self._cond:
+            return bool(self._eventos) and self._eventos[0][0] > cursor + 1
+
+    def aguardar(self, cursor, timeout):
+        """ Bloqueia até existir evento depois de `cursor` (ou estourar o timeout) """
+        fim = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                novos = [e for e in self._eventos if e[0] > cursor]
+                agora = time.monotonic()
+                if novos or agora >= fim:
+                    return novos
+                if self._lendo or agora < self._proxima_leitura:
+                    proxima = fim if self._lendo else min(fim, self._proxima_leitura)
+                    self._cond.wait(proxima - agora)
+                    continue
+                self._lendo = True
+            try:
+                self._ler()
+            except Exception:
+                logger.exception("Falha ao ler os eventos do painel")
+            finally:
+                with self._cond:
+                    self._lendo = False
+                    self._proxima_leitura = time.monotonic() + INTERVALO_LEITURA
+                    self._cond.notify_all()
+
+    def desde(self, last_id):
+        """
+        Eventos depois de `last_id` direto do banco (reconexão, mesmo vinda de outro worker).
+        None = o cliente perdeu demais ou o id não existe mais (retenção): recarregar tudo.
+        """
+        if last_id and not BoardEvent.objects.filter(id=last_id).exists():
+            return None
+        eventos = list(
+            BoardEvent.objects.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'tipo', 'dados')[:MAX_REPLAY + 1]
+        )
+        return None if len(eventos) > MAX_REPLAY else eventos
+
+    def heartbeat(self, user_id):
+        """ Só vira evento quando o motoboy muda de offline para online (neste processo) """
+        agora = time.monotonic()
+        with self._cond:
+            estava_online = user_id in self._online
+            self._online[user_id] = agora
+        if not estava_online:
+            publicar_evento('presenca', user_id=user_id, online=True)
+
+    def expirar_presencas(self):
+        """ Publica 'offline' para quem parou de mandar heartbeat (em todos os processos) """
+        limite = time.monotonic() - PRESENCA_TTL
+        with self._cond:
+            expirados = [uid for uid, visto in self._online.items() if visto < limite]
+            for uid in expirados:
+                del self._online[uid]
+        if not expirados:
+            return
+        # O motoboy pode ter passado a mandar heartbeat para outro worker
+        from logistics.presence import presenca
+        online = presenca.online_ids()
+        for uid in expirados:
+            if uid not in online:
+                publicar_evento('presenca', user_id=uid, online=False)
+
+
+broker = BoardBroker()
+
+_vagas = None
+_vagas_lock = threading.Lock()
+
+
+def _semaforo():
+    global _vagas
+    with _vagas_lock:
+        if _vagas is None:
+            _vagas = threading.BoundedSemaphore(getattr(settings, 'SSE_MAX_CONEXOES', MAX_CONEXOES))
+        return _vagas
+
+
+def publicar_evento(tipo, **dados):
+    """ Grava o delta na transação atual (rollback = nada a avisar); depois do commit acorda os streams """
+    BoardEvent.objects.create(tipo=tipo, dados=dados)
+    transaction.on_commit(broker.acordar)
+
+
+def formatar_sse(evento_id, tipo, dados):
+    return f"id: {evento_id}\nevent: {tipo}\ndata: {json.dumps(dados, default=str)}\n\n"
+
+
+def stream_eventos(last_id=None, keepalive=15, duracao_maxima=300):
+    """
+    Gerador usado pelo StreamingHttpResponse.
+    Encerra depois de `duracao_maxima` segundos para liberar o worker; o EventSource
+    reconecta sozinho mandando o Last-Event-ID e recebe o que perdeu direto do banco.
+    """
+    cursor = broker.cursor
+    yield "retry: 5000\n\n"
+
+    entregues = set()
+    if last_id is None:
+        last_id = broker.ultimo_id
+        # Só o id: o navegador passa a mandar o Last-Event-ID mesmo se nada acontecer até cair
+        yield f"id: {last_id}\n\n"
+    else:
+        perdidos = broker.desde(last_id)
+        if perdidos is None:
+            # O painel precisa ser recarregado inteiro uma vez
+            last_id = broker.ultimo_id
+            yield formatar_sse(last_id, 'resync', {})
+        for evento_id, tipo, dados in perdidos or ():
+            entregues.add(evento_id)
+            last_id = max(last_id, evento_id)
+            yield formatar_sse(last_id, tipo, dados)
+
+    fim = time.monotonic() + duracao_maxima
+    while time.monotonic() < fim:
+        broker.expirar_presencas()
+        if broker.perdeu_eventos(cursor):
+            cursor = broker.cursor
+            last_id = broker.ultimo_id
+            yield formatar_sse(last_id, 'resync', {})
+            continue
+        eventos = broker.aguardar(cursor, timeout=keepalive)
+        if not eventos:
+            # Comentário SSE: mantém proxies/load balancers com a conexão aberta
+            yield ": keep-alive\n\n"
+            continue
+        for seq, evento_id, tipo, dados in eventos:
+            cursor = seq
+            if evento_id in entregues:
+                continue  # Já foi no replay da reconexão
+            # Evento que commitou atrasado tem id menor: o cursor do cliente não volta
+            last_id = max(last_id, evento_id)
+            yield formatar_sse(last_id, tipo, dados)
+
+
+class Transmissao:
+    """
+    Stream que devolve a vaga quando o Django fecha a resposta (StreamingHttpResponse chama
+    close() mesmo se o cliente caiu antes do primeiro evento).
+    """
+
+    def __init__(self, eventos, vagas):
+        self._eventos = eventos
+        self._vagas = vagas
+        self._aberta = True
+
+    def __iter__(self):
+        return self._eventos
+
+    def close(self):
+        self._eventos.close()
+        if self._aberta:
+            self._aberta = False
+            self._vagas.release()
+
+
+def abrir_transmissao(last_id=None):
+    """ Transmissao se ainda há vaga neste processo; None = o painel deve usar o polling """
+    vagas = _semaforo()
+    if not vagas.acquire(blocking=False):
+        return None
+    return Transmissao(stream_eventos(last_id), vagas)
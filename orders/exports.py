@@ -0,0 +1,439 @@
+# orders/exports.py
+"""
+Exportação de OS, entregas e paradas em CSV / XLSX (relatório mensal das empresas, admin).
+
+As linhas saem do banco em lotes (`.values().iterator(chunk_size=LOTE)`: cursor do lado do
+servidor no PostgreSQL, sem instanciar models) e os itens/ocorrências de cada lote vêm numa
+query só. Nada é acumulado: o CSV vai direto para o StreamingHttpResponse e o XLSX é escrito
+em modo write_only num arquivo. A memória fica constante, seja um mês de uma empresa ou o
+histórico inteiro.
+
+OS arquivadas (orders/archive.py) entram no mesmo relatório: os retratos do período são
+restaurados em lotes e cada tipo monta, com `arquivada(os, nomes)`, registros no mesmo formato
+do `.values()`, já com os próprios extras. Elas saem antes das quentes (são as mais antigas).
+
+Períodos grandes (ou `segundo_plano=1`) viram um OrderExport gerado pela fila de tarefas
+(orders/jobs.py) no storage privado (settings.EXPORTS_ROOT, fora do MEDIA_ROOT). O usuário
+acompanha pelo status e baixa o arquivo pronto pelo export_download_view, que confere o dono.
+"""
+import csv
+import logging
+import tempfile
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from itertools import chain, islice
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.utils import timezone
+
+from logistics.models import MotoboyProfile
+from . import archive
+from .jobs import enfileirar, tarefa
+from .models import ServiceOrder, OSDestination, ItemDistribution, RouteStop, Occurrence, OrderExport
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # openpyxl só é necessário para XLSX
+    Workbook = None
+
+logger = logging.getLogger(__name__)
+
+LOTE = 2000
+LOTE_ARQUIVO = 500  # OS arquivadas restauradas por vez (cada uma traz itens, destinos, paradas...)
+# Acima disso (em dias) a exportação vai para segundo plano
+MAX_DIAS_DIRETO = 31
+FORMATOS = ('csv', 'xlsx')
+
+
+class ExportacaoInvalida(ValueError):
+    pass
+
+
+def _data_hora(valor):
+    return timezone.localtime(valor).strftime('%d/%m/%Y %H:%M') if valor else ''
+
+
+STATUS_OS = dict(ServiceOrder.Status.choices)
+PRIORIDADES = dict(ServiceOrder.Priority.choices)
+TIPOS_PARADA = dict(RouteStop.StopType.choices)
+STATUS_PARADA = dict(RouteStop.StopStatus.choices)
+CAUSAS = dict(Occurrence.Causa.choices)
+
+
+def _nome(primeiro_nome, usuario):
+    return primeiro_nome or usuario or ''
+
+
+# Texto que o Excel/LibreOffice leria como fórmula (CSV/XLSX injection): nome, endereço, observação...
+INICIO_DE_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _texto_seguro(valor):
+    """ Célula de texto começando com caractere de fórmula ganha um apóstrofo e vira texto literal """
+    if isinstance(valor, str) and valor.startswith(INICIO_DE_FORMULA):
+        return "'" + valor
+    return valor
+
+
+def _ocorrencia(causa, criado_em):
+    return f"{CAUSAS.get(causa, causa)} ({_data_hora(criado_em)})"
+
+
+def _ocorrencias_por(campo, ids):
+    """ {valor de `campo`: 'Causa (data); ...'} das ocorrências do lote """
+    por_chave = {}
+    for o in Occurrence.objects.filter(**{f'{campo}__in': ids}).order_by('criado_em').values(campo, 'causa', 'criado_em'):
+        por_chave.setdefault(o[campo], []).append(_ocorrencia(o['causa'], o['criado_em']))
+    return {chave: '; '.join(textos) for chave, textos in por_chave.items()}
+
+
+def _nomes(ordens):
+    """ Nomes atuais das empresas e motoboys de um lote de OS arquivadas (duas queries) """
+    clientes = {os_obj.client_id for os_obj in ordens}
+    motoboys = {os_obj.motoboy_id for os_obj in ordens} | {p.motoboy_id for os_obj in ordens for p in os_obj.stops.all()}
+    return {
+        'client': {
+            id_: (primeiro, usuario)
+            for id_, primeiro, usuario in get_user_model().objects.filter(id__in=clientes).values_list('id', 'first_name', 'username')
+        },
+        'motoboy': {
+            id_: (primeiro, usuario)
+            for id_, primeiro, usuario in MotoboyProfile.objects.filter(id__in=motoboys - {None})
+            .values_list('id', 'user__first_name', 'user__username')
+        },
+    }
+
+
+def _colunas_de_nome(nomes, tipo, id_, prefixo):
+    """ As duas colunas de nome ('<prefixo>__first_name', '<prefixo>__username') que o `.values()` traria """
+    primeiro, usuario = nomes[tipo].get(id_, (None, None))
+    return {f'{prefixo}__first_name': primeiro, f'{prefixo}__username': usuario}
+
+
+def _proprios(obj, campos, prefixo=''):
+    """ Colunas do próprio model (sem join) de CAMPOS_*, lidas da instância restaurada """
+    return {
+        campo: getattr(obj, campo[len(prefixo):])
+        for campo in campos if campo.startswith(prefixo) and '__' not in campo[len(prefixo):]
+    }
+
+
+# ==========================================================
+# 1. TIPOS DE EXPORTAÇÃO
+# ==========================================================
+# Cada tipo: colunas, queryset de valores do período (joins por FK, sem instanciar models),
+# `extras(lote)` com o que é 1:N (itens, ocorrências), buscado uma vez por lote, e a função
+# que monta a linha. O período é sempre pela data de criação da OS.
+
+CAMPOS_OS = (
+    'id', 'os_number', 'client__first_name', 'client__username', 'status', 'priority', 'created_at',
+    'collected_at', 'requester_name', 'origin_name', 'origin_street', 'origin_number', 'origin_district',
+    'origin_city', 'motoboy__user__first_name', 'motoboy__user__username', 'internal_code',
+)
+
+
+def _consulta_os(filtro):
+    return ServiceOrder.objects.filter(**filtro).values(*CAMPOS_OS)
+
+
+def _extras_os(lote):
+    return {'ocorrencias': _ocorrencias_por('service_order_id', [r['id'] for r in lote])}
+
+
+def _os_arquivada(os_obj, nomes):
+    r = _proprios(os_obj, CAMPOS_OS)
+    r.update(_colunas_de_nome(nomes, 'client', os_obj.client_id, 'client'))
+    r.update(_colunas_de_nome(nomes, 'motoboy', os_obj.motoboy_id, 'motoboy__user'))
+    ocorrencias = sorted(os_obj.ocorrencias.all(), key=lambda o: o.criado_em)
+    r['extras'] = {'ocorrencias': {os_obj.id: '; '.join(_ocorrencia(o.causa, o.criado_em) for o in ocorrencias)}}
+    return [r]
+
+
+def _linha_os(r, extras):
+    return [
+        r['os_number'], _nome(r['client__first_name'], r['client__username']), STATUS_OS.get(r['status'], r['status']),
+        PRIORIDADES.get(r['priority'], r['priority']), _data_hora(r['created_at']), _data_hora(r['collected_at']),
+        r['requester_name'], r['origin_name'],
+        f"{r['origin_street']}, {r['origin_number']} - {r['origin_district']}, {r['origin_city']}",
+        _nome(r['motoboy__user__first_name'], r['motoboy__user__username']), r['internal_code'],
+        extras['ocorrencias'].get(r['id'], ''),
+    ]
+
+
+CAMPOS_ENTREGA = (
+    'id', 'order__os_number', 'order__client__first_name', 'order__client__username', 'order__status',
+    'order__created_at', 'destination_name', 'destination_street', 'destination_number', 'destination_district',
+    'destination_city', 'destination_zip_code', 'is_delivered', 'delivered_at', 'receiver_name',
+    'order__motoboy__user__first_name', 'order__motoboy__user__username',
+)
+
+
+def _consulta_entregas(filtro):
+    filtro = {f"order__{campo}": valor for campo, valor in filtro.items()}
+    return OSDestination.objects.filter(**filtro).values(*CAMPOS_ENTREGA)
+
+
+def _extras_entregas(lote):
+    ids = [r['id'] for r in lote]
+    itens = {}
+    for d in ItemDistribution.objects.filter(destination_id__in=ids).order_by('id').values(
+        'destination_id', 'quantity_allocated', 'item__description'
+    ):
+        itens.setdefault(d['destination_id'], []).append(f"{d['quantity_allocated']}x {d['item__description']}")
+    return {
+        'itens': {destino: '; '.join(textos) for destino, textos in itens.items()},
+        # Ocorrências da parada deste destino (as da coleta saem na exportação de OS)
+        'ocorrencias': _ocorrencias_por('parada__destination_id', ids),
+    }
+
+
+def _entregas_arquivadas(os_obj, nomes):
+    da_os = _proprios(os_obj, CAMPOS_ENTREGA, 'order__')
+    da_os.update(_colunas_de_nome(nomes, 'client', os_obj.client_id, 'order__client'))
+    da_os.update(_colunas_de_nome(nomes, 'motoboy', os_obj.motoboy_id, 'order__motoboy__user'))
+    destino_da_parada = {p.id: p.destination_id for p in os_obj.stops.all()}
+    ocorrencias = defaultdict(list)
+    for o in sorted(os_obj.ocorrencias.all(), key=lambda o: o.criado_em):
+        ocorrencias[destino_da_parada.get(o.parada_id)].append(_ocorrencia(o.causa, o.criado_em))
+
+    registros = []
+    for destino in os_obj.destinations.all():
+        r = {**da_os, **_proprios(destino, CAMPOS_ENTREGA)}
+        itens = '; '.join(f"{d.quantity_allocated}x {d.item.description}" for d in destino.distributed_items.all())
+        r['extras'] = {
+            'itens': {destino.id: itens},
+            'ocorrencias': {destino.id: '; '.join(ocorrencias.get(destino.id, []))},
+        }
+        registros.append(r)
+    return registros
+
+
+def _linha_entrega(r, extras):
+    return [
+        r['order__os_number'], _nome(r['order__client__first_name'], r['order__client__username']),
+        STATUS_OS.get(r['order__status'], r['order__status']), _data_hora(r['order__created_at']),
+        r['destination_name'], f"{r['destination_street']}, {r['destination_number']}", r['destination_district'],
+        r['destination_city'], r['destination_zip_code'], 'Sim' if r['is_delivered'] else 'Não',
+        _data_hora(r['delivered_at']), r['receiver_name'],
+        _nome(r['order__motoboy__user__first_name'], r['order__motoboy__user__username']),
+        extras['itens'].get(r['id'], ''), extras['ocorrencias'].get(r['id'], ''),
+    ]
+
+
+CAMPOS_PARADA = (
+    'id', 'service_order__os_number', 'service_order__client__first_name', 'service_order__client__username',
+    'stop_type', 'sequence', 'motoboy__user__first_name', 'motoboy__user__username', 'status', 'completed_at',
+    'is_failed', 'failure_reason', 'destination_id', 'destination__destination_name',
+    'destination__destination_street', 'destination__destination_number', 'service_order__origin_name',
+    'service_order__origin_street', 'service_order__origin_number',
+)
+
+
+def _consulta_paradas(filtro):
+    filtro = {f"service_order__{campo}": valor for campo, valor in filtro.items()}
+    return RouteStop.objects.filter(**filtro).values(*CAMPOS_PARADA)
+
+
+def _paradas_arquivadas(os_obj, nomes):
+    da_os = _proprios(os_obj, CAMPOS_PARADA, 'service_order__')
+    da_os.update(_colunas_de_nome(nomes, 'client', os_obj.client_id, 'service_order__client'))
+    registros = []
+    for parada in os_obj.stops.all():
+        r = {**da_os, **_proprios(parada, CAMPOS_PARADA)}
+        r.update(_colunas_de_nome(nomes, 'motoboy', parada.motoboy_id, 'motoboy__user'))
+        # O destino de outra OS do grupo pode não estar neste lote: sai só o local de coleta
+        destino = parada.destination if RouteStop.destination.is_cached(parada) else None
+        r['destination_id'] = destino.id if destino else None
+        r.update(_proprios(destino, CAMPOS_PARADA, 'destination__') if destino else {})
+        r['extras'] = None
+        registros.append(r)
+    return registros
+
+
+def _linha_parada(r, extras):
+    if r['destination_id']:
+        local = (f"{r['destination__destination_name']} - {r['destination__destination_street']}, "
+                 f"{r['destination__destination_number']}")
+    else:
+        local = (f"{r['service_order__origin_name']} - {r['service_order__origin_street']}, "
+                 f"{r['service_order__origin_number']}")
+    return [
+        r['service_order__os_number'], _nome(r['service_order__client__first_name'], r['service_order__client__username']),
+        TIPOS_PARADA.get(r['stop_type'], r['stop_type']), r['sequence'],
+        _nome(r['motoboy__user__first_name'], r['motoboy__user__username']), STATUS_PARADA.get(r['status'], r['status']),
+        _data_hora(r['completed_at']), 'Sim' if r['is_failed'] else 'Não', r['failure_reason'], local,
+    ]
+
+
+TIPOS = {
+    'os': {
+        'nome': 'OS',
+        'colunas': ['OS', 'Empresa', 'Status', 'Prioridade', 'Criada em', 'Coletada em', 'Solicitante',
+                    'Local de coleta', 'Endereço de coleta', 'Motoboy', 'Código interno', 'Ocorrências'],
+        'consulta': _consulta_os,
+        'extras': _extras_os,
+        'linha': _linha_os,
+        'arquivada': _os_arquivada,
+    },
+    'entregas': {
+        'nome': 'Entregas',
+        'colunas': ['OS', 'Empresa', 'Status da OS', 'Criada em', 'Destinatário', 'Endereço', 'Bairro', 'Cidade',
+                    'CEP', 'Entregue', 'Entregue em', 'Recebido por', 'Motoboy', 'Itens', 'Ocorrências'],
+        'consulta': _consulta_entregas,
+        'extras': _extras_entregas,
+        'linha': _linha_entrega,
+        'arquivada': _entregas_arquivadas,
+    },
+    'paradas': {
+        'nome': 'Paradas',
+        'colunas': ['OS', 'Empresa', 'Tipo', 'Sequência', 'Motoboy', 'Status', 'Concluída em', 'Falhou',
+                    'Motivo da falha', 'Local'],
+        'consulta': _consulta_paradas,
+        'extras': None,
+        'linha': _linha_parada,
+        'arquivada': _paradas_arquivadas,
+    },
+}
+
+
+def validar(tipo, formato, inicio, fim):
+    if tipo not in TIPOS:
+        raise ExportacaoInvalida(f"Tipo de exportação desconhecido: {tipo}.")
+    if formato not in FORMATOS:
+        raise ExportacaoInvalida(f"Formato inválido: {formato}.")
+    if formato == 'xlsx' and Workbook is None:
+        raise ExportacaoInvalida("Exportação XLSX indisponível (pip install openpyxl).")
+    if fim < inicio:
+        raise ExportacaoInvalida("A data final é anterior à inicial.")
+
+
+def periodo_padrao():
+    """ Mês corrente até hoje """
+    hoje = timezone.localdate()
+    return hoje.replace(day=1), hoje
+
+
+def vai_para_segundo_plano(inicio, fim):
+    return (fim - inicio).days + 1 > MAX_DIAS_DIRETO
+
+
+def _registros_arquivados(definicao, filtro):
+    for ordens in archive.lotes(filtro, LOTE_ARQUIVO):
+        nomes = _nomes(ordens)
+        for os_obj in ordens:
+            yield from definicao['arquivada'](os_obj, nomes)
+
+
+def linhas(tipo, inicio, fim, client_id=None):
+    """ Gera as linhas (listas) do período, em ordem de id, com memória constante (um lote por vez) """
+    filtro = {
+        'created_at__gte': timezone.make_aware(datetime.combine(inicio, time.min)),
+        'created_at__lt': timezone.make_aware(datetime.combine(fim + timedelta(days=1), time.min)),
+    }
+    if client_id is not None:
+        filtro['client_id'] = client_id
+    definicao = TIPOS[tipo]
+    # Arquivadas primeiro (as mais antigas), depois as quentes; cada parte em ordem de id
+    registros = chain(
+        _registros_arquivados(definicao, filtro),
+        definicao['consulta'](filtro).order_by('id').iterator(chunk_size=LOTE),
+    )
+    while True:
+        lote = list(islice(registros, LOTE))
+        if not lote:
+            return
+        # Registro arquivado já traz os próprios extras; a query de extras é só para os quentes
+        quentes = [r for r in lote if 'extras' not in r]
+        extras = definicao['extras'](quentes) if definicao['extras'] and quentes else None
+        for registro in lote:
+            linha = definicao['linha'](registro, registro['extras'] if 'extras' in registro else extras)
+            # Todo tipo passa por aqui: texto vindo do usuário nunca sai como fórmula
+            yield [_texto_seguro(valor) for valor in linha]
+
+
+def nome_arquivo(tipo, formato, inicio, fim):
+    return f"{tipo}_{inicio:%Y%m%d}_{fim:%Y%m%d}.{formato}"
+
+
+# ==========================================================
+# 2. ESCRITA
+# ==========================================================
+
+class _Eco:
+    """ "Arquivo" do csv.writer que só devolve a linha formatada (padrão do Django para streaming) """
+    def write(self, valor):
+        return valor
+
+
+def csv_em_partes(tipo, inicio, fim, client_id=None):
+    """ Pedaços de texto do CSV para o StreamingHttpResponse (';' e BOM: abre direto no Excel pt-BR) """
+    escritor = csv.writer(_Eco(), delimiter=';')
+    yield '\ufeff' + escritor.writerow(TIPOS[tipo]['colunas'])
+    for linha in linhas(tipo, inicio, fim, client_id):
+        yield escritor.writerow(linha)
+
+
+def escrever_arquivo(arquivo, tipo, formato, inicio, fim, client_id=None):
+    """ Escreve a exportação no arquivo binário aberto; retorna quantas linhas saíram """
+    total = 0
+    if formato == 'csv':
+        for parte in csv_em_partes(tipo, inicio, fim, client_id):
+            arquivo.write(parte.encode('utf-8'))
+            total += 1
+        return total - 1  # Cabeçalho
+
+    # write_only: o openpyxl não guarda as linhas em memória, grava direto no XML da planilha
+    planilha = Workbook(write_only=True)
+    aba = planilha.create_sheet(TIPOS[tipo]['nome'])
+    aba.append(TIPOS[tipo]['colunas'])
+    for linha in linhas(tipo, inicio, fim, client_id):
+        aba.append(linha)
+        total += 1
+    planilha.save(arquivo)
+    return total
+
+
+def arquivo_temporario(tipo, formato, inicio, fim, client_id=None):
+    """ XLSX não dá para mandar em pedaços (é um zip): gera num temporário que é apagado ao fechar """
+    arquivo = tempfile.TemporaryFile(suffix=f'.{formato}')
+    escrever_arquivo(arquivo, tipo, formato, inicio, fim, client_id)
+    arquivo.seek(0)
+    return arquivo
+
+
+# ==========================================================
+# 3. SEGUNDO PLANO
+# ==========================================================
+
+def agendar(exportacao):
+    """ Põe a geração na fila de tarefas. Sem retry: a falha fica registrada no próprio OrderExport. """
+    return enfileirar(
+        'gerar_exportacao', chave=f'exportacao:{exportacao.id}', solicitante=exportacao.solicitante,
+        max_tentativas=1, exportacao_id=exportacao.id,
+    )
+
+
+@tarefa('gerar_exportacao', atomica=False)
+def gerar(usuario, exportacao_id):
+    """ Gera o arquivo de um OrderExport (worker da fila; fora de transação para o status aparecer na hora) """
+    exportacao = OrderExport.objects.get(id=exportacao_id)
+    exportacao.status = OrderExport.Status.GERANDO
+    exportacao.save(update_fields=['status'])
+    try:
+        with tempfile.TemporaryFile(suffix=f'.{exportacao.formato}') as arquivo:
+            exportacao.linhas = escrever_arquivo(
+                arquivo, exportacao.tipo, exportacao.formato, exportacao.inicio, exportacao.fim, exportacao.client_id
+            )
+            arquivo.seek(0)
+            nome = nome_arquivo(exportacao.tipo, exportacao.formato, exportacao.inicio, exportacao.fim)
+            exportacao.arquivo.save(nome, File(arquivo), save=False)
+        exportacao.status = OrderExport.Status.PRONTO
+    except Exception as e:
+        logger.exception("Falha ao gerar a exportação %s", exportacao_id)
+        exportacao.status = OrderExport.Status.ERRO
+        exportacao.erro = str(e)[:500]
+    finally:
+        exportacao.concluido_em = timezone.now()
+        exportacao.save(update_fields=['status', 'arquivo', 'linhas', 'erro', 'concluido_em'])
+    return {'exportacao_id': exportacao.id, 'status': exportacao.status, 'linhas': exportacao.linhas}
@@ -0,0 +1,78 @@
+# orders/fleet.py
+"""
+Snapshot da frota para o Painel de Despacho.
+
+Monta a lista `motoboy_data` inteira com um número fixo de queries, não importa
+quantos motoboys existam:
+  1. Uma query anotada dos motoboys (com o usuário e a carga já contada).
+  2. Uma query com TODAS as paradas abertas da frota, agrupadas em Python.
+  3. Uma consulta por faixa em last_seen para saber quem está online (logistics/presence.py).
+  4. Peso/volume no baú de cada um (orders/capacity.py, do cache; só os que faltam são calculados).
+A previsão de chegada já vem gravada na parada (RouteStop.eta, orders/eta.py): atraso é só conta.
+Com `motoboy_ids`, as mesmas queries ficam restritas a esses motoboys (cards avulsos do painel).
+"""
+from collections import defaultdict
+
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from logistics.models import MotoboyProfile
+from logistics.presence import presenca
+from .capacity import MARCADOR_SOCORRO, cargas
+from .eta import atraso
+from .models import RouteStop
+
+
+def build_fleet_snapshot(motoboy_ids=None):
+    """ Retorna a lista `motoboy_data` no mesmo formato que o template do painel espera """
+    perfis = MotoboyProfile.objects.all()
+    if motoboy_ids is not None:
+        perfis = perfis.filter(id__in=motoboy_ids)
+    motoboys = list(
+        perfis.select_related('user').annotate(
+            open_stops=Count('route_stops', filter=Q(route_stops__is_completed=False))
+        )
+    )
+
+    # Todas as paradas abertas da frota numa tacada só (a ordem por sequência é mantida no agrupamento)
+    paradas_por_motoboy = defaultdict(list)
+    paradas_abertas = RouteStop.objects.filter(
+        motoboy__isnull=False,
+        is_completed=False
+    ).select_related('service_order', 'destination').order_by('motoboy_id', 'sequence')
+    if motoboy_ids is not None:
+        paradas_abertas = paradas_abertas.filter(motoboy_id__in=[mb.id for mb in motoboys])
+    for parada in paradas_abertas:
+        paradas_por_motoboy[parada.motoboy_id].append(parada)
+
+    # Presença: uma consulta para a frota inteira
+    online = presenca.online_ids()
+
+    carga_por_motoboy = cargas([mb.id for mb in motoboys])
+    agora = timezone.now()
+
+    motoboy_data = []
+    for mb in motoboys:
+        ativas = []
+        aguardando_socorro = []
+        for parada in paradas_por_motoboy.get(mb.id, []):
+            # Mesmo critério do icontains antigo: o placeholder de socorro fica separado
+            if MARCADOR_SOCORRO.lower() in (parada.failure_reason or '').lower():
+                aguardando_socorro.append(parada)
+            else:
+                ativas.append(parada)
+
+        carga = carga_por_motoboy[mb.id]
+        motoboy_data.append({
+            'profile': mb,
+            'is_online': mb.is_available and mb.user_id in online,
+            'load': mb.open_stops,
+            'carga': carga,
+            'ocupacao': round(carga['ocupacao'] * 100),  # % do limite do veículo (pior entre peso e volume)
+            'active_stops': ativas,
+            'atraso_min': atraso(ativas[0], agora) if ativas else 0,  # Da parada atual
+            'waiting_rescue_stops': aguardando_socorro,
+        })
+
+    motoboy_data.sort(key=lambda x: x['is_online'], reverse=True)
+    return motoboy_data
@@ -0,0 +1,150 @@
+# orders/geocoding.py
+"""
+Geocodificação offline de origens e destinos.
+
+Ordem de resolução de um endereço:
+  1. LRU em memória (mesmo processo, custo zero).
+  2. GeocodeCache no banco (persistente entre processos e deploys).
+  3. Tabela local CepLocation: primeiro pelo CEP, depois por rua + cidade.
+Nada aqui chama API externa, então pode rodar dentro do request de criação da OS.
+
+Recarregar a base (`manage.py carregar_ceps`) apaga o GeocodeCache e sobe a versão da base
+no cache compartilhado. Cada processo relê a versão a cada INTERVALO_VERSAO segundos e, se
+mudou, descarta o LRU: a chave do LRU leva a versão, então nada calculado com a base antiga
+volta a ser servido.
+"""
+import hashlib
+import math
+import time
+import unicodedata
+from functools import lru_cache
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+
+from .models import CepLocation, GeocodeCache
+
+RAIO_TERRA_KM = 6371.0
+
+CHAVE_VERSAO = 'geocoding_versao_base'
+INTERVALO_VERSAO = 30  # segundos entre leituras da versão da base (por processo)
+_versao = {'valor': None, 'lida_em': 0.0}
+
+
+def normalizar(texto):
+    """ 'Av. São João ' -> 'av. sao joao' """
+    texto = unicodedata.normalize('NFKD', texto or '')
+    texto = ''.join(ch for ch in texto if not unicodedata.combining(ch) and ch != '|')
+    return ' '.join(texto.lower().split())
+
+
+def so_digitos(cep):
+    return ''.join(ch for ch in (cep or '') if ch.isdigit())
+
+
+def _chave_endereco(cep, rua, cidade, uf):
+    return '|'.join([so_digitos(cep), normalizar(rua), normalizar(cidade), normalizar(uf)])
+
+
+def _resolver_na_base(cep, rua, cidade):
+    """ Consulta a tabela local. Retorna (lat, lng, fonte) """
+    if len(cep) == 8:
+        local = CepLocation.objects.filter(cep=cep).values_list('lat', 'lng').first()
+        if local:
+            return local[0], local[1], GeocodeCache.Fonte.CEP
+
+    if rua and cidade:
+        local = CepLocation.objects.filter(city_norm=cidade, street_norm=rua).values_list('lat', 'lng').first()
+        if local:
+            return local[0], local[1], GeocodeCache.Fonte.RUA
+
+    return None, None, GeocodeCache.Fonte.NAO_ENCONTRADO
+
+
+def _versao_base():
+    """ Versão da base de CEPs vista por este processo; se mudou em outro processo, esvazia o LRU """
+    agora = time.monotonic()
+    if _versao['valor'] is None or agora - _versao['lida_em'] >= INTERVALO_VERSAO:
+        valor = cache.get(CHAVE_VERSAO, 0)
+        if _versao['valor'] is not None and valor != _versao['valor']:
+            _geocodificar_chave.cache_clear()
+        _versao['valor'], _versao['lida_em'] = valor, agora
+    return _versao['valor']
+
+
+@lru_cache(maxsize=50_000)
+def _geocodificar_chave(chave, versao):
+    cep, rua, cidade, _uf = chave.split('|')
+    hash_chave = hashlib.sha1(chave.encode('utf-8')).hexdigest()
+
+    salvo = GeocodeCache.objects.filter(chave=hash_chave).values_list('lat', 'lng').first()
+    if salvo:
+        return salvo[0], salvo[1]
+
+    lat, lng, fonte = _resolver_na_base(cep, rua, cidade)
+    try:
+        # Savepoint próprio: a criação da OS roda dentro de um atomic maior
+        with transaction.atomic():
+            GeocodeCache.objects.create(chave=hash_chave, endereco=chave[:400], lat=lat, lng=lng, fonte=fonte)
+    except IntegrityError:
+        # Outro processo gravou o mesmo endereço ao mesmo tempo; tudo bem.
+        pass
+    return lat, lng
+
+
+def geocodificar(cep='', rua='', cidade='', uf=''):
+    """ Retorna (lat, lng) ou (None, None) se o endereço não estiver na base local """
+    chave = _chave_endereco(cep, rua, cidade, uf)
+    if not chave.replace('|', ''):
+        return None, None
+    return _geocodificar_chave(chave, _versao_base())
+
+
+def geocodificar_origem(os_obj):
+    """ Preenche origin_lat/origin_lng (não salva) """
+    os_obj.origin_lat, os_obj.origin_lng = geocodificar(
+        os_obj.origin_zip_code, os_obj.origin_street, os_obj.origin_city, os_obj.origin_state
+    )
+    return os_obj
+
+
+def geocodificar_destino(dest):
+    """ Preenche destination_lat/destination_lng (não salva) """
+    dest.destination_lat, dest.destination_lng = geocodificar(
+        dest.destination_zip_code, dest.destination_street, dest.destination_city, dest.destination_state
+    )
+    return dest
+
+
+def limpar_cache_memoria():
+    _geocodificar_chave.cache_clear()
+
+
+def nova_versao_base():
+    """ Depois de recarregar a base de CEPs: este processo limpa agora, os outros na próxima leitura da versão """
+    try:
+        cache.incr(CHAVE_VERSAO)
+    except ValueError:
+        cache.set(CHAVE_VERSAO, 1, None)
+    _versao['valor'] = None
+    limpar_cache_memoria()
+
+
+# ==========================================================
+# CONSULTAS POR PROXIMIDADE (bounding box sobre os índices lat/lng)
+# ==========================================================
+
+def caixa_envolvente(lat, lng, raio_km):
+    """ Retorna (lat_min, lat_max, lng_min, lng_max) de um quadrado em volta do ponto """
+    dlat = math.degrees(raio_km / RAIO_TERRA_KM)
+    dlng = math.degrees(raio_km / (RAIO_TERRA_KM * max(math.cos(math.radians(lat)), 0.01)))
+    return lat - dlat, lat + dlat, lng - dlng, lng + dlng
+
+
+def filtrar_por_raio(queryset, lat, lng, raio_km, campo_lat, campo_lng):
+    """ Aplica o filtro de caixa no queryset (usa o índice composto de lat/lng) """
+    lat_min, lat_max, lng_min, lng_max = caixa_envolvente(lat, lng, raio_km)
+    return queryset.filter(**{
+        f'{campo_lat}__range': (lat_min, lat_max),
+        f'{campo_lng}__range': (lng_min, lng_max),
+    })
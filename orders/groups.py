@@ -0,0 +1,64 @@
+# orders/groups.py
+"""
+Grupos de OS (mãe + filhas) resolvidos por uma coluna só.
+
+`ServiceOrder.group_root_id` guarda o id da mãe do grupo (o próprio id, se a OS não foi
+mesclada) e é mantido no save / bulk_create / update(parent_os=...) (orders/models.py).
+Assim "as OS do meu grupo" é `group_root_id = X` e "as paradas do meu grupo" um join
+indexado, no lugar do `Q(id=raiz) | Q(parent_os=raiz)` usado como subquery.
+
+Durante um request (GroupCacheMiddleware) as mães já resolvidas ficam num mapa por id:
+pedir a mãe do mesmo grupo de novo devolve a mesma instância, sem query. Qualquer
+mudança de parent_os limpa o mapa.
+"""
+from contextvars import ContextVar
+
+from .models import ServiceOrder, RouteStop
+
+_maes = ContextVar('maes_de_grupo', default=None)
+
+
+def abrir_cache():
+    return _maes.set({})
+
+
+def fechar_cache(token):
+    _maes.reset(token)
+
+
+def esquecer():
+    maes = _maes.get()
+    if maes is not None:
+        maes.clear()
+
+
+def raiz_id(os_obj):
+    """ Aceita a OS ou um id já resolvido de mãe """
+    if isinstance(os_obj, int):
+        return os_obj
+    return os_obj.group_root_id or os_obj.parent_os_id or os_obj.pk
+
+
+def raiz(os_obj):
+    """ A OS mãe do grupo (a própria OS, se ela for a mãe) """
+    mae_id = raiz_id(os_obj)
+    maes = _maes.get()
+    if mae_id == os_obj.pk:
+        mae = os_obj
+    elif maes is not None and mae_id in maes:
+        return maes[mae_id]
+    elif os_obj.parent_os_id == mae_id and ServiceOrder.parent_os.is_cached(os_obj):
+        mae = os_obj.parent_os
+    else:
+        mae = ServiceOrder.objects.get(pk=mae_id)
+    if maes is not None:
+        maes[mae_id] = mae
+    return mae
+
+
+def ordens_do_grupo(os_obj):
+    return ServiceOrder.objects.filter(group_root_id=raiz_id(os_obj))
+
+
+def paradas_do_grupo(os_obj):
+    return RouteStop.objects.filter(service_order__group_root_id=raiz_id(os_obj))
@@ -0,0 +1,81 @@
+# orders/indices.py
+"""
+Conferência por EXPLAIN dos índices das consultas quentes (`manage.py verificar_indices`).
+
+Cada consulta abaixo é a mesma que o painel de despacho / tela do motoboy / painel da
+empresa executa, montada para o "pior caso" da massa (quem tem mais dados). Rodamos o
+EXPLAIN do banco e conferimos se o plano cita o índice desenhado para ela. Em massa
+pequena o planner prefere varrer a tabela, por isso o comando gera a massa (1M de OS por
+padrão) num banco de teste descartável antes de conferir.
+"""
+from django.db import connection
+
+from logistics.models import MotoboyProfile
+from .benchmark import escolher_alvos
+from .groups import paradas_do_grupo
+from .models import ServiceOrder, RouteStop, Occurrence
+
+# O SQLite não usa índice parcial cuja condição é um IN quando a consulta chega com parâmetros
+# (só com o termo literal idêntico). No PostgreSQL o planner prova a condição normalmente.
+SO_POSTGRESQL = {'os_fila_idx', 'os_empresa_abertas_idx'}
+
+
+def consultas(alvos):
+    """ (nome, queryset, índice esperado) """
+    perfil = MotoboyProfile.objects.get(user=alvos['motoboy'])
+    empresa = alvos['empresa']
+    os_alvo = ServiceOrder.objects.get(id=alvos['os_id'])
+
+    return [
+        # Painel de despacho
+        ('despacho: fila', ServiceOrder.objects.fila_despacho(), 'os_fila_idx'),
+        ('despacho: total de ocorrências', ServiceOrder.objects.filter(status='OCORRENCIA'), 'os_status_prio_idx'),
+        ('despacho: ocorrências abertas', Occurrence.objects.filter(resolvida=False).order_by('-urgencia', '-criado_em'),
+         'ocorrencia_aberta_idx'),
+        ('despacho: rota do motoboy', RouteStop.objects.filter(motoboy=perfil, is_completed=False).order_by('sequence'),
+         'parada_aberta_motoboy_idx'),
+        ('grupo: já coletou?', paradas_do_grupo(os_alvo).filter(stop_type='COLETA', is_completed=True),
+         'parada_os_tipo_idx'),
+
+        # Tela do motoboy
+        ('motoboy: paradas abertas', RouteStop.objects.filter(motoboy=perfil, is_completed=False).values_list(
+            'service_order_id', 'sequence', 'id'
+        ), 'parada_aberta_motoboy_idx'),
+        ('motoboy: histórico', ServiceOrder.objects.filter(
+            motoboy=perfil, status__in=['ENTREGUE', 'CANCELADO']
+        ).order_by('-created_at')[:10], 'os_motoboy_status_idx'),
+        ('motoboy: entregas do dia', RouteStop.objects.filter(
+            motoboy=perfil, stop_type='ENTREGA', is_completed=True, completed_at__gte=os_alvo.created_at
+        ), 'parada_concluida_idx'),
+
+        # Painel da empresa / admin
+        ('empresa: por status', ServiceOrder.objects.filter(client=empresa, status='PENDENTE'), 'os_empresa_status_idx'),
+        ('empresa: recentes', ServiceOrder.objects.filter(client=empresa).order_by('-created_at', '-id')[:5],
+         'os_empresa_recentes_idx'),
+        ('empresa: ativas (página)', ServiceOrder.objects.filter(client=empresa).exclude(
+            status__in=['ENTREGUE', 'CANCELADO']
+        ).order_by('-created_at', '-id')[:26], 'os_empresa_abertas_idx'),
+        ('admin: últimas OS', ServiceOrder.objects.order_by('-created_at')[:10], 'os_criacao_idx'),
+    ]
+
+
+def atualizar_estatisticas():
+    """ O planner só escolhe bem com estatísticas recentes (ANALYZE existe nos dois bancos) """
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def verificar(progresso=None):
+    """ Lista de dicts {consulta, indice, usado, exigido, plano} """
+    resultados = []
+    for nome, queryset, indice in consultas(escolher_alvos()):
+        plano = queryset.explain()
+        resultado = {
+            'consulta': nome, 'indice': indice, 'plano': plano,
+            'usado': indice in plano,
+            'exigido': connection.vendor == 'postgresql' or indice not in SO_POSTGRESQL,
+        }
+        resultados.append(resultado)
+        if progresso:
+            progresso(resultado)
+    return resultados
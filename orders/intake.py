@@ -0,0 +1,426 @@
+# orders/intake.py
+"""
+Importação de OS em lote (fechamento do dia dos clientes grandes: 5-20 mil pedidos).
+
+Cada pedido tem o mesmo formato JSON que o os_create_view recebe. O fluxo é:
+  1. Lê os pedidos em pedaços (lista JSON ou NDJSON), sem carregar tudo na memória.
+  2. Valida o pedaço inteiro antes de gravar qualquer coisa dele.
+  3. Grava com bulk_create (ids e os_number reservados de uma vez, ver orders/numbering.py).
+  4. Devolve um resultado por pedido (sucesso com os_number, ou erro com os motivos).
+"""
+import codecs
+import json
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from .geocoding import geocodificar
+from .models import ServiceOrder, OSItem, OSDestination, ItemDistribution, RouteStop
+
+TAMANHO_LOTE = 1000
+TAMANHO_BLOCO = 64 * 1024  # Caracteres lidos por vez
+MAX_PEDIDO = 1024 * 1024  # Um pedido da lista maior que isso é tratado como JSON quebrado
+MAX_OBJETO = 8 * 1024 * 1024  # {"orders": [...]} é carregado inteiro: só até esse tamanho
+
+CAMPOS_ORIGEM_OBRIGATORIOS = ['origin_name', 'origin_street', 'origin_number', 'origin_district', 'origin_city']
+CAMPOS_DESTINO_OBRIGATORIOS = ['id', 'name', 'phone', 'street', 'number', 'district', 'city']
+
+
+# ==========================================================
+# 1. LEITURA
+# ==========================================================
+
+def ler_ndjson(arquivo):
+    """ Um pedido por linha. Linhas inválidas viram um dict com '_erro' para sair no relatório. """
+    for linha in arquivo:
+        if isinstance(linha, bytes):
+            linha = linha.decode('utf-8')
+        linha = linha.strip()
+        if not linha:
+            continue
+        try:
+            yield json.loads(linha)
+        except json.JSONDecodeError as e:
+            yield {'_erro': f'JSON inválido: {e.msg}'}
+
+
+def _blocos_de_texto(arquivo):
+    """ Texto do arquivo em blocos (o upload chega em bytes; o comando abre em modo texto) """
+    decodificador = codecs.getincrementaldecoder('utf-8-sig')()
+    while True:
+        bloco = arquivo.read(TAMANHO_BLOCO)
+        if not bloco:
+            resto = decodificador.decode(b'', final=True)
+            if resto:
+                yield resto
+            return
+        yield decodificador.decode(bloco) if isinstance(bloco, bytes) else bloco
+
+
+def _pular_espacos(texto, pos):
+    while pos < len(texto) and texto[pos] in ' \t\r\n':
+        pos += 1
+    return pos
+
+
+def _pedidos_da_lista(blocos, buffer, pos):
+    """
+    Pedidos da lista JSON um a um, com raw_decode sobre o buffer (só o pedido atual fica
+    na memória). JSON quebrado vira um '_erro' no pedido onde quebrou e a leitura para ali:
+    dentro de uma lista não há como achar o começo do próximo pedido com segurança.
+    """
+    decodificador = json.JSONDecoder()
+    acabou = False
+    esperando_valor = True
+    primeiro = True
+
+    def mais():
+        nonlocal buffer, pos, acabou
+        buffer, pos = buffer[pos:], 0
+        try:
+            buffer += next(blocos)
+        except StopIteration:
+            acabou = True
+
+    while True:
+        pos = _pular_espacos(buffer, pos)
+        if pos >= len(buffer):
+            if acabou:
+                yield {'_erro': 'JSON inválido: lista de pedidos não terminada.'}
+                return
+            mais()
+            continue
+
+        caractere = buffer[pos]
+        if caractere == ']' and (not esperando_valor or primeiro):
+            return
+        if not esperando_valor:
+            if caractere != ',':
+                yield {'_erro': f"JSON inválido: esperado ',' ou ']' depois do pedido."}
+                return
+            pos += 1
+            esperando_valor = True
+            continue
+
+        try:
+            pedido, fim = decodificador.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            if acabou or len(buffer) - pos > MAX_PEDIDO:
+                yield {'_erro': f'JSON inválido: {e.msg}'}
+                return
+            mais()  # Pedido cortado no fim do bloco
+            continue
+        seguinte = _pular_espacos(buffer, fim)
+        if not acabou and (seguinte >= len(buffer) or buffer[seguinte] not in ',]') and len(buffer) - pos <= MAX_PEDIDO:
+            mais()  # Sem ',' ou ']' à vista o valor pode continuar no próximo bloco (ex: número cortado)
+            continue
+
+        yield pedido
+        pos, esperando_valor, primeiro = fim, False, False
+        if pos > TAMANHO_BLOCO:
+            buffer, pos = buffer[pos:], 0
+
+
+def ler_json(arquivo):
+    """
+    Lista JSON de pedidos, lida pedido a pedido. Também aceita {"orders": [...]} ou um pedido
+    só; esses formatos são carregados inteiros, então ficam limitados a MAX_OBJETO caracteres.
+    O começo do arquivo é conferido na hora (ValueError), antes de qualquer pedido ser lido.
+    """
+    blocos = _blocos_de_texto(arquivo)
+    buffer, pos = '', 0
+    while True:
+        pos = _pular_espacos(buffer, pos)
+        if pos < len(buffer):
+            break
+        bloco = next(blocos, None)
+        if bloco is None:
+            raise ValueError('Arquivo vazio.')
+        buffer += bloco
+
+    if buffer[pos] == '[':
+        return _pedidos_da_lista(blocos, buffer, pos + 1)
+    if buffer[pos] != '{':
+        raise ValueError('Esperado uma lista de pedidos.')
+
+    for bloco in blocos:
+        buffer += bloco
+        if len(buffer) > MAX_OBJETO:
+            raise ValueError('Objeto JSON grande demais: envie os pedidos como lista JSON ou NDJSON.')
+    dados = json.loads(buffer)
+    dados = dados.get('orders', [dados])
+    if not isinstance(dados, list):
+        raise ValueError('Esperado uma lista de pedidos.')
+    return iter(dados)
+
+
+def em_lotes(iteravel, tamanho):
+    lote = []
+    for registro in iteravel:
+        lote.append(registro)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+# ==========================================================
+# 2. VALIDAÇÃO
+# ==========================================================
+
+def _inteiro_positivo(valor):
+    try:
+        valor = int(valor)
+    except (TypeError, ValueError):
+        return None
+    return valor if valor > 0 else None
+
+
+def _id_valido(valor):
+    # ids de destino/item ligam as distribuições: texto ou número (lista/objeto nem é hashable)
+    return isinstance(valor, (str, int)) and not isinstance(valor, bool)
+
+
+def validar_pedido(data):
+    """ Retorna a lista de erros do pedido (vazia = pedido ok) """
+    if not isinstance(data, dict):
+        return ['Pedido deve ser um objeto JSON.']
+    if '_erro' in data:
+        return [data['_erro']]
+
+    erros = []
+    for campo in CAMPOS_ORIGEM_OBRIGATORIOS:
+        if not str(data.get(campo) or '').strip():
+            erros.append(f'Campo obrigatório ausente: {campo}')
+
+    if data.get('priority', 'NORMAL') not in ServiceOrder.Priority.values:
+        erros.append(f"Prioridade inválida: {data.get('priority')}")
+    if data.get('vehicle_type', 'MOTO') not in ServiceOrder.VehicleType.values:
+        erros.append(f"Tipo de veículo inválido: {data.get('vehicle_type')}")
+    if data.get('payment_method', 'FATURADO') not in ServiceOrder.PaymentMethod.values:
+        erros.append(f"Forma de pagamento inválida: {data.get('payment_method')}")
+
+    listas = {}
+    for nome in ('destinations', 'items', 'distributions'):
+        listas[nome] = data.get(nome) or []
+        if not isinstance(listas[nome], list):
+            erros.append(f'Campo {nome} deve ser uma lista.')
+            listas[nome] = []
+    destinos, itens, distribuicoes = listas['destinations'], listas['items'], listas['distributions']
+
+    if not destinos and isinstance(data.get('destinations') or [], list):
+        erros.append('O pedido precisa de pelo menos um destino.')
+    ids_destino = set()
+    for k, dest in enumerate(destinos):
+        if not isinstance(dest, dict):
+            erros.append(f'Destino {k + 1}: deve ser um objeto JSON.')
+            continue
+        for campo in CAMPOS_DESTINO_OBRIGATORIOS:
+            if not str(dest.get(campo) or '').strip():
+                erros.append(f'Destino {k + 1}: campo obrigatório ausente: {campo}')
+        if not _id_valido(dest.get('id')):
+            erros.append(f'Destino {k + 1}: id inválido.')
+            continue
+        if dest.get('id') in ids_destino:
+            erros.append(f'Destino {k + 1}: id repetido.')
+        ids_destino.add(dest.get('id'))
+
+    quantidades = {}
+    for k, item in enumerate(itens):
+        if not isinstance(item, dict):
+            erros.append(f'Item {k + 1}: deve ser um objeto JSON.')
+            continue
+        if item.get('id') is not None and not _id_valido(item['id']):
+            erros.append(f'Item {k + 1}: id inválido.')
+            continue
+        if not str(item.get('description') or '').strip():
+            erros.append(f'Item {k + 1}: descrição obrigatória.')
+        qtd = _inteiro_positivo(item.get('quantity'))
+        if qtd is None:
+            erros.append(f'Item {k + 1}: quantidade inválida.')
+        if item.get('weight') not in (None, ''):
+            try:
+                Decimal(str(item['weight']))
+            except InvalidOperation:
+                erros.append(f'Item {k + 1}: peso inválido.')
+        quantidades[item.get('id')] = qtd or 0
+
+    alocado = {}
+    for k, dist in enumerate(distribuicoes):
+        if not isinstance(dist, dict):
+            erros.append(f'Distribuição {k + 1}: deve ser um objeto JSON.')
+            continue
+        if not _id_valido(dist.get('item_id')) or dist['item_id'] not in quantidades:
+            erros.append(f'Distribuição {k + 1}: item inexistente.')
+        if not _id_valido(dist.get('dest_id')) or dist['dest_id'] not in ids_destino:
+            erros.append(f'Distribuição {k + 1}: destino inexistente.')
+        qtd = _inteiro_positivo(dist.get('quantity'))
+        if qtd is None:
+            erros.append(f'Distribuição {k + 1}: quantidade inválida.')
+        else:
+            alocado[dist.get('item_id')] = alocado.get(dist.get('item_id'), 0) + qtd
+    for item_id, total in alocado.items():
+        if item_id in quantidades and total > quantidades[item_id]:
+            erros.append(f'Item {item_id}: distribuição maior que a quantidade total.')
+
+    return erros
+
+
+# ==========================================================
+# 3. GRAVAÇÃO EM LOTE
+# ==========================================================
+
+def _gravar_lote(cliente, pedidos):
+    """ Grava pedidos já validados. Retorna a lista de os_number na mesma ordem. """
+    ordens, itens, destinos = [], [], []
+    itens_por_pedido, destinos_por_pedido = [], []
+    for data in pedidos:
+        origin_lat, origin_lng = geocodificar(
+            data.get('origin_zip_code', ''), data.get('origin_street', ''),
+            data.get('origin_city', ''), data.get('origin_state', '')
+        )
+        os_obj = ServiceOrder(
+            client=cliente,
+            requester_name=data.get('requester_name', ''),
+            requester_phone=data.get('requester_phone', ''),
+            company_cnpj=data.get('company_cnpj', ''),
+            company_email=data.get('company_email', ''),
+            delivery_type=data.get('delivery_type', ''),
+            vehicle_type=data.get('vehicle_type', 'MOTO'),
+            priority=data.get('priority', 'NORMAL'),
+            payment_method=data.get('payment_method', 'FATURADO'),
+            operational_notes=data.get('general_notes', ''),
+            origin_name=data.get('origin_name', ''),
+            origin_street=data.get('origin_street', ''),
+            origin_number=data.get('origin_number', ''),
+            origin_district=data.get('origin_district', ''),
+            origin_city=data.get('origin_city', ''),
+            origin_state=data.get('origin_state', ''),
+            origin_zip_code=data.get('origin_zip_code', ''),
+            origin_lat=origin_lat,
+            origin_lng=origin_lng,
+            is_multiple_delivery=len(data.get('destinations', [])) > 1,
+        )
+        ordens.append(os_obj)
+
+        mapa_itens = {}
+        for item_data in data.get('items', []):
+            peso = item_data.get('weight', '')
+            item = OSItem(
+                order=os_obj,
+                description=item_data['description'],
+                total_quantity=int(item_data['quantity']),
+                item_type=item_data.get('type', ''),
+                weight=Decimal(str(peso)) if peso not in (None, '') else None,
+                dimensions=item_data.get('dimensions', ''),
+                item_notes=item_data.get('notes', ''),
+            )
+            mapa_itens[item_data.get('id')] = item
+            itens.append(item)
+        itens_por_pedido.append(mapa_itens)
+
+        mapa_destinos = {}
+        for dest_data in data.get('destinations', []):
+            dest_lat, dest_lng = geocodificar(
+                dest_data.get('cep', ''), dest_data['street'], dest_data['city'], dest_data.get('state', '')
+            )
+            dest = OSDestination(
+                order=os_obj,
+                destination_name=dest_data['name'],
+                destination_phone=dest_data['phone'],
+                destination_street=dest_data['street'],
+                destination_number=dest_data['number'],
+                destination_complement=dest_data.get('complement', ''),
+                destination_district=dest_data['district'],
+                destination_city=dest_data['city'],
+                destination_state=dest_data.get('state', ''),
+                destination_zip_code=dest_data.get('cep', ''),
+                destination_reference=dest_data.get('reference', ''),
+                destination_lat=dest_lat,
+                destination_lng=dest_lng,
+            )
+            mapa_destinos[dest_data['id']] = dest
+            destinos.append(dest)
+        destinos_por_pedido.append(mapa_destinos)
+
+    with transaction.atomic():
+        # O bulk_create do ServiceOrder reserva os ids/os_number de uma vez (orders/numbering.py)
+        ServiceOrder.objects.bulk_create(ordens)
+        # bulk_create preenche os ids (RETURNING) de itens e destinos, usados logo abaixo
+        OSItem.objects.bulk_create(itens)
+        OSDestination.objects.bulk_create(destinos)
+
+        distribuicoes, paradas = [], []
+        for os_obj, data, mapa_itens, mapa_destinos in zip(ordens, pedidos, itens_por_pedido, destinos_por_pedido):
+            for dist in data.get('distributions', []):
+                distribuicoes.append(ItemDistribution(
+                    item=mapa_itens[dist['item_id']],
+                    destination=mapa_destinos[dist['dest_id']],
+                    quantity_allocated=int(dist['quantity']),
+                ))
+
+            paradas.append(RouteStop(service_order=os_obj, stop_type='COLETA', sequence=1))
+            for seq, dest in enumerate(mapa_destinos.values(), start=2):
+                paradas.append(RouteStop(service_order=os_obj, stop_type='ENTREGA', destination=dest, sequence=seq))
+
+        ItemDistribution.objects.bulk_create(distribuicoes)
+        RouteStop.objects.bulk_create(paradas)
+
+    return [os_obj.os_number for os_obj in ordens]
+
+
+def importar_pedidos(cliente, pedidos, tamanho_lote=TAMANHO_LOTE):
+    """
+    Gerador de resultados, um por pedido, na ordem de entrada:
+      {'index': 0, 'status': 'success', 'os_number': 'OS-0042'}
+      {'index': 1, 'status': 'error', 'errors': [...]}
+    Cada lote é gravado na sua própria transação (um lote com erro de banco não derruba os anteriores).
+    """
+    indice = 0
+    for lote in em_lotes(pedidos, tamanho_lote):
+        validos, posicoes = [], []
+        resultados = [None] * len(lote)
+        for k, data in enumerate(lote):
+            erros = validar_pedido(data)
+            if erros:
+                resultados[k] = {'index': indice + k, 'status': 'error', 'errors': erros}
+            else:
+                validos.append(data)
+                posicoes.append(k)
+
+        if validos:
+            try:
+                numeros = _gravar_lote(cliente, validos)
+            except Exception as e:
+                numeros = None
+                for k in posicoes:
+                    resultados[k] = {'index': indice + k, 'status': 'error', 'errors': [f'Falha ao gravar o lote: {e}']}
+            if numeros:
+                for k, numero in zip(posicoes, numeros):
+                    resultados[k] = {'index': indice + k, 'status': 'success', 'os_number': numero}
+
+        yield from resultados
+        indice += len(lote)
+
+
+def importar_com_resumo(cliente, pedidos, tamanho_lote=TAMANHO_LOTE):
+    """ Igual ao importar_pedidos, mas fecha com uma linha de resumo ('summary') """
+    inicio = time.monotonic()
+    sucesso = erro = 0
+    for resultado in importar_pedidos(cliente, pedidos, tamanho_lote):
+        if resultado['status'] == 'success':
+            sucesso += 1
+        else:
+            erro += 1
+        yield resultado
+
+    duracao = time.monotonic() - inicio
+    yield {
+        'summary': True,
+        'created': sucesso,
+        'failed': erro,
+        'seconds': round(duracao, 2),
+        'orders_per_second': round(sucesso / duracao, 1) if duracao else None,
+    }
@@ -0,0 +1,263 @@
+# orders/jobs.py
+"""
+Fila de tarefas em segundo plano guardada no próprio banco (sem broker externo).
+
+Ações pesadas do despacho (transferência de rota no resgate, reagendamento, atribuição com
+reordenação), as exportações grandes e a otimização de fotos não rodam dentro do request:
+  1. A view chama `enfileirar(tipo, chave=..., **parametros)` e devolve o id da tarefa.
+  2. `manage.py processar_tarefas` (um ou mais processos) reserva a próxima tarefa
+     PENDENTE, executa a função registrada com `@tarefa` e grava o resultado.
+  3. O navegador consulta `painel-despacho/tarefas/<id>/` até a tarefa terminar.
+
+Idempotência: pedidos com a mesma `chave` enquanto a tarefa está na fila, rodando ou
+concluída há menos de JANELA_IDEMPOTENCIA devolvem a mesma tarefa. Depois disso (ou se
+ela terminou em erro) a chave é reaproveitada por uma execução nova.
+
+Falhas: ValueError (regra de negócio, ex: TransicaoInvalida) encerra a tarefa em ERRO na
+hora. Outras exceções (lock, conexão, deadlock) voltam para a fila com espera crescente
+até max_tentativas. Tarefa atômica conclui na mesma transação do trabalho: se o worker
+cair no meio, nada foi gravado e ela é executada de novo (ver `recuperar_travadas`).
+
+Sinal de vida: enquanto a tarefa roda, uma thread do worker renova `iniciada_em` a cada
+INTERVALO_PULSO. Só tarefa sem pulso há mais de TEMPO_MAXIMO conta como worker morto, então
+uma exportação longa não é requeuada (nem marcada como ERRO) no meio da execução.
+
+Com TAREFAS_EM_LINHA = True (padrão em dev: config/settings.py usa DEBUG) a tarefa roda
+logo depois do commit, no próprio processo, sem precisar do worker.
+"""
+import importlib
+import logging
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import BackgroundJob
+
+logger = logging.getLogger(__name__)
+
+Status = BackgroundJob.Status
+
+MAX_TENTATIVAS = 3
+ESPERA_BASE = 10  # segundos; dobra a cada falha (10s, 20s, 40s...)
+JANELA_IDEMPOTENCIA = timedelta(minutes=10)
+TEMPO_MAXIMO = timedelta(minutes=15)  # EXECUTANDO sem sinal de vida há mais que isso = worker caiu
+INTERVALO_PULSO = TEMPO_MAXIMO / 5
+DIAS_HISTORICO = 7
+
+# Módulos que registram tarefas com @tarefa (importados antes de procurar uma)
+MODULOS_TAREFAS = ('orders.services', 'orders.exports', 'orders.media')
+
+_tarefas = {}
+_carregados = set()
+
+
+def tarefa(nome, atomica=True):
+    """
+    Registra `func(usuario, **parametros)` como tarefa `nome`; o retorno (JSON) vira o resultado.
+    atomica=False para trabalho longo que grava o próprio progresso (ex: exportação).
+    """
+    def registrar(func):
+        _tarefas[nome] = (func, atomica)
+        return func
+    return registrar
+
+
+def _registradas():
+    for modulo in MODULOS_TAREFAS:
+        if modulo not in _carregados:
+            importlib.import_module(modulo)
+            _carregados.add(modulo)
+    return _tarefas
+
+
+# ==========================================================
+# 1. ENFILEIRAMENTO (no request)
+# ==========================================================
+
+def enfileirar(tipo, chave=None, solicitante=None, max_tentativas=MAX_TENTATIVAS, **parametros):
+    """ Cria (ou devolve, pela chave) a tarefa. Ela só fica visível ao worker depois do commit. """
+    if tipo not in _registradas():
+        raise ValueError(f"Tarefa desconhecida: {tipo}")
+
+    dados = {
+        'tipo': tipo, 'parametros': parametros, 'solicitante': solicitante,
+        'max_tentativas': max_tentativas,
+    }
+    if chave is None:
+        job = BackgroundJob.objects.create(**dados)
+    else:
+        job, criada = BackgroundJob.objects.get_or_create(chave=chave, defaults=dados)
+        if not criada and not _reaproveitar(job, dados):
+            return job
+
+    if getattr(settings, 'TAREFAS_EM_LINHA', False):
+        transaction.on_commit(lambda: processar(job.id))
+    return job
+
+
+def _reaproveitar(job, dados):
+    """ Chave repetida: reinicia a tarefa com os parâmetros novos se a anterior já 'expirou' """
+    agora = timezone.now()
+    expirada = (
+        job.status == Status.ERRO
+        or (job.status == Status.CONCLUIDA and job.concluida_em and job.concluida_em < agora - JANELA_IDEMPOTENCIA)
+    )
+    if not expirada:
+        return False
+    # UPDATE condicional: dois pedidos simultâneos com a mesma chave reiniciam uma vez só
+    reiniciou = BackgroundJob.objects.filter(id=job.id, status=job.status).update(
+        **dados, status=Status.PENDENTE, tentativas=0, executar_em=agora,
+        resultado=None, erro='', iniciada_em=None, concluida_em=None,
+    )
+    job.refresh_from_db()
+    return bool(reiniciou)
+
+
+# ==========================================================
+# 2. EXECUÇÃO (worker)
+# ==========================================================
+
+def reservar():
+    """ Marca a próxima tarefa vencida como EXECUTANDO e a devolve (None = fila vazia) """
+    with transaction.atomic():
+        # skip_locked: vários workers no PostgreSQL não disputam a mesma linha (no SQLite é ignorado)
+        job = (BackgroundJob.objects.select_for_update(skip_locked=True)
+               .filter(status=Status.PENDENTE, executar_em__lte=timezone.now())
+               .order_by('executar_em', 'id').first())
+        if job is None:
+            return None
+        return job if _marcar_executando(job) else None
+
+
+def _marcar_executando(job):
+    """ UPDATE condicional PENDENTE -> EXECUTANDO: bancos sem SELECT ... FOR UPDATE dependem só dele """
+    agora = timezone.now()
+    if not BackgroundJob.objects.filter(id=job.id, status=Status.PENDENTE).update(
+        status=Status.EXECUTANDO, iniciada_em=agora, tentativas=job.tentativas + 1
+    ):
+        return False
+    job.status, job.iniciada_em, job.tentativas = Status.EXECUTANDO, agora, job.tentativas + 1
+    return True
+
+
+def _pulsar(job):
+    """ Renova `iniciada_em` se esta execução ainda está rodando (não mexe numa tarefa requeuada) """
+    return BackgroundJob.objects.filter(
+        id=job.id, status=Status.EXECUTANDO, tentativas=job.tentativas
+    ).update(iniciada_em=timezone.now())
+
+
+class Pulso:
+    """ Thread que dá sinal de vida da tarefa enquanto `executar` roda (conexão própria) """
+
+    def __init__(self, job, intervalo=INTERVALO_PULSO):
+        self._job = job
+        self._intervalo = intervalo.total_seconds()
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._rodar, name=f'pulso-tarefa-{job.id}', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+        return False
+
+    def _rodar(self):
+        usou_banco = False
+        try:
+            while not self._parar.wait(self._intervalo):
+                usou_banco = True
+                try:
+                    _pulsar(self._job)
+                except Exception:
+                    logger.warning("Falha ao renovar o sinal de vida da tarefa %s", self._job, exc_info=True)
+        finally:
+            if usou_banco:
+                connection.close()
+
+
+def _concluir(job, resultado):
+    BackgroundJob.objects.filter(id=job.id).update(
+        status=Status.CONCLUIDA, resultado=resultado, erro='', concluida_em=timezone.now()
+    )
+
+
+def executar(job):
+    """ Roda uma tarefa já reservada. Retorna True se concluiu. """
+    registro = _registradas().get(job.tipo)
+    try:
+        if registro is None:
+            raise ValueError(f"Tarefa desconhecida: {job.tipo}")
+        func, atomica = registro
+        with Pulso(job):
+            if atomica:
+                with transaction.atomic():
+                    resultado = func(job.solicitante, **job.parametros)
+                    _concluir(job, resultado)
+            else:
+                resultado = func(job.solicitante, **job.parametros)
+                _concluir(job, resultado)
+        return True
+    except Exception as e:
+        definitivo = isinstance(e, ValueError) or job.tentativas >= job.max_tentativas
+        if definitivo:
+            logger.exception("Tarefa %s falhou", job)
+            BackgroundJob.objects.filter(id=job.id).update(
+                status=Status.ERRO, erro=str(e)[:1000], concluida_em=timezone.now()
+            )
+        else:
+            espera = timedelta(seconds=ESPERA_BASE * 2 ** (job.tentativas - 1))
+            logger.warning("Tarefa %s falhou (tentativa %s), nova tentativa em %s", job, job.tentativas, espera, exc_info=True)
+            BackgroundJob.objects.filter(id=job.id).update(
+                status=Status.PENDENTE, erro=str(e)[:1000], executar_em=timezone.now() + espera
+            )
+        return False
+
+
+def processar(job_id):
+    """ Executa uma tarefa específica agora, se ainda estiver na fila (TAREFAS_EM_LINHA) """
+    job = BackgroundJob.objects.filter(id=job_id, status=Status.PENDENTE).first()
+    if job and _marcar_executando(job):
+        executar(job)
+
+
+def recuperar_travadas():
+    """ Tarefas EXECUTANDO sem pulso há mais de TEMPO_MAXIMO (worker morto no meio) voltam para a fila """
+    limite = timezone.now() - TEMPO_MAXIMO
+    travadas = BackgroundJob.objects.filter(status=Status.EXECUTANDO, iniciada_em__lt=limite)
+    esgotadas = travadas.filter(tentativas__gte=F('max_tentativas')).update(
+        status=Status.ERRO, erro="Worker interrompido durante a execução.", concluida_em=timezone.now()
+    )
+    return travadas.update(status=Status.PENDENTE, executar_em=timezone.now()) + esgotadas
+
+
+def limpar_antigas(dias=DIAS_HISTORICO):
+    """ Apaga o histórico de tarefas terminadas (a tabela é fila, não auditoria) """
+    limite = timezone.now() - timedelta(days=dias)
+    return BackgroundJob.objects.filter(
+        status__in=[Status.CONCLUIDA, Status.ERRO], concluida_em__lt=limite
+    ).delete()[0]
+
+
+# ==========================================================
+# 3. CONSULTA (polling da tela)
+# ==========================================================
+
+def serializar(job):
+    return {
+        'id': job.id,
+        'tipo': job.tipo,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'tentativas': job.tentativas,
+        'terminada': job.status in (Status.CONCLUIDA, Status.ERRO),
+        'resultado': job.resultado,
+        'erro': job.erro,
+    }
@@ -0,0 +1,218 @@
+# orders/kpis.py
+"""
+KPIs materializados do Painel Admin.
+
+Em vez de contar a tabela de OS inteira a cada acesso, mantemos contadores de OS por
+status em três recortes (DailyOrderStats, CompanyOrderStats, MotoboyOrderStats). Cada
+criação, mudança de status/motoboy ou remoção gera deltas (+1 no estado novo, -1 no
+antigo) aplicados depois do commit. O painel só lê essas tabelas, que crescem com o
+número de dias/empresas/motoboys e não com o histórico de OS.
+
+Escritas que passam por fora do ORM não geram deltas (o `gerar_os --rapido` já recalcula
+no final); `manage.py recalcular_kpis` reconstrói tudo e corrige qualquer desvio.
+OS arquivadas (orders/archive.py) saem das tabelas quentes sem delta: continuam contando,
+e o recalcular soma as duas tabelas.
+"""
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from logistics.models import MotoboyProfile
+from .models import ServiceOrder, ArchivedOrder, DailyOrderStats, CompanyOrderStats, MotoboyOrderStats
+
+CustomUser = get_user_model()
+
+CAMPOS_KPI = {'status', 'motoboy', 'motoboy_id', 'client', 'client_id'}
+_SEM_MUDANCA = object()
+
+
+def _dia(data_hora):
+    return timezone.localdate(data_hora) if timezone.is_aware(data_hora) else data_hora.date()
+
+
+def _chave(created_at, client_id, motoboy_id, status):
+    """ Uma OS vira a chave (dia, empresa, motoboy, status) """
+    return (_dia(created_at), client_id, motoboy_id, status)
+
+
+# ==========================================================
+# 1. DELTAS
+# ==========================================================
+
+def afeta_kpis(valores):
+    return bool(CAMPOS_KPI & set(valores))
+
+
+def agrupar(queryset):
+    """ Contagem das OS do queryset por (dia, empresa, motoboy, status), feita no banco """
+    linhas = queryset.order_by().values(
+        'client_id', 'motoboy_id', 'status', dia=TruncDate('created_at')
+    ).annotate(n=Count('id'))
+    return Counter({(l['dia'], l['client_id'], l['motoboy_id'], l['status']): l['n'] for l in linhas})
+
+
+def _valor_literal(valores, *nomes):
+    for nome in nomes:
+        if nome in valores:
+            valor = getattr(valores[nome], 'pk', valores[nome])
+            # Expressões (F, Case...) não dá para resolver aqui; quem usar deve rodar o recalcular_kpis
+            return valor if valor is None or isinstance(valor, (str, int)) else _SEM_MUDANCA
+    return _SEM_MUDANCA
+
+
+def registrar_update(antes, valores):
+    """ QuerySet.update(): move as contagens de `antes` para os valores novos """
+    status = _valor_literal(valores, 'status')
+    motoboy_id = _valor_literal(valores, 'motoboy', 'motoboy_id')
+    client_id = _valor_literal(valores, 'client', 'client_id')
+
+    deltas = Counter()
+    for (dia, cliente, motoboy, st), n in antes.items():
+        novo = (
+            dia,
+            cliente if client_id is _SEM_MUDANCA else client_id,
+            motoboy if motoboy_id is _SEM_MUDANCA else motoboy_id,
+            st if status is _SEM_MUDANCA else status,
+        )
+        if novo != (dia, cliente, motoboy, st):
+            deltas[novo] += n
+            deltas[(dia, cliente, motoboy, st)] -= n
+    aplicar(deltas)
+
+
+def registrar_save(os_obj, adicionando):
+    atual = _chave(os_obj.created_at, os_obj.client_id, os_obj.motoboy_id, os_obj.status)
+    deltas = Counter()
+    if adicionando:
+        deltas[atual] += 1
+    else:
+        anterior = getattr(os_obj, '_kpi_db', None)
+        if anterior is None:
+            # Instância que não veio do banco completa (ex: .only()); sem como saber o estado anterior
+            return
+        anterior = _chave(*anterior)
+        if anterior != atual:
+            deltas[atual] += 1
+            deltas[anterior] -= 1
+    os_obj._kpi_db = (os_obj.created_at, os_obj.client_id, os_obj.motoboy_id, os_obj.status)
+    aplicar(deltas)
+
+
+def registrar_criacao(ordens):
+    aplicar(Counter(_chave(o.created_at, o.client_id, o.motoboy_id, o.status) for o in ordens))
+
+
+def registrar_remocao(antes):
+    aplicar(Counter({chave: -n for chave, n in antes.items()}))
+
+
+# ==========================================================
+# 2. GRAVAÇÃO
+# ==========================================================
+
+def aplicar(deltas):
+    """ Aplica os deltas depois do commit (rollback = nada a desfazer nos contadores) """
+    deltas = {chave: n for chave, n in deltas.items() if n}
+    if deltas:
+        transaction.on_commit(lambda: _gravar(deltas))
+
+
+def _gravar(deltas):
+    por_dia, por_empresa, por_motoboy = Counter(), Counter(), Counter()
+    for (dia, cliente, motoboy, status), n in deltas.items():
+        por_dia[(dia, status)] += n
+        por_empresa[(cliente, status)] += n
+        if motoboy:
+            por_motoboy[(motoboy, status)] += n
+
+    with transaction.atomic():
+        for model, campo, contagem in (
+            (DailyOrderStats, 'day', por_dia),
+            (CompanyOrderStats, 'client_id', por_empresa),
+            (MotoboyOrderStats, 'motoboy_id', por_motoboy),
+        ):
+            for (valor, status), n in contagem.items():
+                if n:
+                    _incrementar(model, {campo: valor, 'status': status}, n)
+
+
+def _incrementar(model, filtro, n):
+    if model.objects.filter(**filtro).update(total=F('total') + n):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(total=n, **filtro)
+    except IntegrityError:
+        # Outro processo criou a linha entre o UPDATE e o INSERT
+        model.objects.filter(**filtro).update(total=F('total') + n)
+
+
+def _contar(campo, consulta):
+    """ {(valor de `campo`, status): n} somando as OS quentes e as arquivadas (mesmas colunas) """
+    total = Counter()
+    for base in (ServiceOrder.objects.order_by(), ArchivedOrder.objects.order_by()):
+        for l in consulta(base).annotate(n=Count('id')):
+            total[(l[campo], l['status'])] += l['n']
+    return total
+
+
+def recalcular():
+    """ Reconstrói as três tabelas a partir das OS (3 GROUP BY em cada tabela de OS). Retorna quantas linhas gerou. """
+    with transaction.atomic():
+        DailyOrderStats.objects.all().delete()
+        CompanyOrderStats.objects.all().delete()
+        MotoboyOrderStats.objects.all().delete()
+
+        diarios = DailyOrderStats.objects.bulk_create([
+            DailyOrderStats(day=dia, status=status, total=n)
+            for (dia, status), n in _contar('dia', lambda base: base.values('status', dia=TruncDate('created_at'))).items()
+        ])
+        empresas = CompanyOrderStats.objects.bulk_create([
+            CompanyOrderStats(client_id=client_id, status=status, total=n)
+            for (client_id, status), n in _contar('client_id', lambda base: base.values('client_id', 'status')).items()
+        ])
+        motoboys = MotoboyOrderStats.objects.bulk_create([
+            MotoboyOrderStats(motoboy_id=motoboy_id, status=status, total=n)
+            for (motoboy_id, status), n in _contar(
+                'motoboy_id', lambda base: base.filter(motoboy__isnull=False).values('motoboy_id', 'status')
+            ).items()
+        ])
+    return {'dias': len(diarios), 'empresas': len(empresas), 'motoboys': len(motoboys)}
+
+
+# ==========================================================
+# 3. LEITURA (Painel Admin)
+# ==========================================================
+
+def totais_por_status():
+    """ {status: total} da operação inteira """
+    return dict(DailyOrderStats.objects.values('status').annotate(n=Sum('total')).values_list('status', 'n'))
+
+
+def totais_da_empresa(client_id):
+    """ {status: total} de uma empresa (cards do Painel da Empresa): uma query em poucas linhas """
+    return dict(CompanyOrderStats.objects.filter(client_id=client_id).values_list('status', 'total'))
+
+
+def _soma(status=None):
+    filtro = Q(order_stats__status__in=status) if status else None
+    return Coalesce(Sum('order_stats__total', filter=filtro), 0)
+
+
+def ranking_motoboys(limite=15):
+    return MotoboyProfile.objects.select_related('user').annotate(
+        total_entregas=_soma(['ENTREGUE']),
+        em_andamento=_soma(['ACEITO', 'COLETADO']),
+    ).order_by('-total_entregas')[:limite]
+
+
+def ranking_empresas(limite=15):
+    return CustomUser.objects.filter(type='COMPANY').annotate(
+        total_pedidos=_soma(),
+        concluidas=_soma(['ENTREGUE']),
+        canceladas=_soma(['CANCELADO']),
+    ).order_by('-total_pedidos')[:limite]
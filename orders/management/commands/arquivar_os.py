@@ -0,0 +1,62 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from orders import archive
+
+
+class Command(BaseCommand):
+    help = ('Move os grupos de OS encerrados há mais de --dias para o arquivo (ArchivedOrder), em lotes. '
+            'Use --intervalo para deixar rodando como rotina.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=archive.DIAS_PADRAO, help='Idade mínima do grupo encerrado')
+        parser.add_argument('--lote', type=int, default=archive.LOTE_PADRAO, help='Grupos por transação')
+        parser.add_argument('--simular', action='store_true', help='Só conta os grupos elegíveis, sem mover nada')
+        parser.add_argument('--intervalo', type=float, default=0,
+                            help='Segundos entre rodadas (0 = arquiva o que houver e sai)')
+
+    def handle(self, *args, **options):
+        if options['dias'] < 1 or options['lote'] < 1:
+            raise CommandError("--dias e --lote precisam ser positivos.")
+
+        if options['simular']:
+            n = archive.contar_arquivaveis(options['dias'])
+            self.stdout.write(self.style.WARNING(f"[SIMULAÇÃO] {n} grupo(s) elegível(is) para o arquivo. Nada foi movido."))
+            return
+
+        self._parar = False
+        # SIGTERM (deploy, systemd) termina o lote atual antes de sair
+        signal.signal(signal.SIGTERM, self._sinal)
+        signal.signal(signal.SIGINT, self._sinal)
+
+        while not self._parar:
+            close_old_connections()
+            grupos, ordens = self._rodada(options)
+            self.stdout.write(self.style.SUCCESS(f"{grupos} grupo(s) arquivado(s), {ordens} OS fora das tabelas quentes."))
+            if not options['intervalo']:
+                break
+            time.sleep(options['intervalo'])
+        close_old_connections()
+
+    def _rodada(self, options):
+        """ Lotes até não sobrar grupo elegível (ou chegar o sinal de parar) """
+        grupos = ordens = 0
+        while not self._parar:
+            raizes = archive.grupos_arquivaveis(options['dias'], options['lote'])
+            if not raizes:
+                break
+            inicio = time.monotonic()
+            n_grupos, n_ordens = archive.arquivar(raizes, options['dias'])
+            if not n_grupos:
+                break  # Todos voltaram a andar entre a seleção e a trava
+            grupos += n_grupos
+            ordens += n_ordens
+            if options['verbosity'] > 1:
+                self.stdout.write(f"  {n_grupos} grupo(s) / {n_ordens} OS ({time.monotonic() - inicio:.2f}s)")
+        return grupos, ordens
+
+    def _sinal(self, signum, frame):
+        self._parar = True
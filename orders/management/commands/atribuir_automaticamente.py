@@ -0,0 +1,54 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from orders import assignment
+
+
+class Command(BaseCommand):
+    help = 'Atribui a fila PENDENTE aos motoboys online (emparelhamento em lote). Use --simular para só ver o plano.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--simular', action='store_true', help='Calcula e mostra o plano sem gravar nada')
+        parser.add_argument('--janela', type=int, default=assignment.JANELA, help='OS da fila consideradas por rodada')
+        parser.add_argument('--intervalo', type=float, default=0,
+                            help='Segundos entre rodadas (0 = roda uma vez e sai)')
+
+    def handle(self, *args, **options):
+        if options['janela'] < 1:
+            raise CommandError("--janela precisa ser positiva.")
+
+        self._parar = False
+        signal.signal(signal.SIGTERM, self._sinal)
+        signal.signal(signal.SIGINT, self._sinal)
+
+        while not self._parar:
+            close_old_connections()
+            plano = assignment.atribuir_fila(simular=options['simular'], janela=options['janela'])
+            self._relatorio(plano, options['simular'], detalhado=not options['intervalo'])
+            if not options['intervalo']:
+                break
+            time.sleep(options['intervalo'])
+        close_old_connections()
+
+    def _relatorio(self, plano, simular, detalhado):
+        if detalhado:
+            for par in plano['pares']:
+                self.stdout.write(
+                    f"OS {par['os'].os_number:<14} -> {par['motoboy'].user.get_full_name() or par['motoboy'].user.username:<24} "
+                    f"{par['km']:>6.2f} km  custo {par['custo']:>6.2f}  ({par['paradas']} parada(s), {par['kg']:.1f} kg, {par['litros']:.0f} L)"
+                )
+        resumo = (
+            f"Fila {plano['fila']} OS, {plano['motoboys']} motoboy(s) disponível(is): "
+            f"{len(plano['pares'])} par(es) no plano, {len(plano['sem_motoboy'])} sem motoboy "
+            f"({plano['tempo_ms']} ms)."
+        )
+        if simular:
+            self.stdout.write(self.style.WARNING(f"[SIMULAÇÃO] {resumo} Nada foi gravado."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{resumo} {plano['atribuidas']} OS atribuída(s)."))
+
+    def _sinal(self, signum, frame):
+        self._parar = True
@@ -0,0 +1,77 @@
+import csv
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from orders.geocoding import normalizar, so_digitos, nova_versao_base
+from orders.models import CepLocation, GeocodeCache
+
+
+class Command(BaseCommand):
+    help = 'Carrega a base local de CEPs/logradouros (CSV: cep,logradouro,bairro,cidade,uf,lat,lng) usada na geocodificação.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Caminho do CSV')
+        parser.add_argument('--delimitador', default=',', help='Separador do CSV (padrão: vírgula)')
+        parser.add_argument('--lote', type=int, default=5000, help='Linhas por bulk_create')
+        parser.add_argument('--substituir', action='store_true', help='Apaga a base atual antes de carregar')
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        total = 0
+        ignoradas = 0
+
+        try:
+            arquivo = open(options['arquivo'], newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f"Não foi possível abrir o arquivo: {e}")
+
+        with arquivo, transaction.atomic():
+            if options['substituir']:
+                CepLocation.objects.all().delete()
+
+            buffer = []
+            for linha in csv.DictReader(arquivo, delimiter=options['delimitador']):
+                cep = so_digitos(linha.get('cep'))
+                try:
+                    lat = float(linha['lat'])
+                    lng = float(linha['lng'])
+                except (KeyError, TypeError, ValueError):
+                    ignoradas += 1
+                    continue
+                if len(cep) != 8 or not linha.get('cidade'):
+                    ignoradas += 1
+                    continue
+
+                buffer.append(CepLocation(
+                    cep=cep,
+                    street=linha.get('logradouro', ''),
+                    district=linha.get('bairro', ''),
+                    city=linha['cidade'],
+                    state=(linha.get('uf') or '').upper()[:2],
+                    street_norm=normalizar(linha.get('logradouro', '')),
+                    city_norm=normalizar(linha['cidade']),
+                    lat=lat,
+                    lng=lng,
+                ))
+                if len(buffer) >= lote:
+                    total += self._gravar(buffer)
+                    buffer = []
+
+            if buffer:
+                total += self._gravar(buffer)
+
+        # Depois do commit: qualquer endereço pode ter mudado de coordenada (ou passado a existir).
+        # O que foi resolvido com a base antiga, inclusive por outros processos durante a carga, sai.
+        GeocodeCache.objects.all().delete()
+        nova_versao_base()
+        self.stdout.write(self.style.SUCCESS(f'{total} CEPs carregados ({ignoradas} linhas ignoradas).'))
+
+    def _gravar(self, buffer):
+        CepLocation.objects.bulk_create(
+            buffer,
+            update_conflicts=True,
+            unique_fields=['cep'],
+            update_fields=['street', 'district', 'city', 'state', 'street_norm', 'city_norm', 'lat', 'lng'],
+        )
+        return len(buffer)
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from orders.geocoding import geocodificar_origem, geocodificar_destino
+from orders.models import ServiceOrder, OSDestination
+
+
+class Command(BaseCommand):
+    help = 'Preenche as coordenadas (lat/lng) das OS e destinos que ainda não foram geocodificados.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=2000, help='Registros por bulk_update')
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+
+        pendentes = ServiceOrder.objects.filter(Q(origin_lat__isnull=True) | Q(origin_lng__isnull=True))
+        total_os = self._processar(
+            pendentes.only('id', 'origin_zip_code', 'origin_street', 'origin_city', 'origin_state'),
+            geocodificar_origem, ServiceOrder, ['origin_lat', 'origin_lng'], lote
+        )
+
+        pendentes = OSDestination.objects.filter(Q(destination_lat__isnull=True) | Q(destination_lng__isnull=True))
+        total_dest = self._processar(
+            pendentes.only('id', 'destination_zip_code', 'destination_street', 'destination_city', 'destination_state'),
+            geocodificar_destino, OSDestination, ['destination_lat', 'destination_lng'], lote
+        )
+
+        self.stdout.write(self.style.SUCCESS(f'Geocodificadas: {total_os} origens e {total_dest} destinos.'))
+
+    def _processar(self, queryset, geocodificador, model, campos, lote):
+        total = 0
+        buffer = []
+        for obj in queryset.iterator(chunk_size=lote):
+            geocodificador(obj)
+            if getattr(obj, campos[0]) is None:
+                continue
+            buffer.append(obj)
+            if len(buffer) >= lote:
+                model.objects.bulk_update(buffer, campos)
+                total += len(buffer)
+                buffer = []
+        if buffer:
+            model.objects.bulk_update(buffer, campos)
+            total += len(buffer)
+        return total
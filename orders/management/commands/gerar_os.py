@@ -1,5 +1,6 @@
 import random
-from django.core.management.base import BaseCommand
+import time
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from django.contrib.auth import get_user_model
 from faker import Faker
@@ -13,12 +14,25 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('quantidade', type=int, help='Número de OSs a gerar')
+        parser.add_argument('--rapido', action='store_true', help="Modo em massa (NumPy + INSERT em lote/COPY), com frota, rotas e ocorrências")
+        parser.add_argument('--seed', type=int, default=None, help='Semente para gerar sempre a mesma massa')
+        parser.add_argument('--lote', type=int, default=5000, help='OSs por transação no modo rápido')
+        parser.add_argument('--motoboys', type=int, default=50, help='Tamanho da frota no modo rápido')
+        parser.add_argument('--empresas', type=int, default=20, help='Quantidade de empresas clientes no modo rápido')
+        parser.add_argument('--dias', type=int, default=90, help='Janela de histórico das OS finalizadas (modo rápido)')
+        parser.add_argument('--copy', action='store_true', help='Usa COPY em vez de bulk_create (só PostgreSQL)')
 
     def handle(self, *args, **kwargs):
         quantidade = kwargs['quantidade']
         
         # Inicia o Faker configurado para o Brasil
         fake = Faker('pt_BR')
+        if kwargs['seed'] is not None:
+            Faker.seed(kwargs['seed'])
+            random.seed(kwargs['seed'])
+
+        if kwargs['rapido']:
+            return self._gerar_rapido(quantidade, fake, kwargs)
 
         # 1. Garante que existe pelo menos um utilizador do tipo 'COMPANY' para ser o cliente
         empresa_user = CustomUser.objects.filter(type='COMPANY').first()
@@ -113,4 +127,31 @@ class Command(BaseCommand):
 
                 self.stdout.write(f"OS gerada: {os.os_number} ({num_entregas} entregas)")
 
-        self.stdout.write(self.style.SUCCESS(f'\n{quantidade} Ordens de Serviço geradas com sucesso!'))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS(f'\n{quantidade} Ordens de Serviço geradas com sucesso!'))
+
+    def _gerar_rapido(self, quantidade, fake, opcoes):
+        from orders.seeding import gerar_massa, np
+
+        if np is None:
+            raise CommandError("O modo --rapido precisa do NumPy (pip install numpy).")
+
+        inicio = time.monotonic()
+
+        def progresso(totais):
+            decorrido = time.monotonic() - inicio
+            self.stdout.write(
+                f"{totais['os']}/{quantidade} OS ({totais['paradas']} paradas, "
+                f"{totais['ocorrencias']} ocorrências) - {totais['os'] / decorrido:,.0f} OS/s"
+            )
+
+        totais = gerar_massa(
+            quantidade, fake,
+            seed=opcoes['seed'], lote=opcoes['lote'], motoboys=opcoes['motoboys'],
+            empresas=opcoes['empresas'], dias=opcoes['dias'], usar_copy=opcoes['copy'],
+            progresso=progresso,
+        )
+        decorrido = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f"\n{totais['os']} Ordens de Serviço geradas em {decorrido:.1f}s "
+            f"({totais['os'] * 60 / decorrido:,.0f} OS/min)."
+        ))
@@ -0,0 +1,52 @@
+import json
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.intake import importar_com_resumo, ler_json, ler_ndjson, TAMANHO_LOTE
+
+CustomUser = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Importa OS em lote a partir de um arquivo JSON (lista) ou NDJSON (um pedido por linha).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help="Arquivo de pedidos ('-' para ler da entrada padrão)")
+        parser.add_argument('--cliente', required=True, help='Username da empresa dona dos pedidos')
+        parser.add_argument('--formato', choices=['json', 'ndjson'], help='Padrão: pela extensão do arquivo')
+        parser.add_argument('--lote', type=int, default=TAMANHO_LOTE, help='Pedidos por bulk_create')
+        parser.add_argument('--saida', help='Grava o resultado de cada pedido (NDJSON) neste arquivo')
+
+    def handle(self, *args, **options):
+        try:
+            cliente = CustomUser.objects.get(username=options['cliente'], type='COMPANY')
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"Empresa '{options['cliente']}' não encontrada.")
+
+        caminho = options['arquivo']
+        formato = options['formato'] or ('json' if caminho.endswith('.json') else 'ndjson')
+        arquivo = sys.stdin if caminho == '-' else open(caminho, encoding='utf-8')
+        saida = open(options['saida'], 'w', encoding='utf-8') if options['saida'] else None
+
+        try:
+            pedidos = ler_json(arquivo) if formato == 'json' else ler_ndjson(arquivo)
+            for resultado in importar_com_resumo(cliente, pedidos, options['lote']):
+                if resultado.get('summary'):
+                    self.stdout.write(self.style.SUCCESS(
+                        f"{resultado['created']} OS criadas, {resultado['failed']} com erro "
+                        f"em {resultado['seconds']}s ({resultado['orders_per_second']} OS/s)."
+                    ))
+                    continue
+                if saida:
+                    saida.write(json.dumps(resultado) + '\n')
+                if resultado['status'] == 'error':
+                    self.stderr.write(f"Pedido {resultado['index']}: {'; '.join(resultado['errors'])}")
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if arquivo is not sys.stdin:
+                arquivo.close()
+            if saida:
+                saida.close()
@@ -0,0 +1,68 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from orders.benchmark import (
+    CENARIOS_PADRAO, TOLERANCIA_QUERIES, TOLERANCIA_TEMPO,
+    comparar, executar, ler_cenarios, relatorio_markdown,
+)
+
+
+class Command(BaseCommand):
+    help = 'Mede queries e latência das telas principais em massas de vários tamanhos (banco de teste descartável).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cenarios', default=CENARIOS_PADRAO, help="Lista 'OS:motoboys', ex: 1000:50,10000:500,100000:500")
+        parser.add_argument('--repeticoes', type=int, default=3, help='Medidas por view (usa a mediana)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--json', dest='saida_json', help='Grava o resultado em JSON neste arquivo')
+        parser.add_argument('--markdown', dest='saida_md', help='Grava a tabela em markdown neste arquivo')
+        parser.add_argument('--baseline', help='JSON de uma execução anterior; regressões fazem o comando falhar')
+        parser.add_argument('--tolerancia-queries', type=int, default=TOLERANCIA_QUERIES)
+        parser.add_argument('--tolerancia-tempo', type=float, default=TOLERANCIA_TEMPO, help='Ex: 0.5 = até 50%% mais lento')
+
+    def handle(self, *args, **options):
+        try:
+            cenarios = ler_cenarios(options['cenarios'])
+        except ValueError:
+            raise CommandError("Formato de --cenarios inválido (use OS:motoboys separados por vírgula).")
+
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+
+        def progresso(medida):
+            self.stdout.write(
+                f"{medida['cenario']:>16} {medida['view']:<20} {medida['status_code']} "
+                f"{medida['queries']:>4} queries {medida['db_ms']:>8.1f}ms banco {medida['wall_ms']:>8.1f}ms total"
+                f" | quente: {medida['queries_quente']:>4} queries {medida['wall_ms_quente']:>8.1f}ms total"
+            )
+
+        # Nunca mede no banco de verdade: cria um banco de teste e apaga no final
+        setup_test_environment()
+        nome_original = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            resultados = executar(cenarios, options['repeticoes'], options['seed'], progresso)
+        finally:
+            connection.creation.destroy_test_db(nome_original, verbosity=0)
+            teardown_test_environment()
+
+        regressoes = comparar(resultados, baseline, options['tolerancia_queries'], options['tolerancia_tempo']) if baseline else []
+
+        if options['saida_json']:
+            with open(options['saida_json'], 'w', encoding='utf-8') as f:
+                json.dump({'banco': connection.vendor, 'resultados': resultados}, f, indent=2)
+        markdown = relatorio_markdown(resultados, regressoes)
+        if options['saida_md']:
+            with open(options['saida_md'], 'w', encoding='utf-8') as f:
+                f.write(markdown)
+        else:
+            self.stdout.write('\n' + markdown)
+
+        if regressoes:
+            raise CommandError(f"{len(regressoes)} regressão(ões) em relação ao baseline:\n" + '\n'.join(regressoes))
+        self.stdout.write(self.style.SUCCESS('Benchmark concluído sem regressões.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from orders.media import processar_pendentes
+
+
+class Command(BaseCommand):
+    help = 'Otimiza as fotos/assinaturas que ficaram pendentes (processo reiniciado ou falha temporária).'
+
+    def handle(self, *args, **options):
+        ok, falhas = processar_pendentes()
+        self.stdout.write(self.style.SUCCESS(f"{ok} mídia(s) otimizada(s)."))
+        if falhas:
+            raise CommandError(f"{falhas} mídia(s) falharam; veja o campo erro em PendingMedia.")
@@ -0,0 +1,56 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from orders import jobs
+
+# Manutenção (travadas / histórico) no máximo a cada tanto, não a cada volta do laço
+INTERVALO_MANUTENCAO = 60
+
+
+class Command(BaseCommand):
+    help = 'Worker da fila de tarefas em segundo plano (transferências, reagendamentos, exportações...).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--intervalo', type=float, default=1.0, help='Segundos de espera com a fila vazia')
+        parser.add_argument('--uma-vez', action='store_true', help='Esvazia a fila e sai (cron, testes)')
+
+    def handle(self, *args, **options):
+        self._parar = False
+        # SIGTERM (deploy, systemd) termina a tarefa atual antes de sair
+        signal.signal(signal.SIGTERM, self._sinal)
+        signal.signal(signal.SIGINT, self._sinal)
+
+        executadas = falhas = 0
+        ultima_manutencao = 0
+        while not self._parar:
+            close_old_connections()
+            if time.monotonic() - ultima_manutencao > INTERVALO_MANUTENCAO:
+                recuperadas = jobs.recuperar_travadas()
+                if recuperadas:
+                    self.stdout.write(self.style.WARNING(f"{recuperadas} tarefa(s) travada(s) voltaram para a fila."))
+                jobs.limpar_antigas()
+                ultima_manutencao = time.monotonic()
+
+            job = jobs.reservar()
+            if job is None:
+                if options['uma_vez']:
+                    break
+                time.sleep(options['intervalo'])
+                continue
+
+            inicio = time.monotonic()
+            if jobs.executar(job):
+                executadas += 1
+                self.stdout.write(f"OK     {job.tipo} #{job.id} ({time.monotonic() - inicio:.2f}s)")
+            else:
+                falhas += 1
+                self.stdout.write(self.style.ERROR(f"FALHOU {job.tipo} #{job.id} (tentativa {job.tentativas})"))
+
+        close_old_connections()
+        self.stdout.write(self.style.SUCCESS(f"{executadas} tarefa(s) executada(s), {falhas} falha(s)."))
+
+    def _sinal(self, signum, frame):
+        self._parar = True
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from orders.kpis import recalcular
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói do zero os KPIs materializados do Painel Admin (por dia, empresa e motoboy).'
+
+    def handle(self, *args, **options):
+        linhas = recalcular()
+        self.stdout.write(self.style.SUCCESS(
+            f"KPIs recalculados: {linhas['dias']} linhas por dia, {linhas['empresas']} por empresa, "
+            f"{linhas['motoboys']} por motoboy."
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from orders.search import reindexar
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói do zero os documentos da busca de OS (número, solicitante, endereços, destinatários e itens).'
+
+    def handle(self, *args, **options):
+        def progresso(total):
+            self.stdout.write(f"  {total} OS indexadas...")
+
+        total = reindexar(progresso if options['verbosity'] > 1 else None)
+        self.stdout.write(self.style.SUCCESS(f"Busca reindexada: {total} OS."))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from orders import eta
+
+
+class Command(BaseCommand):
+    help = ('Aprende velocidade por bairro e permanência por tipo de parada com as rotas concluídas '
+            'e refaz as previsões de chegada de todas as filas abertas.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, default=eta.DIAS_TREINO, help='Janela de histórico usada no treino')
+        parser.add_argument('--so-recalcular', action='store_true', help='Não treina: só refaz as previsões com os perfis atuais')
+
+    def handle(self, *args, **options):
+        if options['dias'] < 1:
+            raise CommandError("--dias precisa ser positivo.")
+
+        if not options['so_recalcular']:
+            resumo = eta.treinar(options['dias'])
+            self.stdout.write(
+                f"{resumo['pares']} trechos analisados: {resumo['permanencias']} perfil(is) de permanência, "
+                f"{resumo['regioes']} de velocidade."
+            )
+
+        def progresso(feitos, total):
+            self.stdout.write(f"  {feitos}/{total} motoboys...")
+
+        alteradas = eta.recalcular_todos(progresso if options['verbosity'] > 1 else None)
+        self.stdout.write(self.style.SUCCESS(f"Previsões recalculadas: {alteradas} parada(s) alterada(s)."))
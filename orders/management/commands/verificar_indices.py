@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from faker import Faker
+
+from orders.indices import atualizar_estatisticas, verificar
+from orders.seeding import gerar_massa
+
+
+class Command(BaseCommand):
+    help = 'Confere por EXPLAIN se as consultas quentes usam os índices desenhados para elas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--os', type=int, default=1_000_000, help='Tamanho da massa gerada no banco de teste')
+        parser.add_argument('--motoboys', type=int, default=500)
+        parser.add_argument('--empresas', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--banco-atual', action='store_true',
+                            help='Não gera massa: confere direto no banco configurado (ex: réplica de produção)')
+        parser.add_argument('--planos', action='store_true', help='Mostra o plano completo de cada consulta')
+
+    def handle(self, *args, **options):
+        def progresso(r):
+            if r['usado']:
+                marca = self.style.SUCCESS('OK    ')
+            elif r['exigido']:
+                marca = self.style.ERROR('FALHOU')
+            else:
+                marca = self.style.WARNING('N/A   ')  # Sem suporte neste banco (ver SO_POSTGRESQL)
+            self.stdout.write(f"{marca} {r['consulta']:<32} {r['indice']}")
+            if options['planos'] or (r['exigido'] and not r['usado']):
+                self.stdout.write('    ' + r['plano'].replace('\n', '\n    '))
+
+        if options['banco_atual']:
+            atualizar_estatisticas()
+            resultados = verificar(progresso)
+        else:
+            nome_original = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                self.stdout.write(f"Gerando {options['os']} OS no banco de teste...")
+                fake = Faker('pt_BR')
+                Faker.seed(options['seed'])
+                gerar_massa(
+                    options['os'], fake, seed=options['seed'],
+                    motoboys=options['motoboys'], empresas=options['empresas'],
+                )
+                atualizar_estatisticas()
+                resultados = verificar(progresso)
+            finally:
+                connection.creation.destroy_test_db(nome_original, verbosity=0)
+
+        falhas = [r['consulta'] for r in resultados if r['exigido'] and not r['usado']]
+        if falhas:
+            raise CommandError(f"{len(falhas)} consulta(s) sem o índice esperado: {', '.join(falhas)}")
+        self.stdout.write(self.style.SUCCESS(f'{len(resultados)} consultas usando os índices esperados.'))
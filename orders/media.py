@@ -0,0 +1,221 @@
+# orders/media.py
+"""
+Fotos de comprovante, evidências de ocorrência e assinaturas: upload rápido, otimização depois.
+
+No request o arquivo só é gravado como veio (o upload grande já está num temporário do
+Django; o storage local só move o arquivo), antes da transação da view (`Brutos`), e fica
+registrado num PendingMedia, com uma tarefa 'otimizar_midia' na fila do banco
+(orders/jobs.py, `manage.py processar_tarefas`):
+  1. Corrige a orientação pela EXIF e descarta a EXIF (GPS, aparelho...).
+  2. Reduz para no máximo LADO_MAXIMO px e recomprime em WebP (JPEG se o Pillow não tiver WebP).
+  3. Gera a miniatura usada no modal do despacho e na tela de detalhes da OS.
+  4. Troca o arquivo no registro (só se ainda for o mesmo bruto) e apaga o original.
+
+Falha temporária volta para a fila com espera crescente (até MAX_TENTATIVAS, contadas no
+PendingMedia); arquivo que não é imagem (ou é grande demais para abrir) falha de vez. `manage.py processar_midias` reprocessa o que ficou para trás passando pela
+mesma fila: a chave da tarefa e a reserva do worker impedem que uma mídia seja otimizada duas vezes.
+"""
+import io
+import logging
+import os
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+from . import jobs
+from .models import BackgroundJob, PendingMedia
+
+logger = logging.getLogger(__name__)
+
+LADO_MAXIMO = 1600
+LADO_MINIATURA = 320
+QUALIDADE = 80
+MAX_TENTATIVAS = 3
+
+# (modelo, campo) -> campo da miniatura (None = só otimiza, ex: assinatura)
+CAMPOS = {
+    ('orders.OSDestination', 'proof_photo'): 'proof_photo_miniatura',
+    ('orders.OSDestination', 'receiver_signature'): None,
+    ('orders.Occurrence', 'evidencia_foto'): 'evidencia_foto_miniatura',
+}
+
+FORMATO = 'WEBP' if features.check('webp') else 'JPEG'
+EXTENSAO = '.webp' if FORMATO == 'WEBP' else '.jpg'
+
+
+# ==========================================================
+# 1. RECEBIMENTO (no request)
+# ==========================================================
+
+class Brutos:
+    """
+    Grava os uploads de um modelo antes da transação da view, para o SELECT ... FOR UPDATE não
+    ficar esperando o disco. A view pega o nome gravado com `usar(campo)` e atribui ao campo.
+    Se o bloco levantar exceção (rollback) apaga todos; se terminar bem, apaga os não usados.
+
+        with media.Brutos('orders.Occurrence', evidencia_foto=arquivo) as brutos, transaction.atomic():
+            ocorrencia.evidencia_foto = brutos.usar('evidencia_foto')
+    """
+
+    def __init__(self, modelo, **arquivos):
+        self._campos = {}
+        self._gravados = {}
+        self._usados = set()
+        Model = apps.get_model(modelo)
+        for campo, arquivo in arquivos.items():
+            if (modelo, campo) not in CAMPOS:
+                raise ValueError(f"Campo de mídia não registrado: {modelo}.{campo}")
+            if arquivo:
+                self._campos[campo] = (Model._meta.get_field(campo), arquivo)
+
+    def __enter__(self):
+        try:
+            for campo, (field, arquivo) in self._campos.items():
+                nome = field.generate_filename(None, arquivo.name)
+                self._gravados[campo] = (field.storage, field.storage.save(nome, arquivo, max_length=field.max_length))
+        except BaseException:
+            self._apagar(self._gravados)
+            raise
+        return self
+
+    def usar(self, campo):
+        """ Nome do arquivo gravado para atribuir ao campo (None se não veio upload) """
+        if campo not in self._gravados:
+            return None
+        self._usados.add(campo)
+        return self._gravados[campo][1]
+
+    def __exit__(self, tipo, erro, tb):
+        if tipo is not None:
+            self._apagar(self._gravados)
+        else:
+            self._apagar({campo: v for campo, v in self._gravados.items() if campo not in self._usados})
+        return False
+
+    @staticmethod
+    def _apagar(gravados):
+        for storage, nome in gravados.values():
+            try:
+                storage.delete(nome)
+            except OSError:
+                logger.exception("Falha ao apagar o upload %s", nome)
+
+
+def receber(instancia, campo):
+    """ Chamar depois de gravar o arquivo bruto no campo. A otimização roda na fila de tarefas. """
+    modelo = instancia._meta.label
+    if (modelo, campo) not in CAMPOS:
+        raise ValueError(f"Campo de mídia não registrado: {modelo}.{campo}")
+    if not getattr(instancia, campo):
+        return None
+    pendente = PendingMedia.objects.create(modelo=modelo, objeto_id=instancia.pk, campo=campo)
+    _agendar(pendente)
+    return pendente
+
+
+def _agendar(pendente):
+    """ Uma tarefa por PendingMedia (a chave devolve a que já está na fila ou rodando) """
+    return jobs.enfileirar(
+        'otimizar_midia', chave=f'midia:{pendente.id}', max_tentativas=MAX_TENTATIVAS, pendente_id=pendente.id,
+    )
+
+
+# ==========================================================
+# 2. PROCESSAMENTO (fila de tarefas / comando)
+# ==========================================================
+
+def _salvar(imagem, **opcoes):
+    buffer = io.BytesIO()
+    if FORMATO == 'JPEG' and imagem.mode != 'RGB':
+        imagem = imagem.convert('RGB')
+    # Sem passar exif=..., o Pillow grava a imagem nova sem nenhum metadado
+    imagem.save(buffer, FORMATO, quality=QUALIDADE, **opcoes)
+    return buffer.getvalue()
+
+
+def otimizar(arquivo, com_miniatura=True):
+    """ Arquivo aberto (bytes) -> (imagem otimizada, miniatura ou None), já sem EXIF """
+    with Image.open(arquivo) as original:
+        imagem = ImageOps.exif_transpose(original)
+        if imagem.mode not in ('RGB', 'RGBA'):
+            imagem = imagem.convert('RGBA' if 'A' in imagem.getbands() or 'transparency' in imagem.info else 'RGB')
+        imagem.thumbnail((LADO_MAXIMO, LADO_MAXIMO))
+        otimizada = _salvar(imagem)
+        miniatura = None
+        if com_miniatura:
+            imagem.thumbnail((LADO_MINIATURA, LADO_MINIATURA))
+            miniatura = _salvar(imagem)
+    return otimizada, miniatura
+
+
+def processar(pendente):
+    """ Otimiza um PendingMedia. Levanta exceção se falhar (quem chama registra a tentativa). """
+    Model = apps.get_model(pendente.modelo)
+    campo_miniatura = CAMPOS[(pendente.modelo, pendente.campo)]
+    obj = Model.objects.filter(pk=pendente.objeto_id).first()
+    arquivo = getattr(obj, pendente.campo) if obj else None
+    if not arquivo:
+        return False  # Registro apagado ou foto removida nesse meio tempo
+
+    nome_bruto = arquivo.name
+    with arquivo.open('rb') as bruto:
+        otimizada, miniatura = otimizar(bruto, com_miniatura=campo_miniatura is not None)
+
+    storage = arquivo.storage
+    base = os.path.splitext(os.path.basename(nome_bruto))[0]
+    pasta = os.path.dirname(nome_bruto)
+    novos = {pendente.campo: storage.save(f"{pasta}/{base}{EXTENSAO}", ContentFile(otimizada))}
+    if campo_miniatura:
+        destino = Model._meta.get_field(campo_miniatura).generate_filename(obj, f"{base}{EXTENSAO}")
+        novos[campo_miniatura] = storage.save(destino, ContentFile(miniatura))
+
+    # UPDATE condicional: se chegou outra foto enquanto processávamos, a nossa versão é descartada
+    if not Model.objects.filter(pk=obj.pk, **{pendente.campo: nome_bruto}).update(**novos):
+        for nome in novos.values():
+            storage.delete(nome)
+        return False
+    storage.delete(nome_bruto)
+    anterior = getattr(obj, campo_miniatura).name if campo_miniatura else None
+    if anterior and anterior != novos[campo_miniatura]:
+        storage.delete(anterior)  # Miniatura de uma foto anterior
+    return True
+
+
+@jobs.tarefa('otimizar_midia', atomica=False)
+def _tarefa_otimizar(usuario, pendente_id):
+    pendente = PendingMedia.objects.filter(id=pendente_id).first()
+    if pendente is None:
+        return {'otimizada': False}  # Já processada (ex: pelo comando)
+    try:
+        otimizada = processar(pendente)
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        # Não é imagem (ou é grande demais): tentar de novo não muda nada. O bruto fica como veio
+        # e o PendingMedia sai do `processar_midias`; ValueError = falha final na fila
+        PendingMedia.objects.filter(id=pendente.id).update(tentativas=MAX_TENTATIVAS, erro=str(e)[:500])
+        raise ValueError(f"Arquivo de imagem inválido: {e}") from e
+    except Exception as e:
+        # Registra a tentativa e devolve a exceção para a fila agendar a próxima
+        PendingMedia.objects.filter(id=pendente.id).update(tentativas=pendente.tentativas + 1, erro=str(e)[:500])
+        raise
+    pendente.delete()
+    return {'otimizada': otimizada}
+
+
+def processar_pendentes(progresso=None):
+    """
+    Reprocessa o que ficou para trás (tarefa que sumiu da fila, falha temporária). Retorna (ok, falhas).
+    Cada mídia passa pela tarefa dela: se um worker já a reservou, não é processada de novo.
+    """
+    ok = falhas = 0
+    for pendente in PendingMedia.objects.filter(tentativas__lt=MAX_TENTATIVAS).order_by('id'):
+        job = _agendar(pendente)
+        jobs.processar(job.id)
+        job.refresh_from_db()
+        if job.status == BackgroundJob.Status.CONCLUIDA:
+            ok += 1
+        elif job.status != BackgroundJob.Status.EXECUTANDO:
+            falhas += 1
+        if progresso:
+            progresso(ok, falhas)
+    return ok, falhas
@@ -0,0 +1,114 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def _to_float(valor):
+    try:
+        return float(str(valor).replace(',', '.'))
+    except (TypeError, ValueError):
+        return None
+
+
+def copiar_geo_legado(apps, schema_editor):
+    """ Aproveita as coordenadas que já existiam como texto (geo_pickup_* / geo_delivery_*) """
+    ServiceOrder = apps.get_model('orders', 'ServiceOrder')
+    OSDestination = apps.get_model('orders', 'OSDestination')
+
+    lote = []
+    for os_obj in ServiceOrder.objects.exclude(geo_pickup_lat='').only('id', 'geo_pickup_lat', 'geo_pickup_lng').iterator():
+        lat, lng = _to_float(os_obj.geo_pickup_lat), _to_float(os_obj.geo_pickup_lng)
+        if lat is not None and lng is not None:
+            os_obj.origin_lat, os_obj.origin_lng = lat, lng
+            lote.append(os_obj)
+    ServiceOrder.objects.bulk_update(lote, ['origin_lat', 'origin_lng'], batch_size=1000)
+
+    lote = []
+    for dest in OSDestination.objects.exclude(geo_delivery_lat='').only('id', 'geo_delivery_lat', 'geo_delivery_lng').iterator():
+        lat, lng = _to_float(dest.geo_delivery_lat), _to_float(dest.geo_delivery_lng)
+        if lat is not None and lng is not None:
+            dest.destination_lat, dest.destination_lng = lat, lng
+            lote.append(dest)
+    OSDestination.objects.bulk_update(lote, ['destination_lat', 'destination_lng'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0002_alter_motoboyprofile_category'),
+        ('orders', '0008_alter_dispatcherdecision_acao'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CepLocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cep', models.CharField(max_length=8, unique=True, verbose_name='CEP (só dígitos)')),
+                ('street', models.CharField(blank=True, max_length=255, verbose_name='Logradouro')),
+                ('district', models.CharField(blank=True, max_length=100, verbose_name='Bairro')),
+                ('city', models.CharField(max_length=100, verbose_name='Cidade')),
+                ('state', models.CharField(blank=True, max_length=2, verbose_name='UF')),
+                ('street_norm', models.CharField(blank=True, editable=False, max_length=255)),
+                ('city_norm', models.CharField(editable=False, max_length=100)),
+                ('lat', models.FloatField()),
+                ('lng', models.FloatField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='GeocodeCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chave', models.CharField(help_text='SHA1 do endereço normalizado', max_length=40, unique=True)),
+                ('endereco', models.CharField(max_length=400)),
+                ('lat', models.FloatField(blank=True, null=True)),
+                ('lng', models.FloatField(blank=True, null=True)),
+                ('fonte', models.CharField(choices=[('CEP', 'CEP'), ('RUA', 'Logradouro + Cidade'), ('NAO_ENCONTRADO', 'Não encontrado')], max_length=20)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='osdestination',
+            name='destination_lat',
+            field=models.FloatField(blank=True, null=True, verbose_name='Latitude (Destino)'),
+        ),
+        migrations.AddField(
+            model_name='osdestination',
+            name='destination_lng',
+            field=models.FloatField(blank=True, null=True, verbose_name='Longitude (Destino)'),
+        ),
+        migrations.AddField(
+            model_name='serviceorder',
+            name='origin_lat',
+            field=models.FloatField(blank=True, null=True, verbose_name='Latitude (Coleta)'),
+        ),
+        migrations.AddField(
+            model_name='serviceorder',
+            name='origin_lng',
+            field=models.FloatField(blank=True, null=True, verbose_name='Longitude (Coleta)'),
+        ),
+        migrations.AlterField(
+            model_name='serviceorder',
+            name='status',
+            field=models.CharField(choices=[('PENDENTE', 'Pendente'), ('AGRUPADO', 'Agrupado'), ('ACEITO', 'OS com o Motoboy'), ('COLETADO', 'Coletado / Em Trânsito'), ('ENTREGUE', 'Entregue'), ('CANCELADO', 'Cancelado'), ('OCORRENCIA', 'Ocorrência / Problema')], default='PENDENTE', max_length=20, verbose_name='Status Atual'),
+        ),
+        migrations.AddIndex(
+            model_name='osdestination',
+            index=models.Index(fields=['destination_lat', 'destination_lng'], name='dest_geo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(fields=['origin_lat', 'origin_lng'], name='os_origin_geo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ceplocation',
+            index=models.Index(fields=['city_norm', 'street_norm'], name='cep_city_street_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ceplocation',
+            index=models.Index(fields=['lat', 'lng'], name='cep_geo_idx'),
+        ),
+        migrations.RunPython(copiar_geo_legado, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def popular_kpis(apps, schema_editor):
+    """ Carga inicial dos contadores (o mesmo que `manage.py recalcular_kpis`) """
+    ServiceOrder = apps.get_model('orders', 'ServiceOrder')
+    DailyOrderStats = apps.get_model('orders', 'DailyOrderStats')
+    CompanyOrderStats = apps.get_model('orders', 'CompanyOrderStats')
+    MotoboyOrderStats = apps.get_model('orders', 'MotoboyOrderStats')
+
+    base = ServiceOrder.objects.order_by()
+    DailyOrderStats.objects.bulk_create([
+        DailyOrderStats(day=l['dia'], status=l['status'], total=l['n'])
+        for l in base.values('status', dia=TruncDate('created_at')).annotate(n=Count('id'))
+    ])
+    CompanyOrderStats.objects.bulk_create([
+        CompanyOrderStats(client_id=l['client_id'], status=l['status'], total=l['n'])
+        for l in base.values('client_id', 'status').annotate(n=Count('id'))
+    ])
+    MotoboyOrderStats.objects.bulk_create([
+        MotoboyOrderStats(motoboy_id=l['motoboy_id'], status=l['status'], total=l['n'])
+        for l in base.filter(motoboy__isnull=False).values('motoboy_id', 'status').annotate(n=Count('id'))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0003_presence'),
+        ('orders', '0009_geocoding'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyOrderStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='Dia de criação da OS')),
+                ('status', models.CharField(choices=[('PENDENTE', 'Pendente'), ('AGRUPADO', 'Agrupado'), ('ACEITO', 'OS com o Motoboy'), ('COLETADO', 'Coletado / Em Trânsito'), ('ENTREGUE', 'Entregue'), ('CANCELADO', 'Cancelado'), ('OCORRENCIA', 'Ocorrência / Problema')], max_length=20)),
+                ('total', models.IntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'status'), name='uniq_daily_stats')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CompanyOrderStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDENTE', 'Pendente'), ('AGRUPADO', 'Agrupado'), ('ACEITO', 'OS com o Motoboy'), ('COLETADO', 'Coletado / Em Trânsito'), ('ENTREGUE', 'Entregue'), ('CANCELADO', 'Cancelado'), ('OCORRENCIA', 'Ocorrência / Problema')], max_length=20)),
+                ('total', models.IntegerField(default=0)),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('client', 'status'), name='uniq_company_stats')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MotoboyOrderStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDENTE', 'Pendente'), ('AGRUPADO', 'Agrupado'), ('ACEITO', 'OS com o Motoboy'), ('COLETADO', 'Coletado / Em Trânsito'), ('ENTREGUE', 'Entregue'), ('CANCELADO', 'Cancelado'), ('OCORRENCIA', 'Ocorrência / Problema')], max_length=20)),
+                ('total', models.IntegerField(default=0)),
+                ('motoboy', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_stats', to='logistics.motoboyprofile')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('motoboy', 'status'), name='uniq_motoboy_stats')],
+            },
+        ),
+        migrations.RunPython(popular_kpis, migrations.RunPython.noop),
+    ]
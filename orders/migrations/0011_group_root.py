@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:05
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def popular_grupos(apps, schema_editor):
+    """
+    group_root_id = mãe do grupo. Mesclas antigas podiam deixar "netas" (mescla de uma OS
+    que já era mãe); aqui elas sobem para a mãe do topo, como o resgate já fazia.
+    """
+    ServiceOrder = apps.get_model('orders', 'ServiceOrder')
+    ServiceOrder.objects.filter(parent_os__isnull=True).update(group_root_id=F('id'))
+
+    maes = dict(ServiceOrder.objects.filter(parent_os__isnull=False).values_list('id', 'parent_os_id'))
+    por_raiz = {}
+    for os_id in maes:
+        raiz, vistos = maes[os_id], {os_id}
+        while raiz in maes and raiz not in vistos:
+            vistos.add(raiz)
+            raiz = maes[raiz]
+        por_raiz.setdefault(raiz, []).append(os_id)
+    for raiz, ids in por_raiz.items():
+        ServiceOrder.objects.filter(id__in=ids).update(parent_os_id=raiz, group_root_id=raiz)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_kpis'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serviceorder',
+            name='group_root_id',
+            field=models.BigIntegerField(blank=True, db_index=True, editable=False, null=True, verbose_name='Grupo (OS Mãe)'),
+        ),
+        migrations.RunPython(popular_grupos, migrations.RunPython.noop),
+    ]
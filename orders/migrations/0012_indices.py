@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0003_presence'),
+        ('orders', '0011_group_root'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='occurrence',
+            index=models.Index(condition=models.Q(('resolvida', False)), fields=['-urgencia', '-criado_em'], name='ocorrencia_aberta_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='routestop',
+            index=models.Index(condition=models.Q(('is_completed', False)), fields=['motoboy', 'sequence'], name='parada_aberta_motoboy_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='routestop',
+            index=models.Index(fields=['service_order', 'stop_type', 'is_completed'], name='parada_os_tipo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='routestop',
+            index=models.Index(condition=models.Q(('is_completed', True)), fields=['motoboy', 'completed_at'], name='parada_concluida_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(condition=models.Q(('status__in', ['PENDENTE', 'OCORRENCIA'])), fields=['-priority', 'created_at'], name='os_fila_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(fields=['status', 'priority', 'created_at'], name='os_status_prio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(fields=['client', 'status'], name='os_empresa_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(fields=['client', '-created_at'], name='os_empresa_recentes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(fields=['motoboy', 'status', '-created_at'], name='os_motoboy_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(fields=['-created_at'], name='os_criacao_idx'),
+        ),
+    ]
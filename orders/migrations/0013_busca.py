@@ -0,0 +1,100 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+TABELA = 'orders_ordersearchdocument'
+TABELA_FTS = 'orders_busca_fts'
+
+POSTGRESQL = [
+    ("CREATE EXTENSION IF NOT EXISTS pg_trgm", None),
+    (f"ALTER TABLE {TABELA} ADD COLUMN vetor tsvector "
+     f"GENERATED ALWAYS AS (to_tsvector('simple', documento)) STORED",
+     f"ALTER TABLE {TABELA} DROP COLUMN vetor"),
+    (f"CREATE INDEX busca_vetor_idx ON {TABELA} USING gin (vetor)", "DROP INDEX busca_vetor_idx"),
+    (f"CREATE INDEX busca_trgm_idx ON {TABELA} USING gin (documento gin_trgm_ops)", "DROP INDEX busca_trgm_idx"),
+]
+
+# Tabela FTS5 de "conteúdo externo": guarda só o índice, o texto fica em orders_ordersearchdocument
+SQLITE = [
+    (f"CREATE VIRTUAL TABLE {TABELA_FTS} USING fts5("
+     f"documento, content='{TABELA}', content_rowid='order_id', tokenize='unicode61 remove_diacritics 2')",
+     f"DROP TABLE {TABELA_FTS}"),
+    (f"CREATE TRIGGER busca_fts_ai AFTER INSERT ON {TABELA} BEGIN "
+     f"INSERT INTO {TABELA_FTS}(rowid, documento) VALUES (new.order_id, new.documento); END",
+     "DROP TRIGGER busca_fts_ai"),
+    (f"CREATE TRIGGER busca_fts_ad AFTER DELETE ON {TABELA} BEGIN "
+     f"INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, documento) VALUES ('delete', old.order_id, old.documento); END",
+     "DROP TRIGGER busca_fts_ad"),
+    (f"CREATE TRIGGER busca_fts_au AFTER UPDATE ON {TABELA} BEGIN "
+     f"INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, documento) VALUES ('delete', old.order_id, old.documento); "
+     f"INSERT INTO {TABELA_FTS}(rowid, documento) VALUES (new.order_id, new.documento); END",
+     "DROP TRIGGER busca_fts_au"),
+]
+
+
+def _comandos(schema_editor):
+    return POSTGRESQL if schema_editor.connection.vendor == 'postgresql' else SQLITE
+
+
+def criar_indice_busca(apps, schema_editor):
+    """ Colunas/índices específicos de cada banco (o model só tem o texto) """
+    for criar, _ in _comandos(schema_editor):
+        schema_editor.execute(criar)
+
+
+def remover_indice_busca(apps, schema_editor):
+    for _, remover in reversed(_comandos(schema_editor)):
+        if remover:
+            schema_editor.execute(remover)
+
+
+def popular_busca(apps, schema_editor):
+    """ Carga inicial dos documentos (o mesmo que `manage.py reindexar_busca`) """
+    from orders.geocoding import normalizar, so_digitos
+    from orders.search import CAMPOS_OS, CAMPOS_DESTINO, CAMPOS_ITEM, CAMPOS_DIGITOS, LOTE_REINDEXAR
+    ServiceOrder = apps.get_model('orders', 'ServiceOrder')
+    OSDestination = apps.get_model('orders', 'OSDestination')
+    OSItem = apps.get_model('orders', 'OSItem')
+    OrderSearchDocument = apps.get_model('orders', 'OrderSearchDocument')
+
+    def textos(linha, campos):
+        for campo in campos:
+            if linha.get(campo):
+                yield str(linha[campo])
+                if campo in CAMPOS_DIGITOS:
+                    yield so_digitos(linha[campo])
+
+    ultimo = 0
+    while True:
+        linhas = list(ServiceOrder.objects.filter(id__gt=ultimo).order_by('id').values('id', *CAMPOS_OS)[:LOTE_REINDEXAR])
+        if not linhas:
+            break
+        partes = {l['id']: [str(l['id']), *textos(l, CAMPOS_OS)] for l in linhas}
+        for model, campos in ((OSDestination, CAMPOS_DESTINO), (OSItem, CAMPOS_ITEM)):
+            for l in model.objects.filter(order_id__in=list(partes)).order_by('id').values('order_id', *campos):
+                partes[l['order_id']].extend(textos(l, campos))
+        OrderSearchDocument.objects.bulk_create([
+            OrderSearchDocument(order_id=os_id, documento=normalizar(' '.join(t))) for os_id, t in partes.items()
+        ])
+        ultimo = linhas[-1]['id']
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0012_indices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderSearchDocument',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='orders.serviceorder')),
+                ('documento', models.TextField(verbose_name='Texto normalizado (sem acento, minúsculo)')),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(criar_indice_busca, remover_indice_busca),
+        migrations.RunPython(popular_busca, migrations.RunPython.noop),
+    ]
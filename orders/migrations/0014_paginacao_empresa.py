@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0003_presence'),
+        ('orders', '0013_busca'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='serviceorder',
+            name='os_empresa_recentes_idx',
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(fields=['client', '-created_at', '-id'], name='os_empresa_recentes_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceorder',
+            index=models.Index(condition=models.Q(('status__in', ['ENTREGUE', 'CANCELADO']), _negated=True), fields=['client', '-created_at', '-id'], name='os_empresa_abertas_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0014_paginacao_empresa'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderExport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=20)),
+                ('formato', models.CharField(max_length=5)),
+                ('inicio', models.DateField()),
+                ('fim', models.DateField()),
+                ('status', models.CharField(choices=[('PENDENTE', 'Na fila'), ('GERANDO', 'Gerando'), ('PRONTO', 'Pronto'), ('ERRO', 'Erro')], default='PENDENTE', max_length=10)),
+                ('arquivo', models.FileField(blank=True, upload_to='exports/')),
+                ('linhas', models.PositiveIntegerField(default=0)),
+                ('erro', models.TextField(blank=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+                ('client', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('solicitante', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exportacoes', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
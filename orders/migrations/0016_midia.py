@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0015_exportacoes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingMedia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelo', models.CharField(help_text='app_label.Model, ex: orders.OSDestination', max_length=50)),
+                ('objeto_id', models.BigIntegerField()),
+                ('campo', models.CharField(max_length=50)),
+                ('tentativas', models.PositiveSmallIntegerField(default=0)),
+                ('erro', models.TextField(blank=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='occurrence',
+            name='evidencia_foto_miniatura',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='ocorrencias/miniaturas/'),
+        ),
+        migrations.AddField(
+            model_name='osdestination',
+            name='proof_photo_miniatura',
+            field=models.ImageField(blank=True, editable=False, null=True, upload_to='proofs/miniaturas/'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:10
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0016_midia'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BackgroundJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=50)),
+                ('parametros', models.JSONField(blank=True, default=dict)),
+                ('chave', models.CharField(blank=True, max_length=150, null=True, unique=True)),
+                ('status', models.CharField(choices=[('PENDENTE', 'Na fila'), ('EXECUTANDO', 'Executando'), ('CONCLUIDA', 'Concluída'), ('ERRO', 'Erro')], default='PENDENTE', max_length=10)),
+                ('tentativas', models.PositiveSmallIntegerField(default=0)),
+                ('max_tentativas', models.PositiveSmallIntegerField(default=3)),
+                ('executar_em', models.DateTimeField(default=django.utils.timezone.now, help_text='Próxima tentativa (backoff entre falhas)')),
+                ('resultado', models.JSONField(blank=True, null=True)),
+                ('erro', models.TextField(blank=True)),
+                ('criada_em', models.DateTimeField(auto_now_add=True)),
+                ('iniciada_em', models.DateTimeField(blank=True, null=True)),
+                ('concluida_em', models.DateTimeField(blank=True, null=True)),
+                ('solicitante', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='tarefas', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(condition=models.Q(('status', 'PENDENTE')), fields=['executar_em', 'id'], name='tarefa_fila_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0017_tarefas'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='routestop',
+            name='eta',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Previsão de Chegada'),
+        ),
+        migrations.CreateModel(
+            name='EtaProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('VELOCIDADE', 'Velocidade média (km/h)'), ('PERMANENCIA', 'Permanência na parada (min)')], max_length=12)),
+                ('chave', models.CharField(blank=True, max_length=220)),
+                ('valor', models.FloatField()),
+                ('amostras', models.PositiveIntegerField(default=0)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('tipo', 'chave'), name='uniq_eta_profile')],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:05
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logistics', '0003_presence'),
+        ('orders', '0018_previsao_chegada'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(help_text='Mesmo id da OS original', primary_key=True, serialize=False)),
+                ('os_number', models.CharField(max_length=20, unique=True, verbose_name='Número da OS')),
+                ('group_root_id', models.BigIntegerField(db_index=True, verbose_name='Grupo (OS Mãe)')),
+                ('status', models.CharField(choices=[('PENDENTE', 'Pendente'), ('AGRUPADO', 'Agrupado'), ('ACEITO', 'OS com o Motoboy'), ('COLETADO', 'Coletado / Em Trânsito'), ('ENTREGUE', 'Entregue'), ('CANCELADO', 'Cancelado'), ('OCORRENCIA', 'Ocorrência / Problema')], max_length=20, verbose_name='Status Final')),
+                ('created_at', models.DateTimeField(verbose_name='Data de Criação')),
+                ('arquivada_em', models.DateTimeField(auto_now_add=True)),
+                ('dados', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, help_text="serializers.serialize('python', ...) da OS e dos registros dela")),
+                ('client', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Empresa Solicitante')),
+                ('motoboy', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='logistics.motoboyprofile', verbose_name='Motoboy Responsável')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at', 'id'], name='arquivo_periodo_idx'), models.Index(fields=['client', 'created_at', 'id'], name='arquivo_empresa_idx')],
+            },
+        ),
+    ]
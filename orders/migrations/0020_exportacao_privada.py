@@ -0,0 +1,34 @@
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+import orders.models
+
+
+def mover_para_storage_privado(apps, schema_editor):
+    """ Arquivos já gerados em MEDIA_ROOT/exports/ passam para o storage privado (e saem da mídia pública) """
+    OrderExport = apps.get_model('orders', 'OrderExport')
+    privado = orders.models._storage_exportacoes()
+    for exportacao in OrderExport.objects.exclude(arquivo=''):
+        antigo = exportacao.arquivo.name
+        if not default_storage.exists(antigo):
+            continue
+        with default_storage.open(antigo, 'rb') as conteudo:
+            exportacao.arquivo.name = privado.save(orders.models._caminho_exportacao(exportacao, antigo.rsplit('/', 1)[-1]), conteudo)
+        exportacao.save(update_fields=['arquivo'])
+        default_storage.delete(antigo)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0019_arquivo'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderexport',
+            name='arquivo',
+            field=models.FileField(blank=True, storage=orders.models._storage_exportacoes, upload_to=orders.models._caminho_exportacao),
+        ),
+        migrations.RunPython(mover_para_storage_privado, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:02
+
+import orders.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0021_eventos_painel'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedorder',
+            name='dados',
+            field=models.JSONField(encoder=orders.models.RetratoEncoder, help_text="serializers.serialize('python', ...) da OS e dos registros dela"),
+        ),
+    ]
@@ -1,11 +1,117 @@
 from django.db import models, transaction
 from django.conf import settings
 from django.core.exceptions import ValidationError
+from django.core.files.storage import FileSystemStorage
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from logistics.models import MotoboyProfile
+import datetime
+import secrets
 import uuid
 
 
+def _invalidar_rotas(*motoboy_ids):
+    # Tela "Minhas Entregas" e carga do baú ficam em cache por motoboy (orders/driver_view.py, orders/capacity.py)
+    from .capacity import invalidar_carga
+    from .driver_view import invalidar_rota_motoboy
+    ids = [mid for mid in motoboy_ids if isinstance(mid, int)]
+    invalidar_rota_motoboy(*ids)
+    invalidar_carga(*ids)
+
+
+# Gravados pelo recálculo de ETA (orders/eta.py); não entram na tela do motoboy nem nos KPIs
+CAMPOS_PREVISAO = {'expected_pickup', 'expected_delivery'}
+
+
+def _id_motoboy(valores):
+    """ Novo motoboy num update(motoboy=...) / update(motoboy_id=...) """
+    valor = valores.get('motoboy', valores.get('motoboy_id'))
+    return getattr(valor, 'pk', valor)
+
+
+def _reindexar_busca(*os_ids):
+    # Documento de busca da OS (orders/search.py), refeito depois do commit
+    from .search import agendar
+    agendar(*os_ids)
+
+
+def _recalcular_eta(*motoboy_ids):
+    # Previsões de chegada da fila do motoboy (orders/eta.py), refeitas depois do commit
+    from .eta import agendar
+    agendar(*(mid for mid in motoboy_ids if isinstance(mid, int)))
+
+
+def _esquecer_grupos():
+    # Mapa de grupos do request (orders/groups.py) fica velho quando parent_os muda
+    from .groups import esquecer
+    esquecer()
+
+
+class ServiceOrderQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        # O save() não roda no bulk_create: numeramos aqui, antes do INSERT
+        from .numbering import numerar
+        from . import kpis
+        objs = list(objs)
+        numerar(objs)
+        for obj in objs:
+            obj.group_root_id = obj.parent_os_id or obj.pk
+        resultado = super().bulk_create(objs, *args, **kwargs)
+        kpis.registrar_criacao(objs)
+        _reindexar_busca(*(obj.pk for obj in objs))
+        return resultado
+
+    def fila_despacho(self):
+        """ Coluna "Aguardando" do painel: PENDENTE ou OCORRENCIA sem motoboy, na ordem da tela """
+        return self.filter(
+            models.Q(status='PENDENTE') | models.Q(status='OCORRENCIA', motoboy__isnull=True)
+        ).order_by('-priority', 'created_at')
+
+    def motoboys_afetados(self):
+        """ Motoboys das OS e de qualquer parada delas (a parada pode estar com outro motoboy) """
+        ids = set(self.values_list('motoboy_id', flat=True).order_by().distinct())
+        ids.update(
+            RouteStop.objects.filter(service_order__in=self.values('id'))
+            .values_list('motoboy_id', flat=True).order_by().distinct()
+        )
+        return ids
+
+    def update(self, **kwargs):
+        from . import kpis
+        if 'parent_os' in kwargs or 'parent_os_id' in kwargs:
+            # Mantém o grupo denormalizado: a nova mãe, ou a própria OS se saiu do grupo
+            mae = kwargs.get('parent_os', kwargs.get('parent_os_id'))
+            mae = getattr(mae, 'pk', mae)
+            kwargs['group_root_id'] = models.F('id') if mae is None else mae
+            _esquecer_grupos()
+        from .search import CAMPOS_OS
+        # Previsões (orders/eta.py) não aparecem na tela do motoboy nem mexem em KPI: nenhuma query extra
+        so_previsao = set(kwargs) <= CAMPOS_PREVISAO
+        # Uma contagem agrupada ANTES do update (o filtro pode deixar de casar depois, ex: status)
+        # serve aos KPIs e às telas: o motoboy de cada OS já vem na chave (dia, empresa, motoboy, status).
+        # Paradas com outro motoboy se invalidam pelas próprias escritas (RouteStopQuerySet).
+        antes = None if so_previsao else kpis.agrupar(self)
+        reindexar = list(self.values_list('id', flat=True)) if set(CAMPOS_OS) & set(kwargs) else []
+        linhas = super().update(**kwargs)
+        if antes is not None:
+            _invalidar_rotas(*{motoboy_id for _dia, _cliente, motoboy_id, _status in antes}, _id_motoboy(kwargs))
+            if kpis.afeta_kpis(kwargs):
+                kpis.registrar_update(antes, kwargs)
+        _reindexar_busca(*reindexar)
+        return linhas
+
+    def delete(self):
+        from . import kpis
+        antes = kpis.agrupar(self)
+        resultado = super().delete()
+        kpis.registrar_remocao(antes)
+        return resultado
+
+    def apagar_arquivadas(self):
+        """ Remove OS já copiadas para ArchivedOrder (orders/archive.py): elas continuam contando nos KPIs """
+        return super().delete()
+
+
 class ServiceOrder(models.Model):
     class Status(models.TextChoices):
         PENDING = 'PENDENTE', 'Pendente'
@@ -61,6 +167,9 @@ class ServiceOrder(models.Model):
     origin_zip_code = models.CharField(max_length=10, verbose_name="CEP (Coleta)")
     origin_reference = models.CharField(max_length=255, blank=True, verbose_name="Ponto de Referência (Coleta)")
     origin_notes = models.TextField(blank=True, verbose_name="Observações da Coleta") # Do Prompt Novo
+    # Coordenadas numéricas resolvidas na criação (orders/geocoding.py) - usadas por rota/ETA/proximidade
+    origin_lat = models.FloatField(null=True, blank=True, verbose_name="Latitude (Coleta)")
+    origin_lng = models.FloatField(null=True, blank=True, verbose_name="Longitude (Coleta)")
 
     expected_pickup = models.DateTimeField(null=True, blank=True, verbose_name="Previsão de Coleta")
     expected_delivery = models.DateTimeField(null=True, blank=True, verbose_name="Previsão de Entrega (Geral)")
@@ -72,18 +181,145 @@ class ServiceOrder(models.Model):
     geo_pickup_lng = models.CharField(max_length=50, blank=True, verbose_name="Geo Coleta (Lng)")
     is_multiple_delivery = models.BooleanField(default=False, editable=False) 
     parent_os = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='child_orders', help_text="Se esta OS foi mesclada dentro de outra, a 'Mãe' aparecerá aqui.")
+    # Denormalizado: id da mãe do grupo (ou o próprio id). Mantido no save/update; ver orders/groups.py
+    group_root_id = models.BigIntegerField(null=True, blank=True, editable=False, db_index=True, verbose_name="Grupo (OS Mãe)")
+
+    objects = ServiceOrderQuerySet.as_manager()
+
+    class Meta:
+        # Conferidos por EXPLAIN em `manage.py verificar_indices` (orders/indices.py)
+        indexes = [
+            # Consultas por caixa (bounding box): lat BETWEEN .. AND lng BETWEEN ..
+            models.Index(fields=['origin_lat', 'origin_lng'], name='os_origin_geo_idx'),
+            # Fila do despacho (PENDENTE / OCORRENCIA sem motoboy) já na ordem da tela
+            models.Index(
+                fields=['-priority', 'created_at'], name='os_fila_idx',
+                condition=models.Q(status__in=['PENDENTE', 'OCORRENCIA']),
+            ),
+            # Contagens e filtros por status (total de ocorrências, relatórios)
+            models.Index(fields=['status', 'priority', 'created_at'], name='os_status_prio_idx'),
+            # Painel da empresa: contagem por status e lista das mais recentes (paginação por
+            # chave em created_at, id - orders/pagination.py)
+            models.Index(fields=['client', 'status'], name='os_empresa_status_idx'),
+            models.Index(fields=['client', '-created_at', '-id'], name='os_empresa_recentes_idx'),
+            # Só as OS em aberto: a lista "Minhas OS Ativas" não atravessa o histórico encerrado
+            models.Index(
+                fields=['client', '-created_at', '-id'], name='os_empresa_abertas_idx',
+                condition=~models.Q(status__in=['ENTREGUE', 'CANCELADO']),
+            ),
+            # Histórico do motoboy (ENTREGUE/CANCELADO mais recentes)
+            models.Index(fields=['motoboy', 'status', '-created_at'], name='os_motoboy_status_idx'),
+            # "Últimas OS" do painel admin
+            models.Index(fields=['-created_at'], name='os_criacao_idx'),
+        ]
 
     def save(self, *args, **kwargs):
+        if self._state.adding and not self.os_number:
+            # id e número reservados antes do INSERT (orders/numbering.py): um único write
+            from .numbering import numerar
+            id_alocado = self.pk is None
+            numerar([self])
+            if id_alocado:
+                # Com o pk já preenchido o Django tentaria um UPDATE antes do INSERT
+                kwargs['force_insert'] = True
+        grupo = self.parent_os_id or self.pk
+        if grupo != self.group_root_id:
+            if not self._state.adding:
+                _esquecer_grupos()
+            self.group_root_id = grupo
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'group_root_id' not in update_fields:
+                kwargs['update_fields'] = [*update_fields, 'group_root_id']
+        adicionando = self._state.adding
         super().save(*args, **kwargs)
-        if not self.os_number:
-            self.os_number = f"OS-{str(self.id).zfill(4)}"
-            kwargs['force_insert'] = False
-            super().save(update_fields=['os_number'])
+        from . import kpis
+        from .search import CAMPOS_OS
+        kpis.registrar_save(self, adicionando)
+        # Status/motoboy/observações não entram na busca: só refaz se um campo indexado mudou
+        texto = tuple(getattr(self, campo) for campo in CAMPOS_OS)
+        if adicionando or texto != getattr(self, '_busca_db', None):
+            _reindexar_busca(self.pk)
+        self._busca_db = texto
+        if not adicionando:
+            # Motoboy atual e o do banco (troca): sem query, como no update()
+            _invalidar_rotas(self.motoboy_id, getattr(self, '_motoboy_id_db', None))
+        self._motoboy_id_db = self.motoboy_id
+
+    def delete(self, *args, **kwargs):
+        from . import kpis
+        afetados = ServiceOrder.objects.filter(pk=self.pk).motoboys_afetados()
+        antes = kpis.agrupar(ServiceOrder.objects.filter(pk=self.pk))
+        resultado = super().delete(*args, **kwargs)
+        _invalidar_rotas(*afetados)
+        kpis.registrar_remocao(antes)
+        return resultado
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Guardado para invalidar também a tela do motoboy anterior numa troca
+        instancia._motoboy_id_db = instancia.__dict__.get('motoboy_id')
+        # Estado do banco, para os KPIs saberem de onde a OS saiu (orders/kpis.py)
+        campos = ('created_at', 'client_id', 'motoboy_id', 'status')
+        if all(campo in instancia.__dict__ for campo in campos):
+            instancia._kpi_db = tuple(instancia.__dict__[campo] for campo in campos)
+        # Texto indexado na busca, para o save() só reindexar quando ele muda (orders/search.py)
+        from .search import CAMPOS_OS
+        if all(campo in instancia.__dict__ for campo in CAMPOS_OS):
+            instancia._busca_db = tuple(instancia.__dict__[campo] for campo in CAMPOS_OS)
+        return instancia
 
     def __str__(self):
         return f"OS {self.os_number} - {self.status}"
 
 
+def _ordens_do_queryset(queryset):
+    # OS donas das linhas (itens/destinos), para refazer o documento de busca delas
+    return list(queryset.values_list('order_id', flat=True).order_by().distinct())
+
+
+class OSItemQuerySet(models.QuerySet):
+    """ Mudança de posse/status de itens mexe na carga do baú; a descrição entra na busca da OS """
+
+    def update(self, **kwargs):
+        from .search import CAMPOS_ITEM
+        reindexar = _ordens_do_queryset(self) if set(CAMPOS_ITEM) & set(kwargs) else []
+        if not {'posse_atual', 'posse_atual_id', 'status'} & set(kwargs):
+            linhas = super().update(**kwargs)
+        else:
+            afetados = set(self.exclude(posse_atual__isnull=True).values_list('posse_atual_id', flat=True).order_by().distinct())
+            linhas = super().update(**kwargs)
+            novo = kwargs.get('posse_atual', kwargs.get('posse_atual_id'))
+            _invalidar_rotas(*afetados, getattr(novo, 'pk', novo))
+        _reindexar_busca(*reindexar)
+        return linhas
+
+    def delete(self):
+        reindexar = _ordens_do_queryset(self)
+        afetados = set(self.exclude(posse_atual__isnull=True).values_list('posse_atual_id', flat=True).order_by().distinct())
+        resultado = super().delete()
+        _invalidar_rotas(*afetados)
+        _reindexar_busca(*reindexar)
+        return resultado
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        resultado = super().bulk_create(objs, *args, **kwargs)
+        _invalidar_rotas(*{o.posse_atual_id for o in objs})
+        _reindexar_busca(*{o.order_id for o in objs})
+        return resultado
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        from .search import CAMPOS_ITEM
+        objs = list(objs)
+        resultado = super().bulk_update(objs, fields, *args, **kwargs)
+        if {'posse_atual', 'status'} & set(fields):
+            _invalidar_rotas(*{o.posse_atual_id for o in objs})
+        if set(CAMPOS_ITEM) & set(fields):
+            _reindexar_busca(*{o.order_id for o in objs})
+        return resultado
+
+
 class OSItem(models.Model):
     # Faltava esta classe!
     class ItemStatus(models.TextChoices):
@@ -107,6 +343,22 @@ class OSItem(models.Model):
     requires_signature = models.BooleanField(default=True, verbose_name="Exige Assinatura?")
     item_notes = models.TextField(blank=True, verbose_name="Observações do Item")
 
+    objects = OSItemQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        _invalidar_rotas(self.posse_atual_id)
+        # A descrição entra no documento de busca da OS
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'description' in update_fields:
+            _reindexar_busca(self.order_id)
+
+    def delete(self, *args, **kwargs):
+        resultado = super().delete(*args, **kwargs)
+        _invalidar_rotas(self.posse_atual_id)
+        _reindexar_busca(self.order_id)
+        return resultado
+
     def clean(self):
         if self.status in [self.ItemStatus.COLETADO, self.ItemStatus.TRANSFERIDO]:
             if not self.posse_atual:
@@ -120,6 +372,41 @@ class OSItem(models.Model):
         return f"{self.total_quantity}x {self.description}"
 
 
+class OSDestinationQuerySet(models.QuerySet):
+    """ Nome, endereço e recebedor do destino entram no documento de busca da OS """
+
+    def update(self, **kwargs):
+        from .search import CAMPOS_DESTINO
+        reindexar = _ordens_do_queryset(self) if set(CAMPOS_DESTINO) & set(kwargs) else []
+        linhas = super().update(**kwargs)
+        _reindexar_busca(*reindexar)
+        return linhas
+
+    def delete(self):
+        reindexar = _ordens_do_queryset(self)
+        # As paradas de entrega do destino caem junto (CASCADE, sem passar pelos hooks da parada)
+        afetados = set(RouteStop.objects.filter(destination__in=self.values('id')).values_list('motoboy_id', flat=True).order_by().distinct())
+        resultado = super().delete()
+        _invalidar_rotas(*afetados)
+        _recalcular_eta(*afetados)
+        _reindexar_busca(*reindexar)
+        return resultado
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        resultado = super().bulk_create(objs, *args, **kwargs)
+        _reindexar_busca(*{o.order_id for o in objs})
+        return resultado
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        from .search import CAMPOS_DESTINO
+        objs = list(objs)
+        resultado = super().bulk_update(objs, fields, *args, **kwargs)
+        if set(CAMPOS_DESTINO) & set(fields):
+            _reindexar_busca(*{o.order_id for o in objs})
+        return resultado
+
+
 class OSDestination(models.Model):
     order = models.ForeignKey(ServiceOrder, on_delete=models.CASCADE, related_name='destinations')
     
@@ -134,16 +421,41 @@ class OSDestination(models.Model):
     destination_zip_code = models.CharField(max_length=10, verbose_name="CEP (Destino)")
     destination_reference = models.CharField(max_length=255, blank=True, verbose_name="Ponto de Referência (Destino)")
     destination_notes = models.TextField(blank=True, verbose_name="Observações")
+    destination_lat = models.FloatField(null=True, blank=True, verbose_name="Latitude (Destino)")
+    destination_lng = models.FloatField(null=True, blank=True, verbose_name="Longitude (Destino)")
 
     is_delivered = models.BooleanField(default=False)
     delivered_at = models.DateTimeField(null=True, blank=True, verbose_name="Data/Hora Entrega Real")
     geo_delivery_lat = models.CharField(max_length=50, blank=True, verbose_name="Geo Entrega (Lat)")
     geo_delivery_lng = models.CharField(max_length=50, blank=True, verbose_name="Geo Entrega (Lng)")
     proof_photo = models.ImageField(upload_to='proofs/', null=True, blank=True, verbose_name="Foto Comprovação")
+    # Gerada depois do upload, junto com a otimização da foto (orders/media.py)
+    proof_photo_miniatura = models.ImageField(upload_to='proofs/miniaturas/', null=True, blank=True, editable=False)
     receiver_name = models.CharField(max_length=100, blank=True, verbose_name="Nome de quem recebeu")
     receiver_signature = models.ImageField(upload_to='signatures/', null=True, blank=True, verbose_name="Assinatura Digital")
     confirmation_code = models.CharField(max_length=6, blank=True, verbose_name="Código OTP")
 
+    objects = OSDestinationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['destination_lat', 'destination_lng'], name='dest_geo_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Endereço/recebedor aparecem na tela do motoboy
+        _invalidar_rotas(*RouteStop.objects.filter(destination=self).values_list('motoboy_id', flat=True).distinct())
+        _reindexar_busca(self.order_id)
+
+    def delete(self, *args, **kwargs):
+        afetados = set(RouteStop.objects.filter(destination=self).values_list('motoboy_id', flat=True).distinct())
+        resultado = super().delete(*args, **kwargs)
+        _invalidar_rotas(*afetados)
+        _recalcular_eta(*afetados)
+        _reindexar_busca(self.order_id)
+        return resultado
+
     def __str__(self):
         return f"Destino: {self.destination_name} - {self.destination_district}"
 
@@ -167,6 +479,42 @@ class OrderStatusLog(models.Model):
     def __str__(self):
         return f"{self.order.os_number}: {self.status_anterior} -> {self.status_novo}"
 
+class RouteStopQuerySet(models.QuerySet):
+    """ Toda escrita em paradas descarta a tela cacheada dos motoboys envolvidos """
+
+    def update(self, **kwargs):
+        afetados = set(self.values_list('motoboy_id', flat=True).order_by().distinct())
+        linhas = super().update(**kwargs)
+        _invalidar_rotas(*afetados, _id_motoboy(kwargs))
+        if set(kwargs) != {'eta'}:
+            _recalcular_eta(*afetados, _id_motoboy(kwargs))
+        return linhas
+
+    def delete(self):
+        afetados = set(self.values_list('motoboy_id', flat=True).order_by().distinct())
+        resultado = super().delete()
+        _invalidar_rotas(*afetados)
+        _recalcular_eta(*afetados)
+        return resultado
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        resultado = super().bulk_create(objs, *args, **kwargs)
+        _invalidar_rotas(*{o.motoboy_id for o in objs})
+        _recalcular_eta(*{o.motoboy_id for o in objs})
+        return resultado
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        resultado = super().bulk_update(objs, fields, *args, **kwargs)
+        motoboys = {o.motoboy_id for o in objs} | {getattr(o, '_motoboy_id_db', None) for o in objs}
+        _invalidar_rotas(*motoboys)
+        # A própria gravação das previsões (orders/eta.py) não agenda outro recálculo
+        if list(fields) != ['eta']:
+            _recalcular_eta(*motoboys)
+        return resultado
+
+
 class RouteStop(models.Model):
     """
     Define um Ponto de Parada na rota de um motoboy. 
@@ -203,14 +551,51 @@ class RouteStop(models.Model):
     is_failed = models.BooleanField(default=False)
     failure_reason = models.CharField(max_length=255, blank=True)
 
+    # Previsão de chegada (orders/eta.py), refeita a cada mudança na fila do motoboy
+    eta = models.DateTimeField(null=True, blank=True, verbose_name="Previsão de Chegada")
+
     def clean(self):
         if self.pk:
             old_instance = RouteStop.objects.get(pk=self.pk)
             if old_instance.is_completed and not self.is_completed:
                 raise ValidationError("Não é permitido reabrir uma parada que já foi concluída.")
 
+    objects = RouteStopQuerySet.as_manager()
+
     class Meta:
         ordering = ['motoboy', 'sequence']
+        indexes = [
+            # Rota aberta de cada motoboy (tela do motoboy, frota do painel, próxima sequência)
+            models.Index(
+                fields=['motoboy', 'sequence'], name='parada_aberta_motoboy_idx',
+                condition=models.Q(is_completed=False),
+            ),
+            # Paradas de um grupo por tipo ("já coletou?", paradas restantes)
+            models.Index(fields=['service_order', 'stop_type', 'is_completed'], name='parada_os_tipo_idx'),
+            # Entregas concluídas do dia na tela do motoboy
+            models.Index(
+                fields=['motoboy', 'completed_at'], name='parada_concluida_idx',
+                condition=models.Q(is_completed=True),
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        _invalidar_rotas(self.motoboy_id, getattr(self, '_motoboy_id_db', None))
+        if kwargs.get('update_fields') != ['eta']:
+            _recalcular_eta(self.motoboy_id, getattr(self, '_motoboy_id_db', None))
+
+    def delete(self, *args, **kwargs):
+        resultado = super().delete(*args, **kwargs)
+        _invalidar_rotas(self.motoboy_id, getattr(self, '_motoboy_id_db', None))
+        _recalcular_eta(self.motoboy_id, getattr(self, '_motoboy_id_db', None))
+        return resultado
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        instancia._motoboy_id_db = instancia.__dict__.get('motoboy_id')
+        return instancia
 
     def __str__(self):
         if self.stop_type == 'COLETA':
@@ -255,11 +640,21 @@ class Occurrence(models.Model):
     
     tentativas_contato = models.PositiveIntegerField(default=0)
     evidencia_foto = models.ImageField(upload_to='ocorrencias/evidencias/', null=True, blank=True)
+    evidencia_foto_miniatura = models.ImageField(upload_to='ocorrencias/miniaturas/', null=True, blank=True, editable=False)
     
     urgencia = models.CharField(max_length=10, choices=Urgencia.choices, default=Urgencia.MEDIA)
     criado_em = models.DateTimeField(auto_now_add=True)
     resolvida = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Ocorrências abertas no painel, na ordem da tela
+            models.Index(
+                fields=['-urgencia', '-criado_em'], name='ocorrencia_aberta_idx',
+                condition=models.Q(resolvida=False),
+            ),
+        ]
+
     def __str__(self):
         return f"Ocorrência {self.get_causa_display()} na OS {self.service_order.os_number}"
 
@@ -282,4 +677,284 @@ class DispatcherDecision(models.Model):
     decidido_em = models.DateTimeField(auto_now_add=True)
     
     def __str__(self):
-        return f"Decisão {self.get_acao_display()} por {self.decidido_por}"
\ No newline at end of file
+        return f"Decisão {self.get_acao_display()} por {self.decidido_por}"
+
+
+class CepLocation(models.Model):
+    """
+    Base local de CEPs/logradouros com coordenadas (carregada via `manage.py carregar_ceps`).
+    Permite geocodificar na criação da OS sem chamar API externa.
+    """
+    cep = models.CharField(max_length=8, unique=True, verbose_name="CEP (só dígitos)")
+    street = models.CharField(max_length=255, blank=True, verbose_name="Logradouro")
+    district = models.CharField(max_length=100, blank=True, verbose_name="Bairro")
+    city = models.CharField(max_length=100, verbose_name="Cidade")
+    state = models.CharField(max_length=2, blank=True, verbose_name="UF")
+    # Versões normalizadas (sem acento, minúsculas) para a busca por rua quando o CEP não bate
+    street_norm = models.CharField(max_length=255, blank=True, editable=False)
+    city_norm = models.CharField(max_length=100, editable=False)
+    lat = models.FloatField()
+    lng = models.FloatField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['city_norm', 'street_norm'], name='cep_city_street_idx'),
+            models.Index(fields=['lat', 'lng'], name='cep_geo_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.cep} - {self.street}, {self.city}/{self.state}"
+
+
+class GeocodeCache(models.Model):
+    """ Cache persistente de endereços já resolvidos (inclusive os não encontrados, para não tentar de novo) """
+    class Fonte(models.TextChoices):
+        CEP = 'CEP', 'CEP'
+        RUA = 'RUA', 'Logradouro + Cidade'
+        NAO_ENCONTRADO = 'NAO_ENCONTRADO', 'Não encontrado'
+
+    chave = models.CharField(max_length=40, unique=True, help_text="SHA1 do endereço normalizado")
+    endereco = models.CharField(max_length=400)
+    lat = models.FloatField(null=True, blank=True)
+    lng = models.FloatField(null=True, blank=True)
+    fonte = models.CharField(max_length=20, choices=Fonte.choices)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.endereco} -> {self.lat}, {self.lng}"
+
+
+# ==========================================================
+# KPIs MATERIALIZADOS (orders/kpis.py)
+# ==========================================================
+# Contadores de OS por status em três recortes. Atualizados a cada mudança de status/
+# motoboy e reconstruídos do zero com `manage.py recalcular_kpis`.
+
+class DailyOrderStats(models.Model):
+    day = models.DateField(verbose_name="Dia de criação da OS")
+    status = models.CharField(max_length=20, choices=ServiceOrder.Status.choices)
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['day', 'status'], name='uniq_daily_stats')]
+
+    def __str__(self):
+        return f"{self.day} {self.status}: {self.total}"
+
+
+class CompanyOrderStats(models.Model):
+    client = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='order_stats')
+    status = models.CharField(max_length=20, choices=ServiceOrder.Status.choices)
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['client', 'status'], name='uniq_company_stats')]
+
+    def __str__(self):
+        return f"{self.client_id} {self.status}: {self.total}"
+
+
+class MotoboyOrderStats(models.Model):
+    motoboy = models.ForeignKey(MotoboyProfile, on_delete=models.CASCADE, related_name='order_stats')
+    status = models.CharField(max_length=20, choices=ServiceOrder.Status.choices)
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['motoboy', 'status'], name='uniq_motoboy_stats')]
+
+    def __str__(self):
+        return f"{self.motoboy_id} {self.status}: {self.total}"
+
+
+# ==========================================================
+# BUSCA (orders/search.py)
+# ==========================================================
+# Um documento de texto por OS (dados da OS, coleta, destinos e itens), indexado por
+# tsvector + GIN / trigramas no PostgreSQL e por FTS5 no SQLite. As colunas e índices
+# específicos de cada banco são criados na migração 0013, fora do model.
+
+class OrderSearchDocument(models.Model):
+    order = models.OneToOneField(ServiceOrder, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    documento = models.TextField(verbose_name="Texto normalizado (sem acento, minúsculo)")
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Busca OS {self.order_id}"
+
+
+# ==========================================================
+# EXPORTAÇÕES (orders/exports.py)
+# ==========================================================
+
+def _storage_exportacoes():
+    # Storage privado (settings.EXPORTS_ROOT): nunca servido pelo MEDIA_URL
+    return FileSystemStorage(location=settings.EXPORTS_ROOT)
+
+
+def _caminho_exportacao(instance, filename):
+    # Pasta aleatória por exportação: o caminho não é deduzível pelo id nem pelo período
+    return f'{secrets.token_hex(16)}/{filename}'
+
+
+class OrderExport(models.Model):
+    """ Exportação gerada em segundo plano (períodos grandes); o arquivo fica em settings.EXPORTS_ROOT """
+    class Status(models.TextChoices):
+        PENDENTE = 'PENDENTE', 'Na fila'
+        GERANDO = 'GERANDO', 'Gerando'
+        PRONTO = 'PRONTO', 'Pronto'
+        ERRO = 'ERRO', 'Erro'
+
+    solicitante = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='exportacoes')
+    # Empresa exportada (vazio = todas, só admin)
+    client = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    tipo = models.CharField(max_length=20)
+    formato = models.CharField(max_length=5)
+    inicio = models.DateField()
+    fim = models.DateField()
+
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDENTE)
+    arquivo = models.FileField(upload_to=_caminho_exportacao, storage=_storage_exportacoes, blank=True)
+    linhas = models.PositiveIntegerField(default=0)
+    erro = models.TextField(blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Exportação {self.tipo} {self.inicio}..{self.fim} ({self.get_status_display()})"
+
+
+# ==========================================================
+# MÍDIA (orders/media.py)
+# ==========================================================
+
+class PendingMedia(models.Model):
+    """ Foto/assinatura recebida em bruto, aguardando otimização e miniatura em segundo plano """
+    modelo = models.CharField(max_length=50, help_text="app_label.Model, ex: orders.OSDestination")
+    objeto_id = models.BigIntegerField()
+    campo = models.CharField(max_length=50)
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    erro = models.TextField(blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.modelo}#{self.objeto_id}.{self.campo}"
+
+
+# ==========================================================
+# TAREFAS EM SEGUNDO PLANO (orders/jobs.py)
+# ==========================================================
+
+class BackgroundJob(models.Model):
+    """ Tarefa pesada do despacho na fila do banco; executada por `manage.py processar_tarefas` """
+    class Status(models.TextChoices):
+        PENDENTE = 'PENDENTE', 'Na fila'
+        EXECUTANDO = 'EXECUTANDO', 'Executando'
+        CONCLUIDA = 'CONCLUIDA', 'Concluída'
+        ERRO = 'ERRO', 'Erro'
+
+    tipo = models.CharField(max_length=50)
+    parametros = models.JSONField(default=dict, blank=True)
+    # Chave de idempotência: o mesmo pedido repetido (duplo clique, retry do navegador) devolve a mesma tarefa
+    chave = models.CharField(max_length=150, unique=True, null=True, blank=True)
+    solicitante = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='tarefas')
+
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDENTE)
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    max_tentativas = models.PositiveSmallIntegerField(default=3)
+    executar_em = models.DateTimeField(default=timezone.now, help_text="Próxima tentativa (backoff entre falhas)")
+    resultado = models.JSONField(null=True, blank=True)
+    erro = models.TextField(blank=True)
+    criada_em = models.DateTimeField(auto_now_add=True)
+    iniciada_em = models.DateTimeField(null=True, blank=True)
+    concluida_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Próxima tarefa da fila (o worker consulta a cada segundo)
+            models.Index(
+                fields=['executar_em', 'id'], name='tarefa_fila_idx',
+                condition=models.Q(status='PENDENTE'),
+            ),
+        ]
+
+    def __str__(self):
+        return f"Tarefa {self.id} {self.tipo} ({self.get_status_display()})"
+
+
+# ==========================================================
+# EVENTOS DO PAINEL DE DESPACHO (orders/events.py)
+# ==========================================================
+
+class BoardEvent(models.Model):
+    """ Delta do painel gravado junto com a escrita que o causou; o id é o cursor SSE de todos os processos """
+    tipo = models.CharField(max_length=30)
+    dados = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    criado_em = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"Evento {self.id} {self.tipo}"
+
+
+# ==========================================================
+# PREVISÃO DE CHEGADA (orders/eta.py)
+# ==========================================================
+# Perfis aprendidos offline por `manage.py treinar_eta` a partir das paradas concluídas.
+
+class EtaProfile(models.Model):
+    class Tipo(models.TextChoices):
+        VELOCIDADE = 'VELOCIDADE', 'Velocidade média (km/h)'
+        PERMANENCIA = 'PERMANENCIA', 'Permanência na parada (min)'
+
+    tipo = models.CharField(max_length=12, choices=Tipo.choices)
+    # VELOCIDADE: 'cidade|bairro', 'cidade|' ou '' (geral)  /  PERMANENCIA: tipo da parada
+    chave = models.CharField(max_length=220, blank=True)
+    valor = models.FloatField()
+    amostras = models.PositiveIntegerField(default=0)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['tipo', 'chave'], name='uniq_eta_profile')]
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} [{self.chave or 'geral'}]: {self.valor:.1f}"
+
+
+# ==========================================================
+# ARQUIVO (orders/archive.py)
+# ==========================================================
+# Grupos encerrados há mais de N dias saem das tabelas quentes (`manage.py arquivar_os`).
+# Cada OS vira uma linha com o retrato JSON dela e de tudo que pendia dela (itens, destinos,
+# distribuições, paradas, ocorrências, decisões e histórico de status), no formato do
+# serializador do Django. O id é o mesmo da OS original: links e números antigos continuam
+# valendo.
+
+class RetratoEncoder(DjangoJSONEncoder):
+    """ DjangoJSONEncoder corta datas em milissegundos; o retrato guarda o instante exato """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class ArchivedOrder(models.Model):
+    id = models.BigIntegerField(primary_key=True, help_text="Mesmo id da OS original")
+    os_number = models.CharField(max_length=20, unique=True, verbose_name="Número da OS")
+    group_root_id = models.BigIntegerField(db_index=True, verbose_name="Grupo (OS Mãe)")
+    # Mesmas colunas da OS usadas em filtros (exportação) e nos KPIs (orders/kpis.py -> recalcular)
+    client = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+', verbose_name="Empresa Solicitante")
+    motoboy = models.ForeignKey(MotoboyProfile, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name="Motoboy Responsável")
+    status = models.CharField(max_length=20, choices=ServiceOrder.Status.choices, verbose_name="Status Final")
+    created_at = models.DateTimeField(verbose_name="Data de Criação")
+    arquivada_em = models.DateTimeField(auto_now_add=True)
+    dados = models.JSONField(encoder=RetratoEncoder, help_text="serializers.serialize('python', ...) da OS e dos registros dela")
+
+    class Meta:
+        indexes = [
+            # Exportação por período (com ou sem empresa)
+            models.Index(fields=['created_at', 'id'], name='arquivo_periodo_idx'),
+            models.Index(fields=['client', 'created_at', 'id'], name='arquivo_empresa_idx'),
+        ]
+
+    def __str__(self):
+        return f"OS {self.os_number} (arquivada)"
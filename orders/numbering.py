@@ -0,0 +1,114 @@
+# orders/numbering.py
+"""
+Numeração das OS sem o "save duplo".
+
+O os_number sempre foi `OS-{id:04}`. Em vez de inserir a linha e depois fazer um UPDATE
+com o número, reservamos os ids direto da sequence da tabela ANTES do INSERT. Assim o
+id e o os_number já vão preenchidos no próprio INSERT (inclusive no bulk_create), e o
+formato continua compatível com os números antigos.
+
+Cada processo guarda um bloco de ids reservados (BLOCO_PADRAO) e só volta ao banco
+quando o bloco acaba. Consequência: números podem "pular" (bloco descartado quando o
+processo reinicia) e dois workers intercalam faixas diferentes — igual a qualquer
+sequence com cache do PostgreSQL.
+"""
+import threading
+
+from django.db import connection, transaction
+
+BLOCO_PADRAO = 50
+
+
+def formatar_os_number(os_id):
+    return f"OS-{str(os_id).zfill(4)}"
+
+
+def _tabela():
+    from .models import ServiceOrder
+    return ServiceOrder._meta.db_table
+
+
+def _buscar_postgresql(quantidade):
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+            [_tabela(), quantidade]
+        )
+        return sorted(row[0] for row in cursor.fetchall())
+
+
+def _ultimo_id_sqlite():
+    tabela = _tabela()
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {connection.ops.quote_name(tabela)}")
+            ultimo = cursor.fetchone()[0]
+            # AUTOINCREMENT nunca reaproveita ids de linhas apagadas; respeitamos o mesmo contador
+            cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [tabela])
+            linha = cursor.fetchone()
+            if linha:
+                ultimo = max(ultimo, linha[0])
+    return ultimo
+
+
+class AlocadorOS:
+    """ Entrega ids (e portanto os_number) já reservados, buscando no banco em blocos """
+
+    def __init__(self, bloco=BLOCO_PADRAO):
+        self.bloco = bloco
+        self._lock = threading.Lock()
+        self._livres = []
+        self._maior_sqlite = 0
+
+    def _buscar(self, quantidade):
+        if connection.vendor == 'postgresql':
+            return _buscar_postgresql(quantidade)
+
+        # SQLite (testes/dev): sem sequence. Não dá para guardar bloco entre processos, então
+        # reservamos só o necessário a partir do maior id visto (banco ou já entregue por nós).
+        ultimo = max(_ultimo_id_sqlite(), self._maior_sqlite)
+        ids = list(range(ultimo + 1, ultimo + 1 + quantidade))
+        self._maior_sqlite = ids[-1]
+        return ids
+
+    def reservar(self, quantidade):
+        """ Devolve `quantidade` ids reservados, em ordem crescente """
+        if quantidade <= 0:
+            return []
+        with self._lock:
+            if connection.vendor != 'postgresql':
+                return self._buscar(quantidade)
+
+            faltam = quantidade - len(self._livres)
+            if faltam > 0:
+                # Lotes grandes buscam tudo de uma vez; pedidos unitários reabastecem o bloco
+                self._livres.extend(self._buscar(max(faltam, self.bloco)))
+            ids, self._livres = self._livres[:quantidade], self._livres[quantidade:]
+            return ids
+
+    def proximo(self):
+        return self.reservar(1)[0]
+
+    def descartar_cache(self):
+        with self._lock:
+            self._livres = []
+            self._maior_sqlite = 0
+
+
+alocador = AlocadorOS()
+
+
+def reservar_ids(quantidade):
+    """ Atalho mantido para quem só precisa de N ids de uma vez """
+    return alocador.reservar(quantidade)
+
+
+def numerar(ordens):
+    """ Preenche id e os_number das OS novas que ainda não têm (antes do INSERT) """
+    sem_id = [os_obj for os_obj in ordens if os_obj.pk is None]
+    for os_obj, os_id in zip(sem_id, alocador.reservar(len(sem_id))):
+        os_obj.pk = os_id
+    for os_obj in ordens:
+        if not os_obj.os_number:
+            os_obj.os_number = formatar_os_number(os_obj.pk)
+    return ordens
@@ -0,0 +1,61 @@
+# orders/pagination.py
+"""
+Paginação por chave (keyset) das listas de OS, das mais recentes para as mais antigas.
+
+Em vez de OFFSET (que lê e descarta todas as linhas anteriores), cada página começa logo
+depois da última OS da página anterior: `(created_at, id) < (cursor)`. Com o índice
+(client, -created_at, -id) a página custa o mesmo na primeira ou na milésima, com 50 ou
+500 mil OS na empresa. O cursor vai para o cliente como texto opaco (base64).
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+TAMANHO_PADRAO = 25
+TAMANHO_MAXIMO = 200
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def codificar_cursor(os_obj):
+    bruto = f"{os_obj.created_at.isoformat()}|{os_obj.id}"
+    return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor):
+    """ 'MjAyNi0xMC0xOF...' -> (created_at, id) """
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        data, os_id = bruto.rsplit('|', 1)
+        return datetime.fromisoformat(data), int(os_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise CursorInvalido("Cursor de paginação inválido.") from e
+
+
+def tamanho_pagina(valor, padrao=TAMANHO_PADRAO):
+    """ Tamanho pedido pelo cliente (querystring), limitado a TAMANHO_MAXIMO """
+    try:
+        return max(1, min(int(valor), TAMANHO_MAXIMO))
+    except (TypeError, ValueError):
+        return padrao
+
+
+def pagina(queryset, cursor=None, tamanho=TAMANHO_PADRAO):
+    """
+    Uma página do queryset em (-created_at, -id). Retorna (itens, próximo cursor ou None).
+    Busca uma linha a mais só para saber se existe próxima página (sem COUNT).
+    """
+    queryset = queryset.order_by('-created_at', '-id')
+    if cursor:
+        criado, os_id = decodificar_cursor(cursor)
+        # O created_at__lte redundante dá ao banco o limite da faixa no índice
+        queryset = queryset.filter(Q(created_at__lt=criado) | Q(created_at=criado, id__lt=os_id),
+                                   created_at__lte=criado)
+    itens = list(queryset[:tamanho + 1])
+    if len(itens) > tamanho:
+        itens = itens[:tamanho]
+        return itens, codificar_cursor(itens[-1])
+    return itens, None
@@ -0,0 +1,59 @@
+# orders/profiling.py
+"""
+Perfil de SQL por request: o contador ligado durante o request amostrado e o buffer circular
+com as últimas medidas (por processo).
+
+Quem mede é o SQLProfilingMiddleware (config/middleware.py); quem lê é a tela
+/painel-admin/perfil-sql/ (orders/views.py). O buffer fica aqui para a view não depender
+do módulo de middleware.
+"""
+import threading
+import time
+from collections import Counter, deque
+
+from django.conf import settings
+
+
+class PerfilSQL:
+    """ Contador ligado via connection.execute_wrapper durante o request amostrado """
+
+    def __init__(self):
+        self.queries = 0
+        self.tempo = 0.0
+        self.assinaturas = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.tempo += time.perf_counter() - inicio
+            self.queries += 1
+            # O SQL chega com os placeholders (%s), então o próprio texto já é a "impressão digital"
+            self.assinaturas[sql] += 1
+
+    def duplicadas(self, limite=5):
+        return [(sql, n) for sql, n in self.assinaturas.most_common(limite) if n > 1]
+
+
+class BufferPerfis:
+    """ Últimos N requests medidos (thread-safe, em memória) """
+
+    def __init__(self, tamanho=200):
+        self._itens = deque(maxlen=tamanho)
+        self._lock = threading.Lock()
+
+    def registrar(self, registro):
+        with self._lock:
+            self._itens.append(registro)
+
+    def listar(self):
+        with self._lock:
+            return list(reversed(self._itens))
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+
+
+perfis_sql = BufferPerfis(getattr(settings, 'SQL_PROFILING_BUFFER', 200))
@@ -0,0 +1,336 @@
+# orders/routing.py
+"""
+Roteirizador das paradas abertas de um motoboy.
+
+Regras respeitadas (as mesmas que o despacho já usa):
+  - COLETA antes de ENTREGA/DEVOLUCAO da mesma OS (igual ao reorder_stops_view).
+  - Paradas que travam a rota (bloqueia_proxima com falha/transferência) e tudo que vem
+    antes delas ficam onde estão.
+  - Paradas "estacionadas" na sequência 999 não entram na otimização.
+
+Heurística: inserção mais barata + 2-opt + Or-opt sobre uma matriz de distâncias
+com cache (lru_cache), rápida o bastante para rodar a cada atribuição.
+"""
+import math
+import time
+from functools import lru_cache
+
+from django.db import transaction
+
+from .models import RouteStop
+
+SEQUENCIA_ESTACIONADA = 900  # Tudo >= 900 (ex: 999) fica fora da fila normal
+TEMPO_MAXIMO_S = 0.25
+
+
+# ==========================================================
+# 1. LOCALIZAÇÃO E DISTÂNCIA
+# ==========================================================
+
+def _to_float(valor):
+    try:
+        return float(str(valor).replace(',', '.'))
+    except (TypeError, ValueError):
+        return None
+
+
+def _local(lat, lng, cep, bairro, cidade):
+    lat, lng = _to_float(lat), _to_float(lng)
+    if lat is not None and lng is not None:
+        return ('geo', round(lat, 5), round(lng, 5))
+    cep_digits = ''.join(ch for ch in (cep or '') if ch.isdigit())
+    return ('end', cep_digits[:5], (bairro or '').strip().lower(), (cidade or '').strip().lower())
+
+
+def local_da_coleta(os_obj):
+    """ Chave de localização da origem da OS (também usada pela atribuição automática) """
+    return _local(os_obj.origin_lat, os_obj.origin_lng,
+                  os_obj.origin_zip_code, os_obj.origin_district, os_obj.origin_city)
+
+
+def local_da_parada(stop):
+    """ Chave de localização da parada (coordenada geocodificada quando houver, senão CEP/bairro/cidade) """
+    if stop.stop_type == RouteStop.StopType.COLLECTION:
+        return local_da_coleta(stop.service_order)
+    if stop.stop_type == RouteStop.StopType.DELIVERY and stop.destination_id:
+        dest = stop.destination
+        return _local(dest.destination_lat, dest.destination_lng,
+                      dest.destination_zip_code, dest.destination_district, dest.destination_city)
+    # TRANSFERENCIA / DEVOLUCAO: endereço é texto livre, não dá para posicionar
+    return None
+
+
+def _haversine_km(lat1, lng1, lat2, lng2):
+    raio = 6371.0
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * raio * math.asin(math.sqrt(a))
+
+
+@lru_cache(maxsize=200_000)
+def distancia_km(a, b):
+    """ Distância (km) entre duas chaves de local. Cacheada por processo. """
+    if a is None or b is None or a == b:
+        return 0.0
+    if a[0] == 'geo' and b[0] == 'geo':
+        return _haversine_km(a[1], a[2], b[1], b[2])
+
+    # Sem coordenada: estimativa grosseira pela proximidade do endereço
+    ea = a if a[0] == 'end' else None
+    eb = b if b[0] == 'end' else None
+    if ea and eb:
+        if ea[1] and ea[1] == eb[1]:
+            return 1.0
+        if ea[2] and ea[2] == eb[2] and ea[3] == eb[3]:
+            return 2.0
+        if ea[3] and ea[3] == eb[3]:
+            return 8.0
+    return 30.0
+
+
+# ==========================================================
+# 2. SOLVER (puro Python, sem banco)
+# ==========================================================
+
+class _Problema:
+    def __init__(self, locais, coleta_de, ancora):
+        self.n = len(locais)
+        self.locais = locais
+        self.coleta_de = coleta_de  # índice da entrega -> índice da coleta que deve vir antes
+        self.ancora = ancora
+
+    def d(self, i, j):
+        a = self.ancora if i is None else self.locais[i]
+        return distancia_km(a, self.locais[j])
+
+    def custo(self, rota):
+        if not rota:
+            return 0.0
+        total = self.d(None, rota[0])
+        for k in range(1, len(rota)):
+            total += distancia_km(self.locais[rota[k - 1]], self.locais[rota[k]])
+        return total
+
+    def valida(self, rota):
+        pos = {no: k for k, no in enumerate(rota)}
+        return all(pos[c] < pos[e] for e, c in self.coleta_de.items())
+
+
+def _insercao_mais_barata(prob, ordem_original):
+    rota = []
+    for no in ordem_original:
+        minimo = 0
+        maximo = len(rota)
+        coleta = prob.coleta_de.get(no)
+        if coleta is not None and coleta in rota:
+            minimo = rota.index(coleta) + 1
+        # Se este nó é coleta de alguém já inserido, ele precisa ficar antes dessa entrega
+        for k, outro in enumerate(rota):
+            if prob.coleta_de.get(outro) == no:
+                maximo = min(maximo, k)
+
+        melhor_pos, melhor_delta = maximo, None
+        for p in range(minimo, maximo + 1):
+            anterior = rota[p - 1] if p > 0 else None
+            proximo = rota[p] if p < len(rota) else None
+            delta = prob.d(anterior, no)
+            if proximo is not None:
+                delta += distancia_km(prob.locais[no], prob.locais[proximo]) - prob.d(anterior, proximo)
+            if melhor_delta is None or delta < melhor_delta - 1e-9:
+                melhor_pos, melhor_delta = p, delta
+        rota.insert(melhor_pos, no)
+    return rota
+
+
+def _dois_opt(prob, rota, prazo):
+    melhorou = True
+    while melhorou and time.monotonic() < prazo:
+        melhorou = False
+        for i in range(len(rota) - 1):
+            coletas_no_trecho = set()
+            for j in range(i, len(rota)):
+                no = rota[j]
+                # Inverter um trecho com coleta E entrega da mesma OS quebraria a precedência
+                if prob.coleta_de.get(no) in coletas_no_trecho:
+                    break
+                coletas_no_trecho.add(no)
+                if j == i:
+                    continue
+                anterior = rota[i - 1] if i > 0 else None
+                depois = rota[j + 1] if j + 1 < len(rota) else None
+                antes = prob.d(anterior, rota[i])
+                novo = prob.d(anterior, rota[j])
+                if depois is not None:
+                    antes += distancia_km(prob.locais[rota[j]], prob.locais[depois])
+                    novo += distancia_km(prob.locais[rota[i]], prob.locais[depois])
+                if novo < antes - 1e-9:
+                    rota[i:j + 1] = reversed(rota[i:j + 1])
+                    melhorou = True
+                    break
+            if melhorou:
+                break
+    return rota
+
+
+def _or_opt(prob, rota, prazo):
+    """ Move trechos de 1 a 3 paradas para outra posição (custo calculado por delta, O(1) por tentativa) """
+    def arco(x, y):
+        # x None = âncora (início), y None = fim da rota (caminho aberto, sem volta)
+        if y is None:
+            return 0.0
+        return prob.d(x, y)
+
+    melhorou = True
+    while melhorou and time.monotonic() < prazo:
+        melhorou = False
+        for tamanho in (1, 2, 3):
+            for i in range(len(rota) - tamanho + 1):
+                trecho = rota[i:i + tamanho]
+                anterior = rota[i - 1] if i > 0 else None
+                seguinte = rota[i + tamanho] if i + tamanho < len(rota) else None
+                ganho_remocao = arco(anterior, trecho[0]) + arco(trecho[-1], seguinte) - arco(anterior, seguinte)
+                resto = rota[:i] + rota[i + tamanho:]
+                for p in range(len(resto) + 1):
+                    if p == i:
+                        continue
+                    a = resto[p - 1] if p > 0 else None
+                    b = resto[p] if p < len(resto) else None
+                    custo_insercao = arco(a, trecho[0]) + arco(trecho[-1], b) - arco(a, b)
+                    if custo_insercao < ganho_remocao - 1e-9:
+                        candidata = resto[:p] + trecho + resto[p:]
+                        if prob.valida(candidata):
+                            rota, melhorou = candidata, True
+                            break
+                if melhorou or time.monotonic() >= prazo:
+                    break
+            if melhorou:
+                break
+    return rota
+
+
+def resolver(locais, coleta_de, ancora=None, tempo_maximo=TEMPO_MAXIMO_S):
+    """ Retorna a ordem (índices) que minimiza a distância respeitando coleta antes da entrega """
+    prob = _Problema(locais, coleta_de, ancora)
+    prazo = time.monotonic() + tempo_maximo
+    rota = _insercao_mais_barata(prob, list(range(prob.n)))
+    rota = _dois_opt(prob, rota, prazo)
+    rota = _or_opt(prob, rota, prazo)
+    return rota
+
+
+# ==========================================================
+# 3. INTEGRAÇÃO COM AS PARADAS DO MOTOBOY
+# ==========================================================
+
+def trava_rota(stop):
+    """ Parada que segura a fila: falha bloqueante, transferência/resgate ou socorro """
+    return stop.bloqueia_proxima and (
+        stop.is_failed or stop.stop_type == RouteStop.StopType.TRANSFER or bool(stop.failure_reason)
+    )
+
+
+def sugerir_rota(motoboy):
+    """
+    Calcula a melhor ordem para as paradas abertas do motoboy sem gravar nada.
+    Retorna um dict com as paradas na ordem sugerida e as sequências que elas receberiam.
+    """
+    abertas = list(
+        RouteStop.objects.filter(motoboy=motoboy, is_completed=False)
+        .select_related('service_order', 'destination')
+        .order_by('sequence', 'id')
+    )
+    fila = [s for s in abertas if s.sequence < SEQUENCIA_ESTACIONADA]
+
+    # Tudo até a última parada que trava a rota fica congelado
+    corte = 0
+    for k, stop in enumerate(fila):
+        if trava_rota(stop):
+            corte = k + 1
+    congeladas, moveis = fila[:corte], fila[corte:]
+
+    if congeladas:
+        ancora = local_da_parada(congeladas[-1])
+    else:
+        ultima_feita = (
+            RouteStop.objects.filter(motoboy=motoboy, is_completed=True, completed_at__isnull=False)
+            .select_related('service_order', 'destination')
+            .order_by('-completed_at').first()
+        )
+        ancora = local_da_parada(ultima_feita) if ultima_feita else None
+
+    locais = [local_da_parada(s) for s in moveis]
+    coleta_idx = {s.service_order_id: k for k, s in enumerate(moveis) if s.stop_type == RouteStop.StopType.COLLECTION}
+    coleta_de = {}
+    for k, s in enumerate(moveis):
+        if s.stop_type in (RouteStop.StopType.DELIVERY, RouteStop.StopType.RETURN) and s.service_order_id in coleta_idx:
+            coleta_de[k] = coleta_idx[s.service_order_id]
+
+    inicio = time.monotonic()
+    prob = _Problema(locais, coleta_de, ancora)
+    custo_atual = prob.custo(list(range(len(moveis))))
+    ordem = resolver(locais, coleta_de, ancora)
+    custo_novo = prob.custo(ordem)
+
+    # Se não ganhou nada, mantém a ordem do despachante
+    if custo_novo >= custo_atual - 1e-9:
+        ordem = list(range(len(moveis)))
+        custo_novo = custo_atual
+
+    # Reaproveita os números de sequência que as paradas móveis já ocupavam
+    sequencias = sorted(s.sequence for s in moveis)
+    nova_ordem = [(stop, stop.sequence) for stop in congeladas]
+    nova_ordem += [(moveis[idx], sequencias[k]) for k, idx in enumerate(ordem)]
+
+    return {
+        'motoboy_id': motoboy.id,
+        'ordem': nova_ordem,
+        'distancia_atual_km': round(custo_atual, 2),
+        'distancia_otimizada_km': round(custo_novo, 2),
+        'congeladas': len(congeladas),
+        'estacionadas': len(abertas) - len(fila),
+        'tempo_ms': round((time.monotonic() - inicio) * 1000, 1),
+    }
+
+
+def aplicar_rota(motoboy):
+    """ Recalcula e grava a ordem sugerida numa única query (bulk_update). Retorna o resumo serializado. """
+    with transaction.atomic():
+        # Trava as paradas do motoboy para ninguém reordenar ao mesmo tempo
+        list(RouteStop.objects.select_for_update().filter(motoboy=motoboy, is_completed=False).values_list('id', flat=True))
+        sugestao = sugerir_rota(motoboy)
+
+        dados = serializar_sugestao(sugestao)
+
+        alteradas = []
+        for stop, nova_seq in sugestao['ordem']:
+            if stop.sequence != nova_seq:
+                stop.sequence = nova_seq
+                alteradas.append(stop)
+        if alteradas:
+            RouteStop.objects.bulk_update(alteradas, ['sequence'])
+
+    dados['alteradas'] = len(alteradas)
+    return dados
+
+
+def serializar_sugestao(sugestao):
+    paradas = []
+    for stop, nova_seq in sugestao['ordem']:
+        if stop.stop_type == RouteStop.StopType.COLLECTION:
+            local = stop.service_order.origin_name
+        elif stop.destination_id:
+            local = stop.destination.destination_name
+        else:
+            local = stop.failure_reason
+        paradas.append({
+            'id': stop.id,
+            'type': stop.stop_type,
+            'os_number': stop.service_order.os_number,
+            'sequence_atual': stop.sequence,
+            'sequence': nova_seq,
+            'location': local,
+        })
+    dados = {k: v for k, v in sugestao.items() if k != 'ordem'}
+    dados['stops'] = paradas
+    return dados
@@ -0,0 +1,200 @@
+# orders/search.py
+"""
+Busca textual de OS (número, solicitante, coleta, destinatários, endereços e itens).
+
+Cada OS tem um OrderSearchDocument com todo o texto pesquisável já normalizado (sem acento,
+minúsculo; telefones e CEPs também só com dígitos). O documento é refeito depois do commit
+sempre que a OS, um destino ou um item muda ou é apagado (hooks de save/delete e dos
+querysets em orders/models.py, inclusive update/bulk_create/bulk_update). Escritas por fora
+do ORM (`gerar_os --rapido`) não passam pelos hooks: `manage.py reindexar_busca` reconstrói tudo.
+
+Backends (escolhidos pelo banco da conexão, tabelas/índices criados na migração 0013):
+  - PostgreSQL: coluna gerada `vetor` (tsvector 'simple') com índice GIN. Sem resultado,
+    cai para similaridade de trigramas (pg_trgm, índice GIN) - pega erro de digitação.
+  - SQLite (dev/testes): tabela virtual FTS5 sincronizada por triggers. Sem fallback de
+    trigramas: só prefixo de palavra.
+
+Os termos viram prefixos ("flor" acha "Flores") e todos precisam aparecer na mesma OS.
+"""
+import logging
+import re
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .geocoding import normalizar, so_digitos
+from .models import ServiceOrder, OSDestination, OSItem, OrderSearchDocument
+
+logger = logging.getLogger(__name__)
+
+TABELA_FTS = 'orders_busca_fts'
+LIMITE_PADRAO = 20
+LOTE_REINDEXAR = 2000
+
+# O save() da OS só reindexa quando um destes campos muda (orders/models.py)
+CAMPOS_OS = (
+    'os_number', 'requester_name', 'requester_phone', 'company_cnpj', 'company_email', 'internal_code',
+    'origin_name', 'origin_responsible', 'origin_phone', 'origin_street', 'origin_number',
+    'origin_complement', 'origin_district', 'origin_city', 'origin_zip_code', 'origin_reference',
+)
+CAMPOS_DESTINO = (
+    'destination_name', 'destination_phone', 'destination_street', 'destination_number',
+    'destination_complement', 'destination_district', 'destination_city', 'destination_zip_code',
+    'destination_reference', 'receiver_name',
+)
+CAMPOS_ITEM = ('description',)
+# Também gravados só com dígitos: "(11) 98765-4321" precisa ser achado por "987654321"
+CAMPOS_DIGITOS = {
+    'requester_phone', 'company_cnpj', 'origin_phone', 'origin_zip_code',
+    'destination_phone', 'destination_zip_code',
+}
+
+_PALAVRA = re.compile(r'\w+')
+
+
+# ==========================================================
+# 1. DOCUMENTOS
+# ==========================================================
+
+def _textos(linha, campos):
+    for campo in campos:
+        valor = linha.get(campo)
+        if not valor:
+            continue
+        yield str(valor)
+        if campo in CAMPOS_DIGITOS:
+            yield so_digitos(valor)
+
+
+def montar_documentos(ids):
+    """ {os_id: documento} das OS informadas (3 queries, independente da quantidade) """
+    ids = list(ids)
+    partes = {}
+    for linha in ServiceOrder.objects.filter(id__in=ids).values('id', *CAMPOS_OS):
+        # O id puro também entra: "OS-0042" é achado por "42"
+        partes[linha['id']] = [str(linha['id']), *_textos(linha, CAMPOS_OS)]
+    for model, campos in ((OSDestination, CAMPOS_DESTINO), (OSItem, CAMPOS_ITEM)):
+        for linha in model.objects.filter(order_id__in=ids).order_by('id').values('order_id', *campos):
+            if linha['order_id'] in partes:
+                partes[linha['order_id']].extend(_textos(linha, campos))
+    return {os_id: normalizar(' '.join(textos)) for os_id, textos in partes.items()}
+
+
+def indexar(ids):
+    """ Refaz (upsert) o documento das OS. OS que não existem mais são ignoradas. """
+    documentos = montar_documentos(ids)
+    if not documentos:
+        return 0
+    agora = timezone.now()
+    OrderSearchDocument.objects.bulk_create(
+        [OrderSearchDocument(order_id=os_id, documento=doc, atualizado_em=agora) for os_id, doc in documentos.items()],
+        update_conflicts=True, unique_fields=['order'], update_fields=['documento', 'atualizado_em'],
+    )
+    return len(documentos)
+
+
+def _indexar_depois(ids):
+    try:
+        indexar(ids)
+    except Exception:
+        # Já estamos depois do commit: busca desatualizada não derruba o request (reindexar_busca corrige)
+        logger.exception("Falha ao indexar a busca das OS %s", sorted(ids)[:20])
+
+
+def agendar(*ids):
+    """ Reindexa depois do commit (rollback = nada a refazer), como os KPIs """
+    ids = {os_id for os_id in ids if os_id is not None}
+    if ids:
+        transaction.on_commit(lambda: _indexar_depois(ids))
+
+
+def reindexar(progresso=None):
+    """ Reconstrói o documento de todas as OS, em lotes por faixa de id """
+    total, ultimo = 0, 0
+    while True:
+        ids = list(
+            ServiceOrder.objects.filter(id__gt=ultimo).order_by('id').values_list('id', flat=True)[:LOTE_REINDEXAR]
+        )
+        if not ids:
+            break
+        with transaction.atomic():
+            total += indexar(ids)
+        ultimo = ids[-1]
+        if progresso:
+            progresso(total)
+    # Documentos órfãos não existem (CASCADE), mas a tabela pode ter sido populada à mão
+    OrderSearchDocument.objects.exclude(order_id__in=ServiceOrder.objects.values('id')).delete()
+    return total
+
+
+# ==========================================================
+# 2. CONSULTA
+# ==========================================================
+
+def termos(texto):
+    """ 'Rua São-João, 12' -> ['rua', 'sao', 'joao', '12'] (só \\w: seguro para montar a query) """
+    return _PALAVRA.findall(normalizar(texto))
+
+
+def _filtro_empresa(coluna, client_id):
+    if client_id is None:
+        return '', []
+    tabela_os = connection.ops.quote_name(ServiceOrder._meta.db_table)
+    return f" AND {coluna} IN (SELECT id FROM {tabela_os} WHERE client_id = %s)", [client_id]
+
+
+def _buscar_postgresql(palavras, limite, client_id):
+    tabela = connection.ops.quote_name(OrderSearchDocument._meta.db_table)
+    filtro, params = _filtro_empresa('order_id', client_id)
+    consulta = ' & '.join(f"{p}:*" for p in palavras)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT order_id FROM {tabela} WHERE vetor @@ to_tsquery('simple', %s){filtro} "
+            f"ORDER BY order_id DESC LIMIT %s",
+            [consulta, *params, limite]
+        )
+        ids = [linha[0] for linha in cursor.fetchall()]
+        if ids:
+            return ids
+
+        # Nada exato: erro de digitação ("marcondez" -> "marcondes") via trigramas. O operador
+        # <% usa o limite pg_trgm.word_similarity_threshold (0.6 por padrão) e o índice GIN.
+        frase = ' '.join(palavras)
+        cursor.execute(
+            f"SELECT order_id FROM {tabela} WHERE %s <%% documento{filtro} "
+            f"ORDER BY word_similarity(%s, documento) DESC, order_id DESC LIMIT %s",
+            [frase, *params, frase, limite]
+        )
+        return [linha[0] for linha in cursor.fetchall()]
+
+
+def _buscar_sqlite(palavras, limite, client_id):
+    filtro, params = _filtro_empresa('rowid', client_id)
+    consulta = ' '.join(f'"{p}"*' for p in palavras)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid FROM {TABELA_FTS} WHERE {TABELA_FTS} MATCH %s{filtro} "
+            f"ORDER BY rowid DESC LIMIT %s",
+            [consulta, *params, limite]
+        )
+        return [linha[0] for linha in cursor.fetchall()]
+
+
+def buscar_ids(texto, limite=LIMITE_PADRAO, client_id=None):
+    """
+    Ids das OS que casam com `texto`, mais recentes primeiro (no fallback de trigramas, as
+    mais parecidas primeiro). `client_id` restringe às OS de uma empresa.
+    """
+    palavras = termos(texto)
+    if not palavras:
+        return []
+    if connection.vendor == 'postgresql':
+        return _buscar_postgresql(palavras, limite, client_id)
+    return _buscar_sqlite(palavras, limite, client_id)
+
+
+def buscar(texto, limite=LIMITE_PADRAO, client_id=None):
+    """ As OS (com empresa e motoboy) na ordem de `buscar_ids` """
+    ids = buscar_ids(texto, limite, client_id)
+    ordens = ServiceOrder.objects.select_related('client', 'motoboy__user').in_bulk(ids)
+    return [ordens[os_id] for os_id in ids if os_id in ordens]
@@ -0,0 +1,483 @@
+# orders/seeding.py
+"""
+Gerador de massa de dados em escala (modo --rapido do `manage.py gerar_os`).
+
+Tudo é montado em colunas: os pools de texto do Faker são gerados uma vez só, os sorteios
+são feitos com NumPy e as chaves estrangeiras saem de aritmética sobre ids reservados
+antes do INSERT. A gravação é por lotes, com INSERT em massa (executemany) ou COPY (PostgreSQL).
+"""
+import csv
+import io
+import json
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from logistics.models import MotoboyProfile, Vehicle
+from .kpis import recalcular as recalcular_kpis
+from .search import reindexar as reindexar_busca
+from .models import (
+    ServiceOrder, OSItem, OSDestination, ItemDistribution, RouteStop,
+    Occurrence, DispatcherDecision,
+)
+
+try:
+    import numpy as np
+except ImportError:  # numpy só é necessário no modo rápido
+    np = None
+
+CustomUser = get_user_model()
+
+# Distribuição de status de uma operação "madura": a maior parte já foi entregue
+DISTRIBUICAO_STATUS = {
+    ServiceOrder.Status.DELIVERED: 0.62,
+    ServiceOrder.Status.CANCELED: 0.06,
+    ServiceOrder.Status.PENDING: 0.10,
+    ServiceOrder.Status.ACCEPTED: 0.08,
+    ServiceOrder.Status.COLLECTED: 0.11,
+    ServiceOrder.Status.PROBLEM: 0.03,
+}
+DISTRIBUICAO_PRIORIDADE = {'NORMAL': 0.75, 'URGENTE': 0.15, 'AGENDADA': 0.10}
+DISTRIBUICAO_VEICULO = {'MOTO': 0.7, 'CARRO': 0.25, 'UTILITARIO': 0.05}
+TAXA_OCORRENCIA_RESOLVIDA = 0.05  # % das entregues que tiveram ocorrência no caminho
+
+# Centro da operação (Porto Alegre) e espalhamento das coordenadas em graus (~15km)
+CENTRO = (-30.0346, -51.2177)
+ESPALHAMENTO = 0.12
+
+DESCRICOES_ITENS = [
+    'Caixa de Documentos', 'Peça de Computador', 'Amostra de Sangue', 'Brinde Corporativo',
+    'Contrato Registrado', 'Equipamento de Rede',
+]
+CAUSAS = [c for c in Occurrence.Causa.values]
+
+
+def _exigir_numpy():
+    if np is None:
+        raise RuntimeError("O modo rápido precisa do NumPy (pip install numpy).")
+
+
+# ==========================================================
+# 1. RESERVA DE IDS E GRAVAÇÃO
+# ==========================================================
+
+def reservar_ids(model, quantidade):
+    """ Reserva ids da sequence da tabela para montar as FKs antes do INSERT """
+    if quantidade <= 0:
+        return np.empty(0, dtype=np.int64)
+    if model is ServiceOrder:
+        from .numbering import alocador
+        return np.array(alocador.reservar(quantidade), dtype=np.int64)
+
+    tabela = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+                [tabela, quantidade]
+            )
+            return np.array(sorted(r[0] for r in cursor.fetchall()), dtype=np.int64)
+
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {connection.ops.quote_name(tabela)}")
+        ultimo = cursor.fetchone()[0]
+        cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = %s", [tabela])
+        linha = cursor.fetchone()
+        if linha:
+            ultimo = max(ultimo, linha[0])
+    return np.arange(ultimo + 1, ultimo + 1 + quantidade, dtype=np.int64)
+
+
+def _completar_colunas(model, colunas, n):
+    """ INSERT direto não aplica os defaults do Django; preenche as colunas que faltam """
+    for campo in model._meta.concrete_fields:
+        if campo.primary_key or campo.attname in colunas:
+            continue
+        if getattr(campo, 'auto_now', False) or getattr(campo, 'auto_now_add', False):
+            valor = timezone.now()
+        elif campo.has_default():
+            valor = campo.get_default()
+        elif campo.null:
+            valor = None
+        else:
+            valor = ''
+        colunas[campo.attname] = [valor] * n
+    return colunas
+
+
+def _preparar_coluna(campo, valores):
+    """ Só datas, decimais e JSON precisam de conversão para o driver """
+    if campo.get_internal_type() in ('DateTimeField', 'DateField', 'DecimalField', 'JSONField'):
+        return [None if v is None else campo.get_db_prep_save(v, connection) for v in valores]
+    return valores
+
+
+def _valor_copy(valor):
+    if valor is None:
+        return r'\N'
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    if isinstance(valor, (list, dict)):
+        return json.dumps(valor)
+    if hasattr(valor, 'isoformat'):
+        return valor.isoformat()
+    return valor
+
+
+class Gravador:
+    """
+    Grava colunas (dict attname -> lista) sem instanciar models: executemany com INSERT
+    direto, ou COPY no PostgreSQL. Montar 500 mil objetos para o bulk_create custava mais
+    que o próprio banco.
+    """
+
+    def __init__(self, usar_copy=False):
+        self.usar_copy = usar_copy and connection.vendor == 'postgresql'
+
+    def gravar(self, model, colunas):
+        n = len(next(iter(colunas.values())))
+        if not n:
+            return
+        _completar_colunas(model, colunas, n)
+        campos = [model._meta.get_field(nome) for nome in colunas]
+        valores = [_preparar_coluna(campo, colunas[campo.attname]) for campo in campos]
+        linhas = zip(*valores)
+        colunas_db = [campo.column for campo in campos]
+        if self.usar_copy:
+            self._copy(model, colunas_db, linhas)
+        else:
+            self._insert(model, colunas_db, linhas)
+
+    def _insert(self, model, colunas_db, linhas):
+        sql = (
+            f"INSERT INTO {connection.ops.quote_name(model._meta.db_table)} "
+            f"({', '.join(connection.ops.quote_name(c) for c in colunas_db)}) "
+            f"VALUES ({', '.join(['%s'] * len(colunas_db))})"
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, list(linhas))
+
+    def _copy(self, model, colunas_db, linhas):
+        buffer = io.StringIO()
+        escritor = csv.writer(buffer)
+        for linha in linhas:
+            escritor.writerow([_valor_copy(v) for v in linha])
+        buffer.seek(0)
+
+        sql = (
+            f"COPY {connection.ops.quote_name(model._meta.db_table)} "
+            f"({', '.join(connection.ops.quote_name(c) for c in colunas_db)}) "
+            f"FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+        )
+        with connection.cursor() as cursor:
+            bruto = cursor.cursor
+            if hasattr(bruto, 'copy_expert'):  # psycopg2
+                bruto.copy_expert(sql, buffer)
+            else:  # psycopg 3
+                with bruto.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
+
+
+# ==========================================================
+# 2. POOLS E CADASTROS DE APOIO
+# ==========================================================
+
+class Pools:
+    """ Textos do Faker gerados uma única vez e sorteados por índice """
+
+    def __init__(self, fake, tamanho=2000):
+        self.nomes = np.array([fake.name() for _ in range(tamanho)], dtype=object)
+        self.empresas = np.array([fake.company() for _ in range(tamanho)], dtype=object)
+        self.ruas = np.array([fake.street_name() for _ in range(tamanho)], dtype=object)
+        self.numeros = np.array([fake.building_number() for _ in range(tamanho)], dtype=object)
+        self.bairros = np.array([fake.bairro() for _ in range(tamanho // 10)], dtype=object)
+        self.cidades = np.array([fake.city() for _ in range(tamanho // 50)], dtype=object)
+        self.ufs = np.array([fake.estado_sigla() for _ in range(tamanho // 50)], dtype=object)
+        self.ceps = np.array([fake.postcode() for _ in range(tamanho)], dtype=object)
+        self.telefones = np.array([fake.phone_number() for _ in range(tamanho)], dtype=object)
+        self.primeiros_nomes = np.array([fake.first_name() for _ in range(tamanho)], dtype=object)
+        self.complementos = np.array(['', 'Sala 2', 'Apt 101', 'Casa B', 'Fundos'], dtype=object)
+        self.descricoes = np.array(DESCRICOES_ITENS, dtype=object)
+
+
+def _sortear(rng, pool, n):
+    return pool[rng.integers(0, len(pool), n)]
+
+
+def _escolher(rng, distribuicao, n):
+    chaves = list(distribuicao.keys())
+    pesos = np.array(list(distribuicao.values()), dtype=float)
+    return np.array(chaves, dtype=object)[rng.choice(len(chaves), size=n, p=pesos / pesos.sum())]
+
+
+def garantir_empresas(fake, quantidade, senha_hash):
+    existentes = list(CustomUser.objects.filter(type='COMPANY').values_list('id', flat=True)[:quantidade])
+    faltam = quantidade - len(existentes)
+    if faltam > 0:
+        novos = CustomUser.objects.bulk_create([
+            CustomUser(
+                username=f'empresa_{fake.unique.user_name()}', email=fake.company_email(),
+                password=senha_hash, first_name=fake.company()[:150], type='COMPANY'
+            ) for _ in range(faltam)
+        ])
+        existentes += [u.id for u in novos]
+    return np.array(existentes, dtype=np.int64)
+
+
+def garantir_motoboys(fake, quantidade, senha_hash, rng):
+    existentes = list(MotoboyProfile.objects.values_list('id', flat=True)[:quantidade])
+    faltam = quantidade - len(existentes)
+    if faltam > 0:
+        usuarios = CustomUser.objects.bulk_create([
+            CustomUser(
+                username=f'motoboy_{fake.unique.user_name()}', password=senha_hash,
+                first_name=fake.first_name(), phone=fake.phone_number(), type='MOTOBOY'
+            ) for _ in range(faltam)
+        ])
+        perfis = MotoboyProfile.objects.bulk_create([
+            MotoboyProfile(
+                user=u, cnh_number=fake.numerify('###########'), vehicle_plate=fake.license_plate()[:10],
+                category=rng.choice(['TELE', 'DIARIA', 'MENSAL']), is_available=bool(rng.random() < 0.85)
+            ) for u in usuarios
+        ])
+        tipos = _escolher(rng, {'MOTO': 0.8, 'CARRO': 0.15, 'VAN': 0.05}, len(perfis))
+        Vehicle.objects.bulk_create([
+            Vehicle(owner=p, plate=p.vehicle_plate, brand='Frota Teste', type=t) for p, t in zip(perfis, tipos)
+        ])
+        existentes += [p.id for p in perfis]
+    return np.array(existentes, dtype=np.int64)
+
+
+# ==========================================================
+# 3. GERAÇÃO DE UM LOTE DE OS (VETORIZADA)
+# ==========================================================
+
+class GeradorRapido:
+    def __init__(self, fake, rng, empresas, motoboys, dias=90, usar_copy=False, despachante_id=None):
+        _exigir_numpy()
+        self.rng = rng
+        self.pools = Pools(fake)
+        self.empresas = empresas
+        self.motoboys = motoboys
+        self.dias = dias
+        self.gravador = Gravador(usar_copy=usar_copy)
+        self.despachante_id = despachante_id
+        self.agora = timezone.now()
+        # Última sequência usada na rota aberta de cada motoboy (paradas novas entram no fim)
+        self.seq_motoboy = dict(
+            RouteStop.objects.filter(motoboy_id__in=motoboys.tolist(), is_completed=False, sequence__lt=900)
+            .values('motoboy_id').annotate(ultima=Max('sequence')).values_list('motoboy_id', 'ultima')
+        )
+
+    def _datas(self, segundos):
+        return [self.agora - timedelta(seconds=float(s)) for s in segundos]
+
+    def gerar_lote(self, n):
+        rng, P = self.rng, self.pools
+        S = ServiceOrder.Status
+
+        # ---------------- OS ----------------
+        os_ids = reservar_ids(ServiceOrder, n)
+        status = _escolher(rng, DISTRIBUICAO_STATUS, n)
+        atribuida = ~np.isin(status, [S.PENDING, S.CANCELED])
+        motoboy = np.where(atribuida, self.motoboys[rng.integers(0, len(self.motoboys), n)], -1)
+        # Em aberto = criadas nas últimas horas; finalizadas espalhadas pelo histórico
+        finalizada = np.isin(status, [S.DELIVERED, S.CANCELED])
+        idade = np.where(finalizada, rng.uniform(3600, self.dias * 86400, n), rng.uniform(60, 6 * 3600, n))
+        criado = self._datas(idade)
+        coletada = np.isin(status, [S.COLLECTED, S.DELIVERED]) | ((status == S.PROBLEM) & (rng.random(n) < 0.5))
+        min_coleta = rng.uniform(10, 60, n)
+
+        n_dest = rng.integers(1, 4, n)
+        origem_lat = CENTRO[0] + rng.normal(0, ESPALHAMENTO / 2, n)
+        origem_lng = CENTRO[1] + rng.normal(0, ESPALHAMENTO / 2, n)
+
+        self.gravador.gravar(ServiceOrder, {
+            'id': os_ids.tolist(),
+            'os_number': [f"OS-{str(i).zfill(4)}" for i in os_ids.tolist()],
+            'group_root_id': os_ids.tolist(),  # Massa sem mesclas: cada OS é a mãe do próprio grupo
+            'created_at': criado,
+            'priority': _escolher(rng, DISTRIBUICAO_PRIORIDADE, n).tolist(),
+            'status': status.tolist(),
+            'client_id': self.empresas[rng.integers(0, len(self.empresas), n)].tolist(),
+            'motoboy_id': [None if m < 0 else int(m) for m in motoboy.tolist()],
+            'requester_name': _sortear(rng, P.nomes, n).tolist(),
+            'requester_phone': _sortear(rng, P.telefones, n).tolist(),
+            'vehicle_type': _escolher(rng, DISTRIBUICAO_VEICULO, n).tolist(),
+            'origin_name': _sortear(rng, P.empresas, n).tolist(),
+            'origin_responsible': _sortear(rng, P.primeiros_nomes, n).tolist(),
+            'origin_phone': _sortear(rng, P.telefones, n).tolist(),
+            'origin_street': _sortear(rng, P.ruas, n).tolist(),
+            'origin_number': _sortear(rng, P.numeros, n).tolist(),
+            'origin_district': _sortear(rng, P.bairros, n).tolist(),
+            'origin_city': _sortear(rng, P.cidades, n).tolist(),
+            'origin_state': _sortear(rng, P.ufs, n).tolist(),
+            'origin_zip_code': _sortear(rng, P.ceps, n).tolist(),
+            'origin_lat': origem_lat.tolist(),
+            'origin_lng': origem_lng.tolist(),
+            'collected_at': [c + timedelta(minutes=float(m)) if ok else None for c, m, ok in zip(criado, min_coleta, coletada)],
+            'is_multiple_delivery': (n_dest > 1).tolist(),
+        })
+
+        # ---------------- DESTINOS / ITENS / DISTRIBUIÇÃO ----------------
+        d = int(n_dest.sum())
+        dono = np.repeat(np.arange(n), n_dest)  # índice da OS de cada destino
+        dest_ids = reservar_ids(OSDestination, d)
+        item_ids = reservar_ids(OSItem, d)
+        entregue = status[dono] == S.DELIVERED
+        min_entrega = min_coleta[dono] + rng.uniform(15, 120, d)
+        criado_dest = [criado[k] for k in dono.tolist()]
+        entregue_em = [c + timedelta(minutes=float(m)) if ok else None for c, m, ok in zip(criado_dest, min_entrega, entregue)]
+
+        self.gravador.gravar(OSDestination, {
+            'id': dest_ids.tolist(),
+            'order_id': os_ids[dono].tolist(),
+            'destination_name': _sortear(rng, P.nomes, d).tolist(),
+            'destination_phone': _sortear(rng, P.telefones, d).tolist(),
+            'destination_street': _sortear(rng, P.ruas, d).tolist(),
+            'destination_number': _sortear(rng, P.numeros, d).tolist(),
+            'destination_complement': _sortear(rng, P.complementos, d).tolist(),
+            'destination_district': _sortear(rng, P.bairros, d).tolist(),
+            'destination_state': _sortear(rng, P.ufs, d).tolist(),
+            'destination_city': _sortear(rng, P.cidades, d).tolist(),
+            'destination_zip_code': _sortear(rng, P.ceps, d).tolist(),
+            'destination_lat': (CENTRO[0] + rng.normal(0, ESPALHAMENTO, d)).tolist(),
+            'destination_lng': (CENTRO[1] + rng.normal(0, ESPALHAMENTO, d)).tolist(),
+            'is_delivered': entregue.tolist(),
+            'delivered_at': entregue_em,
+            'receiver_name': np.where(entregue, _sortear(rng, P.primeiros_nomes, d), '').tolist(),
+        })
+
+        quantidade = rng.integers(1, 6, d)
+        status_item = np.full(d, OSItem.ItemStatus.NAO_COLETADO, dtype=object)
+        em_posse = coletada[dono] & ~entregue
+        status_item[em_posse] = OSItem.ItemStatus.COLETADO
+        status_item[entregue] = OSItem.ItemStatus.ENTREGUE
+        self.gravador.gravar(OSItem, {
+            'id': item_ids.tolist(),
+            'order_id': os_ids[dono].tolist(),
+            'description': _sortear(rng, P.descricoes, d).tolist(),
+            'total_quantity': quantidade.tolist(),
+            'status': status_item.tolist(),
+            'posse_atual_id': [int(m) if ok else None for m, ok in zip(motoboy[dono].tolist(), em_posse)],
+            'item_type': ['Pacote'] * d,
+            'weight': np.round(rng.uniform(0.2, 8.0, d), 2).tolist(),
+            'dimensions': [f"{a}x{b}x{c}" for a, b, c in rng.integers(10, 60, (d, 3)).tolist()],
+        })
+
+        self.gravador.gravar(ItemDistribution, {
+            'id': reservar_ids(ItemDistribution, d).tolist(),
+            'item_id': item_ids.tolist(),
+            'destination_id': dest_ids.tolist(),
+            'quantity_allocated': quantidade.tolist(),
+        })
+
+        # ---------------- PARADAS (1 coleta + 1 entrega por destino) ----------------
+        total_paradas = n + d
+        stop_ids = reservar_ids(RouteStop, total_paradas)
+        entrega_ids = stop_ids[n:]
+        primeiro_destino = np.cumsum(n_dest) - n_dest
+        posicao_no_pedido = np.arange(d) - np.repeat(primeiro_destino, n_dest)
+        # OS em OCORRENCIA: o problema foi na coleta ou, se já coletou, na 1ª entrega
+        problema = np.flatnonzero(status == S.PROBLEM)
+        parada_problema = np.where(coletada[problema], n + primeiro_destino[problema], problema)
+
+        concluida = np.concatenate([coletada, entregue])
+        concluida_em = [
+            c + timedelta(minutes=float(m)) if ok else None
+            for c, m, ok in zip(criado, min_coleta, coletada)
+        ] + entregue_em
+        motoboy_parada = np.concatenate([motoboy, motoboy[dono]])
+        sequencias = np.concatenate([np.ones(n, dtype=np.int64), posicao_no_pedido + 2])
+
+        # Paradas abertas entram no fim da rota do motoboy, como no assign_motoboy_view
+        for k in np.flatnonzero(~concluida & (motoboy_parada >= 0)).tolist():
+            mb = int(motoboy_parada[k])
+            self.seq_motoboy[mb] = self.seq_motoboy.get(mb, 0) + 1
+            sequencias[k] = self.seq_motoboy[mb]
+
+        status_parada = np.where(concluida, RouteStop.StopStatus.CONCLUIDA, RouteStop.StopStatus.PENDENTE).astype(object)
+        status_parada[parada_problema] = RouteStop.StopStatus.COM_OCORRENCIA
+        self.gravador.gravar(RouteStop, {
+            'id': stop_ids.tolist(),
+            'motoboy_id': [None if m < 0 else int(m) for m in motoboy_parada.tolist()],
+            'service_order_id': np.concatenate([os_ids, os_ids[dono]]).tolist(),
+            'stop_type': ['COLETA'] * n + ['ENTREGA'] * d,
+            'destination_id': [None] * n + dest_ids.tolist(),
+            'sequence': sequencias.tolist(),
+            'status': status_parada.tolist(),
+            'is_completed': concluida.tolist(),
+            'completed_at': concluida_em,
+        })
+
+        # ---------------- OCORRÊNCIAS E DECISÕES ----------------
+        # Abertas: OS em OCORRENCIA. Resolvidas: uma parte das entregues (com decisão do despachante).
+        resolvidas = np.flatnonzero(entregue & (posicao_no_pedido == 0) & (rng.random(d) < TAXA_OCORRENCIA_RESOLVIDA))
+
+        paradas_oc = stop_ids[parada_problema].tolist() + entrega_ids[resolvidas].tolist()
+        os_oc = os_ids[problema].tolist() + os_ids[dono[resolvidas]].tolist()
+        mb_oc = motoboy[problema].tolist() + motoboy[dono[resolvidas]].tolist()
+        resolvida = [False] * len(problema) + [True] * len(resolvidas)
+        criado_oc = [criado[k] + timedelta(minutes=30) for k in problema.tolist()]
+        criado_oc += [criado[k] + timedelta(minutes=45) for k in dono[resolvidas].tolist()]
+        m = len(paradas_oc)
+        if m:
+            causas = _sortear(rng, np.array(CAUSAS, dtype=object), m)
+            oc_ids = reservar_ids(Occurrence, m)
+            self.gravador.gravar(Occurrence, {
+                'id': oc_ids.tolist(),
+                'parada_id': paradas_oc,
+                'service_order_id': os_oc,
+                'motoboy_id': mb_oc,
+                'causa': causas.tolist(),
+                'observacao': ['Gerada automaticamente'] * m,
+                'tentativas_contato': rng.integers(0, 4, m).tolist(),
+                'urgencia': np.where(causas == 'ACIDENTE', 'ALTA', 'MEDIA').tolist(),
+                'criado_em': criado_oc,
+                'resolvida': resolvida,
+            })
+            if len(resolvidas):
+                self.gravador.gravar(DispatcherDecision, {
+                    'id': reservar_ids(DispatcherDecision, len(resolvidas)).tolist(),
+                    'occurrence_id': oc_ids[len(problema):].tolist(),
+                    'acao': ['REAGENDAR'] * len(resolvidas),
+                    'detalhes': ['Reagendada (massa de teste)'] * len(resolvidas),
+                    'decidido_por_id': [self.despachante_id] * len(resolvidas),
+                    'decidido_em': criado_oc[len(problema):],
+                })
+
+        return {'os': n, 'destinos': d, 'paradas': total_paradas, 'ocorrencias': m}
+
+
+def gerar_massa(quantidade, fake, seed=None, lote=5000, motoboys=50, empresas=20, dias=90,
+                usar_copy=False, progresso=None):
+    """ Gera `quantidade` OS com toda a operação em volta. Retorna os totais gerados. """
+    _exigir_numpy()
+    rng = np.random.default_rng(seed)
+    senha_hash = make_password('senha_teste')
+
+    ids_empresas = garantir_empresas(fake, empresas, senha_hash)
+    ids_motoboys = garantir_motoboys(fake, motoboys, senha_hash, rng)
+    despachante = CustomUser.objects.filter(type='DISPATCHER').values_list('id', flat=True).first()
+
+    gerador = GeradorRapido(fake, rng, ids_empresas, ids_motoboys, dias=dias,
+                            usar_copy=usar_copy, despachante_id=despachante)
+    totais = {'os': 0, 'destinos': 0, 'paradas': 0, 'ocorrencias': 0}
+    restante = quantidade
+    while restante > 0:
+        n = min(lote, restante)
+        with transaction.atomic():
+            parcial = gerador.gerar_lote(n)
+        for chave, valor in parcial.items():
+            totais[chave] += valor
+        restante -= n
+        if progresso:
+            progresso(totais)
+
+    # A gravação passa por fora do ORM: os KPIs materializados e a busca não viram as escritas
+    recalcular_kpis()
+    reindexar_busca()
+    return totais
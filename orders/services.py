@@ -1,11 +1,27 @@
+import logging
+import time
+
 from django.db import transaction, models
-from django.db.models import Q, Value, Max, F
+from django.db.models import Value, Max, F
 from django.db.models.functions import Concat
+from logistics.models import MotoboyProfile
 from .models import ServiceOrder, RouteStop, OSItem, Occurrence, DispatcherDecision
+from .transitions import transicionar, transicionar_varias
+from .groups import raiz, paradas_do_grupo
+from .jobs import tarefa
+from .routing import aplicar_rota
+
+logger = logging.getLogger(__name__)
 
 @transaction.atomic
 def transferir_rota_por_acidente(ocorrencia_id, novo_motoboy_id, local_transferencia_str, despachante_user, furar_fila=False, transfer_all_cargo=False):
-    ocorrencia = Occurrence.objects.select_for_update().get(id=ocorrencia_id)
+    """
+    Resgate: passa a rota do motoboy acidentado para `novo_motoboy_id`.
+    Só operações de conjunto (UPDATE / bulk_update / bulk_create): o número de queries não
+    cresce com o tamanho do baú. Retorna um resumo com as contagens e o tempo gasto.
+    """
+    inicio = time.monotonic()
+    ocorrencia = Occurrence.objects.select_for_update().select_related('service_order', 'motoboy').get(id=ocorrencia_id)
     os_atual = ocorrencia.service_order
     motoboy_antigo = ocorrencia.motoboy
     
@@ -14,51 +30,46 @@ def transferir_rota_por_acidente(ocorrencia_id, novo_motoboy_id, local_transfere
 
     # 1. Tira o motoboy acidentado de circulação
     motoboy_antigo.is_available = False
-    motoboy_antigo.save()
+    motoboy_antigo.save(update_fields=['is_available'])
 
     # Define a OS "Mãe" do acidente (a que vai receber as outras)
-    root_os = os_atual.parent_os or os_atual
+    root_os = raiz(os_atual)
 
     # 👇 --- A MÁGICA DA MESCLA: TRANSFORMA AS CARGAS EXTRAS EM FILHAS DA OS ATUAL --- 👇
+    raizes_extras = set()
     if transfer_all_cargo:
-        outras_os_coletadas = ServiceOrder.objects.filter(
-            motoboy=motoboy_antigo,
-            status='COLETADO'
-        ).exclude(
-            Q(id=root_os.id) | Q(parent_os=root_os)
+        # Mães dos grupos já coletados que estão no baú (uma query, sem resolver OS por OS)
+        raizes_extras = set(
+            ServiceOrder.objects.filter(motoboy=motoboy_antigo, status='COLETADO')
+            .exclude(group_root_id=root_os.id)
+            .values_list('group_root_id', flat=True).order_by().distinct()
         )
-        
-        if outras_os_coletadas.exists():
-            for os_extra in outras_os_coletadas:
-                # Encontra a raiz da carga extra
-                root_extra = os_extra.parent_os or os_extra
-
-                # Transforma a raiz extra numa FILHA da OS do acidente
-                root_extra.parent_os = root_os
-                root_extra.status = 'AGRUPADO'
-                root_extra.operational_notes += f"\n[AGRUPADA NO RESGATE] Mesclada com a OS principal {root_os.os_number}."
-                root_extra.save()
-
-                # Se a extra já tinha filhas, achata a árvore passando elas para a OS do acidente
-                ServiceOrder.objects.filter(parent_os=root_extra).update(parent_os=root_os)
+        if raizes_extras:
+            # Cada mãe extra vira FILHA da OS do acidente: status, parent_os e nota num único UPDATE
+            transicionar_varias(
+                ServiceOrder.objects.filter(id__in=raizes_extras), 'AGRUPADO', despachante_user,
+                parent_os=root_os,
+                operational_notes=Concat(
+                    F('operational_notes'),
+                    Value(f"\n[AGRUPADA NO RESGATE] Mesclada com a OS principal {root_os.os_number}."),
+                ),
+            )
+            # Achata a árvore: as filhas das extras passam direto para a OS do acidente
+            ServiceOrder.objects.filter(group_root_id__in=raizes_extras).update(parent_os=root_os)
 
             root_os.is_multiple_delivery = True
             root_os.operational_notes += f"\n[GRUPO DE RESGATE] Absorveu cargas extras que estavam retidas no baú."
-            root_os.save()
     # 👆 ----------------------------------------------------------------------------- 👆
 
-    # 2. Agora que mesclamos tudo, o nosso grupo de trabalho é o pacote completo!
-    grouped_orders = ServiceOrder.objects.filter(Q(id=root_os.id) | Q(parent_os=root_os))
+    # 2. Agora que mesclamos tudo, o nosso grupo de trabalho é o pacote completo (group_root_id = root_os)!
 
     # 3. Devolve para a fila APENAS as OS que não foram coletadas e não entraram na mescla
     outras_os_pendentes = ServiceOrder.objects.filter(
         motoboy=motoboy_antigo, 
         status__in=['PENDENTE', 'ACEITO']
-    ).exclude(
-        id__in=grouped_orders.values_list('id', flat=True)
-    )
+    ).exclude(group_root_id=root_os.id)
     RouteStop.objects.filter(service_order__in=outras_os_pendentes, is_completed=False).update(motoboy=None, status='PENDENTE')
-    outras_os_pendentes.update(motoboy=None, status='PENDENTE')
+    devolvidas = transicionar_varias(outras_os_pendentes, 'PENDENTE', despachante_user, motoboy=None)['ids']
 
     # Registra a decisão
     DispatcherDecision.objects.create(
@@ -69,82 +80,72 @@ def transferir_rota_por_acidente(ocorrencia_id, novo_motoboy_id, local_transfere
     )
 
     # Lógica de Sequência para o novo motoboy
-    def calcular_sequencia_novo_motoboy():
-        if furar_fila:
-            RouteStop.objects.filter(motoboy_id=novo_motoboy_id, is_completed=False).update(sequence=F('sequence') + 10)
-            return 1
-        else:
-            ultima = RouteStop.objects.filter(motoboy_id=novo_motoboy_id).aggregate(Max('sequence'))['sequence__max'] or 0
-            return ultima + 1
+    if furar_fila:
+        RouteStop.objects.filter(motoboy_id=novo_motoboy_id, is_completed=False).update(sequence=F('sequence') + 10)
+        seq_transferencia = 1
+    else:
+        ultima = RouteStop.objects.filter(motoboy_id=novo_motoboy_id).aggregate(Max('sequence'))['sequence__max'] or 0
+        seq_transferencia = ultima + 1
 
-    seq_transferencia = calcular_sequencia_novo_motoboy()
+    # Congela a lista de paradas do grupo gigante ANTES de criarmos as paradas de transferência
+    paradas_pendentes = list(paradas_do_grupo(root_os).filter(
+        motoboy=motoboy_antigo, 
+        is_completed=False
+    ).order_by('sequence'))
 
     # O sistema confia na parada de COLETA (Verificamos se QUALQUER OS do grupo gigante já foi coletada)
-    tem_itens_na_bag = RouteStop.objects.filter(
-        service_order__in=grouped_orders, 
+    tem_itens_na_bag = paradas_do_grupo(root_os).filter(
         stop_type='COLETA', 
         is_completed=True
     ).exists()
-    
-    # Congela a lista de paradas do grupo gigante ANTES de criarmos as paradas de transferência
-    paradas_pendentes = list(RouteStop.objects.filter(
-        service_order__in=grouped_orders, 
-        motoboy=motoboy_antigo, 
-        is_completed=False
-    ).order_by('sequence'))
+
+    # Com carga, a 1ª posição da fila nova é a parada de resgate; as do grupo vêm logo depois
+    primeira = seq_transferencia + 1 if tem_itens_na_bag else seq_transferencia
+    for index, p in enumerate(paradas_pendentes):
+        p.sequence = primeira + index
+        p.motoboy_id = novo_motoboy_id
+        p.status = RouteStop.StopStatus.PENDENTE
+        p.is_failed = False
+        p.failure_reason = ""
+        p.bloqueia_proxima = False
+    # Uma escrita para o baú inteiro (no PostgreSQL, um único UPDATE ... CASE)
+    RouteStop.objects.bulk_update(
+        paradas_pendentes, ['sequence', 'motoboy', 'status', 'is_failed', 'failure_reason', 'bloqueia_proxima']
+    )
 
     if not tem_itens_na_bag:
         # --- TRANSFERÊNCIA LIMPA (Acidente ANTES de pegar o pacote na loja) ---
-        for index, p in enumerate(paradas_pendentes):
-            p.sequence = seq_transferencia + index
-            p.motoboy_id = novo_motoboy_id
-            p.status = RouteStop.StopStatus.PENDENTE
-            p.is_failed = False
-            p.failure_reason = ""
-            p.bloqueia_proxima = False
-            p.save()
-            
         root_os.operational_notes += f"\n[TRANSFERÊNCIA LIMPA] Rota repassada para outro técnico antes da coleta."
         novo_status_os = 'ACEITO'
         
     else:
         # --- TRANSFERÊNCIA COM CARGA (O Baú está cheio) ---
-        
-        # Cria UMA ÚNICA parada de aviso para o motoboy antigo
-        RouteStop.objects.create(
-            service_order=root_os,
-            motoboy=motoboy_antigo,
-            stop_type='TRANSFERENCIA',
-            sequence=1,
-            status=RouteStop.StopStatus.PENDENTE,
-            failure_reason=f"AGUARDE O RESGATE AQUI: {local_transferencia_str}",
-            bloqueia_proxima=True
-        )
-
-        # Passa os destinos do grupo gigante para o novo motoboy
-        for index, p in enumerate(paradas_pendentes):
-            p.sequence = seq_transferencia + index + 1
-            p.motoboy_id = novo_motoboy_id
-            p.status = RouteStop.StopStatus.PENDENTE
-            p.is_failed = False
-            p.failure_reason = ""
-            p.bloqueia_proxima = False
-            p.save()
-
-        # Cria UMA ÚNICA parada de resgate para o novo motoboy
-        RouteStop.objects.create(
-            service_order=root_os,
-            motoboy_id=novo_motoboy_id,
-            stop_type='TRANSFERENCIA',
-            sequence=seq_transferencia,
-            failure_reason=f"Resgatar carga(s) de colega acidentado: {local_transferencia_str}",
-            status=RouteStop.StopStatus.PENDENTE,
-            bloqueia_proxima=True
-        )
+        RouteStop.objects.bulk_create([
+            # UMA ÚNICA parada de aviso para o motoboy antigo
+            RouteStop(
+                service_order=root_os,
+                motoboy=motoboy_antigo,
+                stop_type='TRANSFERENCIA',
+                sequence=1,
+                status=RouteStop.StopStatus.PENDENTE,
+                failure_reason=f"AGUARDE O RESGATE AQUI: {local_transferencia_str}",
+                bloqueia_proxima=True
+            ),
+            # UMA ÚNICA parada de resgate para o novo motoboy
+            RouteStop(
+                service_order=root_os,
+                motoboy_id=novo_motoboy_id,
+                stop_type='TRANSFERENCIA',
+                sequence=seq_transferencia,
+                failure_reason=f"Resgatar carga(s) de colega acidentado: {local_transferencia_str}",
+                status=RouteStop.StopStatus.PENDENTE,
+                bloqueia_proxima=True
+            ),
+        ])
 
         # Atualiza TODOS os itens de TODAS as OS mescladas
         OSItem.objects.filter(
-            order__in=grouped_orders, 
+            order__group_root_id=root_os.id, 
             posse_atual=motoboy_antigo, 
             status=OSItem.ItemStatus.COLETADO
         ).update(
@@ -157,12 +158,146 @@ def transferir_rota_por_acidente(ocorrencia_id, novo_motoboy_id, local_transfere
         novo_status_os = 'COLETADO'
 
     ocorrencia.resolvida = True
-    ocorrencia.save()
+    ocorrencia.save(update_fields=['resolvida'])
 
     # Atualiza tudo para o novo motoboy. As filhas ficam 'AGRUPADO' e a Mãe fica 'COLETADO'
-    grouped_orders.exclude(id=root_os.id).update(motoboy_id=novo_motoboy_id, status='AGRUPADO')
-    root_os.status = novo_status_os
-    root_os.motoboy_id = novo_motoboy_id
-    root_os.save()
-    
-    return True
\ No newline at end of file
+    transicionar(root_os, novo_status_os, despachante_user, status_filhas='AGRUPADO', motoboy_id=novo_motoboy_id)
+    root_os.save(update_fields=['operational_notes', 'is_multiple_delivery'])
+
+    resumo = {
+        'os_principal': root_os.os_number,
+        'grupos_mesclados': len(raizes_extras),
+        'paradas_transferidas': len(paradas_pendentes),
+        'os_devolvidas': len(devolvidas),
+        'com_carga': tem_itens_na_bag,
+        'tempo_ms': round((time.monotonic() - inicio) * 1000, 1),
+    }
+    logger.info("Resgate da ocorrência %s: %s", ocorrencia_id, resumo)
+    return resumo
+
+
+# ==========================================================
+# TAREFAS EM SEGUNDO PLANO (orders/jobs.py)
+# ==========================================================
+
+@tarefa('transferir_rota')
+def _tarefa_transferir_rota(usuario, ocorrencia_id, novo_motoboy_id, local_transferencia, furar_fila=False, transfer_all_cargo=False):
+    resumo = transferir_rota_por_acidente(ocorrencia_id, novo_motoboy_id, local_transferencia, usuario, furar_fila, transfer_all_cargo)
+    return {'ocorrencia_id': ocorrencia_id, 'novo_motoboy_id': novo_motoboy_id, **resumo}
+
+
+@tarefa('reagendar_parada')
+def reagendar_parada(usuario, ocorrencia_id, incluir_novo_endereco=False):
+    """ Decisão REAGENDAR: reposiciona a parada na fila do motoboy, reativa o grupo e fecha a ocorrência """
+    ocorrencia = Occurrence.objects.select_for_update().get(id=ocorrencia_id)
+    if ocorrencia.resolvida:
+        raise ValueError("Esta ocorrência já foi resolvida.")
+    parada = ocorrencia.parada
+
+    # --- REORDENAÇÃO INTELIGENTE DA ROTA ---
+    if parada.motoboy_id:
+        # Puxa (e trava) a fila atual de paradas do motoboy
+        paradas_pendentes = list(RouteStop.objects.select_for_update().filter(
+            motoboy_id=parada.motoboy_id,
+            is_completed=False
+        ).order_by('sequence'))
+
+        # Salva os números de sequência originais que estão livres
+        # Ex: se ele já fez a parada 1, isso vai salvar [2, 3, 4]
+        sequencias_disponiveis = sorted(p.sequence for p in paradas_pendentes if p.sequence < 900)
+
+        # Remove a parada atual da lista para reposicioná-la
+        if parada in paradas_pendentes:
+            paradas_pendentes.remove(parada)
+
+        if parada.stop_type == 'COLETA':
+            if not paradas_pendentes:
+                paradas_pendentes.append(parada)
+            else:
+                parada_atual = paradas_pendentes[0]
+                # A coleta reagendada entra LOGO APÓS a tarefa que o motoboy faz agora
+                paradas_pendentes.insert(1, parada)
+
+                # Trava de Segurança: Se ele estiver indo entregar essa OS, a coleta PASSA NA FRENTE
+                if parada_atual.service_order_id == parada.service_order_id and parada_atual.stop_type in ['ENTREGA', 'DEVOLUCAO']:
+                    paradas_pendentes.remove(parada)
+                    paradas_pendentes.insert(0, parada)
+        else:
+            # Se for ENTREGA que falhou, joga pro fim da fila pendente
+            paradas_pendentes.append(parada)
+
+        # Usa as sequências originais para não atropelar as concluídas!
+        for index, p in enumerate(paradas_pendentes):
+            if index < len(sequencias_disponiveis):
+                p.sequence = sequencias_disponiveis[index]
+            else:
+                p.sequence = (sequencias_disponiveis[-1] + 1) if sequencias_disponiveis else 1
+
+    # A parada reagendada volta limpa (com ou sem motoboy vinculado)
+    parada.is_failed = False
+    parada.bloqueia_proxima = False
+    parada.status = RouteStop.StopStatus.PENDENTE
+    parada.failure_reason = ""
+    if parada.motoboy_id:
+        RouteStop.objects.bulk_update(
+            paradas_pendentes, ['sequence', 'is_failed', 'bloqueia_proxima', 'status', 'failure_reason']
+        )
+    else:
+        parada.save()
+
+    # --- ATUALIZA OS STATUS DA OS E FINALIZA OCORRÊNCIA ---
+    root_os = raiz(ocorrencia.service_order)
+    group_stops = paradas_do_grupo(root_os)
+    new_status = 'COLETADO' if group_stops.filter(stop_type='COLETA', is_completed=True).exists() else 'ACEITO'
+    transicionar(root_os, new_status, usuario)
+
+    if incluir_novo_endereco:
+        root_os.operational_notes += (
+            f"\n[ENDERECO ATUALIZADO] Tentativa reativada com novo endereco na parada {parada.get_stop_type_display()}."
+        )
+        root_os.save(update_fields=['operational_notes'])
+
+    DispatcherDecision.objects.create(
+        occurrence=ocorrencia, acao=DispatcherDecision.Acao.REAGENDAR,
+        detalhes="O despachante mandou re-tentar ou ignorar o bloqueio.",
+        decidido_por=usuario
+    )
+    ocorrencia.resolvida = True
+    ocorrencia.save()
+    return {'ocorrencia_id': ocorrencia.id, 'os_id': root_os.id, 'status': new_status}
+
+
+def atribuir_paradas(os_obj, motoboy):
+    """
+    Joga as paradas do grupo (mãe + filhas) no fim da fila do motoboy. Idempotente: paradas
+    que já são dele ficam onde estão, então repetir não duplica a rota. Retorna quantas moveu.
+    Roda dentro da transação da atribuição: OS em ACEITO sempre tem as paradas na fila.
+    """
+    # Trava a fila do motoboy enquanto calcula a próxima sequência
+    last_seq = len(RouteStop.objects.select_for_update().filter(motoboy=motoboy, is_completed=False).values_list('id', flat=True))
+
+    novas = [stop for stop in paradas_do_grupo(os_obj).order_by('sequence') if stop.motoboy_id != motoboy.id]
+    for stop in novas:
+        last_seq += 1
+        stop.motoboy = motoboy
+        stop.sequence = last_seq
+    RouteStop.objects.bulk_update(novas, ['motoboy', 'sequence'])
+    return len(novas)
+
+
+@tarefa('atribuir_paradas')
+def _tarefa_atribuir_paradas(usuario, os_id, motoboy_id, otimizar=False):
+    """
+    Complemento da atribuição na fila: confere as paradas e, se pedido, reorganiza a fila inteira
+    do motoboy com o roteirizador. A OS pode ter sido cancelada, devolvida ou passada para outro
+    motoboy antes do worker chegar aqui; nesse caso nada é mexido.
+    """
+    os_obj = ServiceOrder.objects.select_for_update().get(id=os_id)
+    if os_obj.motoboy_id != motoboy_id or os_obj.status in (ServiceOrder.Status.PENDING, ServiceOrder.Status.CANCELED):
+        raise ValueError(f"A OS {os_obj.os_number} não está mais com este motoboy ({os_obj.get_status_display()}).")
+    motoboy = MotoboyProfile.objects.get(id=motoboy_id)
+
+    resultado = {'os_id': os_obj.id, 'motoboy_id': motoboy.id, 'paradas': atribuir_paradas(os_obj, motoboy)}
+    if otimizar:
+        resultado['reordenadas'] = aplicar_rota(motoboy)['alteradas']
+    return resultado
@@ -20,3 +20,81 @@ function openOSDetails(element) {
     modal.show();
 }
 
+function cancelarOS(osId, osNumber) {
+    if (!confirm(`Tem certeza que deseja cancelar a OS ${osNumber}?`)) return;
+    fetch(`/os/${osId}/cancelar/`, {
+        method: 'POST',
+        headers: {'X-CSRFToken': document.getElementById('tabelaAtivas').dataset.csrf}
+    }).then(response => {
+        if (response.ok) window.location.reload();
+        else alert('Erro ao cancelar a OS.');
+    });
+}
+
+function escaparHtml(texto) {
+    const div = document.createElement('div');
+    div.textContent = texto == null ? '' : texto;
+    return div.innerHTML;
+}
+
+function linhaOS(os) {
+    const acaoCancelar = os.status === 'PENDENTE'
+        ? `<button class="btn btn-sm btn-light text-danger border rounded-3 shadow-sm" onclick="cancelarOS(${os.id}, '${escaparHtml(os.os_number)}')" title="Cancelar Solicitação"><i class="bi bi-x-circle"></i></button>`
+        : `<button class="btn btn-sm btn-light text-muted border rounded-3 shadow-sm" disabled title="Não é possível cancelar uma OS que já está em andamento"><i class="bi bi-x-circle"></i></button>`;
+    const [data, hora] = os.criada_em.split(' ');
+    let previsao = '';
+    if (os.previsao_entrega) {
+        previsao = `<br><span class="text-primary fw-bold" style="font-size: 0.7rem;" title="Previsão de entrega"><i class="bi bi-clock"></i> Entrega ~${escaparHtml(os.previsao_entrega)}</span>`;
+    } else if (os.previsao_coleta) {
+        previsao = `<br><span class="text-primary fw-bold" style="font-size: 0.7rem;" title="Previsão de coleta"><i class="bi bi-clock"></i> Coleta ~${escaparHtml(os.previsao_coleta)}</span>`;
+    }
+    return `
+        <tr>
+            <td class="px-4 py-3">
+                <span class="fw-bold font-monospace text-dark">${escaparHtml(os.os_number)}</span><br>
+                <span class="badge bg-light text-secondary border border-secondary border-opacity-25">${escaparHtml(os.priority_display)}</span>
+            </td>
+            <td class="px-4 py-3">
+                <span class="status-badge status-${escaparHtml(os.status)}">${escaparHtml(os.status_display)}</span>
+            </td>
+            <td class="px-4 py-3">
+                <span class="fw-bold text-dark d-block">${escaparHtml(os.origin_name)}</span>
+                <small class="text-slate-500 text-truncate d-inline-block" style="max-width: 200px;">${escaparHtml(os.origin_district)}, ${escaparHtml(os.origin_city)}</small>
+            </td>
+            <td class="px-4 py-3 small text-slate-500">${data}<br>${hora}${previsao}</td>
+            <td class="px-4 py-3 text-end">
+                <div class="d-flex justify-content-end gap-2">
+                    <button class="btn btn-sm btn-light text-primary border rounded-3 shadow-sm"
+                            data-os="${escaparHtml(os.os_number)}" data-status="${escaparHtml(os.status_display)}"
+                            data-origin="${escaparHtml(os.origin_name)}" data-date="${escaparHtml(os.criada_em)}"
+                            onclick="openOSDetails(this)" title="Ver Detalhes">
+                        <i class="bi bi-eye"></i>
+                    </button>
+                    ${acaoCancelar}
+                </div>
+            </td>
+        </tr>`;
+}
+
+// Próximas páginas das OS ativas (paginação por cursor, ver orders/pagination.py)
+function carregarMaisOS(botao) {
+    botao.disabled = true;
+    fetch(`/painel-empresa/os/?situacao=ativas&cursor=${encodeURIComponent(botao.dataset.cursor)}`)
+    .then(res => res.json())
+    .then(data => {
+        if (data.status !== 'success') throw new Error(data.message);
+        document.getElementById('tabelaAtivas').insertAdjacentHTML('beforeend', data.resultados.map(linhaOS).join(''));
+        if (data.proximo) {
+            botao.dataset.cursor = data.proximo;
+            botao.disabled = false;
+        } else {
+            botao.closest('.card-footer').remove();
+        }
+    })
+    .catch(err => {
+        console.error(err);
+        botao.disabled = false;
+        alert('Erro ao carregar mais OS.');
+    });
+}
+
@@ -94,7 +94,8 @@ function submitModalAssign() {
     const motoboyId = document.getElementById('modalCourierSelect').value;
     if (!motoboyId) { alert("⚠️ Selecione um técnico na lista para atribuir a OS."); return; }
     if (!currentModalOsId) return;
-    assignMotoboySecurely(currentModalOsId, motoboyId);
+    const ignorar = document.getElementById('modalIgnorarCapacidade')?.checked || false;
+    assignMotoboySecurely(currentModalOsId, motoboyId, ignorar);
 }
 
 function confirmCancelOS() {
@@ -121,7 +122,7 @@ function verOSCompleta() {
 let currentHasExtraCargo = false;
 let currentOccurrenceOsId = null;
 
-function openDecisionModal(occurrenceId, osId, causaText, obsText, fotoUrl, causaCode = '', stopType = '', hasExtraCargo = 'false') {
+function openDecisionModal(occurrenceId, osId, causaText, obsText, fotoUrl, causaCode = '', stopType = '', hasExtraCargo = 'false', miniaturaUrl = '') {
     document.getElementById('currentOccurrenceId').value = occurrenceId;
     currentOccurrenceOsId = osId;
     document.getElementById('currentOccurrenceCauseCode').value = causaCode || '';
@@ -134,8 +135,13 @@ function openDecisionModal(occurrenceId, osId, causaText, obsText, fotoUrl, caus
     const fotoBox = document.getElementById('decFotoBox');
     const fotoLink = document.getElementById('decFotoLink');
     
+    const fotoMiniatura = document.getElementById('decFotoMiniatura');
+    
     if (fotoUrl && fotoUrl !== 'None' && fotoUrl !== '') {
         fotoLink.href = fotoUrl;
+        // Miniatura só existe depois que o pool otimizou a foto (orders/media.py)
+        fotoMiniatura.classList.toggle('d-none', !miniaturaUrl);
+        fotoMiniatura.src = miniaturaUrl || '';
         fotoBox.classList.remove('d-none');
     } else {
         fotoBox.classList.add('d-none');
@@ -200,6 +206,31 @@ function toggleReagendarAddressBox() {
     if (box) box.classList.toggle('d-none');
 }
 
+// Ações pesadas (transferência, reagendamento) voltam 202 com o id da tarefa: acompanha até terminar
+function aguardarTarefa(urlStatus, aoConcluir, tentativa = 0) {
+    fetch(urlStatus)
+        .then(res => res.json())
+        .then(data => {
+            const tarefa = data.tarefa;
+            if (data.status !== 'success') {
+                document.body.style.cursor = 'default';
+                alert('Erro: ' + data.message);
+            } else if (!tarefa.terminada) {
+                // 1s, 1.5s, 2.25s... até 10s entre consultas
+                setTimeout(() => aguardarTarefa(urlStatus, aoConcluir, tentativa + 1), Math.min(1000 * Math.pow(1.5, tentativa), 10000));
+            } else if (tarefa.status === 'CONCLUIDA') {
+                aoConcluir(tarefa);
+            } else {
+                document.body.style.cursor = 'default';
+                alert('Erro: ' + (tarefa.erro || 'A tarefa falhou.'));
+            }
+        })
+        .catch(err => {
+            console.error(err);
+            setTimeout(() => aguardarTarefa(urlStatus, aoConcluir, tentativa + 1), 5000);
+        });
+}
+
 function submitDecision(acao) {
     const occId = document.getElementById('currentOccurrenceId').value;
     const causaCode = document.getElementById('currentOccurrenceCauseCode')?.value || '';
@@ -242,6 +273,9 @@ function submitDecision(acao) {
     .then(data => {
         if(data.status === 'success') {
             window.location.reload(); 
+        } else if (data.status === 'queued') {
+            document.body.style.cursor = 'wait';
+            aguardarTarefa(data.url_status, () => window.location.reload());
         } else {
             alert('Erro: ' + data.message);
         }
@@ -272,7 +306,12 @@ function buscarCepReagendar(cep) {
         .catch(err => console.error(err));
 }
 
-function submitTransfer() {
+// Baú do motoboy estouraria (orders/capacity.py): o despachante decide se segue assim mesmo
+function confirmarCapacidade(data) {
+    return data.capacidade && confirm(`⚠️ ${data.message}\n\nTransferir mesmo assim?`);
+}
+
+function submitTransfer(ignorarCapacidade = false) {
     const occId = document.getElementById('currentOccurrenceId').value;
     const motoboyId = document.getElementById('socorristaSelect').value;
     const cep = document.getElementById('decTransferCep')?.value || '';
@@ -315,7 +354,8 @@ function submitTransfer() {
             novo_motoboy_id: motoboyId,
             local_encontro: local,
             'furar_fila': document.getElementById('furar_fila').checked,
-            'transfer_all_cargo': transferAllCargo
+            'transfer_all_cargo': transferAllCargo,
+            'ignorar_capacidade': ignorarCapacidade
         })
     })
     .then(response => response.json())
@@ -323,6 +363,14 @@ function submitTransfer() {
         if(data.status === 'success') {
             alert('Transferência executada com segurança!');
             window.location.reload();
+        } else if (data.status === 'queued') {
+            document.body.style.cursor = 'wait';
+            aguardarTarefa(data.url_status, () => {
+                alert('Transferência executada com segurança!');
+                window.location.reload();
+            });
+        } else if (confirmarCapacidade(data)) {
+            submitTransfer(true);
         } else {
             alert('Erro: ' + data.message);
         }
@@ -371,7 +419,10 @@ function dropMerge(ev, targetOsId) {
         })
         .then(data => {
             document.body.style.cursor = 'default';
-            if(data.status === 'success') window.location.reload(); 
+            if(data.status === 'success') {
+                if (data.aviso) alert(data.aviso);
+                window.location.reload();
+            }
             else alert("Erro do sistema: " + data.message);
         })
         .catch(err => {
@@ -412,7 +463,7 @@ function desfazerMescla(childOsId) {
     });
 }
 
-function assignMotoboySecurely(osId, motoboyId) {
+function assignMotoboySecurely(osId, motoboyId, ignorarCapacidade = false) {
     document.body.style.cursor = 'wait';
     const form = document.createElement('form');
     form.method = 'POST';
@@ -429,6 +480,14 @@ function assignMotoboySecurely(osId, motoboyId) {
     inputMotoboy.name = 'motoboy_id';
     inputMotoboy.value = motoboyId;
     form.appendChild(inputMotoboy);
+
+    if (ignorarCapacidade) {
+        const inputIgnorar = document.createElement('input');
+        inputIgnorar.type = 'hidden';
+        inputIgnorar.name = 'ignorar_capacidade';
+        inputIgnorar.value = '1';
+        form.appendChild(inputIgnorar);
+    }
     
     document.body.appendChild(form);
     form.submit();
@@ -554,7 +613,239 @@ function autoRefreshDashboard() {
         })
         .catch(error => console.log('Silencioso: Falha na autossincronização', error));
 }
-setInterval(autoRefreshDashboard, 10000);
+
+// ====================================================
+// TEMPO REAL (SSE): o servidor avisa quando algo muda
+// ====================================================
+// Sem EventSource (ou com o stream caído) voltamos ao polling antigo de 10s.
+// Servidor sem vaga para mais um stream responde 503: o EventSource desiste e tentamos de novo mais tarde.
+const NOVA_TENTATIVA_SSE_MS = 60000;
+// Com o stream aberto, um refresh lento de segurança cobre escritas que não publicam evento (admin, scripts)
+const REFRESH_SEGURANCA_MS = 120000;
+// Delta com mais OS/motoboys que isso recarrega as colunas inteiras (mesmo limite do servidor)
+const MAX_CARDS_DELTA = 50;
+let pollingTimer = null;
+let segurancaTimer = null;
+let refreshPendente = null;
+let deltaPendente = novoDelta();
+
+function iniciarPolling() {
+    if (segurancaTimer) {
+        clearInterval(segurancaTimer);
+        segurancaTimer = null;
+    }
+    if (!pollingTimer) pollingTimer = setInterval(autoRefreshDashboard, 10000);
+}
+
+function pararPolling() {
+    if (pollingTimer) {
+        clearInterval(pollingTimer);
+        pollingTimer = null;
+    }
+    if (!segurancaTimer) segurancaTimer = setInterval(autoRefreshDashboard, REFRESH_SEGURANCA_MS);
+}
+
+function novoDelta() {
+    return { os: new Set(), motoboys: new Set(), ocorrencias: false, tudo: false };
+}
+
+// Junta o que o evento mexeu: só esses cards são buscados de novo
+function registrarDelta(tipo, dados) {
+    if (tipo === 'resync' || tipo === 'os_lote') deltaPendente.tudo = true;
+    if (dados.os_id) deltaPendente.os.add(dados.os_id);
+    (dados.ids || []).forEach(id => deltaPendente.os.add(id));
+    if (dados.motoboy_id) deltaPendente.motoboys.add(dados.motoboy_id);
+    if (tipo === 'ocorrencia') deltaPendente.ocorrencias = true;
+    agendarRefresh();
+}
+
+// Vários eventos seguidos (ex: atribuição de um grupo) viram uma única busca
+function agendarRefresh() {
+    if (refreshPendente) return;
+    refreshPendente = setTimeout(() => {
+        refreshPendente = null;
+        if (isInteracting || isModalOpen) {
+            agendarRefresh();
+            return;
+        }
+        const delta = deltaPendente;
+        deltaPendente = novoDelta();
+        atualizarCards(delta);
+    }, 1000);
+}
+
+function atualizarCards(delta) {
+    if (delta.tudo || delta.os.size + delta.motoboys.size > MAX_CARDS_DELTA) {
+        autoRefreshDashboard();
+        return;
+    }
+    // A OS pode ter saído de um motoboy que o evento não cita (reatribuição, transferência)
+    document.querySelectorAll('#lista-rotas [data-os-ids]').forEach(card => {
+        const ids = card.dataset.osIds.split(' ').filter(Boolean).map(Number);
+        if (ids.some(id => delta.os.has(id))) delta.motoboys.add(Number(card.dataset.motoboyId));
+    });
+
+    const params = new URLSearchParams({
+        os: [...delta.os].join(','),
+        motoboys: [...delta.motoboys].join(','),
+    });
+    // Ocorrência resolvida muda o status da OS: o bloco só volta se tiver card dela
+    const ocorrencias = [...document.querySelectorAll('#painel-ocorrencias [data-os-id]')];
+    if (delta.ocorrencias || ocorrencias.some(card => delta.os.has(Number(card.dataset.osId)))) {
+        params.set('ocorrencias', '1');
+    }
+
+    fetch(`/painel-despacho/cards/?${params}`)
+        .then(res => {
+            if (!res.ok) throw new Error("Status " + res.status);
+            return res.json();
+        })
+        .then(aplicarCards)
+        .catch(error => {
+            console.log('Silencioso: falha ao aplicar o delta, recarregando as colunas', error);
+            autoRefreshDashboard();
+        });
+}
+
+function criarCard(html) {
+    const modelo = document.createElement('template');
+    modelo.innerHTML = html.trim();
+    return modelo.content.firstElementChild;
+}
+
+// Troca o card (ou insere/remove); `inserir` recebe o card novo quando ele ainda não está na tela
+function trocarCard(chave, html, inserir) {
+    const atual = document.querySelector(`[data-card="${chave}"]`);
+    if (!html) {
+        atual?.remove();
+        return;
+    }
+    const novo = criarCard(html);
+    if (atual) atual.replaceWith(novo);
+    else inserir(novo);
+}
+
+// Mesma ordem de fila_despacho(): prioridade desc, criação asc
+function vemAntes(a, b) {
+    if (a.dataset.prioridade !== b.dataset.prioridade) return a.dataset.prioridade > b.dataset.prioridade;
+    if (a.dataset.criada !== b.dataset.criada) return Number(a.dataset.criada) < Number(b.dataset.criada);
+    return Number(a.dataset.id) < Number(b.dataset.id);
+}
+
+function inserirNaFila(card) {
+    const vazia = document.getElementById('fila-vazia');
+    const depois = [...document.querySelectorAll('#lista-fila [data-card^="fila-"]')].find(outro => vemAntes(card, outro));
+    vazia.parentNode.insertBefore(card, depois || vazia);
+}
+
+function aplicarCards(data) {
+    Object.entries(data.fila).forEach(([id, html]) => trocarCard(`fila-${id}`, html, inserirNaFila));
+    Object.entries(data.frota).forEach(([id, html]) => {
+        trocarCard(`frota-${id}`, html, card => document.getElementById('lista-frota').appendChild(card));
+    });
+    Object.entries(data.rotas).forEach(([id, html]) => {
+        trocarCard(`rota-${id}`, html, card => document.getElementById('lista-rotas').appendChild(card));
+    });
+    if (data.ocorrencias !== undefined) {
+        document.getElementById('painel-ocorrencias').replaceWith(criarCard(data.ocorrencias));
+    }
+
+    const { aguardando, atendimento } = data.contadores;
+    document.getElementById('fila-vazia').hidden = aguardando > 0;
+    document.getElementById('contador-aguardando').textContent = aguardando;
+    document.getElementById('contador-atendimento').textContent = `${atendimento} OS`;
+    document.getElementById('tab-aguardando').textContent = `Aguardando (${aguardando})`;
+    document.getElementById('tab-atendimento').textContent = `Em Atendimento (${atendimento})`;
+}
+
+// Presença só mexe no selo do card, sem ir ao servidor
+function aplicarPresenca(dados) {
+    const card = document.querySelector(`#col-frota [data-user-id="${dados.user_id}"]`);
+    const badge = card?.querySelector('.presence-badge');
+    if (!badge) return;
+
+    const online = dados.online && card.dataset.available === '1';
+    badge.className = online
+        ? 'badge presence-badge bg-success bg-opacity-10 text-success border border-success border-opacity-25'
+        : 'badge presence-badge bg-secondary bg-opacity-10 text-secondary border border-secondary border-opacity-25';
+    badge.innerHTML = online
+        ? '<i class="bi bi-circle-fill" style="font-size: 0.4rem; vertical-align: middle;"></i> Livre'
+        : 'Offline';
+}
+
+function conectarEventosPainel() {
+    if (!window.EventSource) {
+        iniciarPolling();
+        return;
+    }
+
+    const stream = new EventSource('/painel-despacho/eventos/');
+    stream.onopen = pararPolling;
+    stream.onerror = () => {
+        iniciarPolling(); // O navegador reconecta sozinho; enquanto isso, polling.
+        if (stream.readyState === EventSource.CLOSED) {
+            setTimeout(conectarEventosPainel, NOVA_TENTATIVA_SSE_MS);
+        }
+    };
+
+    ['os_criada', 'os_lote', 'os_atribuida', 'os_status', 'parada_concluida', 'ocorrencia', 'resync'].forEach(tipo => {
+        stream.addEventListener(tipo, event => registrarDelta(tipo, JSON.parse(event.data)));
+    });
+    stream.addEventListener('presenca', event => aplicarPresenca(JSON.parse(event.data)));
+}
+conectarEventosPainel();
+
+
+// ====================================================
+// BUSCA DE OS (número, solicitante, destinatário, endereço, item)
+// ====================================================
+let buscaTimer = null;
+let buscaSeq = 0;
+
+function escaparHtml(texto) {
+    const div = document.createElement('div');
+    div.textContent = texto == null ? '' : texto;
+    return div.innerHTML;
+}
+
+function buscarOS(termo) {
+    clearTimeout(buscaTimer);
+    const caixa = document.getElementById('buscaOSResultados');
+    termo = termo.trim();
+    if (termo.length < 2) {
+        caixa.classList.add('d-none');
+        return;
+    }
+    // Espera o despachante parar de digitar; respostas fora de ordem são descartadas
+    buscaTimer = setTimeout(() => {
+        const seq = ++buscaSeq;
+        fetch(`/os/buscar/?q=${encodeURIComponent(termo)}`)
+        .then(res => res.json())
+        .then(data => {
+            if (seq !== buscaSeq) return;
+            const resultados = data.resultados || [];
+            caixa.innerHTML = resultados.length ? resultados.map(os => `
+                <a href="/os/${os.id}/detalhes/" class="list-group-item list-group-item-action py-2">
+                    <div class="d-flex justify-content-between">
+                        <strong>${escaparHtml(os.os_number)}</strong>
+                        <span class="badge bg-light text-dark border">${escaparHtml(os.status_display)}</span>
+                    </div>
+                    <small class="text-muted d-block">${escaparHtml(os.empresa)} • ${escaparHtml(os.solicitante)} • ${escaparHtml(os.criada_em)}</small>
+                    <small class="text-muted d-block"><i class="bi bi-geo-alt"></i> ${escaparHtml(os.coleta)}</small>
+                </a>
+            `).join('') : '<div class="list-group-item text-muted small">Nenhuma OS encontrada.</div>';
+            caixa.classList.remove('d-none');
+        })
+        .catch(err => console.error(err));
+    }, 250);
+}
+
+document.addEventListener('click', ev => {
+    const caixa = document.getElementById('buscaOSResultados');
+    if (caixa && !ev.target.closest('#buscaOSResultados') && ev.target.id !== 'buscaOS') {
+        caixa.classList.add('d-none');
+    }
+});
 
 
 // ====================================================
@@ -669,7 +960,7 @@ function buscarCepTransferencia(cep) {
         }).catch(err => console.error(err));
 }
 
-function submitTransferRoute() {
+function submitTransferRoute(ignorarCapacidade = false) {
     if (!problemOsId) return;
     
     const newMotoboyId = document.getElementById('transferMotoboySelect').value;
@@ -714,11 +1005,15 @@ function submitTransferRoute() {
     fetch(`/painel-despacho/transferir/${problemOsId}/`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json', 'X-CSRFToken': getCSRFToken() },
-        body: JSON.stringify({ new_motoboy_id: newMotoboyId, transfer_address: transferAddress })
+        body: JSON.stringify({ new_motoboy_id: newMotoboyId, transfer_address: transferAddress, ignorar_capacidade: ignorarCapacidade })
     })
     .then(res => res.json())
     .then(data => {
-        if(data.status === 'success') window.location.reload();
+        if(data.status === 'success') {
+            if (data.aviso) alert(data.aviso);
+            window.location.reload();
+        }
+        else if (confirmarCapacidade(data)) submitTransferRoute(true);
         else { alert("Erro ao transferir: " + data.message); document.body.style.cursor = 'default'; }
     });
 }
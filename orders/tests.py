@@ -1,3 +1,819 @@
-from django.test import TestCase
+import itertools
+import random
+from datetime import timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from logistics.models import MotoboyProfile
+from . import archive, exports, jobs, kpis, transitions
+from .assignment import emparelhar
+from .models import (
+    ArchivedOrder, BackgroundJob, CompanyOrderStats, DailyOrderStats, DispatcherDecision, ItemDistribution,
+    MotoboyOrderStats, OrderStatusLog, OSDestination, OSItem, Occurrence, RouteStop, ServiceOrder,
+)
+from .pagination import CursorInvalido, TAMANHO_MAXIMO, codificar_cursor, pagina, tamanho_pagina
+from .search import buscar_ids
+from .services import transferir_rota_por_acidente
+from .transitions import (
+    TERMINAIS, TRANSICOES_PERMITIDAS, TransicaoInvalida, assinar, pode_transicionar, transicionar,
+    transicionar_varias, validar,
+)
+
+Status = BackgroundJob.Status
+
+
+# Tarefas de teste (registradas junto com as de orders.services / orders.exports)
+@jobs.tarefa('teste_eco')
+def _eco(usuario, valor):
+    return {'valor': valor}
+
+
+@jobs.tarefa('teste_falha_temporaria')
+def _falha_temporaria(usuario):
+    raise RuntimeError("Banco indisponível")
+
+
+@jobs.tarefa('teste_regra')
+def _regra(usuario):
+    raise ValueError("Transição inválida")
+
+
+def criar_empresa(username='empresa'):
+    return CustomUser.objects.create_user(username=username, password='x', type='COMPANY')
+
+
+def criar_os(empresa, **campos):
+    dados = {
+        'client': empresa, 'requester_name': 'Solicitante', 'requester_phone': '11999990000',
+        'origin_name': 'Loja', 'origin_responsible': 'Gerente', 'origin_phone': '1133330000',
+        'origin_street': 'Rua A', 'origin_number': '1', 'origin_district': 'Centro',
+        'origin_city': 'São Paulo', 'origin_zip_code': '01000-000',
+    }
+    dados.update(campos)
+    return ServiceOrder.objects.create(**dados)
+
+
+def criar_motoboy(username):
+    usuario = CustomUser.objects.create_user(username=username, password='x', type='MOTOBOY')
+    return MotoboyProfile.objects.create(user=usuario, cnh_number='123', category='TELE', vehicle_plate='ABC1D23')
+
+
+# ==========================================================
+# FILA DE TAREFAS (orders/jobs.py)
+# ==========================================================
+
+@override_settings(TAREFAS_EM_LINHA=False)
+class FilaDeTarefasTests(TestCase):
+
+    def _rodar_proxima(self):
+        job = jobs.reservar()
+        self.assertIsNotNone(job)
+        jobs.executar(job)
+        job.refresh_from_db()
+        return job
+
+    def test_mesma_chave_devolve_a_mesma_tarefa(self):
+        primeira = jobs.enfileirar('teste_eco', chave='os:1:eco', valor=1)
+        segunda = jobs.enfileirar('teste_eco', chave='os:1:eco', valor=2)
+        self.assertEqual(primeira.id, segunda.id)
+        self.assertEqual(BackgroundJob.objects.count(), 1)
+        self.assertEqual(segunda.parametros, {'valor': 1})
+
+    def test_chave_de_tarefa_concluida_vale_ate_o_fim_da_janela(self):
+        job = jobs.enfileirar('teste_eco', chave='os:1:eco', valor=1)
+        self.assertEqual(self._rodar_proxima().status, Status.CONCLUIDA)
+        self.assertEqual(jobs.enfileirar('teste_eco', chave='os:1:eco', valor=2).id, job.id)
+
+        BackgroundJob.objects.filter(id=job.id).update(
+            concluida_em=timezone.now() - jobs.JANELA_IDEMPOTENCIA - timedelta(seconds=1)
+        )
+        nova = jobs.enfileirar('teste_eco', chave='os:1:eco', valor=2)
+        self.assertEqual(nova.id, job.id)
+        self.assertEqual((nova.status, nova.parametros, nova.tentativas), (Status.PENDENTE, {'valor': 2}, 0))
+
+    def test_chave_de_tarefa_com_erro_e_reaproveitada(self):
+        job = jobs.enfileirar('teste_regra', chave='os:1:regra')
+        with self.assertLogs('orders.jobs', 'ERROR'):
+            self.assertEqual(self._rodar_proxima().status, Status.ERRO)
+        self.assertEqual(jobs.enfileirar('teste_regra', chave='os:1:regra').status, Status.PENDENTE)
+        self.assertEqual(BackgroundJob.objects.get(id=job.id).status, Status.PENDENTE)
+
+    def test_tarefa_desconhecida(self):
+        with self.assertRaises(ValueError):
+            jobs.enfileirar('nao_existe')
+
+    def test_reservar_entrega_cada_tarefa_uma_vez(self):
+        job = jobs.enfileirar('teste_eco', valor=1)
+        reservada = jobs.reservar()
+        self.assertEqual((reservada.id, reservada.status, reservada.tentativas), (job.id, Status.EXECUTANDO, 1))
+        self.assertIsNone(jobs.reservar())
+        self.assertFalse(jobs._marcar_executando(job))
+
+    def test_conclusao_grava_o_resultado(self):
+        jobs.enfileirar('teste_eco', valor=42)
+        job = self._rodar_proxima()
+        self.assertEqual((job.status, job.resultado), (Status.CONCLUIDA, {'valor': 42}))
+
+    def test_valueerror_encerra_sem_nova_tentativa(self):
+        jobs.enfileirar('teste_regra')
+        with self.assertLogs('orders.jobs', 'ERROR'):
+            job = self._rodar_proxima()
+        self.assertEqual((job.status, job.tentativas), (Status.ERRO, 1))
+        self.assertIn("Transição inválida", job.erro)
+
+    def test_falha_temporaria_volta_com_espera_crescente(self):
+        job = jobs.enfileirar('teste_falha_temporaria')
+        esperas = []
+        for _ in range(jobs.MAX_TENTATIVAS - 1):
+            antes = timezone.now()
+            with self.assertLogs('orders.jobs', 'WARNING'):
+                job = self._rodar_proxima()
+            self.assertEqual(job.status, Status.PENDENTE)
+            esperas.append(round((job.executar_em - antes).total_seconds()))
+            # Ainda não venceu: o worker não pega
+            self.assertIsNone(jobs.reservar())
+            BackgroundJob.objects.filter(id=job.id).update(executar_em=timezone.now())
+        self.assertEqual(esperas, [jobs.ESPERA_BASE * 2 ** n for n in range(jobs.MAX_TENTATIVAS - 1)])
+
+        with self.assertLogs('orders.jobs', 'ERROR'):
+            job = self._rodar_proxima()
+        self.assertEqual((job.status, job.tentativas), (Status.ERRO, jobs.MAX_TENTATIVAS))
+
+    def test_recuperar_travadas(self):
+        antiga = timezone.now() - jobs.TEMPO_MAXIMO - timedelta(minutes=1)
+        travada = BackgroundJob.objects.create(tipo='teste_eco', status=Status.EXECUTANDO, iniciada_em=antiga, tentativas=1)
+        esgotada = BackgroundJob.objects.create(
+            tipo='teste_eco', status=Status.EXECUTANDO, iniciada_em=antiga, tentativas=3, max_tentativas=3
+        )
+        rodando = BackgroundJob.objects.create(tipo='teste_eco', status=Status.EXECUTANDO, iniciada_em=timezone.now(), tentativas=1)
+
+        self.assertEqual(jobs.recuperar_travadas(), 2)
+        travada.refresh_from_db()
+        esgotada.refresh_from_db()
+        rodando.refresh_from_db()
+        self.assertEqual(travada.status, Status.PENDENTE)
+        self.assertEqual(esgotada.status, Status.ERRO)
+        self.assertEqual(rodando.status, Status.EXECUTANDO)
+
+    def test_pulso_mantem_tarefa_longa_fora_da_recuperacao(self):
+        antiga = timezone.now() - jobs.TEMPO_MAXIMO - timedelta(minutes=1)
+        longa = BackgroundJob.objects.create(tipo='teste_eco', status=Status.EXECUTANDO, iniciada_em=antiga, tentativas=1)
+        self.assertEqual(jobs._pulsar(longa), 1)
+        self.assertEqual(jobs.recuperar_travadas(), 0)
+        longa.refresh_from_db()
+        self.assertEqual(longa.status, Status.EXECUTANDO)
+
+    def test_pulso_nao_mexe_em_tarefa_requeuada(self):
+        job = BackgroundJob.objects.create(tipo='teste_eco', status=Status.EXECUTANDO, iniciada_em=timezone.now(), tentativas=1)
+        BackgroundJob.objects.filter(id=job.id).update(status=Status.PENDENTE, iniciada_em=None)
+        self.assertEqual(jobs._pulsar(job), 0)
+        # Outra execução já reservou a tarefa: o pulso da antiga também não conta
+        BackgroundJob.objects.filter(id=job.id).update(status=Status.EXECUTANDO, tentativas=2)
+        self.assertEqual(jobs._pulsar(job), 0)
+
+    def test_limpar_antigas_so_apaga_terminadas(self):
+        velha = timezone.now() - timedelta(days=jobs.DIAS_HISTORICO + 1)
+        BackgroundJob.objects.create(tipo='teste_eco', status=Status.CONCLUIDA, concluida_em=velha)
+        BackgroundJob.objects.create(tipo='teste_eco', status=Status.ERRO, concluida_em=velha)
+        pendente = BackgroundJob.objects.create(tipo='teste_eco')
+        self.assertEqual(jobs.limpar_antigas(), 2)
+        self.assertEqual(list(BackgroundJob.objects.values_list('id', flat=True)), [pendente.id])
+
+
+# ==========================================================
+# PAGINAÇÃO POR CHAVE (orders/pagination.py)
+# ==========================================================
+
+class PaginacaoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.empresa = criar_empresa()
+        ordens = [criar_os(cls.empresa) for _ in range(12)]
+        # Várias OS no mesmo instante: o id desempata sem repetir nem pular nenhuma
+        base = timezone.now() - timedelta(hours=1)
+        for k, os_obj in enumerate(ordens):
+            ServiceOrder.objects.filter(id=os_obj.id).update(created_at=base + timedelta(minutes=k // 3))
+        cls.esperado = list(
+            ServiceOrder.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+
+    def test_percorre_todas_sem_repetir(self):
+        vistos, cursor, paginas = [], None, 0
+        while True:
+            itens, cursor = pagina(ServiceOrder.objects.all(), cursor, tamanho=5)
+            vistos += [os_obj.id for os_obj in itens]
+            paginas += 1
+            if cursor is None:
+                break
+        self.assertEqual(vistos, self.esperado)
+        self.assertEqual(paginas, 3)
+
+    def test_ultima_pagina_cheia_nao_tem_proxima(self):
+        itens, cursor = pagina(ServiceOrder.objects.all(), None, tamanho=12)
+        self.assertEqual(len(itens), 12)
+        self.assertIsNone(cursor)
+
+    def test_cursor_respeita_o_filtro(self):
+        outra = criar_empresa('outra')
+        criar_os(outra)
+        _, cursor = pagina(ServiceOrder.objects.filter(client=self.empresa), None, tamanho=4)
+        itens, _ = pagina(ServiceOrder.objects.filter(client=self.empresa), cursor, tamanho=20)
+        self.assertEqual([os_obj.id for os_obj in itens], self.esperado[4:])
+
+    def test_cursor_da_ultima_os_devolve_pagina_vazia(self):
+        ultima = ServiceOrder.objects.get(id=self.esperado[-1])
+        self.assertEqual(pagina(ServiceOrder.objects.all(), codificar_cursor(ultima)), ([], None))
+
+    def test_cursor_invalido(self):
+        for cursor in ('lixo', 'bm9fcGlwZQ', codificar_cursor(ServiceOrder.objects.first())[:-3] + '!!!'):
+            with self.assertRaises(CursorInvalido):
+                pagina(ServiceOrder.objects.all(), cursor)
+
+    def test_tamanho_pagina(self):
+        self.assertEqual(tamanho_pagina('10'), 10)
+        self.assertEqual(tamanho_pagina('0'), 1)
+        self.assertEqual(tamanho_pagina('99999'), TAMANHO_MAXIMO)
+        self.assertEqual(tamanho_pagina(None, padrao=7), 7)
+        self.assertEqual(tamanho_pagina('abc', padrao=7), 7)
+
+
+# ==========================================================
+# EMPARELHAMENTO DE CUSTO MÍNIMO (orders/assignment.py)
+# ==========================================================
+
+def _valor(recompensas, candidatos, vagas, escolha):
+    """ Soma de (recompensa - custo) de uma atribuição; None se estoura as vagas de alguém """
+    custos = {(o, mb): c for o, lista in candidatos.items() for mb, c in lista}
+    por_motoboy = [0] * len(vagas)
+    total = 0.0
+    for o, mb in escolha.items():
+        total += recompensas[o] - custos[(o, mb)]
+        por_motoboy[mb] += 1
+    for mb, n in enumerate(por_motoboy):
+        if n > len(vagas[mb]):
+            return None
+        total -= sum(vagas[mb][:n])
+    return total
+
+
+def _melhor_por_forca_bruta(recompensas, candidatos, vagas):
+    opcoes = [[None] + [mb for mb, _ in candidatos.get(o, [])] for o in range(len(recompensas))]
+    melhor = 0.0
+    for combinacao in itertools.product(*opcoes):
+        escolha = {o: mb for o, mb in enumerate(combinacao) if mb is not None}
+        valor = _valor(recompensas, candidatos, vagas, escolha)
+        if valor is not None and valor > melhor:
+            melhor = valor
+    return melhor
+
+
+class EmparelharTests(TestCase):
+
+    def test_nao_e_guloso(self):
+        # A OS mais valiosa pegaria o motoboy 0 e a outra ficaria com o motoboy 1 (custo 10)
+        escolha = emparelhar([100, 50], {0: [(0, 1), (1, 2)], 1: [(0, 1), (1, 10)]}, [[0], [0]])
+        self.assertEqual(escolha, {0: 1, 1: 0})
+
+    def test_recompensa_menor_que_o_custo_fica_na_fila(self):
+        self.assertEqual(emparelhar([5], {0: [(0, 10)]}, [[0]]), {})
+
+    def test_sem_vaga_para_todas_ganha_a_mais_valiosa(self):
+        self.assertEqual(emparelhar([10, 50], {0: [(0, 1)], 1: [(0, 1)]}, [[0]]), {1: 0})
+
+    def test_vaga_cada_vez_mais_cara_divide_a_fila(self):
+        # A segunda OS no mesmo motoboy custa 30 a mais: compensa mandar para o mais longe
+        escolha = emparelhar([100, 100], {0: [(0, 1), (1, 5)], 1: [(0, 1), (1, 5)]}, [[0, 30], [0, 30]])
+        self.assertEqual(sorted(escolha.values()), [0, 1])
+
+    def test_os_sem_candidato(self):
+        self.assertEqual(emparelhar([100, 100], {1: [(0, 3)]}, [[0]]), {1: 0})
+
+    def test_otimo_igual_a_forca_bruta(self):
+        sorteio = random.Random(7)
+        for _ in range(60):
+            n, m = sorteio.randint(1, 5), sorteio.randint(1, 3)
+            recompensas = [sorteio.uniform(5, 60) for _ in range(n)]
+            candidatos = {}
+            for o in range(n):
+                escolhidos = sorteio.sample(range(m), sorteio.randint(0, m))
+                if escolhidos:
+                    candidatos[o] = [(mb, sorteio.uniform(0, 40)) for mb in escolhidos]
+            vagas = [sorted(sorteio.uniform(0, 20) for _ in range(sorteio.randint(0, 3))) for _ in range(m)]
+
+            escolha = emparelhar(recompensas, candidatos, vagas)
+            valor = _valor(recompensas, candidatos, vagas, escolha)
+            self.assertIsNotNone(valor, "Atribuição estourou as vagas de um motoboy")
+            self.assertAlmostEqual(valor, _melhor_por_forca_bruta(recompensas, candidatos, vagas), places=6)
+
+
+# ==========================================================
+# BUSCA (orders/search.py, backend FTS5 do SQLite)
+# ==========================================================
+
+@skipUnless(connection.vendor == 'sqlite', "Backend FTS5 só existe no SQLite")
+class BuscaFTS5Tests(TestCase):
+
+    def setUp(self):
+        self.empresa = criar_empresa()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.os_obj = criar_os(self.empresa, requester_name='Marcondes', requester_phone='(11) 98765-4321')
+            self.destino = OSDestination.objects.create(
+                order=self.os_obj, destination_name='Floricultura São João', destination_phone='1144445555',
+                destination_street='Av. Paulista', destination_number='900', destination_district='Bela Vista',
+                destination_city='São Paulo', destination_zip_code='01310-100',
+            )
+            self.item = OSItem.objects.create(order=self.os_obj, description='Buquê de rosas', total_quantity=1)
+            self.outra = criar_os(criar_empresa('outra'), requester_name='Marcondes Filho')
+
+    def test_prefixo_sem_acento_e_todos_os_termos(self):
+        self.assertEqual(buscar_ids('flor joao'), [self.os_obj.id])
+        self.assertEqual(buscar_ids('BUQUE'), [self.os_obj.id])
+        self.assertEqual(buscar_ids('flor marte'), [])
+
+    def test_telefone_e_numero_da_os(self):
+        self.assertEqual(buscar_ids('11987654321'), [self.os_obj.id])
+        self.assertEqual(buscar_ids('(11) 98765-4321'), [self.os_obj.id])
+        self.assertEqual(buscar_ids(str(self.os_obj.id)), [self.os_obj.id])
+
+    def test_mais_recentes_primeiro_e_filtro_da_empresa(self):
+        self.assertEqual(buscar_ids('marcondes'), [self.outra.id, self.os_obj.id])
+        self.assertEqual(buscar_ids('marcondes', client_id=self.empresa.id), [self.os_obj.id])
+        self.assertEqual(buscar_ids('marcondes', limite=1), [self.outra.id])
+
+    def test_texto_sem_palavras_e_aspas(self):
+        self.assertEqual(buscar_ids('  --  '), [])
+        self.assertEqual(buscar_ids('"flor*'), [self.os_obj.id])
+
+    def test_reindexa_ao_editar_e_apagar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            OSItem.objects.filter(id=self.item.id).update(description='Caixa de bombons')
+        self.assertEqual(buscar_ids('rosas'), [])
+        self.assertEqual(buscar_ids('bombons'), [self.os_obj.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.destino.delete()
+        self.assertEqual(buscar_ids('floricultura'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.os_obj.requester_name = 'Teixeira'
+            self.os_obj.save()
+        self.assertEqual(buscar_ids('teixeira'), [self.os_obj.id])
+        self.assertEqual(buscar_ids('marcondes'), [self.outra.id])
+
+
+# ==========================================================
+# RESGATE DE MOTOBOY ACIDENTADO (services.transferir_rota_por_acidente)
+# ==========================================================
+
+class TransferenciaPorAcidenteTests(TestCase):
+
+    def setUp(self):
+        self.empresa = criar_empresa()
+        self.despachante = CustomUser.objects.create_user(username='despachante', password='x', type='DISPATCHER')
+        self.antigo = criar_motoboy('acidentado')
+        self.novo = criar_motoboy('socorrista')
+        # O socorrista já tem uma entrega na rota
+        os_do_novo = criar_os(self.empresa, status='ACEITO', motoboy=self.novo)
+        self.parada_do_novo = self._parada(os_do_novo, self.novo, 'ENTREGA', 1)
+
+    def _parada(self, os_obj, motoboy, tipo, sequencia, concluida=False, **campos):
+        return RouteStop.objects.create(
+            service_order=os_obj, motoboy=motoboy, stop_type=tipo, sequence=sequencia, is_completed=concluida, **campos
+        )
+
+    def _item(self, os_obj, coletado):
+        return OSItem.objects.create(
+            order=os_obj, description='Caixa', total_quantity=1,
+            status='COLETADO' if coletado else 'NAO_COLETADO', posse_atual=self.antigo if coletado else None,
+        )
+
+    def _cenario(self, grupos_coletados=0, com_carga=True):
+        """
+        OS do acidente (entrega travada pela ocorrência), `grupos_coletados` grupos (mãe + filha) no
+        baú e uma OS aceita que ainda não foi coletada.
+        """
+        self.os_acidente = criar_os(self.empresa, status='OCORRENCIA', motoboy=self.antigo)
+        self._item(self.os_acidente, com_carga)
+        coleta = self._parada(self.os_acidente, self.antigo, 'COLETA', 1, concluida=com_carga)
+        entrega = self._parada(
+            self.os_acidente, self.antigo, 'ENTREGA', 2,
+            is_failed=True, failure_reason='Pneu furado', status='AGUARDANDO_DECISAO',
+        )
+        self.ocorrencia = Occurrence.objects.create(
+            parada=entrega if com_carga else coleta, service_order=self.os_acidente,
+            motoboy=self.antigo, causa=Occurrence.Causa.ACIDENTE,
+        )
+
+        self.grupos = []
+        for k in range(grupos_coletados):
+            mae = criar_os(self.empresa, status='COLETADO', motoboy=self.antigo)
+            filha = criar_os(self.empresa, status='AGRUPADO', motoboy=self.antigo, parent_os=mae)
+            self._item(mae, True)
+            self._item(filha, True)
+            self._parada(mae, self.antigo, 'COLETA', 3 + 2 * k, concluida=True)
+            self._parada(mae, self.antigo, 'ENTREGA', 4 + 2 * k)
+            self.grupos.append((mae, filha))
+
+        self.na_fila = criar_os(self.empresa, status='ACEITO', motoboy=self.antigo)
+        self.parada_na_fila = self._parada(self.na_fila, self.antigo, 'COLETA', 99)
+
+    def _transferir(self, **opcoes):
+        return transferir_rota_por_acidente(
+            self.ocorrencia.id, self.novo.id, 'Posto Ipiranga', self.despachante, **opcoes
+        )
+
+    def _paradas_abertas(self, motoboy):
+        return list(
+            RouteStop.objects.filter(motoboy=motoboy, is_completed=False)
+            .order_by('sequence').values_list('stop_type', 'service_order_id', 'sequence')
+        )
+
+    def _assert_devolvida_para_a_fila(self):
+        self.na_fila.refresh_from_db()
+        self.parada_na_fila.refresh_from_db()
+        self.assertEqual((self.na_fila.status, self.na_fila.motoboy_id), ('PENDENTE', None))
+        self.assertEqual((self.parada_na_fila.motoboy_id, self.parada_na_fila.status), (None, 'PENDENTE'))
+
+    def test_bau_inteiro_mescla_os_grupos_coletados(self):
+        self._cenario(grupos_coletados=2)
+        resumo = self._transferir(transfer_all_cargo=True)
+
+        self.assertEqual(
+            (resumo['grupos_mesclados'], resumo['paradas_transferidas'], resumo['os_devolvidas'], resumo['com_carga']),
+            (2, 3, 1, True),
+        )
+        raiz = self.os_acidente
+        raiz.refresh_from_db()
+        self.assertEqual((raiz.status, raiz.motoboy_id, raiz.is_multiple_delivery), ('COLETADO', self.novo.id, True))
+        for mae, filha in self.grupos:
+            for os_obj in (mae, filha):
+                os_obj.refresh_from_db()
+                self.assertEqual(
+                    (os_obj.status, os_obj.parent_os_id, os_obj.group_root_id, os_obj.motoboy_id),
+                    ('AGRUPADO', raiz.id, raiz.id, self.novo.id),
+                )
+            self.assertIn('[AGRUPADA NO RESGATE]', mae.operational_notes)
+
+        # Resgate logo depois da rota atual do socorrista; as entregas do baú na ordem antiga
+        entregas = [raiz.id] + [mae.id for mae, _ in self.grupos]
+        self.assertEqual(self._paradas_abertas(self.novo), [
+            ('ENTREGA', self.parada_do_novo.service_order_id, 1),
+            ('TRANSFERENCIA', raiz.id, 2),
+            *[('ENTREGA', os_id, 3 + k) for k, os_id in enumerate(entregas)],
+        ])
+        self.assertFalse(RouteStop.objects.filter(motoboy=self.novo, is_failed=True).exists())
+        self.assertEqual(self._paradas_abertas(self.antigo), [('TRANSFERENCIA', raiz.id, 1)])
+
+        self.assertEqual(
+            set(OSItem.objects.filter(order__group_root_id=raiz.id).values_list('status', flat=True)), {'TRANSFERIDO'}
+        )
+        self._assert_devolvida_para_a_fila()
+        self.ocorrencia.refresh_from_db()
+        self.antigo.refresh_from_db()
+        self.assertTrue(self.ocorrencia.resolvida)
+        self.assertFalse(self.antigo.is_available)
+
+    def test_sem_o_bau_inteiro_os_outros_grupos_ficam_com_o_acidentado(self):
+        self._cenario(grupos_coletados=2)
+        resumo = self._transferir(transfer_all_cargo=False, furar_fila=True)
+
+        self.assertEqual((resumo['grupos_mesclados'], resumo['paradas_transferidas']), (0, 1))
+        # Furando a fila: o resgate vem primeiro e a rota antiga do socorrista anda 10 posições
+        self.assertEqual(self._paradas_abertas(self.novo), [
+            ('TRANSFERENCIA', self.os_acidente.id, 1),
+            ('ENTREGA', self.os_acidente.id, 2),
+            ('ENTREGA', self.parada_do_novo.service_order_id, 11),
+        ])
+        for mae, filha in self.grupos:
+            for os_obj in (mae, filha):
+                os_obj.refresh_from_db()
+                self.assertEqual((os_obj.group_root_id, os_obj.motoboy_id), (mae.id, self.antigo.id))
+            self.assertEqual(mae.status, 'COLETADO')
+            self.assertEqual(
+                set(OSItem.objects.filter(order__group_root_id=mae.id).values_list('status', flat=True)), {'COLETADO'}
+            )
+        self.assertEqual(OSItem.objects.get(order=self.os_acidente).status, 'TRANSFERIDO')
+        self._assert_devolvida_para_a_fila()
+
+    def test_sem_carga_repassa_a_rota_sem_parada_de_resgate(self):
+        self._cenario(com_carga=False)
+        resumo = self._transferir(transfer_all_cargo=True)
+
+        self.assertEqual((resumo['com_carga'], resumo['paradas_transferidas']), (False, 2))
+        self.os_acidente.refresh_from_db()
+        self.assertEqual((self.os_acidente.status, self.os_acidente.motoboy_id), ('ACEITO', self.novo.id))
+        self.assertEqual(self._paradas_abertas(self.novo), [
+            ('ENTREGA', self.parada_do_novo.service_order_id, 1),
+            ('COLETA', self.os_acidente.id, 2),
+            ('ENTREGA', self.os_acidente.id, 3),
+        ])
+        self.assertEqual(self._paradas_abertas(self.antigo), [])
+        self.assertFalse(RouteStop.objects.filter(stop_type='TRANSFERENCIA').exists())
+        self.assertEqual(OSItem.objects.get(order=self.os_acidente).status, 'NAO_COLETADO')
+        self._assert_devolvida_para_a_fila()
+
+    def test_queries_nao_crescem_com_o_bau(self):
+        self._cenario(grupos_coletados=1)
+        with CaptureQueriesContext(connection) as pequeno:
+            self._transferir(transfer_all_cargo=True)
+
+        self.antigo = criar_motoboy('acidentado2')
+        self._cenario(grupos_coletados=6)
+        with self.assertNumQueries(len(pequeno)):
+            self._transferir(transfer_all_cargo=True)
+
+    def test_ocorrencia_ja_resolvida(self):
+        self._cenario()
+        Occurrence.objects.filter(id=self.ocorrencia.id).update(resolvida=True)
+        with self.assertRaises(ValueError):
+            self._transferir()
+        self.antigo.refresh_from_db()
+        self.assertTrue(self.antigo.is_available)
+
+
+# ==========================================================
+# EXPORTAÇÕES (orders/exports.py)
+# ==========================================================
+
+class ExportacaoTests(TestCase):
+
+    def setUp(self):
+        self.empresa = criar_empresa()
+        self.os_obj = criar_os(
+            self.empresa, requester_name='=HYPERLINK("http://x","clique")', origin_name='@SOMA(A1)',
+            internal_code='-2+3', origin_street='+55 Rua',
+        )
+        self.admin = CustomUser.objects.create_user(username='admin', password='x', type='ADMIN')
+        self.hoje = timezone.localdate()
+
+    def test_texto_com_cara_de_formula_sai_como_texto(self):
+        [linha] = exports.linhas('os', self.hoje, self.hoje)
+        self.assertEqual(linha[6], '\'=HYPERLINK("http://x","clique")')
+        self.assertEqual(linha[7], "'@SOMA(A1)")
+        self.assertEqual(linha[8], "'+55 Rua, 1 - Centro, São Paulo")
+        self.assertEqual(linha[10], "'-2+3")
+        self.assertEqual(linha[0], self.os_obj.os_number)
+
+    def test_empresa_invalida_na_exportacao_do_admin(self):
+        self.client.force_login(self.admin)
+        resposta = self.client.get('/exportar/os/', {'empresa': 'abc'})
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(self.client.get('/exportar/os/', {'empresa': str(self.empresa.id)}).status_code, 200)
+
+
+# ==========================================================
+# ARQUIVO DAS OS ENCERRADAS (orders/archive.py)
+# ==========================================================
+
+def _campos(obj):
+    return {campo.attname: campo.value_from_object(obj) for campo in obj._meta.concrete_fields}
+
+
+def _por_id(relacionados):
+    return sorted(relacionados, key=lambda obj: obj.pk)
+
+
+def _grafo(ordens):
+    """ OS com tudo que pende delas, campo a campo (vale para OS quentes e restauradas) """
+    return {
+        os_obj.id: {
+            'os': _campos(os_obj),
+            'itens': [
+                (_campos(item), [_campos(d) for d in _por_id(item.distributions.all())])
+                for item in _por_id(os_obj.items.all())
+            ],
+            'destinos': [_campos(destino) for destino in _por_id(os_obj.destinations.all())],
+            'paradas': [_campos(parada) for parada in _por_id(os_obj.stops.all())],
+            'ocorrencias': [(_campos(oc), _campos(oc.decisao)) for oc in _por_id(os_obj.ocorrencias.all())],
+            'logs': [_campos(log) for log in _por_id(os_obj.logs.all())],
+        }
+        for os_obj in ordens
+    }
+
+
+class ArquivoTests(TestCase):
+
+    def setUp(self):
+        self.empresa = criar_empresa()
+        self.empresa.first_name = 'Floricultura'
+        self.empresa.save()
+        self.despachante = CustomUser.objects.create_user(username='despachante', password='x', type='DISPATCHER')
+        self.motoboy = criar_motoboy('motoboy')
+        self.mae = criar_os(self.empresa, status='ENTREGUE', motoboy=self.motoboy, internal_code='CC-7')
+        self.filha = criar_os(self.empresa, status='ENTREGUE', motoboy=self.motoboy, parent_os=self.mae)
+        sequencia = itertools.count(1)
+        for os_obj in (self.mae, self.filha):
+            item = OSItem.objects.create(
+                order=os_obj, description=f'Vaso {os_obj.id}', total_quantity=2, status='ENTREGUE', weight='1.250',
+            )
+            destino = OSDestination.objects.create(
+                order=os_obj, destination_name='Ana', destination_phone='1144445555', destination_street='Rua B',
+                destination_number='2', destination_district='Centro', destination_city='São Paulo',
+                destination_zip_code='01000-000', is_delivered=True, receiver_name='Ana',
+            )
+            ItemDistribution.objects.create(item=item, destination=destino, quantity_allocated=2)
+            coleta = RouteStop.objects.create(
+                service_order=os_obj, motoboy=self.motoboy, stop_type='COLETA', sequence=next(sequencia),
+                is_completed=True, status='CONCLUIDA',
+            )
+            RouteStop.objects.create(
+                service_order=os_obj, motoboy=self.motoboy, stop_type='ENTREGA', destination=destino,
+                sequence=next(sequencia), is_completed=True, status='CONCLUIDA',
+            )
+            ocorrencia = Occurrence.objects.create(
+                parada=coleta, service_order=os_obj, motoboy=self.motoboy, causa=Occurrence.Causa.FECHADO, resolvida=True,
+            )
+            DispatcherDecision.objects.create(
+                occurrence=ocorrencia, acao=DispatcherDecision.Acao.REAGENDAR, decidido_por=self.despachante,
+            )
+            OrderStatusLog.objects.create(order=os_obj, status_anterior='COLETADO', status_novo='ENTREGUE')
+
+        # Tudo encerrado há mais tempo que a janela do arquivo
+        antigo = timezone.now() - timedelta(days=archive.DIAS_PADRAO + 10)
+        ServiceOrder.objects.filter(group_root_id=self.mae.id).update(created_at=antigo)
+        RouteStop.objects.filter(service_order__group_root_id=self.mae.id).update(completed_at=antigo)
+        self.dia = timezone.localdate(antigo)
+        self.ids = [self.mae.id, self.filha.id]
+
+    def _quentes(self):
+        return _grafo(ServiceOrder.objects.filter(id__in=self.ids).order_by('id'))
+
+    def _linhas(self):
+        return {tipo: list(exports.linhas(tipo, self.dia, self.dia)) for tipo in exports.TIPOS}
+
+    def _kpis(self):
+        return [
+            sorted(model.objects.values_list(*campos, 'status', 'total'))
+            for model, campos in ((DailyOrderStats, ['day']), (CompanyOrderStats, ['client_id']), (MotoboyOrderStats, ['motoboy_id']))
+        ]
+
+    def test_ida_e_volta_mantem_o_grupo(self):
+        original = self._quentes()
+        linhas = self._linhas()
+        kpis.recalcular()
+        totais = self._kpis()
+
+        self.assertEqual(archive.grupos_arquivaveis(), [self.mae.id])
+        self.assertEqual(archive.arquivar([self.mae.id]), (1, 2))
+        self.assertFalse(ServiceOrder.objects.filter(id__in=self.ids).exists())
+        self.assertFalse(RouteStop.objects.exists())
+        self.assertEqual(list(ArchivedOrder.objects.order_by('id').values_list('id', 'group_root_id')),
+                         [(self.mae.id, self.mae.id), (self.filha.id, self.mae.id)])
+
+        restauradas = archive.restaurar(*ArchivedOrder.objects.order_by('id').values_list('dados', flat=True))
+        self.assertEqual(_grafo(restauradas), original)
+
+        grupo = archive.grupo_da_os(self.filha.id)
+        self.assertEqual((grupo['os'].id, grupo['raiz'].id), (self.filha.id, self.mae.id))
+        self.assertEqual([p.sequence for p in grupo['paradas']], [1, 2, 3, 4])
+        self.assertEqual(len(grupo['ocorrencias']), 2)
+        self.assertIsNone(archive.grupo_da_os(999999))
+
+        # Relatórios e KPIs não mudam: arquivada conta igual a quente
+        self.assertEqual(self._linhas(), linhas)
+        self.assertEqual(self._kpis(), totais)
+        kpis.recalcular()
+        self.assertEqual(self._kpis(), totais)
+
+    def test_detalhes_da_os_arquivada(self):
+        archive.arquivar([self.mae.id])
+        self.client.force_login(self.despachante)
+        resposta = self.client.get(f'/os/{self.filha.id}/detalhes/')
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.context['arquivada'])
+        self.assertEqual((resposta.context['os'].id, resposta.context['root_os'].id), (self.filha.id, self.mae.id))
+        self.assertEqual([item.description for item in resposta.context['items']], [f'Vaso {self.filha.id}'])
+        self.assertEqual(len(resposta.context['stops']), 4)
+        self.assertContains(resposta, self.filha.os_number)
+        self.assertEqual(self.client.get('/os/999999/detalhes/').status_code, 404)
+
+    def test_grupo_com_parada_aberta_fica(self):
+        RouteStop.objects.filter(service_order=self.filha, stop_type='ENTREGA').update(is_completed=False)
+        self.assertEqual(archive.grupos_arquivaveis(), [])
+        self.assertEqual(archive.arquivar([self.mae.id]), (0, 0))
+        self.assertEqual(ServiceOrder.objects.filter(id__in=self.ids).count(), 2)
+
+
+# ==========================================================
+# TRANSIÇÕES DE STATUS (orders/transitions.py)
+# ==========================================================
+
+class TransicoesTests(TestCase):
+
+    def setUp(self):
+        self.empresa = criar_empresa()
+        self.despachante = CustomUser.objects.create_user(username='despachante', password='x', type='DISPATCHER')
+        self.motoboy = criar_motoboy('motoboy')
+        self.mae = criar_os(self.empresa, status='ACEITO')
+        self.filha = criar_os(self.empresa, status='AGRUPADO', parent_os=self.mae)
+        self.cancelada = criar_os(self.empresa, status='CANCELADO', parent_os=self.mae)
+
+    def _status(self):
+        return dict(ServiceOrder.objects.filter(group_root_id=self.mae.id).values_list('id', 'status'))
+
+    def _logs(self):
+        return sorted(OrderStatusLog.objects.values_list('order_id', 'status_anterior', 'status_novo', 'changed_by_id'))
+
+    def test_tabela_de_transicoes(self):
+        todos = set(ServiceOrder.Status.values)
+        self.assertEqual(set(TRANSICOES_PERMITIDAS), todos)
+        for atual in todos:
+            for novo in todos:
+                esperado = atual == novo or novo in TRANSICOES_PERMITIDAS[atual]
+                self.assertEqual(pode_transicionar(atual, novo), esperado, (atual, novo))
+            if atual in TERMINAIS:
+                self.assertEqual(TRANSICOES_PERMITIDAS[atual], set())
+        validar('ENTREGUE', 'ENTREGUE')
+        with self.assertRaises(TransicaoInvalida):
+            validar('ENTREGUE', 'PENDENTE')
+        self.assertTrue(issubclass(TransicaoInvalida, ValueError))
+
+    def test_grupo_inteiro_a_partir_da_filha(self):
+        transicao = transicionar(self.filha, 'COLETADO', self.despachante, motoboy=self.motoboy)
+
+        self.assertEqual(self._status(), {self.mae.id: 'COLETADO', self.filha.id: 'COLETADO', self.cancelada.id: 'CANCELADO'})
+        self.assertEqual(
+            set(ServiceOrder.objects.filter(status='COLETADO').values_list('motoboy_id', flat=True)), {self.motoboy.id}
+        )
+        # Filha encerrada fica de fora: nem status, nem log
+        self.assertEqual(transicao['ids'], [self.mae.id, self.filha.id])
+        self.assertEqual(transicao['anteriores'], {self.mae.id: 'ACEITO', self.filha.id: 'AGRUPADO'})
+        self.assertEqual(self._logs(), [
+            (self.mae.id, 'ACEITO', 'COLETADO', self.despachante.id),
+            (self.filha.id, 'AGRUPADO', 'COLETADO', self.despachante.id),
+        ])
+        # A instância fica igual ao banco: um save() depois não volta o status
+        self.assertEqual((self.filha.status, self.filha.motoboy_id), ('COLETADO', self.motoboy.id))
+
+    def test_status_filhas(self):
+        transicionar(self.mae, 'COLETADO', status_filhas='AGRUPADO')
+        self.assertEqual(self._status(), {self.mae.id: 'COLETADO', self.filha.id: 'AGRUPADO', self.cancelada.id: 'CANCELADO'})
+        self.assertEqual(self._logs(), [(self.mae.id, 'ACEITO', 'COLETADO', None)])
+
+    def test_so_a_os_sem_o_grupo(self):
+        transicionar(self.filha, 'PENDENTE', grupo=False)
+        self.assertEqual(self._status(), {self.mae.id: 'ACEITO', self.filha.id: 'PENDENTE', self.cancelada.id: 'CANCELADO'})
+
+    def test_mesmo_status_nao_gera_log_nem_aviso(self):
+        avisos = []
+        assinar(avisos.append)
+        self.addCleanup(transitions._assinantes.remove, avisos.append)
+        with self.captureOnCommitCallbacks(execute=True):
+            transicao = transicionar(self.mae, 'ACEITO', status_filhas='AGRUPADO')
+        self.assertEqual(transicao['novos'], {})
+        self.assertEqual(self._logs(), [])
+        self.assertEqual(avisos, [])
+
+    def test_assinantes_depois_do_commit(self):
+        avisos = []
+
+        def com_defeito(transicao):
+            raise RuntimeError("assinante quebrado")
+
+        for func in (com_defeito, avisos.append):
+            assinar(func)
+            self.addCleanup(transitions._assinantes.remove, func)
+        with self.captureOnCommitCallbacks() as callbacks:
+            transicionar(self.mae, 'PENDENTE', self.despachante)
+        self.assertEqual(avisos, [])
+
+        with self.assertLogs('orders.transitions', 'ERROR'):
+            for callback in callbacks:
+                callback()
+        self.assertEqual(len(avisos), 1)
+        self.assertEqual(avisos[0]['raiz_id'], self.mae.id)
+        self.assertEqual(avisos[0]['novos'], {self.mae.id: 'PENDENTE', self.filha.id: 'PENDENTE'})
+        self.assertEqual(avisos[0]['usuario_id'], self.despachante.id)
+
+    def test_transicao_invalida_desfaz_tudo(self):
+        ServiceOrder.objects.filter(id=self.mae.id).update(status='ENTREGUE')
+        with self.assertRaises(TransicaoInvalida), transaction.atomic():
+            # Escrita do chamador antes da transição (como nas views de ocorrência)
+            RouteStop.objects.create(service_order=self.mae, stop_type='DEVOLUCAO', sequence=1)
+            transicionar(self.mae, 'COLETADO', self.despachante)
+        self.assertFalse(RouteStop.objects.exists())
+        self.assertEqual(self._status()[self.filha.id], 'AGRUPADO')
+        self.assertEqual(self._logs(), [])
+
+    def test_varias_uma_invalida_cancela_todas(self):
+        avulsa = criar_os(self.empresa)
+        with self.assertRaises(TransicaoInvalida):
+            transicionar_varias(ServiceOrder.objects.filter(id__in=[avulsa.id, self.cancelada.id]), 'PENDENTE')
+        self.assertEqual(ServiceOrder.objects.get(id=avulsa.id).status, 'PENDENTE')
+
+        transicionar_varias(ServiceOrder.objects.filter(id__in=[avulsa.id, self.filha.id]), 'ACEITO', motoboy=self.motoboy)
+        self.assertEqual(self._status()[self.mae.id], 'ACEITO')
+        self.assertEqual(
+            sorted(ServiceOrder.objects.filter(id__in=[avulsa.id, self.filha.id]).values_list('status', 'motoboy_id')),
+            [('ACEITO', self.motoboy.id)] * 2,
+        )
+        self.assertEqual(self._logs(), sorted([
+            (avulsa.id, 'PENDENTE', 'ACEITO', None), (self.filha.id, 'AGRUPADO', 'ACEITO', None),
+        ]))
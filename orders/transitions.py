@@ -0,0 +1,173 @@
+# orders/transitions.py
+"""
+Motor de transição de status das OS.
+
+Toda mudança de status passa por `transicionar` (um grupo: mãe + filhas) ou
+`transicionar_varias` (OS avulsas). O motor:
+  1. Trava as linhas e valida a mudança contra TRANSICOES_PERMITIDAS.
+  2. Aplica o status novo no grupo inteiro num único UPDATE.
+  3. Grava os OrderStatusLog correspondentes num bulk_create.
+  4. Depois do commit, avisa quem assinou (`assinar`) com um dict da transição.
+
+Cache da tela do motoboy e KPIs continuam presos ao QuerySet.update/save (orders/models.py),
+porque escritas que não são transição (troca de motoboy, bulk_create...) também mexem neles.
+Os assinantes daqui são para quem só se importa com mudança de status (painel, push...).
+"""
+import logging
+
+from django.db import transaction
+
+from .events import publicar_evento
+from .groups import raiz_id as _raiz_id
+from .models import ServiceOrder, OrderStatusLog
+
+logger = logging.getLogger(__name__)
+
+Status = ServiceOrder.Status
+
+TERMINAIS = {Status.DELIVERED, Status.CANCELED}
+
+TRANSICOES_PERMITIDAS = {
+    Status.PENDING: {Status.ACCEPTED, Status.AGRUPADO, Status.CANCELED},
+    Status.AGRUPADO: {Status.PENDING, Status.ACCEPTED, Status.COLLECTED, Status.PROBLEM, Status.DELIVERED, Status.CANCELED},
+    Status.ACCEPTED: {Status.PENDING, Status.AGRUPADO, Status.COLLECTED, Status.PROBLEM, Status.CANCELED},
+    Status.COLLECTED: {Status.AGRUPADO, Status.PROBLEM, Status.DELIVERED},
+    Status.PROBLEM: {Status.PENDING, Status.AGRUPADO, Status.ACCEPTED, Status.COLLECTED, Status.DELIVERED, Status.CANCELED},
+    Status.DELIVERED: set(),
+    Status.CANCELED: set(),
+}
+
+_assinantes = []
+
+
+class TransicaoInvalida(ValueError):
+    pass
+
+
+def pode_transicionar(atual, novo):
+    """ Mesmo status é sempre aceito (não faz nada) """
+    return atual == novo or novo in TRANSICOES_PERMITIDAS.get(atual, ())
+
+
+def validar(atual, novo):
+    if not pode_transicionar(atual, novo):
+        rotulos = dict(Status.choices)
+        raise TransicaoInvalida(
+            f"Não é possível passar a OS de {rotulos.get(atual, atual)} para {rotulos.get(novo, novo)}."
+        )
+
+
+def assinar(func):
+    """ Registra `func(transicao)`; pode ser usado como decorador """
+    if func not in _assinantes:
+        _assinantes.append(func)
+    return func
+
+
+def _notificar(transicao):
+    for func in list(_assinantes):
+        try:
+            func(transicao)
+        except Exception:
+            # Um assinante com defeito não pode derrubar a transição (que já foi commitada)
+            logger.exception("Assinante de transição %r falhou", func)
+
+
+# ==========================================================
+# 1. APLICAÇÃO
+# ==========================================================
+
+def _aplicar(atuais, destino, usuario, campos, raiz_id=None):
+    """
+    atuais: {os_id: status no banco}  /  destino: {os_id: status novo} (só as que serão escritas)
+    Um UPDATE por status de destino (normalmente um só) + os logs de quem de fato mudou.
+    """
+    por_status = {}
+    for os_id, status in destino.items():
+        por_status.setdefault(status, []).append(os_id)
+    for status, ids in por_status.items():
+        ServiceOrder.objects.filter(id__in=ids).update(status=status, **campos)
+
+    mudaram = {os_id: status for os_id, status in destino.items() if atuais[os_id] != status}
+    OrderStatusLog.objects.bulk_create([
+        OrderStatusLog(order_id=os_id, status_anterior=atuais[os_id], status_novo=status, changed_by=usuario)
+        for os_id, status in mudaram.items()
+    ])
+
+    transicao = {
+        'raiz_id': raiz_id,
+        'ids': sorted(destino),
+        'anteriores': {os_id: atuais[os_id] for os_id in mudaram},
+        'novos': mudaram,
+        'usuario_id': getattr(usuario, 'pk', None),
+        'campos': sorted(campos),
+    }
+    if mudaram:
+        transaction.on_commit(lambda: _notificar(transicao))
+    return transicao
+
+
+def _sincronizar(instancia, status, campos):
+    """
+    Deixa a instância em memória igual ao banco. Sem isso, um save() posterior (ex: para
+    gravar operational_notes) voltaria o status antigo e contaria o KPI duas vezes.
+    """
+    instancia.status = status
+    for campo, valor in campos.items():
+        setattr(instancia, campo, valor)
+    if getattr(instancia, '_kpi_db', None) is not None:
+        instancia._kpi_db = (instancia.created_at, instancia.client_id, instancia.motoboy_id, instancia.status)
+    if 'motoboy' in campos or 'motoboy_id' in campos:
+        instancia._motoboy_id_db = instancia.motoboy_id
+
+
+@transaction.atomic
+def transicionar(os_obj, novo_status, usuario=None, grupo=True, status_filhas=None, **campos):
+    """
+    Passa a OS para `novo_status`. Com grupo=True (padrão) vale para a mãe e todas as filhas,
+    partindo de qualquer OS do grupo. Só o status da mãe é validado: as filhas acompanham,
+    exceto as já encerradas (ENTREGUE/CANCELADO), que ficam como estão.
+    `status_filhas` dá um status diferente às filhas (ex: resgate: mãe COLETADO, filhas AGRUPADO).
+    `campos` vai junto no mesmo UPDATE (ex: motoboy=None).
+    """
+    raiz_id = _raiz_id(os_obj) if grupo else os_obj.id
+    filtro = {'group_root_id': raiz_id} if grupo else {'id': raiz_id}
+    atuais = dict(ServiceOrder.objects.select_for_update().filter(**filtro).values_list('id', 'status'))
+    if raiz_id not in atuais:
+        raise ServiceOrder.DoesNotExist(f"OS {raiz_id} não encontrada.")
+
+    validar(atuais[raiz_id], novo_status)
+
+    destino = {}
+    for os_id, status in atuais.items():
+        alvo = novo_status if os_id == raiz_id or status_filhas is None else status_filhas
+        if os_id != raiz_id and status in TERMINAIS and status != alvo:
+            continue
+        destino[os_id] = alvo
+
+    transicao = _aplicar(atuais, destino, usuario, campos, raiz_id)
+    if os_obj.id in destino:
+        _sincronizar(os_obj, destino[os_obj.id], campos)
+    return transicao
+
+
+@transaction.atomic
+def transicionar_varias(queryset, novo_status, usuario=None, **campos):
+    """ OS avulsas (sem arrastar grupo). Cada uma é validada; uma inválida cancela todas. """
+    atuais = dict(queryset.select_for_update().order_by().values_list('id', 'status'))
+    for status in set(atuais.values()):
+        validar(status, novo_status)
+    return _aplicar(atuais, dict.fromkeys(atuais, novo_status), usuario, campos)
+
+
+# ==========================================================
+# 2. ASSINANTES PADRÃO
+# ==========================================================
+
+@assinar
+def _avisar_painel(transicao):
+    """ Painel de despacho: mudança de status vira evento SSE (já estamos depois do commit) """
+    publicar_evento(
+        'os_status', os_id=transicao['raiz_id'], ids=list(transicao['novos']),
+        status=sorted(set(transicao['novos'].values())),
+    )
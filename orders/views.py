@@ -1,20 +1,40 @@
 import json
-from django.contrib.auth import logout
-from django.http import HttpResponse, JsonResponse
+import tempfile
+from datetime import date
+from django.http import JsonResponse, StreamingHttpResponse, FileResponse, Http404
 from django.views.decorators.http import require_POST
 from django.shortcuts import render, redirect, get_object_or_404
+from django.template.loader import render_to_string
 from django.contrib.auth.decorators import login_required
 from .models import ServiceOrder, OSItem, OSDestination, ItemDistribution, RouteStop
 from django.contrib import messages
 from accounts.models import CustomUser
-from .forms import ServiceOrderForm
 from django.utils import timezone
 from logistics.models import MotoboyProfile
-from django.core.cache import cache
-from django.db.models import Q, F, Count, Max, Exists, OuterRef
+from django.conf import settings
+from django.db.models import F, Max, Exists, OuterRef
 from django.db import transaction
 from orders.models import Occurrence, DispatcherDecision
-from orders.services import transferir_rota_por_acidente
+from orders.transitions import transicionar, transicionar_varias, validar, TransicaoInvalida
+from orders.groups import raiz, paradas_do_grupo
+from orders.fleet import build_fleet_snapshot
+from orders.events import abrir_transmissao, publicar_evento
+from orders.routing import sugerir_rota, aplicar_rota, serializar_sugestao
+from orders.geocoding import geocodificar
+from orders.intake import importar_com_resumo, ler_json, ler_ndjson
+from orders.driver_view import build_driver_view
+from orders.services import atribuir_paradas
+from orders.search import buscar, LIMITE_PADRAO
+from orders.pagination import pagina, tamanho_pagina, CursorInvalido
+from orders import exports
+from orders import media
+from orders import jobs
+from orders import capacity
+from orders import archive
+from orders.models import BackgroundJob
+from orders.models import OrderExport
+from orders import kpis
+from orders.profiling import perfis_sql
 
 @login_required
 def root_redirect(request):
@@ -35,6 +55,27 @@ def root_redirect(request):
         
     return redirect('login')
 
+def _tarefa_enfileirada(tarefa, mensagem):
+    """ 202 com o id da tarefa: a tela acompanha em /painel-despacho/tarefas/<id>/ """
+    return JsonResponse({
+        'status': 'queued', 'message': mensagem, 'tarefa_id': tarefa.id,
+        'url_status': f'/painel-despacho/tarefas/{tarefa.id}/',
+    }, status=202)
+
+def _capacidade_excedida(avaliacao):
+    """ 409: o baú do motoboy estouraria. O painel pergunta e reenvia com ignorar_capacidade. """
+    return JsonResponse({
+        'status': 'error', 'capacidade': True, 'message': avaliacao['mensagem'], 'ocupacao': avaliacao['ocupacao'],
+    }, status=409)
+
+@login_required
+def job_status_view(request, tarefa_id):
+    """ Situação de uma tarefa em segundo plano (polling do painel) """
+    tarefa = get_object_or_404(BackgroundJob, id=tarefa_id)
+    if tarefa.solicitante_id != request.user.id and request.user.type != 'DISPATCHER' and not request.user.is_superuser:
+        return JsonResponse({'status': 'error', 'message': 'Sem permissão.'}, status=403)
+    return JsonResponse({'status': 'success', 'tarefa': jobs.serializar(tarefa)})
+
 @login_required
 @require_POST
 def resolve_occurrence_view(request, occurrence_id):
@@ -58,16 +99,27 @@ def resolve_occurrence_view(request, occurrence_id):
 
             if not novo_motoboy_id:
                 return JsonResponse({'status': 'error', 'message': 'Selecione um motoboy.'}, status=400)
+
+            if not data.get('ignorar_capacidade'):
+                # O socorrista leva o grupo da ocorrência (e, com o baú inteiro, os outros grupos já coletados)
+                raizes = {os_atual.group_root_id}
+                if transfer_all_cargo:
+                    raizes.update(ServiceOrder.objects.filter(
+                        motoboy=ocorrencia.motoboy, status='COLETADO'
+                    ).values_list('group_root_id', flat=True))
+                avaliacao = capacity.verificar(int(novo_motoboy_id), raizes)
+                if avaliacao['nivel'] == 'excede':
+                    return _capacidade_excedida(avaliacao)
                 
-            # Chama a função cirúrgica que criámos no services.py
-            transferir_rota_por_acidente(
-                ocorrencia.id, novo_motoboy_id, local_encontro, request.user, furar_fila, transfer_all_cargo
+            # A transferência (services.transferir_rota_por_acidente) roda na fila de tarefas, fora do request
+            tarefa = jobs.enfileirar(
+                'transferir_rota', chave=f'ocorrencia:{ocorrencia.id}:transferir', solicitante=request.user,
+                ocorrencia_id=ocorrencia.id, novo_motoboy_id=int(novo_motoboy_id), local_transferencia=local_encontro,
+                furar_fila=furar_fila, transfer_all_cargo=transfer_all_cargo,
             )
-            
-            return JsonResponse({'status': 'success', 'message': 'Rota transferida com sucesso!'})
+            return _tarefa_enfileirada(tarefa, 'Transferência em andamento.')
 
         elif acao == DispatcherDecision.Acao.REAGENDAR:
-            motoboy_da_parada = parada.motoboy
             incluir_novo_endereco = bool(data.get('incluir_novo_endereco'))
             novo_endereco = data.get('novo_endereco') or {}
 
@@ -102,9 +154,11 @@ def resolve_occurrence_view(request, occurrence_id):
                     os_alvo.origin_city = city
                     os_alvo.origin_state = state
                     os_alvo.origin_zip_code = cep
+                    os_alvo.origin_lat, os_alvo.origin_lng = geocodificar(cep, street, city, state)
                     os_alvo.save(update_fields=[
                         'origin_street', 'origin_number', 'origin_complement',
-                        'origin_district', 'origin_city', 'origin_state', 'origin_zip_code'
+                        'origin_district', 'origin_city', 'origin_state', 'origin_zip_code',
+                        'origin_lat', 'origin_lng'
                     ])
 
                 elif parada.stop_type == RouteStop.StopType.DELIVERY and parada.destination_id:
@@ -116,9 +170,11 @@ def resolve_occurrence_view(request, occurrence_id):
                     dest.destination_city = city
                     dest.destination_state = state
                     dest.destination_zip_code = cep
+                    dest.destination_lat, dest.destination_lng = geocodificar(cep, street, city, state)
                     dest.save(update_fields=[
                         'destination_street', 'destination_number', 'destination_complement',
-                        'destination_district', 'destination_city', 'destination_state', 'destination_zip_code'
+                        'destination_district', 'destination_city', 'destination_state', 'destination_zip_code',
+                        'destination_lat', 'destination_lng'
                     ])
                 else:
                     return JsonResponse({
@@ -127,186 +183,110 @@ def resolve_occurrence_view(request, occurrence_id):
                     }, status=400)
             # --- FIM DA ATUALIZAÇÃO DE ENDEREÇO ---
 
-            # --- 2. REORDENAÇÃO INTELIGENTE DA ROTA ---
-            if motoboy_da_parada:
-                with transaction.atomic():
-                    # Puxa a fila atual de paradas do motoboy
-                    paradas_pendentes = list(RouteStop.objects.filter(
-                        motoboy=motoboy_da_parada,
-                        is_completed=False
-                    ).order_by('sequence'))
-
-                    # MÁGICA AQUI: Salva os números de sequência originais que estão livres
-                    # Ex: se ele já fez a parada 1, isso vai salvar [2, 3, 4]
-                    sequencias_disponiveis = [p.sequence for p in paradas_pendentes if p.sequence < 900]
-                    sequencias_disponiveis.sort()
-
-                    # Remove a parada atual da lista para reposicioná-la
-                    if parada in paradas_pendentes:
-                        paradas_pendentes.remove(parada)
-
-                    if parada.stop_type == 'COLETA':
-                        os_falha = parada.service_order
-                        
-                        if not paradas_pendentes:
-                            paradas_pendentes.append(parada)
-                        else:
-                            parada_atual = paradas_pendentes[0]
-                            # A coleta reagendada entra LOGO APÓS a tarefa que o motoboy faz agora
-                            paradas_pendentes.insert(1, parada)
-
-                            # Trava de Segurança: Se ele estiver indo entregar essa OS, a coleta PASSA NA FRENTE
-                            if parada_atual.service_order == os_falha and parada_atual.stop_type in ['ENTREGA', 'DEVOLUCAO']:
-                                paradas_pendentes.remove(parada)
-                                paradas_pendentes.insert(0, parada)
-                    else:
-                        # Se for ENTREGA que falhou, joga pro fim da fila pendente
-                        paradas_pendentes.append(parada)
-
-                    # Salva usando as sequências originais para não atropelar as concluídas!
-                    for index, p in enumerate(paradas_pendentes):
-                        is_target = (p.id == parada.id)
-                        
-                        # Garante que pega a sequência correta que estava disponível
-                        if index < len(sequencias_disponiveis):
-                            nova_seq = sequencias_disponiveis[index]
-                        else:
-                            nova_seq = (sequencias_disponiveis[-1] + 1) if sequencias_disponiveis else 1
-                        
-                        RouteStop.objects.filter(id=p.id).update(
-                            sequence=nova_seq,
-                            is_failed=False if is_target else p.is_failed,
-                            bloqueia_proxima=False if is_target else p.bloqueia_proxima,
-                            status=RouteStop.StopStatus.PENDENTE if is_target else p.status,
-                            failure_reason="" if is_target else p.failure_reason
-                        )
-            else:
-                # Caso extremo: não tem motoboy vinculado. Só limpa a parada.
-                parada.is_failed = False
-                parada.bloqueia_proxima = False
-                parada.status = RouteStop.StopStatus.PENDENTE
-                parada.failure_reason = ""
-                parada.save()
-
-            # --- 3. ATUALIZA OS STATUS DA OS E FINALIZA OCORRÊNCIA ---
-            root_os = os_atual.parent_os or os_atual
-            grouped_orders = ServiceOrder.objects.filter(Q(id=root_os.id) | Q(parent_os=root_os))
-            
-            group_stops = RouteStop.objects.filter(service_order__in=grouped_orders)
-            new_status = 'COLETADO' if group_stops.filter(stop_type='COLETA', is_completed=True).exists() else 'ACEITO'
-            grouped_orders.update(status=new_status)
-
-            if incluir_novo_endereco:
-                root_os.operational_notes += (
-                    f"\n[ENDERECO ATUALIZADO] Tentativa reativada com novo endereco na parada {parada.get_stop_type_display()}."
-                )
-                root_os.save(update_fields=['operational_notes'])
-
-            DispatcherDecision.objects.create(
-                occurrence=ocorrencia, acao=acao, 
-                detalhes="O despachante mandou re-tentar ou ignorar o bloqueio.", 
-                decidido_por=request.user
+            # --- 2. REORDENAÇÃO, STATUS DO GRUPO E FECHAMENTO: fila de tarefas (services.reagendar_parada) ---
+            tarefa = jobs.enfileirar(
+                'reagendar_parada', chave=f'ocorrencia:{ocorrencia.id}:reagendar', solicitante=request.user,
+                ocorrencia_id=ocorrencia.id, incluir_novo_endereco=incluir_novo_endereco,
             )
-            ocorrencia.resolvida = True
-            ocorrencia.save()
+            return _tarefa_enfileirada(tarefa, 'Reagendamento em andamento.')
 
         elif acao == DispatcherDecision.Acao.RETORNAR:
             endereco_retorno = data.get('endereco_retorno', 'Base da Empresa')
             is_priority = data.get('is_priority', False)
 
-            # 1. Finaliza a parada que falhou (tira-a da frente)
-            parada.is_failed = True
-            parada.is_completed = True
-            parada.completed_at = timezone.now()
-            parada.status = RouteStop.StopStatus.COM_OCORRENCIA
-            parada.save()
+            # Valida antes de mexer nas paradas: tudo ou nada
+            root_os = raiz(os_atual)
+            validar(root_os.status, 'COLETADO')
+
+            with transaction.atomic():
+                # 1. Finaliza a parada que falhou (tira-a da frente)
+                parada.is_failed = True
+                parada.is_completed = True
+                parada.completed_at = timezone.now()
+                parada.status = RouteStop.StopStatus.COM_OCORRENCIA
+                parada.save()
             
-            # 2. Desbloqueia as paradas pendentes desse motoboy (Para tirar a "Rota Suspensa")
-            motoboy = ocorrencia.motoboy
-            motoboy.route_stops.filter(is_completed=False).update(is_failed=False, bloqueia_proxima=False, failure_reason="")
-
-            # 3. Calcula a sequência (Onde a devolução vai entrar)
-            if is_priority:
-                current_active = motoboy.route_stops.filter(is_completed=False).order_by('sequence').first()
-                sequence_to_use = current_active.sequence if current_active else parada.sequence + 1
-                motoboy.route_stops.filter(is_completed=False, sequence__gte=sequence_to_use).update(sequence=F('sequence') + 1)
-            else:
-                ultima = motoboy.route_stops.aggregate(max_seq=Max('sequence'))['max_seq'] or 0
-                sequence_to_use = ultima + 1
+                # 2. Desbloqueia as paradas pendentes desse motoboy (Para tirar a "Rota Suspensa")
+                motoboy = ocorrencia.motoboy
+                motoboy.route_stops.filter(is_completed=False).update(is_failed=False, bloqueia_proxima=False, failure_reason="")
+
+                # 3. Calcula a sequência (Onde a devolução vai entrar)
+                if is_priority:
+                    current_active = motoboy.route_stops.filter(is_completed=False).order_by('sequence').first()
+                    sequence_to_use = current_active.sequence if current_active else parada.sequence + 1
+                    motoboy.route_stops.filter(is_completed=False, sequence__gte=sequence_to_use).update(sequence=F('sequence') + 1)
+                else:
+                    ultima = motoboy.route_stops.aggregate(max_seq=Max('sequence'))['max_seq'] or 0
+                    sequence_to_use = ultima + 1
                 
-            # 4. Cria a parada de DEVOLUÇÃO com o texto 100% correto
-            RouteStop.objects.create(
-                service_order=os_atual,
-                motoboy=motoboy,
-                stop_type='DEVOLUCAO',
-                sequence=sequence_to_use,
-                failure_reason=f"Devolver em: {endereco_retorno}",
-                status='PENDENTE',
-                bloqueia_proxima=False
-            )
+                # 4. Cria a parada de DEVOLUÇÃO com o texto 100% correto
+                RouteStop.objects.create(
+                    service_order=os_atual,
+                    motoboy=motoboy,
+                    stop_type='DEVOLUCAO',
+                    sequence=sequence_to_use,
+                    failure_reason=f"Devolver em: {endereco_retorno}",
+                    status='PENDENTE',
+                    bloqueia_proxima=False
+                )
             
-            # 5. Resolve a ocorrência e atualiza logs
-            DispatcherDecision.objects.create(
-                occurrence=ocorrencia, acao=acao, 
-                detalhes=f"Devolução agendada para: {endereco_retorno} (Prioridade: {is_priority})", 
-                decidido_por=request.user
-            )
+                # 5. Resolve a ocorrência e atualiza logs
+                DispatcherDecision.objects.create(
+                    occurrence=ocorrencia, acao=acao, 
+                    detalhes=f"Devolução agendada para: {endereco_retorno} (Prioridade: {is_priority})", 
+                    decidido_por=request.user
+                )
             
-            ocorrencia.resolvida = True
-            ocorrencia.save()
+                ocorrencia.resolvida = True
+                ocorrencia.save()
 
-            root_os = os_atual.parent_os or os_atual
-            grouped_orders = ServiceOrder.objects.filter(Q(id=root_os.id) | Q(parent_os=root_os))
-            grouped_orders.update(status='COLETADO')
+                transicionar(root_os, 'COLETADO', request.user)
             
         elif acao == 'VOLTAR_FILA':
-            root_os = os_atual.parent_os or os_atual
-            grouped_orders = ServiceOrder.objects.filter(Q(id=root_os.id) | Q(parent_os=root_os))
-
-            # Atualiza a raiz na memória para não gerar OS Fantasma
-            root_os.status = 'PENDENTE'
-            root_os.motoboy = None
-            root_os.operational_notes += f"\n[🔄 VOLTOU À FILA] A OS retornou para Aguardando. Motivo: {ocorrencia.get_causa_display()}."
-            root_os.save()
-
-            # Atualiza as filhas
-            grouped_orders.exclude(id=root_os.id).update(status='PENDENTE', motoboy=None)
+            root_os = raiz(os_atual)
 
-            # Reseta as paradas para a fila
-            RouteStop.objects.filter(
-                service_order__in=grouped_orders,
-                is_completed=False
-            ).update(
-                motoboy=None,
-                is_failed=False,
-                failure_reason="",
-                status=RouteStop.StopStatus.PENDENTE,
-                bloqueia_proxima=False
-            )
+            with transaction.atomic():
+                # Mãe e filhas voltam para a fila (a raiz em memória também é atualizada)
+                transicionar(root_os, 'PENDENTE', request.user, motoboy=None)
+                root_os.operational_notes += f"\n[🔄 VOLTOU À FILA] A OS retornou para Aguardando. Motivo: {ocorrencia.get_causa_display()}."
+                root_os.save()
+
+                # Reseta as paradas para a fila
+                paradas_do_grupo(root_os).filter(
+                    is_completed=False
+                ).update(
+                    motoboy=None,
+                    is_failed=False,
+                    failure_reason="",
+                    status=RouteStop.StopStatus.PENDENTE,
+                    bloqueia_proxima=False
+                )
 
-            # Reseta a posse dos itens para a base
-            OSItem.objects.filter(
-                order__in=grouped_orders,
-                posse_atual=ocorrencia.motoboy
-            ).update(
-                status=OSItem.ItemStatus.NAO_COLETADO,
-                posse_atual=None
-            )
+                # Reseta a posse dos itens para a base
+                OSItem.objects.filter(
+                    order__group_root_id=root_os.id,
+                    posse_atual=ocorrencia.motoboy
+                ).update(
+                    status=OSItem.ItemStatus.NAO_COLETADO,
+                    posse_atual=None
+                )
 
-            DispatcherDecision.objects.create(
-                occurrence=ocorrencia, acao=acao, 
-                detalhes="Motoboy desvinculado. OS devolvida para a fila Aguardando.", 
-                decidido_por=request.user
-            )
+                DispatcherDecision.objects.create(
+                    occurrence=ocorrencia, acao=acao, 
+                    detalhes="Motoboy desvinculado. OS devolvida para a fila Aguardando.", 
+                    decidido_por=request.user
+                )
 
-            ocorrencia.resolvida = True
-            ocorrencia.save()
+                ocorrencia.resolvida = True
+                ocorrencia.save()
 
         else:
             return JsonResponse({'status': 'error', 'message': 'Ação não reconhecida.'}, status=400)
 
         return JsonResponse({'status': 'success'})
 
+    except TransicaoInvalida as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
@@ -326,10 +306,11 @@ def cancel_os_view(request, os_id):
     if os.status in ['COLETADO', 'ENTREGUE']:
         return JsonResponse({'status': 'error', 'message': 'Esta OS já está em rota ou foi entregue e não pode ser cancelada.'}, status=400)
         
-    # Efetua o cancelamento
-    os.status = 'CANCELADO'
-    os.motoboy = None # Retira do motoboy, se houver
-    os.save()
+    # Efetua o cancelamento (a OS mãe leva as filhas junto; uma filha sozinha só cancela a si mesma)
+    try:
+        transicionar(os, 'CANCELADO', request.user, grupo=os.parent_os_id is None, motoboy=None)
+    except TransicaoInvalida as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
     
     messages.success(request, f'A OS {os.os_number} foi cancelada com sucesso.')
     return JsonResponse({'status': 'success'})
@@ -340,33 +321,27 @@ def admin_dashboard_view(request):
     if not (request.user.type == 'ADMIN' or request.user.is_superuser):
         return redirect('root')
 
-    # 1. KPIs Gerais da Operação
-    total_os = ServiceOrder.objects.count()
-    os_completed = ServiceOrder.objects.filter(status='ENTREGUE').count()
-    os_canceled = ServiceOrder.objects.filter(status='CANCELADO').count()
-    os_progress = ServiceOrder.objects.filter(status__in=['ACEITO', 'COLETADO', 'OCORRENCIA']).count()
+    # 1. KPIs Gerais da Operação (contadores materializados, ver orders/kpis.py)
+    por_status = kpis.totais_por_status()
+    total_os = sum(por_status.values())
+    os_completed = por_status.get('ENTREGUE', 0)
+    os_canceled = por_status.get('CANCELADO', 0)
+    os_progress = sum(por_status.get(st, 0) for st in ['ACEITO', 'COLETADO', 'OCORRENCIA'])
     
     empresas_ativas = CustomUser.objects.filter(type='COMPANY', is_active=True).count()
     motoboys_ativos = MotoboyProfile.objects.filter(is_available=True).count()
 
     # 2. Alertas (Ocorrências Críticas Pendentes)
-    alertas = Occurrence.objects.filter(resolvida=False).select_related('service_order', 'motoboy').order_by('-urgencia', '-criado_em')[:5]
+    alertas = Occurrence.objects.filter(resolvida=False).select_related('service_order', 'motoboy__user').order_by('-urgencia', '-criado_em')[:5]
 
     # 3. Visão Global (Últimas 20 OS)
-    recent_orders = ServiceOrder.objects.select_related('client', 'motoboy').order_by('-created_at')[:20]
+    recent_orders = ServiceOrder.objects.select_related('client', 'motoboy__user').order_by('-created_at')[:20]
 
     # 4. Ranking de Motoboys (Ordenado por total de entregas)
-    motoboys_ranking = MotoboyProfile.objects.select_related('user').annotate(
-        total_entregas=Count('deliveries', filter=Q(deliveries__status='ENTREGUE')),
-        em_andamento=Count('deliveries', filter=Q(deliveries__status__in=['ACEITO', 'COLETADO']))
-    ).order_by('-total_entregas')[:15]
+    motoboys_ranking = kpis.ranking_motoboys(15)
 
     # 5. Ranking de Empresas (Volume de pedidos)
-    companies_ranking = CustomUser.objects.filter(type='COMPANY').annotate(
-        total_pedidos=Count('orders'),
-        concluidas=Count('orders', filter=Q(orders__status='ENTREGUE')),
-        canceladas=Count('orders', filter=Q(orders__status='CANCELADO'))
-    ).order_by('-total_pedidos')[:15]
+    companies_ranking = kpis.ranking_empresas(15)
 
     context = {
         'kpis': {
@@ -384,6 +359,44 @@ def admin_dashboard_view(request):
     }
     return render(request, 'orders/admin_dashboard.html', context)
 
+@login_required
+def sql_profile_view(request):
+    """ Últimos requests amostrados pelo SQLProfilingMiddleware, com resumo por view """
+    if not (request.user.type == 'ADMIN' or request.user.is_superuser):
+        return redirect('root')
+
+    registros = perfis_sql.listar()
+
+    por_view = {}
+    for r in registros:
+        resumo = por_view.setdefault(r['view'] or r['caminho'], {
+            'view': r['view'] or r['caminho'], 'requests': 0, 'queries': 0, 'max_queries': 0,
+            'sql_ms': 0.0, 'total_ms': 0.0, 'max_total_ms': 0.0, 'com_duplicadas': 0,
+        })
+        resumo['requests'] += 1
+        resumo['queries'] += r['queries']
+        resumo['max_queries'] = max(resumo['max_queries'], r['queries'])
+        resumo['sql_ms'] += r['sql_ms']
+        resumo['total_ms'] += r['total_ms']
+        resumo['max_total_ms'] = max(resumo['max_total_ms'], r['total_ms'])
+        resumo['com_duplicadas'] += 1 if r['duplicadas'] else 0
+    for resumo in por_view.values():
+        n = resumo['requests']
+        resumo['media_queries'] = round(resumo.pop('queries') / n, 1)
+        resumo['media_sql_ms'] = round(resumo.pop('sql_ms') / n, 1)
+        resumo['media_total_ms'] = round(resumo.pop('total_ms') / n, 1)
+    resumo_views = sorted(por_view.values(), key=lambda v: v['media_total_ms'], reverse=True)
+
+    if request.GET.get('formato') == 'json':
+        return JsonResponse({'status': 'success', 'resumo': resumo_views, 'registros': registros})
+
+    return render(request, 'orders/sql_profile.html', {
+        'registros': registros,
+        'resumo_views': resumo_views,
+        'ativo': settings.SQL_PROFILING_ENABLED,
+        'taxa': settings.SQL_PROFILING_SAMPLE_RATE,
+    })
+
 @login_required
 def os_create_view(request):
     if request.user.type != 'COMPANY':
@@ -393,6 +406,12 @@ def os_create_view(request):
         try:
             data = json.loads(request.body)
             
+            # Geocodificação local (CEP/rua -> lat/lng), sem API externa no request
+            origin_lat, origin_lng = geocodificar(
+                data.get('origin_zip_code', ''), data.get('origin_street', ''),
+                data.get('origin_city', ''), data.get('origin_state', '')
+            )
+
             with transaction.atomic():
                 # 1. SALVA A CAPA DA OS E COLETA (Agora com os campos novos)
                 os = ServiceOrder.objects.create(
@@ -414,6 +433,8 @@ def os_create_view(request):
                     origin_city=data.get('origin_city', ''),
                     origin_state=data.get('origin_state', ''),       # NOVO
                     origin_zip_code=data.get('origin_zip_code', ''),
+                    origin_lat=origin_lat,
+                    origin_lng=origin_lng,
                     is_multiple_delivery=len(data.get('destinations', [])) > 1
                 )
 
@@ -436,6 +457,10 @@ def os_create_view(request):
                 # 3. SALVA OS DESTINOS (Agora com Complemento, Referência e UF)
                 dest_dict = {}
                 for dest_data in data.get('destinations', []):
+                    dest_lat, dest_lng = geocodificar(
+                        dest_data.get('cep', ''), dest_data['street'],
+                        dest_data['city'], dest_data.get('state', '')
+                    )
                     novo_dest = OSDestination.objects.create(
                         order=os,
                         destination_name=dest_data['name'],
@@ -447,7 +472,9 @@ def os_create_view(request):
                         destination_city=dest_data['city'],
                         destination_state=dest_data.get('state', ''),           # NOVO
                         destination_zip_code=dest_data.get('cep', ''),          # NOVO
-                        destination_reference=dest_data.get('reference', '')    # NOVO
+                        destination_reference=dest_data.get('reference', ''),   # NOVO
+                        destination_lat=dest_lat,
+                        destination_lng=dest_lng
                     )
                     dest_dict[dest_data['id']] = novo_dest
 
@@ -481,6 +508,8 @@ def os_create_view(request):
                         sequence=seq
                     )
 
+                publicar_evento('os_criada', os_id=os.id, os_number=os.os_number, priority=os.priority)
+
             return JsonResponse({'status': 'success', 'os_number': os.os_number})
             
         except Exception as e:
@@ -490,46 +519,58 @@ def os_create_view(request):
 
     return render(request, 'orders/os_create.html')
 
+@login_required
+@require_POST
+def os_bulk_create_view(request):
+    """
+    Importação em lote para clientes grandes.
+    Aceita uma lista JSON (Content-Type: application/json) ou NDJSON (application/x-ndjson),
+    e responde em NDJSON: uma linha de resultado por pedido + uma linha final de resumo.
+    """
+    if request.user.type != 'COMPANY':
+        return JsonResponse({'status': 'error', 'message': 'Sem permissão.'}, status=403)
+
+    # Copia o corpo para um arquivo temporário (memória limitada) antes de começar a responder
+    entrada = tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024)
+    while True:
+        bloco = request.read(64 * 1024)
+        if not bloco:
+            break
+        entrada.write(bloco)
+    entrada.seek(0)
+
+    if 'ndjson' in request.content_type or 'jsonlines' in request.content_type:
+        pedidos = ler_ndjson(entrada)
+    else:
+        try:
+            # Lê pedido a pedido enquanto responde; aqui só confere o começo do arquivo
+            pedidos = ler_json(entrada)
+        except ValueError as e:
+            entrada.close()
+            return JsonResponse({'status': 'error', 'message': f'JSON inválido: {e}'}, status=400)
+
+    cliente = request.user
+
+    def gerar_linhas():
+        try:
+            for resultado in importar_com_resumo(cliente, pedidos):
+                if resultado.get('summary'):
+                    publicar_evento('os_lote', client_id=cliente.id, created=resultado['created'])
+                yield json.dumps(resultado) + '\n'
+        finally:
+            entrada.close()
+
+    return StreamingHttpResponse(gerar_linhas(), content_type='application/x-ndjson')
+
 @login_required
 def dispatch_dashboard_view(request):
     if request.user.type != 'DISPATCHER' and not request.user.is_superuser:
         return redirect('root')
 
-    pending_orders = ServiceOrder.objects.filter(
-        Q(status='PENDENTE') | Q(status='OCORRENCIA', motoboy__isnull=True)
-    ).order_by('-priority', 'created_at')
-    
-    from logistics.models import MotoboyProfile
-    motoboys = MotoboyProfile.objects.all()
+    pending_orders = ServiceOrder.objects.fila_despacho().select_related('client').prefetch_related('ocorrencias', 'child_orders')
     
-    motoboy_data = []
-    for mb in motoboys:
-        last_seen = cache.get(f'seen_{mb.user.id}')
-        is_online = mb.is_available and bool(last_seen)
-
-        # Paradas operacionais normais (não inclui placeholder de socorro)
-        ativas = mb.route_stops.filter(
-            is_completed=False
-        ).exclude(
-            failure_reason__icontains='[AGUARDANDO SOCORRO]'
-        ).order_by('sequence')
-
-        # Placeholder criado para o motoboy antigo enquanto aguarda socorrista
-        aguardando_socorro = mb.route_stops.filter(
-            is_completed=False,
-            failure_reason__icontains='[AGUARDANDO SOCORRO]'
-        ).order_by('sequence')
-        
-        motoboy_data.append({
-            'profile': mb,
-            'is_online': is_online,
-            'load': ativas.count() + aguardando_socorro.count(),
-            'max_load': 10,
-            'active_stops': ativas,
-            'waiting_rescue_stops': aguardando_socorro,
-        })
-        
-    motoboy_data.sort(key=lambda x: x['is_online'], reverse=True)
+    # Frota inteira com número fixo de queries (ver orders/fleet.py)
+    motoboy_data = build_fleet_snapshot()
 
     total_ativas = sum(mb['load'] for mb in motoboy_data)
     total_ocorrencias = ServiceOrder.objects.filter(status='OCORRENCIA').count()
@@ -540,29 +581,139 @@ def dispatch_dashboard_view(request):
         'total_ativas': total_ativas,
         'total_ocorrencias': total_ocorrencias,
         'now': timezone.now(),
+        'ocorrencias_pendentes': _ocorrencias_pendentes(),
     }
-    context['ocorrencias_pendentes'] = Occurrence.objects.filter(resolvida=False).annotate(
+
+    return render(request, 'orders/dispatch_panel.html', context)
+
+def _ocorrencias_pendentes():
+    return Occurrence.objects.filter(resolvida=False).select_related(
+        'service_order', 'parada', 'motoboy__user'
+    ).annotate(
         has_extra_cargo=Exists(
             ServiceOrder.objects.filter(
                 motoboy=OuterRef('motoboy_id'),
                 status='COLETADO'
             ).exclude(
-                id=OuterRef('service_order_id')  # Exclui a própria OS da ocorrência
-            ).exclude(
-                parent_os=OuterRef('service_order_id') # Exclui as filhas da OS da ocorrência
+                group_root_id=OuterRef('service_order__group_root_id')  # Exclui o grupo da OS da ocorrência
             )
         )
     ).order_by('-urgencia', '-criado_em')
 
-    return render(request, 'orders/dispatch_panel.html', context)
+MAX_CARDS = 100  # Acima disso o painel recarrega as colunas inteiras
+
+def _ids(valor):
+    """ "1,2,3" -> [1, 2, 3]; ignora o que não for número """
+    return [int(parte) for parte in (valor or '').split(',') if parte.strip().isdigit()][:MAX_CARDS]
+
+@login_required
+def dispatch_cards_view(request):
+    """
+    Cards avulsos do painel para aplicar um delta SSE sem reconstruir as colunas.
+    ?os=1,2 -> card da fila de cada OS (None = saiu da fila); os motoboys dessas OS vêm junto.
+    ?motoboys=3 -> card da frota e da coluna "Em Atendimento"; ?ocorrencias=1 -> bloco de ocorrências.
+    """
+    if request.user.type != 'DISPATCHER' and not request.user.is_superuser:
+        return JsonResponse({'status': 'error', 'message': 'Sem permissão.'}, status=403)
+
+    os_ids = _ids(request.GET.get('os'))
+    motoboy_ids = set(_ids(request.GET.get('motoboys')))
+    if os_ids:
+        motoboy_ids |= ServiceOrder.objects.filter(id__in=os_ids).motoboys_afetados()
+    motoboy_ids.discard(None)
+
+    na_fila = {
+        os.id: os for os in ServiceOrder.objects.fila_despacho().filter(id__in=os_ids)
+        .select_related('client').prefetch_related('ocorrencias', 'child_orders')
+    }
+    fila = {
+        os_id: render_to_string('orders/painel/card_fila.html', {'os': na_fila[os_id]}, request)
+        if os_id in na_fila else None
+        for os_id in os_ids
+    }
+
+    frota, rotas = {}, {}
+    agora = timezone.now()
+    for data in build_fleet_snapshot(motoboy_ids) if motoboy_ids else ():
+        contexto = {'data': data, 'now': agora}
+        frota[data['profile'].id] = render_to_string('orders/painel/card_frota.html', contexto, request)
+        rotas[data['profile'].id] = render_to_string('orders/painel/card_rota.html', contexto, request)
+
+    resposta = {
+        'fila': fila,
+        'frota': frota,
+        'rotas': rotas,
+        'contadores': {
+            'aguardando': ServiceOrder.objects.fila_despacho().count(),
+            'atendimento': RouteStop.objects.filter(motoboy__isnull=False, is_completed=False).count(),
+        },
+    }
+    if request.GET.get('ocorrencias'):
+        resposta['ocorrencias'] = render_to_string(
+            'orders/painel/ocorrencias.html', {'ocorrencias_pendentes': _ocorrencias_pendentes(), 'now': agora}, request
+        )
+    return JsonResponse(resposta)
+
+@login_required
+def dispatch_events_view(request):
+    """ Stream SSE com os deltas do painel (nova OS, atribuição, parada concluída, ocorrência, presença) """
+    if request.user.type != 'DISPATCHER' and not request.user.is_superuser:
+        return JsonResponse({'status': 'error', 'message': 'Sem permissão.'}, status=403)
+
+    last_id = request.headers.get('Last-Event-ID') or request.GET.get('last_id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        last_id = None
+
+    transmissao = abrir_transmissao(last_id)
+    if transmissao is None:
+        # Streams demais neste processo: o EventSource desiste e o painel volta ao polling
+        return JsonResponse({'status': 'error', 'message': 'Tempo real indisponível; usando atualização periódica.'}, status=503)
+
+    response = StreamingHttpResponse(transmissao, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Nginx: não segurar o stream em buffer
+    return response
+
+@login_required
+def search_os_view(request):
+    """ Busca de OS por número, solicitante, endereço, destinatário ou item (ver orders/search.py) """
+    user = request.user
+    if user.type == 'DISPATCHER' or user.type == 'ADMIN' or user.is_superuser:
+        client_id = None
+    elif user.type == 'COMPANY':
+        client_id = user.id  # Empresa só acha as próprias OS
+    else:
+        return JsonResponse({'status': 'error', 'message': 'Sem permissão.'}, status=403)
+
+    termo = request.GET.get('q', '').strip()
+    if len(termo) < 2:
+        return JsonResponse({'status': 'success', 'resultados': []})
+    try:
+        # Sem piso, ?limite=-5 vira LIMIT sem fim no SQLite e erro no PostgreSQL
+        limite = max(1, min(int(request.GET.get('limite', LIMITE_PADRAO)), 50))
+    except ValueError:
+        limite = LIMITE_PADRAO
+
+    resultados = [{
+        'id': os.id,
+        'os_number': os.os_number,
+        'status': os.status,
+        'status_display': os.get_status_display(),
+        'empresa': os.client.first_name or os.client.username,
+        'solicitante': os.requester_name,
+        'coleta': f"{os.origin_street}, {os.origin_number} - {os.origin_district}",
+        'motoboy': os.motoboy.user.first_name if os.motoboy else None,
+        'criada_em': timezone.localtime(os.created_at).strftime('%d/%m %H:%M'),
+    } for os in buscar(termo, limite, client_id)]
+    return JsonResponse({'status': 'success', 'resultados': resultados})
 
 @login_required
 def get_route_stops(request, os_id):
     """Retorna a rota de uma OS em JSON para montar a timeline no Modal"""
     os_alvo = get_object_or_404(ServiceOrder, id=os_id)
-    stops = RouteStop.objects.filter(
-        Q(service_order=os_alvo) | Q(service_order__parent_os=os_alvo)
-    ).order_by('sequence')
+    stops = paradas_do_grupo(os_alvo).select_related('service_order', 'destination').order_by('sequence')
     data = []
     for stop in stops:
         if stop.stop_type == 'COLETA':
@@ -600,13 +751,19 @@ def merge_os_view(request):
     if source_os.status != 'PENDENTE' or target_os.status != 'PENDENTE':
         return JsonResponse({'status': 'error', 'message': 'Apenas OS PENDENTES podem ser mescladas.'})
 
+    # Ainda sem motoboy: o grupo novo é comparado com o veículo que a OS destino pede (só avisa)
+    avaliacao = capacity.verificar_veiculo([source_os.group_root_id, target_os.group_root_id], target_os.vehicle_type)
+    aviso = f"{avaliacao['mensagem']} Considere trocar o tipo de veículo da OS {target_os.os_number}." if avaliacao['nivel'] == 'excede' else ''
+
     with transaction.atomic():
         # 1. Torna a OS Origem "Filha" da OS Destino
-        source_os.parent_os = target_os
         # Muda o status para não aparecer mais na coluna "Aguardando", mas NÃO cancela.
-        source_os.status = 'AGRUPADO' 
+        transicionar(source_os, 'AGRUPADO', request.user, grupo=False)
+        source_os.parent_os = target_os
         source_os.operational_notes += f"\n[AGRUPADA] Viajando junto com a OS {target_os.os_number}."
         source_os.save()
+        # Se a origem já era mãe de um grupo, as filhas dela passam direto para a nova mãe (árvore de um nível só)
+        ServiceOrder.objects.filter(parent_os=source_os).update(parent_os=target_os)
 
         # 2. Atualiza a numeração da sequência para o Modal
         last_seq = target_os.stops.count()
@@ -621,7 +778,7 @@ def merge_os_view(request):
         target_os.is_multiple_delivery = True
         target_os.save()
 
-    return JsonResponse({'status': 'success'})
+    return JsonResponse({'status': 'success', 'aviso': aviso})
 
 
 @login_required
@@ -650,8 +807,8 @@ def unmerge_os_view(request):
 
     with transaction.atomic():
         # 1. Remove o vínculo com a mãe e volta o status para PENDENTE
+        transicionar(child_os, 'PENDENTE', request.user, grupo=False)
         child_os.parent_os = None
-        child_os.status = 'PENDENTE'
 
         # Remove tags de log específicas, se existirem
         for marker in ["[AGRUPADA]", "[MESCLADA]"]:
@@ -691,64 +848,13 @@ def motoboy_tasks_view(request):
     if not perfil.cnh_number or 'Pendente' in perfil.cnh_number or not perfil.vehicle_plate or 'Pendente' in perfil.vehicle_plate:
         return redirect('motoboy_profile')
 
-    # 1. Encontra TODAS as OS que têm pelo menos UMA parada para ESTE motoboy específico
-    pending_os_ids = RouteStop.objects.filter(
-        motoboy=perfil,
-        is_completed=False
-    ).values_list('service_order_id', flat=True)
-
-    # 2. Busca as OS baseadas nas paradas pendentes
-    ativas_qs = ServiceOrder.objects.filter(
-        Q(id__in=pending_os_ids) | Q(child_orders__id__in=pending_os_ids),
-        status__in=['ACEITO', 'COLETADO', 'OCORRENCIA'], 
-        parent_os__isnull=True
-    ).distinct().order_by('created_at')
-
-    proxima_parada_global = RouteStop.objects.filter(
-        motoboy=perfil, 
-        is_completed=False
-    ).exclude(sequence=999).order_by('sequence').first()
-    
-    os_em_execucao_id = proxima_parada_global.service_order.id if proxima_parada_global else None
-
-    ativas_data = []
-    for os in ativas_qs:
-        # 3. MANDA PARA A TELA SÓ AS PARADAS DESTE MOTOBOY (O novo não vê o que o antigo já fez)
-        stops = RouteStop.objects.filter(
-            (Q(service_order=os) | Q(service_order__parent_os=os)),
-            motoboy=perfil
-        ).order_by('sequence')
-        
-        filhas = os.child_orders.all()
-
-        # MÁGICA INVISÍVEL: Verifica se a OS está a aguardar o despachante (só tem paragens 999)
-        ta_pausada = not stops.filter(is_completed=False).exclude(sequence=999).exists()
-        
-        ativas_data.append({
-            'os': os,
-            'stops': stops,
-            'has_children': filhas.exists(),
-            'child_numbers': [f.os_number for f in filhas],
-            'ta_pausada': ta_pausada,
-            'eh_a_atual': (os.id == os_em_execucao_id)
-        })
-
-    ativas_data.sort(key=lambda x: (
-        x['ta_pausada'], 
-        not x['eh_a_atual'], 
-        x['os'].created_at
-    ))
-
-    entregas_concluidas_hoje = RouteStop.objects.filter(
-        motoboy=perfil, stop_type='ENTREGA', is_completed=True, is_failed=False, completed_at__date=timezone.now().date()
-    ).count()
-
-    historico = ServiceOrder.objects.filter(motoboy=perfil, status__in=['ENTREGUE', 'CANCELADO']).order_by('-created_at')[:10]
+    # Paradas, OS, filhas e destinos em poucas queries, com cache por motoboy (orders/driver_view.py)
+    dados = build_driver_view(perfil)
 
     context = {
-        'ativas_data': ativas_data,
-        'historico': historico,
-        'entregas_concluidas': entregas_concluidas_hoje,
+        'ativas_data': dados['ativas_data'],
+        'historico': dados['historico'],
+        'entregas_concluidas': dados['entregas_concluidas'],
     }
     return render(request, 'orders/motoboy_tasks.html', context)
 
@@ -803,30 +909,32 @@ def assign_motoboy_view(request, os_id):
         
         from logistics.models import MotoboyProfile
         motoboy = get_object_or_404(MotoboyProfile, id=motoboy_id)
+
+        # Peso/volume do grupo contra o baú do motoboy (carga lida na hora, orders/capacity.py)
+        avaliacao = capacity.verificar(motoboy.id, [os.group_root_id])
+        if avaliacao['nivel'] == 'excede' and not request.POST.get('ignorar_capacidade'):
+            messages.error(request, f"OS #{os.os_number} não atribuída a {motoboy.user.first_name}. {avaliacao['mensagem']}")
+            return redirect('dispatch_dashboard')
+        if avaliacao['nivel'] != 'ok':
+            messages.warning(request, avaliacao['mensagem'])
         
-        # Atualiza a OS Mãe
-        os.motoboy = motoboy
-        os.status = 'ACEITO'
-        os.save()
-
-        # Atualiza as OS Filhas (para as empresas verem que o motoboy aceitou!)
-        child_orders = ServiceOrder.objects.filter(parent_os=os)
-        child_orders.update(motoboy=motoboy, status='ACEITO')
-        
-        # --- MÁGICA DA ROTEIRIZAÇÃO ---
-        last_seq = motoboy.route_stops.filter(is_completed=False).count()
-        
-        # Pega as paradas da Mãe E das Filhas
-        stops = RouteStop.objects.filter(
-            Q(service_order=os) | Q(service_order__parent_os=os)
-        ).order_by('sequence')
+        # Atualiza a OS Mãe e as Filhas (para as empresas verem que o motoboy aceitou!)
+        try:
+            with transaction.atomic():
+                transicionar(os, 'ACEITO', request.user, motoboy=motoboy)
 
-        # Joga as paradas na fila do motoboy
-        for stop in stops:
-            last_seq += 1
-            stop.motoboy = motoboy
-            stop.sequence = last_seq
-            stop.save()
+                # --- MÁGICA DA ROTEIRIZAÇÃO: paradas do grupo na fila do motoboy (services.atribuir_paradas) ---
+                # Na mesma transação: um bulk_update de poucas linhas, e a OS nunca fica ACEITO sem rota
+                atribuir_paradas(os, motoboy)
+
+                # Reorganizar a fila inteira é pesado: vai para a fila de tarefas (que confere a OS de novo)
+                if request.POST.get('otimizar_rota'):
+                    jobs.enfileirar('atribuir_paradas', solicitante=request.user, os_id=os.id, motoboy_id=motoboy.id, otimizar=True)
+        except TransicaoInvalida as e:
+            messages.error(request, str(e))
+            return redirect('dispatch_dashboard')
+
+        publicar_evento('os_atribuida', os_id=os.id, os_number=os.os_number, motoboy_id=motoboy.id)
             
         messages.success(request, f"Roteiro da OS #{os.os_number} adicionado à rota de {motoboy.user.first_name}!")
         
@@ -884,6 +992,29 @@ def reorder_stops_view(request):
 
     return JsonResponse({'status': 'success'})
 
+@login_required
+def suggest_route_view(request, motoboy_id):
+    """ Prévia do roteirizador: mostra a ordem otimizada das paradas abertas sem gravar nada """
+    if request.user.type != 'DISPATCHER' and not request.user.is_superuser:
+        return JsonResponse({'status': 'error', 'message': 'Sem permissão.'}, status=403)
+
+    motoboy = get_object_or_404(MotoboyProfile, id=motoboy_id)
+    dados = serializar_sugestao(sugerir_rota(motoboy))
+    dados['status'] = 'success'
+    return JsonResponse(dados)
+
+@login_required
+@require_POST
+def apply_route_view(request, motoboy_id):
+    """ Grava a ordem otimizada das paradas abertas do motoboy """
+    if request.user.type != 'DISPATCHER' and not request.user.is_superuser:
+        return JsonResponse({'status': 'error', 'message': 'Sem permissão.'}, status=403)
+
+    motoboy = get_object_or_404(MotoboyProfile, id=motoboy_id)
+    dados = aplicar_rota(motoboy)
+    dados['status'] = 'success'
+    return JsonResponse(dados)
+
 @login_required
 @require_POST
 def motoboy_update_status(request, stop_id):
@@ -892,90 +1023,105 @@ def motoboy_update_status(request, stop_id):
 
     from orders.models import RouteStop, OSItem, ItemDistribution, ServiceOrder
 
-    current_stop = get_object_or_404(RouteStop, id=stop_id, motoboy__user=request.user)
-
-    if not current_stop.is_completed:
-        os = current_stop.service_order
-        root_os = os.parent_os or os
-        grouped_orders = ServiceOrder.objects.filter(Q(id=root_os.id) | Q(parent_os=root_os))
-
-        # 1. SE FOR ENTREGA: Tira a posse do motoboy e marca item como ENTREGUE
-        if current_stop.stop_type == 'ENTREGA' and current_stop.destination:
-            dest = current_stop.destination
-            receiver_name = request.POST.get('receiver_name')
-            proof_photo = request.FILES.get('proof_photo')
-            if receiver_name: dest.receiver_name = receiver_name
-            if proof_photo: dest.proof_photo = proof_photo
-            dest.is_delivered = True
-            dest.delivered_at = timezone.now()
-            dest.save()
-
-            # Passa os itens deste destino específico para ENTREGUE
-            item_ids = ItemDistribution.objects.filter(destination=dest).values_list('item_id', flat=True)
-            OSItem.objects.filter(id__in=item_ids).update(
-                status=OSItem.ItemStatus.ENTREGUE, 
-                posse_atual=None  # Sai do baú do motoboy
-            )
+    # Tudo ou nada: se a transição falhar (ex: a OS voltou para a fila), destino, fotos, posse
+    # dos itens e a parada concluída não ficam gravados pela metade. As fotos vão para o storage
+    # antes do lock da parada; se a transação desfizer (ou não forem usadas), são apagadas.
+    try:
+        with media.Brutos('orders.OSDestination', proof_photo=request.FILES.get('proof_photo'),
+                          receiver_signature=request.FILES.get('receiver_signature')) as brutos, \
+                transaction.atomic():
+            current_stop = get_object_or_404(RouteStop.objects.select_for_update(), id=stop_id, motoboy__user=request.user)
+
+            if not current_stop.is_completed:
+                os = current_stop.service_order
+                root_os = raiz(os)
+
+                # 1. SE FOR ENTREGA: Tira a posse do motoboy e marca item como ENTREGUE
+                if current_stop.stop_type == 'ENTREGA' and current_stop.destination:
+                    dest = current_stop.destination
+                    receiver_name = request.POST.get('receiver_name')
+                    proof_photo = brutos.usar('proof_photo')
+                    receiver_signature = brutos.usar('receiver_signature')
+                    if receiver_name: dest.receiver_name = receiver_name
+                    if proof_photo: dest.proof_photo = proof_photo
+                    if receiver_signature: dest.receiver_signature = receiver_signature
+                    dest.is_delivered = True
+                    dest.delivered_at = timezone.now()
+                    dest.save()
+                    # Grava os arquivos como vieram; redução, EXIF e miniatura ficam para a fila (orders/media.py)
+                    if proof_photo: media.receber(dest, 'proof_photo')
+                    if receiver_signature: media.receber(dest, 'receiver_signature')
+
+                    # Passa os itens deste destino específico para ENTREGUE
+                    item_ids = ItemDistribution.objects.filter(destination=dest).values_list('item_id', flat=True)
+                    OSItem.objects.filter(id__in=item_ids).update(
+                        status=OSItem.ItemStatus.ENTREGUE, 
+                        posse_atual=None  # Sai do baú do motoboy
+                    )
 
-        # Conclui a parada do motoboy atual
-        current_stop.is_completed = True
-        current_stop.completed_at = timezone.now()
-        current_stop.save()
+                # Conclui a parada do motoboy atual
+                current_stop.is_completed = True
+                current_stop.completed_at = timezone.now()
+                current_stop.save()
 
-        # 2. SE FOR TRANSFERÊNCIA (O novo motoboy foi buscar a carga ao local do acidente)
-        if current_stop.stop_type == 'TRANSFERENCIA':
-            # Liberta a paragem fantasma do motoboy antigo (acidentado)
-            RouteStop.objects.filter(
-                service_order__in=grouped_orders,
-                stop_type='TRANSFERENCIA',
-                is_completed=False
-            ).exclude(motoboy=current_stop.motoboy).update(
-                is_completed=True,
-                status=RouteStop.StopStatus.CONCLUIDA,
-                completed_at=timezone.now()
-            )
+                publicar_evento(
+                    'parada_concluida', stop_id=current_stop.id, stop_type=current_stop.stop_type,
+                    os_id=os.id, motoboy_id=current_stop.motoboy_id
+                )
 
-            # O novo motoboy assume a posse física dos itens transferidos
-            OSItem.objects.filter(
-                order__in=grouped_orders,
-                status=OSItem.ItemStatus.TRANSFERIDO
-            ).update(
-                status=OSItem.ItemStatus.COLETADO,
-                posse_atual=current_stop.motoboy
-            )
-            messages.success(request, f"Carga assumida com sucesso!")
+                # 2. SE FOR TRANSFERÊNCIA (O novo motoboy foi buscar a carga ao local do acidente)
+                if current_stop.stop_type == 'TRANSFERENCIA':
+                    # Liberta a paragem fantasma do motoboy antigo (acidentado)
+                    paradas_do_grupo(root_os).filter(
+                        stop_type='TRANSFERENCIA',
+                        is_completed=False
+                    ).exclude(motoboy=current_stop.motoboy).update(
+                        is_completed=True,
+                        status=RouteStop.StopStatus.CONCLUIDA,
+                        completed_at=timezone.now()
+                    )
 
-        # 3. SE FOR COLETA: O motoboy pegou a mercadoria na loja
-        if current_stop.stop_type == 'COLETA':
-            # Atualiza o status de todas as OS agrupadas (mãe e filhas)
-            grouped_orders.update(status='COLETADO')
-            
-            # Passa a posse lógica de TODOS os itens do grupo para este motoboy
-            OSItem.objects.filter(order__in=grouped_orders).update(
-                status=OSItem.ItemStatus.COLETADO,
-                posse_atual=current_stop.motoboy
-            )
-            messages.success(request, f"Coleta confirmada! Os itens estão agora em sua posse.")
-            
-        elif current_stop.stop_type in ['ENTREGA', 'DEVOLUCAO']:
-            # Verifica se ele ainda tem paragens
-            paradas_restantes = RouteStop.objects.filter(
-                service_order__in=grouped_orders,
-                motoboy=current_stop.motoboy,
-                is_completed=False
-            ).count()
-            
-            if paradas_restantes == 0:
-                total_geral_restantes = RouteStop.objects.filter(
-                    service_order__in=grouped_orders, is_completed=False
-                ).count()
-                
-                if total_geral_restantes == 0:
-                    os.status = 'ENTREGUE'
-                    os.save()
-                messages.success(request, f"Todas as suas tarefas desta OS foram concluídas!")
-            else:
-                messages.success(request, f"Etapa confirmada! Partindo para o próximo destino.")
+                    # O novo motoboy assume a posse física dos itens transferidos
+                    OSItem.objects.filter(
+                        order__group_root_id=root_os.id,
+                        status=OSItem.ItemStatus.TRANSFERIDO
+                    ).update(
+                        status=OSItem.ItemStatus.COLETADO,
+                        posse_atual=current_stop.motoboy
+                    )
+                    messages.success(request, f"Carga assumida com sucesso!")
+
+                # 3. SE FOR COLETA: O motoboy pegou a mercadoria na loja
+                if current_stop.stop_type == 'COLETA':
+                    # Atualiza o status de todas as OS agrupadas (mãe e filhas)
+                    transicionar(os, 'COLETADO', request.user)
+
+                    # Passa a posse lógica de TODOS os itens do grupo para este motoboy
+                    OSItem.objects.filter(order__group_root_id=root_os.id).update(
+                        status=OSItem.ItemStatus.COLETADO,
+                        posse_atual=current_stop.motoboy
+                    )
+                    messages.success(request, f"Coleta confirmada! Os itens estão agora em sua posse.")
+
+                elif current_stop.stop_type in ['ENTREGA', 'DEVOLUCAO']:
+                    # Verifica se ele ainda tem paragens
+                    paradas_restantes = paradas_do_grupo(root_os).filter(
+                        motoboy=current_stop.motoboy,
+                        is_completed=False
+                    ).count()
+
+                    if paradas_restantes == 0:
+                        total_geral_restantes = paradas_do_grupo(root_os).filter(
+                            is_completed=False
+                        ).count()
+
+                        if total_geral_restantes == 0:
+                            transicionar(os, 'ENTREGUE', request.user)
+                        messages.success(request, f"Todas as suas tarefas desta OS foram concluídas!")
+                    else:
+                        messages.success(request, f"Etapa confirmada! Partindo para o próximo destino.")
+    except TransicaoInvalida as e:
+        messages.error(request, str(e))
 
     return redirect('motoboy_tasks')
 
@@ -983,8 +1129,7 @@ def motoboy_update_status(request, stop_id):
 def motoboy_heartbeat_view(request):
     """ Recebe o sinal do aplicativo/tela do motoboy para mantê-lo online """
     if request.user.type == 'MOTOBOY':
-        # Mantém ele online no Cache por 2 minutos (120 segundos)
-        cache.set(f'seen_{request.user.id}', True, timeout=300)
+        # O heartbeat em si é registrado pelo ActiveUserMiddleware (todo request do motoboy conta)
         return JsonResponse({'status': 'online'})
     return JsonResponse({'status': 'ignored'})
 
@@ -1006,33 +1151,166 @@ def company_dashboard_view(request):
     if request.user.type != 'COMPANY':
         return redirect('root')
 
-    # Busca todas as OS desta empresa
-    minhas_os = ServiceOrder.objects.filter(client=request.user).order_by('-created_at')
+    minhas_os = ServiceOrder.objects.filter(client=request.user)
 
-    # Calcula as métricas reais do banco de dados
+    # Cards: contadores materializados da empresa (orders/kpis.py), uma query só
+    totais = kpis.totais_da_empresa(request.user.id)
     metrics = {
-        'pending': minhas_os.filter(status='PENDENTE').count(),
-        'in_progress': minhas_os.filter(status__in=['ACEITO', 'COLETADO']).count(),
-        'delivered': minhas_os.filter(status='ENTREGUE').count(),
-        'canceled': minhas_os.filter(status='CANCELADO').count(),
-        'total': minhas_os.count()
+        'pending': totais.get('PENDENTE', 0),
+        'in_progress': totais.get('ACEITO', 0) + totais.get('COLETADO', 0),
+        'delivered': totais.get('ENTREGUE', 0),
+        'canceled': totais.get('CANCELADO', 0),
+        'total': sum(totais.values()),
     }
 
-    # Separa as ativas para a tabela principal (Exclui as finalizadas)
-    ativas = minhas_os.exclude(status__in=['ENTREGUE', 'CANCELADO'])
+    # Tabela principal: só a primeira página das ativas; o resto vem de company_orders_api_view
+    ativas, proximo_cursor = pagina(_os_da_empresa(request.user, 'ativas'))
     
     # Pega as 5 últimas para a barra lateral direita
-    recentes = minhas_os[:5]
+    recentes = minhas_os.order_by('-created_at', '-id')[:5]
 
     context = {
         'metrics': metrics,
         'ativas': ativas,
+        'proximo_cursor': proximo_cursor,
         'recentes': recentes,
         'company_initials': request.user.first_name[:2].upper() if request.user.first_name else 'EM'
     }
     
     return render(request, 'orders/company_dashboard.html', context)
 
+def _os_da_empresa(empresa, situacao):
+    minhas_os = ServiceOrder.objects.filter(client=empresa)
+    if situacao == 'ativas':
+        return minhas_os.exclude(status__in=['ENTREGUE', 'CANCELADO'])
+    if situacao == 'finalizadas':
+        return minhas_os.filter(status__in=['ENTREGUE', 'CANCELADO'])
+    return minhas_os
+
+def _hora_prevista(quando):
+    return timezone.localtime(quando).strftime('%d/%m %H:%M') if quando else None
+
+@login_required
+def company_orders_api_view(request):
+    """ Lista de OS da empresa em páginas por cursor: ?situacao=ativas|finalizadas|todas&cursor=...&tamanho=... """
+    if request.user.type != 'COMPANY':
+        return JsonResponse({'status': 'error', 'message': 'Sem permissão.'}, status=403)
+
+    situacao = request.GET.get('situacao', 'ativas')
+    if situacao not in ('ativas', 'finalizadas', 'todas'):
+        return JsonResponse({'status': 'error', 'message': 'Situação inválida.'}, status=400)
+    try:
+        itens, proximo = pagina(
+            _os_da_empresa(request.user, situacao), request.GET.get('cursor'),
+            tamanho_pagina(request.GET.get('tamanho')),
+        )
+    except CursorInvalido as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    resultados = [{
+        'id': os.id,
+        'os_number': os.os_number,
+        'status': os.status,
+        'status_display': os.get_status_display(),
+        'priority_display': os.get_priority_display(),
+        'origin_name': os.origin_name,
+        'origin_district': os.origin_district,
+        'origin_city': os.origin_city,
+        'criada_em': timezone.localtime(os.created_at).strftime('%d/%m/%Y %H:%M'),
+        'previsao_coleta': _hora_prevista(os.expected_pickup),
+        'previsao_entrega': _hora_prevista(os.expected_delivery),
+    } for os in itens]
+    return JsonResponse({'status': 'success', 'resultados': resultados, 'proximo': proximo})
+
+def _empresa_exportada(request):
+    """ Empresa só exporta as próprias OS; admin escolhe (?empresa=<id>) ou exporta todas """
+    if request.user.type == 'COMPANY':
+        return request.user.id
+    if request.user.type == 'ADMIN' or request.user.is_superuser:
+        empresa = request.GET.get('empresa')
+        if not empresa:
+            return None
+        if not empresa.isdigit():
+            # Cair no "todas as empresas" aqui exportaria muito mais do que foi pedido
+            raise exports.ExportacaoInvalida(f"Empresa inválida: {empresa}.")
+        return int(empresa)
+    raise PermissionError
+
+@login_required
+def export_view(request, tipo):
+    """
+    /exportar/<os|entregas|paradas>/?formato=csv|xlsx&inicio=AAAA-MM-DD&fim=AAAA-MM-DD[&segundo_plano=1]
+    Período padrão: mês corrente. Períodos grandes viram um OrderExport (responde o id para acompanhar).
+    """
+    try:
+        client_id = _empresa_exportada(request)
+    except PermissionError:
+        return JsonResponse({'status': 'error', 'message': 'Sem permissão.'}, status=403)
+    except exports.ExportacaoInvalida as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    formato = request.GET.get('formato', 'csv')
+    inicio, fim = exports.periodo_padrao()
+    try:
+        if request.GET.get('inicio'):
+            inicio = date.fromisoformat(request.GET['inicio'])
+        if request.GET.get('fim'):
+            fim = date.fromisoformat(request.GET['fim'])
+        exports.validar(tipo, formato, inicio, fim)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    if request.GET.get('segundo_plano') == '1' or exports.vai_para_segundo_plano(inicio, fim):
+        with transaction.atomic():
+            exportacao = OrderExport.objects.create(
+                solicitante=request.user, client_id=client_id, tipo=tipo, formato=formato, inicio=inicio, fim=fim,
+            )
+            exports.agendar(exportacao)
+        return JsonResponse({
+            'status': 'success', 'exportacao_id': exportacao.id,
+            'url_status': f'/exportar/status/{exportacao.id}/',
+        }, status=202)
+
+    nome = exports.nome_arquivo(tipo, formato, inicio, fim)
+    if formato == 'xlsx':
+        return FileResponse(exports.arquivo_temporario(tipo, formato, inicio, fim, client_id),
+                            as_attachment=True, filename=nome)
+    response = StreamingHttpResponse(exports.csv_em_partes(tipo, inicio, fim, client_id),
+                                     content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{nome}"'
+    return response
+
+def _exportacao_do_usuario(request, exportacao_id):
+    exportacao = get_object_or_404(OrderExport, id=exportacao_id)
+    if exportacao.solicitante_id != request.user.id and not (request.user.type == 'ADMIN' or request.user.is_superuser):
+        return None
+    return exportacao
+
+@login_required
+def export_status_view(request, exportacao_id):
+    exportacao = _exportacao_do_usuario(request, exportacao_id)
+    if exportacao is None:
+        return JsonResponse({'status': 'error', 'message': 'Sem permissão.'}, status=403)
+    return JsonResponse({
+        'status': 'success',
+        'exportacao': {
+            'id': exportacao.id, 'tipo': exportacao.tipo, 'formato': exportacao.formato,
+            'situacao': exportacao.status, 'situacao_display': exportacao.get_status_display(),
+            'linhas': exportacao.linhas, 'erro': exportacao.erro,
+            'url_download': f'/exportar/baixar/{exportacao.id}/' if exportacao.status == OrderExport.Status.PRONTO else None,
+        },
+    })
+
+@login_required
+def export_download_view(request, exportacao_id):
+    exportacao = _exportacao_do_usuario(request, exportacao_id)
+    if exportacao is None:
+        return JsonResponse({'status': 'error', 'message': 'Sem permissão.'}, status=403)
+    if exportacao.status != OrderExport.Status.PRONTO:
+        return JsonResponse({'status': 'error', 'message': 'A exportação ainda não está pronta.'}, status=409)
+    return FileResponse(exportacao.arquivo.open('rb'), as_attachment=True,
+                        filename=exports.nome_arquivo(exportacao.tipo, exportacao.formato, exportacao.inicio, exportacao.fim))
+
 @login_required
 @require_POST
 def report_problem_view(request, stop_id):
@@ -1042,73 +1320,85 @@ def report_problem_view(request, stop_id):
 
     from orders.models import RouteStop, Occurrence, ServiceOrder
     
-    # 1. Busca as entidades
-    current_stop = get_object_or_404(RouteStop, id=stop_id, motoboy__user=request.user)
-    os_atual = current_stop.service_order
-    motoboy_profile = request.user.motoboy_profile
-
-    # 2. Extrai os dados do formulário
     causa = request.POST.get('causa')
-    observacao = request.POST.get('observacao', '')
-    evidencia_foto = request.FILES.get('evidencia_foto')
-    
-    # O motoboy diz se pode continuar a viagem ou se está travado (ex: quebrou a moto)
-    pode_seguir = request.POST.get('pode_seguir') == 'on'
-
     if not causa:
         messages.error(request, "A causa da ocorrência é obrigatória.")
         return redirect('motoboy_tasks')
 
-    # 3. Cria o registro de Ocorrência estruturado
-    ocorrencia = Occurrence.objects.create(
-        parada=current_stop,
-        service_order=os_atual,
-        motoboy=motoboy_profile,
-        causa=causa,
-        observacao=observacao,
-        evidencia_foto=evidencia_foto,
-        urgencia=Occurrence.Urgencia.ALTA if causa == 'ACIDENTE' else Occurrence.Urgencia.MEDIA
-    )
-
-    # 4. Atualiza a Parada (RouteStop)
-    current_stop.status = RouteStop.StopStatus.COM_OCORRENCIA
-    current_stop.is_failed = True
-    current_stop.failure_reason = f"{ocorrencia.get_causa_display()}"
-    # Se for acidente, bloqueia a rota na marra. Se não for, respeita o que o motoboy marcou.
-    current_stop.bloqueia_proxima = True if causa == 'ACIDENTE' else not pode_seguir
-    # Se o motoboy pode continuar trabalhando, tira essa parada da frente dele.
-    if not current_stop.bloqueia_proxima:
-        # Sequência alta (999) para que outras OS apareçam primeiro na fila.
-        current_stop.sequence = 999
-
-    current_stop.save()
-
-    # 5. Atualiza o status da OS Mãe e das filhas para OCORRENCIA (para o despachante ver)
-    root_os = os_atual.parent_os or os_atual
-    grouped_orders = ServiceOrder.objects.filter(Q(id=root_os.id) | Q(parent_os=root_os))
-    grouped_orders.update(status=ServiceOrder.Status.PROBLEM)
-    
-    # Adiciona no Log da OS Mãe
-    nova_nota = f"\n[🚨 OCORRÊNCIA - {current_stop.get_stop_type_display()}] Motivo: {ocorrencia.get_causa_display()}."
-    root_os.operational_notes += nova_nota
-    root_os.save()
+    # Ocorrência, evidência, parada e status do grupo juntos: se a transição falhar nada fica gravado
+    # (a evidência é gravada antes do lock da parada e apagada se a transação desfizer)
+    try:
+        with media.Brutos('orders.Occurrence', evidencia_foto=request.FILES.get('evidencia_foto')) as brutos, \
+                transaction.atomic():
+            # 1. Busca as entidades
+            current_stop = get_object_or_404(RouteStop.objects.select_for_update(), id=stop_id, motoboy__user=request.user)
+            os_atual = current_stop.service_order
+            motoboy_profile = request.user.motoboy_profile
+
+            # 2. Extrai os dados do formulário
+            observacao = request.POST.get('observacao', '')
+            evidencia_foto = brutos.usar('evidencia_foto')
+
+            # O motoboy diz se pode continuar a viagem ou se está travado (ex: quebrou a moto)
+            pode_seguir = request.POST.get('pode_seguir') == 'on'
+
+            # 3. Cria o registro de Ocorrência estruturado
+            ocorrencia = Occurrence.objects.create(
+                parada=current_stop,
+                service_order=os_atual,
+                motoboy=motoboy_profile,
+                causa=causa,
+                observacao=observacao,
+                evidencia_foto=evidencia_foto,
+                urgencia=Occurrence.Urgencia.ALTA if causa == 'ACIDENTE' else Occurrence.Urgencia.MEDIA
+            )
+            if evidencia_foto:
+                media.receber(ocorrencia, 'evidencia_foto')
+
+            # 4. Atualiza a Parada (RouteStop)
+            current_stop.status = RouteStop.StopStatus.COM_OCORRENCIA
+            current_stop.is_failed = True
+            current_stop.failure_reason = f"{ocorrencia.get_causa_display()}"
+            # Se for acidente, bloqueia a rota na marra. Se não for, respeita o que o motoboy marcou.
+            current_stop.bloqueia_proxima = True if causa == 'ACIDENTE' else not pode_seguir
+            # Se o motoboy pode continuar trabalhando, tira essa parada da frente dele.
+            if not current_stop.bloqueia_proxima:
+                # Sequência alta (999) para que outras OS apareçam primeiro na fila.
+                current_stop.sequence = 999
+
+            current_stop.save()
+
+            # 5. Atualiza o status da OS Mãe e das filhas para OCORRENCIA (para o despachante ver)
+            root_os = raiz(os_atual)
+            transicionar(root_os, ServiceOrder.Status.PROBLEM, request.user)
+
+            # Adiciona no Log da OS Mãe
+            nova_nota = f"\n[🚨 OCORRÊNCIA - {current_stop.get_stop_type_display()}] Motivo: {ocorrencia.get_causa_display()}."
+            root_os.operational_notes += nova_nota
+            root_os.save()
 
-    # 6. Se for ACIDENTE (veículo avariado), bloqueia o motoboy na hora: não recebe novas OS
-    #    e a tela "Minhas Entregas" mostra o aviso "Veículo Avariado" com o botão "Consertei o Veículo"
-    if causa == 'ACIDENTE':
-        motoboy_profile.is_available = False
-        motoboy_profile.save()
-        
-        os_nao_coletadas = ServiceOrder.objects.filter(
-            motoboy=motoboy_profile,
-            status='ACEITO'
-        ).exclude(
-            Q(id=os_atual.id) | Q(parent_os=os_atual) | Q(id=os_atual.parent_os_id)
-        )
-        
-        if os_nao_coletadas.exists():
-            RouteStop.objects.filter(service_order__in=os_nao_coletadas, is_completed=False).update(motoboy=None, status='PENDENTE')
-            os_nao_coletadas.update(motoboy=None, status='PENDENTE')
+            # 6. Se for ACIDENTE (veículo avariado), bloqueia o motoboy na hora: não recebe novas OS
+            #    e a tela "Minhas Entregas" mostra o aviso "Veículo Avariado" com o botão "Consertei o Veículo"
+            if causa == 'ACIDENTE':
+                motoboy_profile.is_available = False
+                motoboy_profile.save()
+
+                os_nao_coletadas = ServiceOrder.objects.filter(
+                    motoboy=motoboy_profile,
+                    status='ACEITO'
+                ).exclude(group_root_id=root_os.id)
+
+                if os_nao_coletadas.exists():
+                    RouteStop.objects.filter(service_order__in=os_nao_coletadas, is_completed=False).update(motoboy=None, status='PENDENTE')
+                    transicionar_varias(os_nao_coletadas, 'PENDENTE', request.user, motoboy=None)
+
+            publicar_evento(
+                'ocorrencia', occurrence_id=ocorrencia.id, os_id=os_atual.id,
+                motoboy_id=motoboy_profile.id, causa=causa, urgencia=ocorrencia.urgencia
+            )
+    except TransicaoInvalida as e:
+        messages.error(request, str(e))
+        return redirect('motoboy_tasks')
 
     messages.warning(request, "Ocorrência enviada! O despachante já foi notificado.")
     return redirect('motoboy_tasks')
@@ -1124,28 +1414,29 @@ def resolve_os_problem(request, os_id):
     data = json.loads(request.body)
     action = data.get('action', 'reactivate')
 
-    root_os = os.parent_os or os
-    grouped_orders = ServiceOrder.objects.filter(Q(id=root_os.id) | Q(parent_os=root_os))
+    root_os = raiz(os)
 
     if action == 'reactivate':
         # Reativar: O despachante mandou o motoboy tentar de novo.
         failed_stop_ids = list(
-            RouteStop.objects.filter(
-                service_order__in=grouped_orders,
+            paradas_do_grupo(root_os).filter(
                 is_completed=False,
                 is_failed=True
             ).values_list('id', flat=True)
         )
 
-        group_stops = RouteStop.objects.filter(service_order__in=grouped_orders)
+        group_stops = paradas_do_grupo(root_os)
         new_status = 'COLETADO' if group_stops.filter(stop_type='COLETA', is_completed=True).exists() else 'ACEITO'
         
-        grouped_orders.update(status=new_status)
+        try:
+            transicionar(root_os, new_status, request.user)
+        except TransicaoInvalida as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
         root_os.operational_notes += f"\n[✅ RESOLVIDO] Ocorrência ignorada e rota reativada por {request.user.first_name}."
         
         # Limpa o erro da parada travada para ela voltar ao normal na tela do motoboy
-        RouteStop.objects.filter(
-            service_order__in=grouped_orders, is_completed=False, is_failed=True
+        paradas_do_grupo(root_os).filter(
+            is_completed=False, is_failed=True
         ).update(is_failed=False, failure_reason="")
 
         # Coloca as paradas reativadas no fim da rota atual do motoboy.
@@ -1165,11 +1456,14 @@ def resolve_os_problem(request, os_id):
         
     elif action == 'unassign':
         # Desvincular: Tira do motoboy e devolve para a fila (Útil se a loja fechou antes dele coletar)
-        grouped_orders.update(status='PENDENTE', motoboy=None)
+        try:
+            transicionar(root_os, 'PENDENTE', request.user, motoboy=None)
+        except TransicaoInvalida as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
         # Limpa o motoboy e reseta a falha para o próximo assumir a OS limpa
-        RouteStop.objects.filter(
-            service_order__in=grouped_orders, is_completed=False
+        paradas_do_grupo(root_os).filter(
+            is_completed=False
         ).update(motoboy=None, is_failed=False, failure_reason="")
 
         root_os.operational_notes += f"\n[🔄 RETORNOU] Grupo removido do motoboy e voltou para a fila por {request.user.first_name}."
@@ -1188,16 +1482,24 @@ def transfer_route_view(request, os_id):
     transfer_address = (data.get('transfer_address') or '').strip()
 
     os_obj = get_object_or_404(ServiceOrder, id=os_id)
-    os_root = os_obj.parent_os or os_obj
-    grouped_orders = ServiceOrder.objects.filter(Q(id=os_root.id) | Q(parent_os=os_root))
+    os_root = raiz(os_obj)
     new_motoboy = get_object_or_404(MotoboyProfile, id=new_motoboy_id)
 
+    avaliacao = capacity.verificar(new_motoboy.id, [os_root.id])
+    if avaliacao['nivel'] == 'excede' and not data.get('ignorar_capacidade'):
+        return _capacidade_excedida(avaliacao)
+
     with transaction.atomic():
-        group_stops = RouteStop.objects.filter(service_order__in=grouped_orders)
+        group_stops = paradas_do_grupo(os_root)
         is_collected = group_stops.filter(stop_type='COLETA', is_completed=True).exists()
 
-        first_pending = RouteStop.objects.filter(
-            service_order__in=grouped_orders,
+        # Valida antes de mexer nas paradas: o grupo vai para ACEITO (antes da coleta) ou COLETADO
+        try:
+            validar(os_root.status, 'COLETADO' if is_collected else 'ACEITO')
+        except TransicaoInvalida as e:
+            return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+        first_pending = paradas_do_grupo(os_root).filter(
             is_completed=False
         ).exclude(
             failure_reason__icontains="[AGUARDANDO SOCORRO]"
@@ -1218,8 +1520,8 @@ def transfer_route_view(request, os_id):
             )
 
         if not is_collected:
-            pending_real_stops = RouteStop.objects.filter(
-                service_order__in=grouped_orders, is_completed=False
+            pending_real_stops = paradas_do_grupo(os_root).filter(
+                is_completed=False
             ).exclude(
                 failure_reason__icontains="[AGUARDANDO SOCORRO]"
             ).exclude(
@@ -1233,18 +1535,14 @@ def transfer_route_view(request, os_id):
                     stop.failure_reason = ""
                     stop.save()
 
-            new_status = 'ACEITO'
-            grouped_orders.update(motoboy=new_motoboy, status=new_status)
-
-            os_root.status = new_status
-            os_root.motoboy = new_motoboy
+            transicionar(os_root, 'ACEITO', request.user, motoboy=new_motoboy)
             os_root.operational_notes += (
                 f"\n[🚨 SOCORRO] Veículo avariado ANTES da coleta. "
                 f"OS reatribuída para {new_motoboy.user.first_name} (coleta no endereço original)."
             )
             os_root.save()
 
-            return JsonResponse({'status': 'success'})
+            return JsonResponse({'status': 'success', 'aviso': avaliacao['mensagem']})
 
         if not transfer_address:
             return JsonResponse({
@@ -1253,8 +1551,8 @@ def transfer_route_view(request, os_id):
             }, status=400)
 
         seq_transf = first_pending.sequence
-        RouteStop.objects.filter(
-            service_order__in=grouped_orders, is_completed=False
+        paradas_do_grupo(os_root).filter(
+            is_completed=False
         ).exclude(failure_reason__icontains="[AGUARDANDO SOCORRO]").update(sequence=F('sequence') + 1)
 
         RouteStop.objects.create(
@@ -1262,8 +1560,8 @@ def transfer_route_view(request, os_id):
             sequence=seq_transf, failure_reason=f"Encontro: {transfer_address}"
         )
 
-        pending_real_stops = RouteStop.objects.filter(
-            service_order__in=grouped_orders, is_completed=False
+        pending_real_stops = paradas_do_grupo(os_root).filter(
+            is_completed=False
         ).exclude(failure_reason__icontains="[AGUARDANDO SOCORRO]").exclude(failure_reason__icontains="Encontro:")
 
         pending_real_stops.update(motoboy=new_motoboy)
@@ -1273,15 +1571,11 @@ def transfer_route_view(request, os_id):
                 stop.failure_reason = ""
                 stop.save()
 
-        new_status = 'COLETADO'
-        grouped_orders.update(motoboy=new_motoboy, status=new_status)
-
-        os_root.status = new_status
-        os_root.motoboy = new_motoboy
+        transicionar(os_root, 'COLETADO', request.user, motoboy=new_motoboy)
         os_root.operational_notes += f"\n[🚨 SOCORRO] Carga transferida para {new_motoboy.user.first_name}. Ponto de encontro: {transfer_address}"
         os_root.save()
 
-    return JsonResponse({'status': 'success'})
+    return JsonResponse({'status': 'success', 'aviso': avaliacao['mensagem']})
 
 @login_required
 @require_POST
@@ -1294,56 +1588,65 @@ def create_return_view(request, os_id):
     is_priority = data.get('is_priority', False)
     
     root_os = get_object_or_404(ServiceOrder, id=os_id)
-    grouped_orders = ServiceOrder.objects.filter(Q(id=root_os.id) | Q(parent_os=root_os))
 
-    with transaction.atomic():
-        motoboy = root_os.motoboy
+    try:
+        with transaction.atomic():
+            motoboy = root_os.motoboy
         
-        active_stop = motoboy.route_stops.filter(service_order__in=grouped_orders, is_completed=False).order_by('sequence').first()
-        if active_stop and active_stop.is_failed:
-            active_stop.is_completed = True
-            active_stop.completed_at = timezone.now()
-            active_stop.save()
+            active_stop = motoboy.route_stops.filter(service_order__group_root_id=root_os.id, is_completed=False).order_by('sequence').first()
+            if active_stop and active_stop.is_failed:
+                active_stop.is_completed = True
+                active_stop.completed_at = timezone.now()
+                active_stop.save()
             
-        sequence_to_use = 99
-        if motoboy:
-            if is_priority:
-                current_active = motoboy.route_stops.filter(is_completed=False).order_by('sequence').first()
-                if current_active:
-                    sequence_to_use = current_active.sequence + 1
-                    motoboy.route_stops.filter(
-                        is_completed=False, sequence__gte=sequence_to_use
-                    ).update(sequence=F('sequence') + 1)
+            sequence_to_use = 99
+            if motoboy:
+                if is_priority:
+                    current_active = motoboy.route_stops.filter(is_completed=False).order_by('sequence').first()
+                    if current_active:
+                        sequence_to_use = current_active.sequence + 1
+                        motoboy.route_stops.filter(
+                            is_completed=False, sequence__gte=sequence_to_use
+                        ).update(sequence=F('sequence') + 1)
+                    else:
+                        sequence_to_use = motoboy.route_stops.count() + 1
                 else:
                     sequence_to_use = motoboy.route_stops.count() + 1
-            else:
-                sequence_to_use = motoboy.route_stops.count() + 1
 
-        RouteStop.objects.create(
-            service_order=root_os,
-            motoboy=motoboy,
-            stop_type='DEVOLUCAO',
-            sequence=sequence_to_use,
-            failure_reason=f"Devolver em: {return_address}" 
-        )
+            RouteStop.objects.create(
+                service_order=root_os,
+                motoboy=motoboy,
+                stop_type='DEVOLUCAO',
+                sequence=sequence_to_use,
+                failure_reason=f"Devolver em: {return_address}" 
+            )
         
-        tipo_log = "PRIORITÁRIA" if is_priority else "NORMAL"
-        root_os.operational_notes += f"\n[🔄 DEVOLUÇÃO {tipo_log}] Agendada devolução para {return_address}."
+            tipo_log = "PRIORITÁRIA" if is_priority else "NORMAL"
+            root_os.operational_notes += f"\n[🔄 DEVOLUÇÃO {tipo_log}] Agendada devolução para {return_address}."
         
-        group_stops = RouteStop.objects.filter(service_order__in=grouped_orders)
-        if group_stops.filter(stop_type='COLETA', is_completed=True).exists():
-            root_os.status = 'COLETADO'
-        else:
-            root_os.status = 'ACEITO'
+            group_stops = paradas_do_grupo(root_os)
+            if group_stops.filter(stop_type='COLETA', is_completed=True).exists():
+                transicionar(root_os, 'COLETADO', request.user)
+            else:
+                transicionar(root_os, 'ACEITO', request.user)
             
-        root_os.save()
+            root_os.save()
+    except TransicaoInvalida as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
     return JsonResponse({'status': 'success'})
 
 @login_required
 def os_details_view(request, os_id):
     """ Exibe a visão completa e detalhada de uma OS (Itens, Destinos, Pesos, Histórico, etc) """
-    os_obj = get_object_or_404(ServiceOrder, id=os_id)
+    grupo_arquivado = None
+    os_obj = ServiceOrder.objects.filter(id=os_id).first()
+    if os_obj is None:
+        # OS encerrada há tempo: vem do arquivo, já com itens/destinos/paradas ligados (orders/archive.py)
+        grupo_arquivado = archive.grupo_da_os(os_id)
+        if grupo_arquivado is None:
+            raise Http404("OS não encontrada.")
+        os_obj = grupo_arquivado['os']
     
     # Segurança: Apenas quem tem direito pode ver
     if request.user.type not in ['ADMIN', 'DISPATCHER'] and not request.user.is_superuser:
@@ -1355,13 +1658,17 @@ def os_details_view(request, os_id):
     items = os_obj.items.all()
     destinations = os_obj.destinations.all()
     
-    # Pega as paradas reais da rota (inclui as da OS mãe e das filhas se for agrupada)
-    root_os = os_obj.parent_os or os_obj
-    grouped_orders = ServiceOrder.objects.filter(Q(id=root_os.id) | Q(parent_os=root_os))
-    stops = RouteStop.objects.filter(service_order__in=grouped_orders).order_by('sequence')
-    
-    from orders.models import Occurrence # Garanta que Occurrence está importado no topo do ficheiro
-    ocorrencias = Occurrence.objects.filter(service_order__in=grouped_orders).order_by('-criado_em')
+    if grupo_arquivado:
+        root_os = grupo_arquivado['raiz']
+        stops = grupo_arquivado['paradas']
+        ocorrencias = grupo_arquivado['ocorrencias']
+    else:
+        # Pega as paradas reais da rota (inclui as da OS mãe e das filhas se for agrupada)
+        root_os = raiz(os_obj)
+        stops = paradas_do_grupo(root_os).order_by('sequence')
+
+        from orders.models import Occurrence # Garanta que Occurrence está importado no topo do ficheiro
+        ocorrencias = Occurrence.objects.filter(service_order__group_root_id=root_os.id).order_by('-criado_em')
 
     context = {
         'os': os_obj,
@@ -1370,6 +1677,7 @@ def os_details_view(request, os_id):
         'destinations': destinations,
         'stops': stops,
         'ocorrencias': ocorrencias, # Adicionado ao context
+        'arquivada': grupo_arquivado is not None,
     }
     
     return render(request, 'orders/os_details.html', context)